@@ -0,0 +1,34 @@
+"""Gunicorn configuration for production deployment.
+
+The application is loaded once in the master (``preload_app``) and shared
+copy-on-write by the workers; see ``src/startup.py`` for the boot path.
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8080")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = 30
+keepalive = 5
+loglevel = "info"
+accesslog = "-"
+errorlog = "-"
+wsgi_app = "wsgi:app"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def when_ready(server):
+    """Finish the shared state of the preloaded application before forking."""
+    if preload_app:
+        from src.startup import preload
+
+        preload(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    """Create the per-worker resources of a new worker."""
+    from src.startup import init_worker
+
+    init_worker(worker.app.wsgi())
@@ -0,0 +1,175 @@
+"""Fingerprinted static assets and cached pages.
+
+Files under ``static/`` are loaded once, fingerprinted with a digest of their
+content and served from ``/assets/<name>.<fingerprint>.<ext>``. As a URL
+changes whenever the file does, responses can be cached by browsers and
+proxies for a year without revalidation. Text assets are precompressed with
+every available encoding at load time, so serving them costs no compression.
+
+Rendered pages that do not depend on the request (the index page) are kept
+the same way, with an ETag, so a repeat visit is answered with a 304 without
+rendering the template again.
+
+With ``auto_reload`` (development), files are reloaded when they change and
+pages are rendered on every request.
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from src.compression import available_encodings, compress
+
+ASSET_URL_PREFIX = "/assets"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Assets worth precompressing (images are already compressed)
+COMPRESSIBLE_ASSET_TYPES = frozenset(
+    {
+        "application/javascript",
+        "application/json",
+        "image/svg+xml",
+        "text/css",
+        "text/html",
+        "text/javascript",
+        "text/plain",
+    }
+)
+
+
+@dataclass
+class Asset:
+    """Content of a static file or cached page, with its encoded variants.
+
+    Attributes:
+        path: Path relative to the static directory, or page name
+        mimetype: Content type, with charset for text
+        data: Identity bytes
+        fingerprint: Digest of ``data``, also used as ETag
+        variants: Encoding to compressed bytes, only when smaller
+        mtime: Modification time of the source file (0 for pages)
+    """
+
+    path: str
+    mimetype: str
+    data: bytes
+    fingerprint: str
+    variants: Dict[str, bytes] = field(default_factory=dict)
+    mtime: float = 0.0
+
+    @classmethod
+    def build(
+        cls, path: str, data: bytes, mimetype: Optional[str] = None, mtime: float = 0
+    ) -> "Asset":
+        """Fingerprint ``data`` and precompress it if worthwhile."""
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        base_type = mimetype.split(";")[0]
+        if base_type.startswith("text/") or base_type == "application/javascript":
+            if "charset" not in mimetype:
+                mimetype += "; charset=utf-8"
+        variants = {}
+        if base_type in COMPRESSIBLE_ASSET_TYPES:
+            for encoding in available_encodings():
+                compressed = compress(data, encoding)
+                if len(compressed) < len(data):
+                    variants[encoding] = compressed
+        return cls(
+            path=path,
+            mimetype=mimetype,
+            data=data,
+            fingerprint=hashlib.sha256(data).hexdigest()[:16],
+            variants=variants,
+            mtime=mtime,
+        )
+
+    @property
+    def fingerprinted_name(self) -> str:
+        """File name with the fingerprint before the extension."""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{self.fingerprint}{ext}"
+
+    def body(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Bytes to send for a negotiated encoding, and the encoding applied."""
+        if encoding is not None and encoding in self.variants:
+            return self.variants[encoding], encoding
+        return self.data, None
+
+
+class StaticAssets:
+    """Manifest of the fingerprinted static files and cache of rendered pages.
+
+    Attributes:
+        directory (str): Static directory scanned for assets
+        auto_reload (bool): Reload changed files and render pages on every
+            request, for development
+    """
+
+    def __init__(self, directory: str, auto_reload: bool = False) -> None:
+        self.directory = directory
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._by_path: Dict[str, Asset] = {}
+        self._by_name: Dict[str, Asset] = {}
+        self._pages: Dict[str, Asset] = {}
+        self.load()
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], directory: str) -> "StaticAssets":
+        """Build the manifest of ``directory`` from a Flask config mapping."""
+        return cls(directory, auto_reload=config.get("ASSETS_AUTO_RELOAD", False))
+
+    def load(self) -> None:
+        """Scan the static directory, reading new and changed files."""
+        by_path = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.startswith("."):
+                    continue
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                mtime = os.path.getmtime(full_path)
+                asset = self._by_path.get(path)
+                if asset is None or asset.mtime != mtime:
+                    with open(full_path, "rb") as f:
+                        asset = Asset.build(path, f.read(), mtime=mtime)
+                by_path[path] = asset
+        with self._lock:
+            self._by_path = by_path
+            self._by_name = {
+                asset.fingerprinted_name: asset for asset in by_path.values()
+            }
+
+    def url(self, path: str) -> str:
+        """Fingerprinted URL of a static file (plain static URL if unknown)."""
+        if self.auto_reload:
+            self.load()
+        asset = self._by_path.get(path)
+        if asset is None:
+            return f"/static/{path}"
+        return f"{ASSET_URL_PREFIX}/{asset.fingerprinted_name}"
+
+    def get(self, name: str) -> Optional[Asset]:
+        """Asset served under a fingerprinted name, or None."""
+        if self.auto_reload:
+            self.load()
+        return self._by_name.get(name)
+
+    def page(self, name: str, render: Callable[[], str]) -> Asset:
+        """Rendered page ``name``, rendering it on first use.
+
+        Args:
+            name: Cache key of the page
+            render: Renders the page HTML; must not depend on the request
+        """
+        page = None if self.auto_reload else self._pages.get(name)
+        if page is None:
+            page = Asset.build(
+                name, render().encode("utf-8"), mimetype="text/html; charset=utf-8"
+            )
+            if not self.auto_reload:
+                self._pages[name] = page
+        return page
@@ -0,0 +1,388 @@
+"""Key-value backends for the shared tier of the render cache.
+
+A backend stores opaque bytes under string keys, each with its own TTL. Three
+implementations are provided:
+
+- :class:`MemoryBackend`: per process, mostly useful for tests;
+- :class:`FilesystemBackend`: a directory shared by the workers of a node;
+- :class:`RedisBackend`: any server speaking the Redis protocol (RESP), shared
+  by every node. The client is a minimal one built on sockets, so no Redis
+  package is needed.
+
+Backends raise :class:`CacheBackendError` when the store cannot be reached;
+callers are expected to treat it as a cache miss.
+"""
+
+import hashlib
+import os
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Mapping, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+BACKEND_MEMORY = "memory"
+BACKEND_FILESYSTEM = "filesystem"
+BACKEND_REDIS = "redis"
+
+
+class CacheBackendError(Exception):
+    """Raised when a cache backend cannot serve a request."""
+
+
+class CacheBackend:
+    """Base class of the byte-oriented key-value backends."""
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["CacheBackend"]:
+        """Build the backend selected by ``RENDER_CACHE_SHARED``, or None.
+
+        Raises:
+            ValueError: If the backend name is unknown
+        """
+        name = (config.get("RENDER_CACHE_SHARED") or "").lower()
+        if not name:
+            return None
+        url = config.get("RENDER_CACHE_SHARED_URL", "")
+        max_bytes = config.get("RENDER_CACHE_SHARED_MAX_BYTES", 256 * 1024 * 1024)
+        if name == BACKEND_MEMORY:
+            return MemoryBackend(max_bytes=max_bytes)
+        if name == BACKEND_FILESYSTEM:
+            return FilesystemBackend(
+                url or os.path.join(tempfile.gettempdir(), "kroki-render-cache"),
+                max_bytes=max_bytes,
+            )
+        if name == BACKEND_REDIS:
+            return RedisBackend(
+                url or "redis://localhost:6379/0",
+                timeout=config.get("RENDER_CACHE_SHARED_TIMEOUT", 0.25),
+            )
+        raise ValueError(f"Unknown render cache backend: {name}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Value of ``key``, or None if absent or expired."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store ``value`` under ``key`` for ``ttl`` seconds."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Remove ``key`` if present."""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Thread-safe in-process backend, LRU bounded by total value bytes."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._values: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            stored = self._values.get(key)
+            if stored is None:
+                return None
+            if stored[1] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._values.move_to_end(key)
+            return stored[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            if key in self._values:
+                self._remove(key)
+            self._values[key] = (value, time.monotonic() + ttl)
+            self._size += len(value)
+            while self._size > self.max_bytes and self._values:
+                self._remove(next(iter(self._values)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._values:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        """Drop a value and release its budget (lock held)."""
+        value, _ = self._values.pop(key)
+        self._size -= len(value)
+
+
+class FilesystemBackend(CacheBackend):
+    """Backend keeping one file per key in a directory.
+
+    Each file starts with its expiry time. Files are written atomically, so
+    several workers may share the directory. The directory is pruned of
+    expired files, then of the least recently written ones beyond
+    ``max_bytes``, at most every ``prune_interval`` seconds per process.
+
+    Attributes:
+        directory (str): Directory holding the values
+        max_bytes (int): Total size of the files kept
+        prune_interval (float): Minimum seconds between two prunes
+    """
+
+    _HEADER = struct.Struct(">d")
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        prune_interval: float = 60,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prune_interval = prune_interval
+        self._last_prune = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                header = f.read(self._HEADER.size)
+                if len(header) < self._HEADER.size:
+                    return None
+                (expires_at,) = self._HEADER.unpack(header)
+                if expires_at <= time.time():
+                    return None
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            raise CacheBackendError(f"Cannot read {key}: {e}") from e
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(self._HEADER.pack(time.time() + ttl))
+                    f.write(value)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            raise CacheBackendError(f"Cannot write {key}: {e}") from e
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise CacheBackendError(f"Cannot delete {key}: {e}") from e
+
+    def prune(self) -> None:
+        """Remove expired files, then the oldest beyond ``max_bytes``."""
+        self._last_prune = time.monotonic()
+        now = time.time()
+        files: List[Tuple[float, int, str]] = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith("."):
+                    # Value being written
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    with open(path, "rb") as f:
+                        (expires_at,) = self._HEADER.unpack(f.read(self._HEADER.size))
+                    stat = os.stat(path)
+                except (OSError, struct.error):
+                    continue
+                if expires_at <= now:
+                    _remove_quietly(path)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _remove_quietly(path)
+            total -= size
+
+    def _path(self, key: str) -> str:
+        """File of a key: hashed, fanned out by the first two hex digits."""
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+
+def _remove_quietly(path: str) -> None:
+    """Remove a file that another worker may have removed already."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class RedisBackend(CacheBackend):
+    """Backend for servers speaking the Redis protocol (RESP2).
+
+    Uses ``GET``, ``SET ... PX`` and ``DEL``, so it works with Redis, Valkey,
+    KeyDB and compatible stores. Connections are pooled per process and
+    opened lazily; any socket or protocol error closes the connection and
+    raises :class:`CacheBackendError`.
+
+    Attributes:
+        host (str): Server host
+        port (int): Server port
+        db (int): Database number selected on connect
+        password (str): Password sent with ``AUTH``, or None
+        timeout (float): Connect and read timeout in seconds
+        pool_size (int): Idle connections kept
+    """
+
+    def __init__(self, url: str, timeout: float = 0.25, pool_size: int = 8) -> None:
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported cache URL: {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._pool: "queue.LifoQueue[_RespConnection]" = queue.LifoQueue(pool_size)
+        self._pid = os.getpid()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.execute("DEL", key)
+
+    def execute(self, *args: Any) -> Any:
+        """Send one command and return its reply.
+
+        Raises:
+            CacheBackendError: On connection, protocol or server errors
+        """
+        connection = self._acquire()
+        try:
+            reply = connection.command(*args)
+        except (OSError, ValueError) as e:
+            connection.close()
+            raise CacheBackendError(f"Redis {args[0]} failed: {e}") from e
+        self._release(connection)
+        if isinstance(reply, _RespError):
+            raise CacheBackendError(f"Redis {args[0]} failed: {reply}")
+        return reply
+
+    def _acquire(self) -> "_RespConnection":
+        """Idle pooled connection, or a new one."""
+        if self._pid != os.getpid():
+            # Forked: the pooled sockets are shared with the parent process
+            self._pid = os.getpid()
+            self._pool = queue.LifoQueue(self.pool_size)
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            connection = _RespConnection(self.host, self.port, self.timeout)
+        except OSError as e:
+            raise CacheBackendError(
+                f"Cannot connect to {self.host}:{self.port}: {e}"
+            ) from e
+        try:
+            if self.password is not None:
+                connection.checked("AUTH", self.password)
+            if self.db:
+                connection.checked("SELECT", self.db)
+        except (OSError, ValueError) as e:
+            connection.close()
+            raise CacheBackendError(
+                f"Cannot connect to {self.host}:{self.port}: {e}"
+            ) from e
+        return connection
+
+    def _release(self, connection: "_RespConnection") -> None:
+        """Return a healthy connection to the pool."""
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class _RespError(str):
+    """Error reply of a RESP server."""
+
+
+class _RespConnection:
+    """One socket to a RESP server."""
+
+    def __init__(self, host: str, port: int, timeout: float) -> None:
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+
+    def command(self, *args: Any) -> Any:
+        """Send a command as an array of bulk strings and read the reply."""
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def checked(self, *args: Any) -> Any:
+        """Send a command that must succeed.
+
+        Raises:
+            ValueError: If the server answers with an error
+        """
+        reply = self.command(*args)
+        if isinstance(reply, _RespError):
+            raise ValueError(reply)
+        return reply
+
+    def close(self) -> None:
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _read_reply(self) -> Any:
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ValueError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return _RespError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ValueError("Connection closed by server")
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ValueError(f"Unexpected reply: {line[:32]!r}")
@@ -0,0 +1,203 @@
+"""Canonical forms of diagram sources for cache keys.
+
+Sources that differ only in line endings, trailing whitespace, comments or
+(where the grammar ignores it) layout render to the same image, yet hash to
+different render keys. This module reduces a source to a canonical form per
+diagram type so that such variants share one cache entry and one Kroki render.
+
+The canonical form is only ever hashed: the source sent upstream is unchanged.
+Every rule therefore has to preserve the rendered output exactly, including
+what the theme preprocessing of :class:`src.kroki_client.KrokiClient` looks at
+(a ``theme:`` anywhere in a Mermaid source, a PlantUML source starting with
+``@startuml``):
+
+- all types: CRLF and CR line endings become LF;
+- line-based text types: trailing whitespace and leading/trailing blank lines
+  are dropped, indentation is kept (Mermaid mindmaps, YAML front matter and
+  PlantUML notes depend on it);
+- Mermaid: ``%%`` comment lines are dropped (``%%{...}%%`` directives and
+  lines mentioning ``theme:`` are kept);
+- PlantUML: ``'`` comment lines and whole-line ``/' ... '/`` blocks are dropped
+  after the ``@startuml`` line; anything before it is kept verbatim;
+- Graphviz: ``//``, ``/* */`` and ``#`` comments are dropped and whitespace
+  between tokens is collapsed, quoted and HTML strings are kept verbatim;
+- Excalidraw: the JSON document is re-serialised with sorted keys;
+- ASCII-art and XML types (ditaa, bpmn): line endings only.
+"""
+
+import json
+import re
+from typing import Callable, Dict, List
+
+_TRAILING_WS_RE = re.compile(r"[ \t\f\v]+$", re.MULTILINE)
+# Characters Graphviz treats as token separators
+_DOT_WHITESPACE = " \t\n\f\v\ufeff"
+
+
+def canonical_source(diagram_type: str, source: str) -> str:
+    """Return the canonical form of ``source`` used to build its cache key.
+
+    Args:
+        diagram_type: Kroki diagram type
+        source: Diagram source as sent by the client
+
+    Returns:
+        str: Canonical source; two sources with the same canonical form
+            render identically
+    """
+    source = source.replace("\r\n", "\n").replace("\r", "\n")
+    canonicalizer = CANONICALIZERS.get(diagram_type)
+    return source if canonicalizer is None else canonicalizer(source)
+
+
+def _canonical_text(source: str) -> str:
+    """Drop trailing whitespace and surrounding blank lines."""
+    return _TRAILING_WS_RE.sub("", source).strip("\n")
+
+
+def _canonical_mermaid(source: str) -> str:
+    """Drop ``%%`` comment lines, keeping ``%%{...}%%`` directives.
+
+    Comments mentioning ``theme:`` are kept too: their presence stops the
+    theme injection.
+    """
+    lines = [
+        line
+        for line in source.split("\n")
+        if not (
+            line.lstrip().startswith("%%")
+            and not line.lstrip().startswith("%%{")
+            and "theme:" not in line
+        )
+    ]
+    return _canonical_text("\n".join(lines))
+
+
+def _canonical_plantuml(source: str) -> str:
+    """Drop ``'`` comment lines and block comments spanning whole lines.
+
+    A block comment that starts or ends in the middle of a line is kept.
+    Lines before ``@startuml`` are kept verbatim, blank ones included: the
+    styling is only injected when the source starts with ``@startuml``.
+    """
+    source_lines = source.split("\n")
+    start = next(
+        (
+            i
+            for i, line in enumerate(source_lines)
+            if line.strip().startswith("@startuml")
+        ),
+        0,
+    )
+    head = source_lines[:start]
+    lines: List[str] = []
+    block: List[str] = []
+    for line in source_lines[start:]:
+        stripped = line.strip()
+        if block:
+            block.append(line)
+            end = stripped.find("'/")
+            if end >= 0:
+                if end != len(stripped) - 2:
+                    lines.extend(block)
+                block = []
+            continue
+        if stripped.startswith("/'"):
+            end = stripped.find("'/", 2)
+            if end < 0:
+                block.append(line)
+                continue
+            if end == len(stripped) - 2:
+                continue
+        elif stripped.startswith("'"):
+            continue
+        lines.append(line)
+    # An unterminated block is not a comment we can vouch for
+    lines.extend(block)
+    return "\n".join(head + [_canonical_text("\n".join(lines))])
+
+
+def _canonical_dot(source: str) -> str:
+    """Drop comments and collapse whitespace outside of strings.
+
+    A comment is replaced by a space, as Graphviz does, so that removing it
+    never joins two tokens. Unterminated strings or comments are left as is.
+    """
+    parts: List[str] = []
+    position = 0
+    size = len(source)
+    line_start = True
+
+    def separate() -> None:
+        if parts and parts[-1] != " ":
+            parts.append(" ")
+
+    while position < size:
+        char = source[position]
+        if char in _DOT_WHITESPACE:
+            line_start = line_start or char == "\n"
+            separate()
+            position += 1
+            continue
+        if char == "#" and line_start:
+            end = source.find("\n", position)
+            position = size if end < 0 else end
+            continue
+        line_start = False
+        if source.startswith("//", position):
+            end = source.find("\n", position)
+            position = size if end < 0 else end
+            separate()
+        elif source.startswith("/*", position):
+            end = source.find("*/", position + 2)
+            if end < 0:
+                parts.append(source[position:])
+                break
+            position = end + 2
+            separate()
+        elif char == '"':
+            end = position + 1
+            while end < size and source[end] != '"':
+                end += 2 if source[end] == "\\" else 1
+            parts.append(source[position : end + 1])
+            position = end + 1
+        elif char == "<":
+            depth = 0
+            end = position
+            while end < size:
+                if source[end] == "<":
+                    depth += 1
+                elif source[end] == ">":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                end += 1
+            parts.append(source[position : end + 1])
+            position = end + 1
+        else:
+            parts.append(char)
+            position += 1
+    return "".join(parts).strip(" ")
+
+
+def _canonical_json(source: str) -> str:
+    """Re-serialise a JSON document with sorted keys, or keep it as text."""
+    try:
+        document = json.loads(source)
+    except ValueError:
+        return _canonical_text(source)
+    return json.dumps(
+        document, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+
+
+# Diagram type to canonicalizer; types not listed only get LF line endings
+CANONICALIZERS: Dict[str, Callable[[str], str]] = {
+    "mermaid": _canonical_mermaid,
+    "plantuml": _canonical_plantuml,
+    "graphviz": _canonical_dot,
+    "excalidraw": _canonical_json,
+    "blockdiag": _canonical_text,
+    "seqdiag": _canonical_text,
+    "actdiag": _canonical_text,
+}
@@ -0,0 +1,349 @@
+"""Cache-aware routing of renders across app replicas.
+
+Behind a round-robin load balancer, the same diagram reaches a different
+replica each time and every replica ends up rendering and caching it. In
+cluster mode, each replica computes the render identity of an API request
+and forwards the request to the replica owning that identity on a consistent
+hash ring, so each diagram is rendered and cached once per cluster.
+
+The ring uses bounded loads: a replica already handling more than
+``load_factor`` times its fair share of the requests this replica is routing
+is skipped for the next one on the ring, so a hot diagram cannot overload
+its owner. Loads are tracked locally by each replica.
+
+Forwarded requests carry the ``X-Kroki-Forwarded-By`` header and are always
+rendered where they land, so a request is forwarded at most once. The header
+is only honoured when it names a peer and comes with a fresh
+``X-Kroki-Forwarded-Signature``: an HMAC of the sender, the request ID, the
+client lane and a timestamp, keyed by the secret shared by the replicas. A
+replica that cannot be reached is skipped: the request is rendered locally.
+
+Permalinks are stored by the replica rendering the diagram and served by any
+replica, so cluster mode needs a permalink store shared by all of them.
+"""
+
+import bisect
+import hashlib
+import hmac
+import math
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from typing import IO, Any, Dict, Iterator, List, Mapping, Optional, Union
+
+import requests
+
+from src.permalinks import STORE_FILESYSTEM
+from src.request_log import REQUEST_ID_HEADER
+
+FORWARDED_HEADER = "X-Kroki-Forwarded-By"
+FORWARDED_SIGNATURE_HEADER = "X-Kroki-Forwarded-Signature"
+# Client lane decided by the forwarding replica, covered by the signature
+CLIENT_HEADER = "X-Kroki-Client"
+
+# Request headers passed on to the owning replica
+FORWARDED_REQUEST_HEADERS = (
+    "Accept-Encoding",
+    "Content-Type",
+    "If-None-Match",
+    CLIENT_HEADER,
+    REQUEST_ID_HEADER,
+)
+
+# Response headers passed back to the client
+FORWARDED_RESPONSE_HEADERS = (
+    "Cache-Control",
+    "Content-Disposition",
+    "Content-Encoding",
+    "ETag",
+    "Retry-After",
+    "Vary",
+    "X-Permalink",
+)
+
+
+class ClusterForwardError(Exception):
+    """Raised when a request cannot be forwarded to its owning replica."""
+
+
+@dataclass
+class ForwardedResponse:
+    """Response of the replica a request was forwarded to.
+
+    Attributes:
+        status: HTTP status code
+        headers: Headers among :data:`FORWARDED_RESPONSE_HEADERS`, and the
+            content type
+        body: Body as sent, still content-encoded
+    """
+
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+def _position(value: str) -> int:
+    """Position of a value on the ring."""
+    return int.from_bytes(hashlib.sha256(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes.
+
+    Attributes:
+        nodes (List[str]): Nodes on the ring
+        vnodes (int): Points per node, smoothing the key distribution
+    """
+
+    def __init__(self, nodes: List[str], vnodes: int = 100) -> None:
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+        self.nodes = list(dict.fromkeys(nodes))
+        self.vnodes = vnodes
+        points = sorted(
+            (_position(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(vnodes)
+        )
+        self._positions = [position for position, _ in points]
+        self._owners = [node for _, node in points]
+
+    def walk(self, key: str) -> Iterator[str]:
+        """Distinct nodes in ring order, starting with the owner of ``key``."""
+        start = bisect.bisect(self._positions, _position(key))
+        seen = set()
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class Cluster:
+    """Routes renders to the replica owning them, with bounded loads.
+
+    Attributes:
+        self_url (str): Base URL of this replica, as listed in the peers
+        ring (HashRing): Ring of all replicas, this one included
+        load_factor (float): Largest load of a replica, as a multiple of the
+            average, before requests spill to the next replica on the ring
+        timeout (float): Seconds to wait for a forwarded response
+        connect_timeout (float): Seconds to wait for a connection to a peer
+        max_skew (float): Age in seconds after which a forwarding signature
+            is refused
+    """
+
+    def __init__(
+        self,
+        self_url: str,
+        peers: List[str],
+        vnodes: int = 100,
+        load_factor: float = 1.25,
+        timeout: float = 30,
+        connect_timeout: float = 1,
+        secret: Optional[str] = None,
+        max_skew: float = 60,
+    ) -> None:
+        self.self_url = self_url.rstrip("/")
+        nodes = [peer.rstrip("/") for peer in peers]
+        if self.self_url not in nodes:
+            nodes.append(self.self_url)
+        self.ring = HashRing(nodes, vnodes=vnodes)
+        self.load_factor = max(1.0, load_factor)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_skew = max_skew
+        # Without a shared secret, no other replica can be authenticated
+        self._secret = (secret or secrets.token_hex(32)).encode("utf-8")
+        self._lock = threading.Lock()
+        self._loads: Dict[str, int] = {node: 0 for node in self.ring.nodes}
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["Cluster"]:
+        """Build the router from a Flask config mapping, or None if disabled.
+
+        Raises:
+            ValueError: If permalinks are stored per replica, or no secret
+                authenticates the replicas
+        """
+        peers = [
+            peer.strip()
+            for peer in (config.get("CLUSTER_PEERS") or "").split(",")
+            if peer.strip()
+        ]
+        self_url = config.get("CLUSTER_SELF_URL")
+        if not peers or not self_url:
+            return None
+        store = (config.get("PERMALINK_STORE") or "").lower()
+        if store and (store != STORE_FILESYSTEM or not config.get("PERMALINK_SHARED")):
+            raise ValueError(
+                "Cluster routing needs a permalink store shared by every replica: "
+                "set PERMALINK_STORE=filesystem with PERMALINK_DIR on shared "
+                "storage and PERMALINK_SHARED=true"
+            )
+        secret = config.get("CLUSTER_SECRET") or config.get("SECRET_KEY")
+        if not secret:
+            raise ValueError(
+                "Cluster routing needs CLUSTER_SECRET or SECRET_KEY, shared by "
+                "every replica, to authenticate forwarded requests"
+            )
+        return cls(
+            self_url,
+            peers,
+            vnodes=config.get("CLUSTER_VNODES", 100),
+            load_factor=config.get("CLUSTER_LOAD_FACTOR", 1.25),
+            timeout=config.get("CLUSTER_FORWARD_TIMEOUT", 30),
+            secret=secret,
+        )
+
+    def acquire(self, key: str) -> str:
+        """Choose the replica for a render and count it in its load.
+
+        The owner of ``key`` is chosen unless its load is above its bounded
+        share, in which case the next replica on the ring under its share is.
+        Every call must be paired with :meth:`release`.
+
+        Returns:
+            str: Base URL of the chosen replica
+        """
+        with self._lock:
+            total = sum(self._loads.values()) + 1
+            capacity = math.ceil(self.load_factor * total / len(self.ring.nodes))
+            for node in self.ring.walk(key):
+                if self._loads[node] < capacity:
+                    break
+            self._loads[node] += 1
+            return node
+
+    def release(self, node: str) -> None:
+        """Remove a finished render from the load of its replica."""
+        with self._lock:
+            self._loads[node] -= 1
+
+    def is_local(self, node: str) -> bool:
+        """Whether ``node`` is this replica."""
+        return node == self.self_url
+
+    def is_peer(self, url: str) -> bool:
+        """Whether ``url`` is another replica of the ring."""
+        url = url.rstrip("/")
+        return url in self.ring.nodes and not self.is_local(url)
+
+    def sign(
+        self,
+        request_id: str,
+        lane: str,
+        timestamp: Optional[int] = None,
+        sender: Optional[str] = None,
+    ) -> str:
+        """Signature of a request forwarded by ``sender``.
+
+        Args:
+            request_id: ID of the forwarded request
+            lane: Client lane sent with the request
+            timestamp: Signing time in Unix seconds (default: now)
+            sender: Base URL of the forwarding replica (default: this one)
+
+        Returns:
+            str: ``<timestamp>:<hex HMAC-SHA256>``
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        message = "\n".join(
+            (sender or self.self_url, request_id, lane, str(timestamp))
+        ).encode("utf-8")
+        digest = hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+        return f"{timestamp}:{digest}"
+
+    def is_forwarded(self, headers: Mapping[str, str]) -> bool:
+        """Whether a request was forwarded by a peer, with a valid signature.
+
+        Args:
+            headers: Headers of the request, case-insensitive
+
+        Returns:
+            bool: True if :data:`FORWARDED_HEADER` names a peer and
+                :data:`FORWARDED_SIGNATURE_HEADER` is a fresh signature of
+                the request by that peer
+        """
+        sender = (headers.get(FORWARDED_HEADER) or "").rstrip("/")
+        if not self.is_peer(sender):
+            return False
+        signature = headers.get(FORWARDED_SIGNATURE_HEADER) or ""
+        try:
+            timestamp = int(signature.partition(":")[0])
+        except ValueError:
+            return False
+        if abs(time.time() - timestamp) > self.max_skew:
+            return False
+        expected = self.sign(
+            headers.get(REQUEST_ID_HEADER) or "",
+            headers.get(CLIENT_HEADER) or "",
+            timestamp,
+            sender,
+        )
+        return hmac.compare_digest(expected.encode("utf-8"), signature.encode("utf-8"))
+
+    def loads(self) -> Dict[str, int]:
+        """Renders in flight per replica, as routed by this replica."""
+        with self._lock:
+            return dict(self._loads)
+
+    def forward(
+        self,
+        node: str,
+        path: str,
+        body: Union[bytes, IO[bytes]],
+        headers: Mapping[str, str],
+    ) -> ForwardedResponse:
+        """Send a request to another replica.
+
+        The response body is read as sent, without decoding its
+        ``Content-Encoding``, so it can be relayed unchanged.
+
+        Args:
+            node: Base URL of the replica
+            path: Path and query string of the request
+            body: Request body, decompressed
+            headers: Request headers; only :data:`FORWARDED_REQUEST_HEADERS`
+                are passed on
+
+        Returns:
+            ForwardedResponse: Response of the replica
+
+        Raises:
+            ClusterForwardError: If the replica cannot be reached or answers
+                with a server error
+        """
+        forwarded = {
+            name: headers[name] for name in FORWARDED_REQUEST_HEADERS if name in headers
+        }
+        forwarded[FORWARDED_HEADER] = self.self_url
+        forwarded[FORWARDED_SIGNATURE_HEADER] = self.sign(
+            forwarded.get(REQUEST_ID_HEADER, ""), forwarded.get(CLIENT_HEADER, "")
+        )
+        try:
+            response = requests.post(
+                node + path,
+                data=body,
+                headers=forwarded,
+                timeout=(self.connect_timeout, self.timeout),
+                stream=True,
+            )
+            try:
+                content = response.raw.read(decode_content=False)
+            finally:
+                response.close()
+        except requests.exceptions.RequestException as e:
+            raise ClusterForwardError(f"Cannot reach {node}: {e}") from e
+        if response.status_code >= 500:
+            raise ClusterForwardError(f"{node} answered {response.status_code}")
+        relayed = {
+            name: response.headers[name]
+            for name in ("Content-Type",) + FORWARDED_RESPONSE_HEADERS
+            if name in response.headers
+        }
+        return ForwardedResponse(response.status_code, relayed, content)
@@ -0,0 +1,97 @@
+"""Response compression and Accept-Encoding negotiation.
+
+This module provides the codecs used for precompressed render variants
+(gzip always, brotli when the optional ``brotli`` package is installed) and
+a small ``Accept-Encoding`` parser to pick the best encoding for a client.
+"""
+
+import gzip
+from typing import Optional, Sequence, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+ENCODING_GZIP = "gzip"
+ENCODING_BROTLI = "br"
+
+# Content types worth compressing (PNG is already deflated)
+COMPRESSIBLE_TYPES = frozenset({"image/svg+xml"})
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """Encodings supported by this process, most preferred first."""
+    if brotli is not None:
+        return (ENCODING_BROTLI, ENCODING_GZIP)
+    return (ENCODING_GZIP,)
+
+
+def choose_encoding(
+    accept_encoding: Optional[str], available: Sequence[str] = ()
+) -> Optional[str]:
+    """Pick the best content coding accepted by the client.
+
+    Args:
+        accept_encoding: Raw Accept-Encoding header value
+        available: Server-side encodings in preference order, defaults to
+                  :func:`available_encodings`
+
+    Returns:
+        Optional[str]: Chosen encoding, or None for identity
+    """
+    if not accept_encoding:
+        return None
+    available = tuple(available) or available_encodings()
+
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in available:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress ``data`` with the maximum level of ``encoding``.
+
+    Output is deterministic (no gzip timestamp), so identical renders give
+    identical compressed bytes.
+
+    Raises:
+        ValueError: If the encoding is not available
+    """
+    if encoding == ENCODING_GZIP:
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == ENCODING_BROTLI and brotli is not None:
+        return brotli.compress(data, quality=11)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """Reverse :func:`compress`.
+
+    Raises:
+        ValueError: If the encoding is not available
+    """
+    if encoding == ENCODING_GZIP:
+        return gzip.decompress(data)
+    if encoding == ENCODING_BROTLI and brotli is not None:
+        return brotli.decompress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
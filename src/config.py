@@ -21,21 +21,155 @@ class Config:
 
     Environment Variables:
         KROKI_URL: Kroki service endpoint URL (default: http://localhost:8000)
+        KROKI_GET_MAX_URI: Longest deflate+base64 GET URL sent to Kroki, match
+                           Kroki's KROKI_MAX_URI_LENGTH; 0 disables (default: 0)
+        KROKI_GET_MIN_BYTES: Smallest source sent as a compressed GET (default: 1024)
         REQUEST_TIMEOUT: HTTP request timeout in seconds (default: 10)
-        MAX_BYTES: Maximum diagram source size in bytes (default: 1000000)
+        MAX_BYTES: Source size above which sources are spooled to disk and
+                   streamed to Kroki (default: 1000000)
+        MAX_REQUEST_BYTES: Largest accepted request body, larger ones get 413
+                           (default: 10MB)
         FLASK_ENV: Flask environment name (default: development)
         FLASK_DEBUG: Enable Flask debug mode (default: false)
         SECRET_KEY: Flask secret key for session management (required in production)
         DIAGRAM_BACKGROUND_COLOR: Default diagram background color (default: white)
         DIAGRAM_THEME: Default diagram theme (default: default)
+        SCHEDULER_MAX_CONCURRENCY: Concurrent upstream renders per worker (default: 8)
+        SCHEDULER_RESERVED_INTERACTIVE: Slots reserved for UI renders (default: 2)
+        SCHEDULER_MAX_QUEUE: Maximum queued renders per worker (default: 32)
+        SCHEDULER_QUEUE_TIMEOUT: Maximum wait for a render slot in seconds (default: 10)
+        RENDER_CACHE_MAX_BYTES: Render cache memory budget, 0 disables (default: 64MB)
+        RENDER_CACHE_TTL: Render cache entry lifetime in seconds (default: 3600)
+        RENDER_CACHE_STORE_COMPRESSED: Keep SVG renders gzip-compressed only (default: false)
+        RENDER_CACHE_CANONICAL: Key renders by canonical source, ignoring comments
+                                and insignificant whitespace (default: true)
+        RENDER_CACHE_SHARED: Shared render cache tier: memory, filesystem or
+                             redis (default: none)
+        RENDER_CACHE_SHARED_URL: Directory (filesystem) or redis:// URL (redis)
+                                 of the shared tier
+        RENDER_CACHE_SHARED_TTL: Render lifetime in the shared tier in seconds
+                                 (default: 86400)
+        RENDER_CACHE_SHARED_MAX_BYTES: Budget of the memory and filesystem shared
+                                       tiers (default: 256MB)
+        RENDER_CACHE_SHARED_TIMEOUT: Shared tier network timeout in seconds
+                                     (default: 0.25)
+        RENDER_CACHE_SHARED_RETRY_AFTER: Seconds the shared tier is bypassed after
+                                         an error (default: 30)
+        NEGATIVE_CACHE_MAX_BYTES: Budget of the syntax error cache, 0 disables
+                                  (default: 1MB)
+        NEGATIVE_CACHE_TTL: Syntax error cache entry lifetime in seconds (default: 30)
+        PREFLIGHT_VALIDATE: Check Graphviz/Mermaid syntax locally before calling
+                            Kroki (default: false)
+        PREFLIGHT_MAX_CHARS: Longest source checked locally (default: 200000)
+        COST_ESTIMATE: Estimate render cost to set timeouts and lanes (default: false)
+        COST_MAX_COMPLEXITY: Complexity ceiling above which diagrams are refused,
+                             0 disables (default: 0)
+        COST_TIMEOUT_FACTOR: Upstream timeout as a multiple of the predicted
+                             render time (default: 4)
+        COST_MIN_TIMEOUT: Shortest estimated upstream timeout in seconds (default: 5)
+        COST_MAX_TIMEOUT: Longest estimated upstream timeout in seconds (default: 60)
+        COST_HEAVY_SECONDS: Predicted render time from which a render moves one
+                            lane down, 0 disables (default: 2)
+        SVG_NORMALIZE: Make generated SVG ids deterministic (default: true)
+        SVG_OPTIMIZE: Enable SVG optimisation of renders (default: false)
+        SVG_OPTIMIZE_PASSES: Comma-separated optimisation passes (default: all)
+        SVG_PRECISION: Decimal places kept in SVG geometry (default: 3)
+        PNG_OPTIMIZE: Enable background lossless PNG recompression (default: false)
+        PNG_OPTIMIZE_LEVEL: zlib level used for recompression (default: 9)
+        PNG_OPTIMIZE_MAX_PIXELS: Largest image eligible for colour reduction
+            (default: 4000000)
+        PNG_OPTIMIZE_WORKERS: Background optimisation threads (default: 1)
+        PNG_OPTIMIZE_MAX_PENDING: Maximum queued optimisations (default: 32)
+        LOG_LEVEL: Level of the application loggers (default: INFO)
+        LOG_FORMAT: Log line format, json or text (default: json)
+        LOG_SAMPLE_RATE: Fraction of successful requests logged; errors and
+                         slow requests are always logged (default: 1.0)
+        LOG_SLOW_MS: Duration from which a request is always logged in
+                     milliseconds (default: 1000)
+        TRACE_ENABLED: Record per-request spans in memory (default: false)
+        TRACE_BUFFER_SIZE: Slowest and most recent traces kept per worker
+                           (default: 50)
+        TRACE_MIN_MS: Shortest request kept among the slowest traces in
+                      milliseconds (default: 0)
+        ADMIN_TOKEN: Token required by the debug endpoints, which are
+                     disabled while it is unset (default: unset)
+        PROFILE_ENABLED: Allow per-request CPU profiling (default: false)
+        PROFILE_DIR: Directory of the request profiles
+                     (default: <tmp>/kroki-profiles)
+        PROFILE_SAMPLE_RATE: Fraction of requests profiled without being
+                             asked (default: 0)
+        PROFILE_MAX_FILES: Number of profiles kept (default: 20)
+        MEMORY_TRACKING: Measure per-request peak allocations with tracemalloc
+                         (default: false)
+        MEMORY_SAMPLE_RATE: Fraction of requests measured (default: 1.0)
+        MEMORY_RSS_INTERVAL: Seconds between worker RSS samples, 0 disables
+                             (default: 15)
+        MEMORY_MAX_GROWTH_MB: RSS growth after which a worker is recycled,
+                              0 disables (default: 0)
+        MEMORY_RECYCLE_MIN_REQUESTS: Requests a worker serves before it may be
+                                     recycled (default: 100)
+        PREVIEW_ENABLED: Serve the live-preview endpoint (default: true)
+        PREVIEW_MAX_SESSIONS: Preview sessions tracked per worker
+                              (default: 1000)
+        PREVIEW_MIN_DEBOUNCE_MS: Shortest debounce suggested to the editor
+                                 (default: 150)
+        PREVIEW_MAX_DEBOUNCE_MS: Longest debounce suggested to the editor
+                                 (default: 2000)
+        ASSETS_AUTO_RELOAD: Reload changed static files and render the index
+                            page on every request (default: false, true in
+                            development)
+        PERMALINK_STORE: Store renders for permalinks: memory or filesystem,
+                         empty to disable (default: disabled)
+        PERMALINK_DIR: Directory of the filesystem permalink store
+                       (default: <tmp>/kroki-permalinks)
+        PERMALINK_MAX_BYTES: Size above which the oldest stored renders are
+                             dropped (default: 256MB)
+        PERMALINK_TTL: Seconds a stored render is kept, 0 for no age limit
+                       (default: 0)
+        PERMALINK_SHARED: The filesystem permalink store is shared by every
+                          replica, required with cluster routing
+                          (default: false)
+        CLUSTER_PEERS: Comma-separated base URLs of all replicas, enabling
+                       cache-aware routing (default: disabled)
+        CLUSTER_SELF_URL: Base URL of this replica, as listed in CLUSTER_PEERS
+        CLUSTER_VNODES: Points per replica on the hash ring (default: 100)
+        CLUSTER_LOAD_FACTOR: Load of a replica, as a multiple of the average,
+                             above which renders spill to the next replica
+                             (default: 1.25)
+        CLUSTER_FORWARD_TIMEOUT: Seconds to wait for a forwarded render
+                                 (default: 30)
+        CLUSTER_SECRET: Key shared by every replica to sign forwarded
+                        requests (default: SECRET_KEY)
+        HOTKEYS_TOP_K: Number of hottest renders tracked and kept warm,
+                       0 disables (default: 0)
+        HOTKEYS_SKETCH_WIDTH: Counters per row of the frequency sketch
+                              (default: 2048)
+        HOTKEYS_SKETCH_DEPTH: Rows of the frequency sketch (default: 4)
+        HOTKEYS_DECAY_AFTER: Requests after which counts are halved
+                             (default: 100000)
+        HOTKEYS_REFRESH_INTERVAL: Seconds between refreshes of the hottest
+                                  renders, 0 disables (default: 60)
+        HOTKEYS_STATE_FILE: File keeping the hottest renders across restarts
+                            (default: none)
+        WARMUP_ENABLED: Render a seed corpus into the cache at startup
+                        (default: false)
+        WARMUP_TEMPLATES: Include the quick-use templates of the index page
+                          in the seed corpus (default: true)
+        WARMUP_CORPUS: JSON file of additional diagrams to warm (default: none)
+        WARMUP_CONCURRENCY: Warm-up renders run at the same time (default: 4)
+        WARMUP_TIMEOUT: Seconds after which the warm-up is abandoned and the
+                        worker reports ready (default: 60)
     """
 
     # Kroki service configuration
     KROKI_URL: str = os.getenv("KROKI_URL", "http://localhost:8000")
+    KROKI_GET_MAX_URI: int = int(os.getenv("KROKI_GET_MAX_URI", "0"))
+    KROKI_GET_MIN_BYTES: int = int(os.getenv("KROKI_GET_MIN_BYTES", "1024"))
 
     # Request settings
     REQUEST_TIMEOUT: int = int(os.getenv("REQUEST_TIMEOUT", "10"))
     MAX_BYTES: int = int(os.getenv("MAX_BYTES", "1000000"))
+    MAX_REQUEST_BYTES: int = int(os.getenv("MAX_REQUEST_BYTES", str(10 * 1024 * 1024)))
 
     # Flask settings
     FLASK_ENV: str = os.getenv("FLASK_ENV", "development")
@@ -48,6 +182,137 @@ class Config:
     DIAGRAM_BACKGROUND_COLOR: str = os.getenv("DIAGRAM_BACKGROUND_COLOR", "white")
     DIAGRAM_THEME: str = os.getenv("DIAGRAM_THEME", "default")
 
+    # Upstream render scheduling (priority lanes)
+    SCHEDULER_MAX_CONCURRENCY: int = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))
+    SCHEDULER_RESERVED_INTERACTIVE: int = int(
+        os.getenv("SCHEDULER_RESERVED_INTERACTIVE", "2")
+    )
+    SCHEDULER_MAX_QUEUE: int = int(os.getenv("SCHEDULER_MAX_QUEUE", "32"))
+    SCHEDULER_QUEUE_TIMEOUT: float = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "10"))
+
+    # Render cache
+    RENDER_CACHE_MAX_BYTES: int = int(
+        os.getenv("RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+    )
+    RENDER_CACHE_TTL: int = int(os.getenv("RENDER_CACHE_TTL", "3600"))
+    RENDER_CACHE_STORE_COMPRESSED: bool = (
+        os.getenv("RENDER_CACHE_STORE_COMPRESSED", "false").lower() == "true"
+    )
+    RENDER_CACHE_CANONICAL: bool = (
+        os.getenv("RENDER_CACHE_CANONICAL", "true").lower() == "true"
+    )
+    RENDER_CACHE_SHARED: str = os.getenv("RENDER_CACHE_SHARED", "")
+    RENDER_CACHE_SHARED_URL: str = os.getenv("RENDER_CACHE_SHARED_URL", "")
+    RENDER_CACHE_SHARED_TTL: int = int(os.getenv("RENDER_CACHE_SHARED_TTL", "86400"))
+    RENDER_CACHE_SHARED_MAX_BYTES: int = int(
+        os.getenv("RENDER_CACHE_SHARED_MAX_BYTES", str(256 * 1024 * 1024))
+    )
+    RENDER_CACHE_SHARED_TIMEOUT: float = float(
+        os.getenv("RENDER_CACHE_SHARED_TIMEOUT", "0.25")
+    )
+    RENDER_CACHE_SHARED_RETRY_AFTER: int = int(
+        os.getenv("RENDER_CACHE_SHARED_RETRY_AFTER", "30")
+    )
+
+    # SVG post-processing
+    SVG_NORMALIZE: bool = os.getenv("SVG_NORMALIZE", "true").lower() == "true"
+    SVG_OPTIMIZE: bool = os.getenv("SVG_OPTIMIZE", "false").lower() == "true"
+    SVG_OPTIMIZE_PASSES: str = os.getenv("SVG_OPTIMIZE_PASSES", "")
+    SVG_PRECISION: int = int(os.getenv("SVG_PRECISION", "3"))
+    PNG_OPTIMIZE: bool = os.getenv("PNG_OPTIMIZE", "false").lower() == "true"
+    PNG_OPTIMIZE_LEVEL: int = int(os.getenv("PNG_OPTIMIZE_LEVEL", "9"))
+    PNG_OPTIMIZE_MAX_PIXELS: int = int(os.getenv("PNG_OPTIMIZE_MAX_PIXELS", "4000000"))
+    PNG_OPTIMIZE_WORKERS: int = int(os.getenv("PNG_OPTIMIZE_WORKERS", "1"))
+    PNG_OPTIMIZE_MAX_PENDING: int = int(os.getenv("PNG_OPTIMIZE_MAX_PENDING", "32"))
+
+    # Negative cache of failed renders
+    NEGATIVE_CACHE_MAX_BYTES: int = int(
+        os.getenv("NEGATIVE_CACHE_MAX_BYTES", str(1024 * 1024))
+    )
+    NEGATIVE_CACHE_TTL: int = int(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+
+    # Pre-flight syntax validation
+    PREFLIGHT_VALIDATE: bool = (
+        os.getenv("PREFLIGHT_VALIDATE", "false").lower() == "true"
+    )
+    PREFLIGHT_MAX_CHARS: int = int(os.getenv("PREFLIGHT_MAX_CHARS", "200000"))
+
+    # Render cost estimation
+    COST_ESTIMATE: bool = os.getenv("COST_ESTIMATE", "false").lower() == "true"
+    COST_MAX_COMPLEXITY: float = float(os.getenv("COST_MAX_COMPLEXITY", "0"))
+    COST_TIMEOUT_FACTOR: float = float(os.getenv("COST_TIMEOUT_FACTOR", "4"))
+    COST_MIN_TIMEOUT: float = float(os.getenv("COST_MIN_TIMEOUT", "5"))
+    COST_MAX_TIMEOUT: float = float(os.getenv("COST_MAX_TIMEOUT", "60"))
+    COST_HEAVY_SECONDS: float = float(os.getenv("COST_HEAVY_SECONDS", "2"))
+
+    # Structured request logging
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json").lower()
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    LOG_SLOW_MS: float = float(os.getenv("LOG_SLOW_MS", "1000"))
+
+    # In-process tracing and debug endpoints
+    TRACE_ENABLED: bool = os.getenv("TRACE_ENABLED", "false").lower() == "true"
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "50"))
+    TRACE_MIN_MS: float = float(os.getenv("TRACE_MIN_MS", "0"))
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    PROFILE_ENABLED: bool = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "")
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_MAX_FILES: int = int(os.getenv("PROFILE_MAX_FILES", "20"))
+
+    # Memory accounting and worker recycling
+    MEMORY_TRACKING: bool = os.getenv("MEMORY_TRACKING", "false").lower() == "true"
+    MEMORY_SAMPLE_RATE: float = float(os.getenv("MEMORY_SAMPLE_RATE", "1.0"))
+    MEMORY_RSS_INTERVAL: float = float(os.getenv("MEMORY_RSS_INTERVAL", "15"))
+    MEMORY_MAX_GROWTH_MB: int = int(os.getenv("MEMORY_MAX_GROWTH_MB", "0"))
+    MEMORY_RECYCLE_MIN_REQUESTS: int = int(
+        os.getenv("MEMORY_RECYCLE_MIN_REQUESTS", "100")
+    )
+
+    # Live preview
+    PREVIEW_ENABLED: bool = os.getenv("PREVIEW_ENABLED", "true").lower() == "true"
+    PREVIEW_MAX_SESSIONS: int = int(os.getenv("PREVIEW_MAX_SESSIONS", "1000"))
+    PREVIEW_MIN_DEBOUNCE_MS: float = float(os.getenv("PREVIEW_MIN_DEBOUNCE_MS", "150"))
+    PREVIEW_MAX_DEBOUNCE_MS: float = float(os.getenv("PREVIEW_MAX_DEBOUNCE_MS", "2000"))
+
+    # Static assets and page caching
+    ASSETS_AUTO_RELOAD: bool = (
+        os.getenv("ASSETS_AUTO_RELOAD", "false").lower() == "true"
+    )
+
+    # Render permalinks
+    PERMALINK_STORE: str = os.getenv("PERMALINK_STORE", "")
+    PERMALINK_DIR: str = os.getenv("PERMALINK_DIR", "")
+    PERMALINK_MAX_BYTES: int = int(
+        os.getenv("PERMALINK_MAX_BYTES", str(256 * 1024 * 1024))
+    )
+    PERMALINK_TTL: float = float(os.getenv("PERMALINK_TTL", "0"))
+    PERMALINK_SHARED: bool = os.getenv("PERMALINK_SHARED", "false").lower() == "true"
+
+    # Cache-aware routing across replicas
+    CLUSTER_PEERS: str = os.getenv("CLUSTER_PEERS", "")
+    CLUSTER_SELF_URL: str = os.getenv("CLUSTER_SELF_URL", "")
+    CLUSTER_VNODES: int = int(os.getenv("CLUSTER_VNODES", "100"))
+    CLUSTER_LOAD_FACTOR: float = float(os.getenv("CLUSTER_LOAD_FACTOR", "1.25"))
+    CLUSTER_FORWARD_TIMEOUT: float = float(os.getenv("CLUSTER_FORWARD_TIMEOUT", "30"))
+    CLUSTER_SECRET: str = os.getenv("CLUSTER_SECRET", "")
+
+    # Hot diagram tracking and pre-rendering
+    HOTKEYS_TOP_K: int = int(os.getenv("HOTKEYS_TOP_K", "0"))
+    HOTKEYS_SKETCH_WIDTH: int = int(os.getenv("HOTKEYS_SKETCH_WIDTH", "2048"))
+    HOTKEYS_SKETCH_DEPTH: int = int(os.getenv("HOTKEYS_SKETCH_DEPTH", "4"))
+    HOTKEYS_DECAY_AFTER: int = int(os.getenv("HOTKEYS_DECAY_AFTER", "100000"))
+    HOTKEYS_REFRESH_INTERVAL: float = float(os.getenv("HOTKEYS_REFRESH_INTERVAL", "60"))
+    HOTKEYS_STATE_FILE: str = os.getenv("HOTKEYS_STATE_FILE", "")
+
+    # Render cache warm-up at startup
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+    WARMUP_TEMPLATES: bool = os.getenv("WARMUP_TEMPLATES", "true").lower() == "true"
+    WARMUP_CORPUS: str = os.getenv("WARMUP_CORPUS", "")
+    WARMUP_CONCURRENCY: int = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+    WARMUP_TIMEOUT: float = float(os.getenv("WARMUP_TIMEOUT", "60"))
+
 
 class DevelopmentConfig(Config):
     """Development environment configuration.
@@ -57,6 +322,7 @@ class DevelopmentConfig(Config):
     """
 
     DEBUG: bool = True
+    ASSETS_AUTO_RELOAD: bool = True
 
 
 class ProductionConfig(Config):
@@ -78,6 +344,8 @@ class TestingConfig(Config):
 
     TESTING: bool = True
     DEBUG: bool = True
+    # No background RSS sampling thread per test app
+    MEMORY_RSS_INTERVAL: float = 0
 
 
 config: Dict[str, Type[Config]] = {
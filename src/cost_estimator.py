@@ -0,0 +1,297 @@
+"""Static render-cost estimation for diagram sources.
+
+Render latency grows with the structure of a diagram (nodes and edges to lay
+out, sequence participants, Excalidraw elements) far more than with its byte
+length. This module counts those features with a single cheap pass over the
+source, turns them into a complexity score and predicts the render time with
+a per-type linear model. The prediction drives the upstream timeout and lane
+of the request, and diagrams above a complexity ceiling are refused before
+they take upstream capacity.
+
+The per-unit cost of each type is recalibrated from observed latencies, and
+the prediction error is exported so the model can be checked in production.
+"""
+
+import json
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from src.scheduler import LANE_API, LANE_BATCH, LANE_INTERACTIVE
+from src.validators import (
+    TOKEN_EDGEOP,
+    TOKEN_ID,
+    TOKEN_KEYWORD,
+    SourceSyntaxError,
+    dot_tokens,
+)
+
+# Default (base seconds, seconds per complexity unit) per diagram type
+DEFAULT_COSTS: Dict[str, Tuple[float, float]] = {
+    "graphviz": (0.05, 0.002),
+    "mermaid": (0.3, 0.004),
+    "plantuml": (0.2, 0.003),
+    "excalidraw": (0.2, 0.002),
+    "blockdiag": (0.1, 0.003),
+    "seqdiag": (0.1, 0.003),
+    "actdiag": (0.1, 0.003),
+}
+FALLBACK_COST = (0.2, 0.003)
+
+# Weight of each feature in the complexity score
+FEATURE_WEIGHTS: Dict[str, float] = {
+    "nodes": 1.0,
+    "edges": 2.0,
+    "clusters": 5.0,
+    "participants": 2.0,
+    "statements": 1.0,
+    "elements": 1.0,
+    "points": 0.1,
+    "lines": 1.0,
+}
+# Bytes per complexity unit for sources that are not read (spooled files)
+BYTES_PER_UNIT = 40
+
+# Lane a heavy render is moved to
+_DEMOTED_LANE = {LANE_INTERACTIVE: LANE_API, LANE_API: LANE_BATCH}
+
+_QUOTED_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"')
+# Mermaid flowchart links and sequence messages
+_MERMAID_LINK_RE = re.compile(r"<?(?:-{2,}|={2,}|-\.+-|~{3})[>xo]?|-{1,2}(?:>>|>|x|\))")
+_MERMAID_DECL_RE = re.compile(
+    r"^\s*(?:participant|actor|class|state|entity|box)\b", re.MULTILINE
+)
+# PlantUML arrows: -> --> ->> <- .> ..> -[#red]-> and friends
+_PLANTUML_LINK_RE = re.compile(r"<?[-.]+(?:\[[^\]\n]*\][-.]*)?>>?|<[-.]+")
+_PLANTUML_DECL_RE = re.compile(
+    r"^\s*(?:participant|actor|boundary|control|entity|database|collections|queue"
+    r"|class|interface|abstract|enum|component|node|usecase|state|object|rectangle)\b",
+    re.MULTILINE,
+)
+_BLOCKDIAG_LINK_RE = re.compile(r"<?->>?|--|>>|<<")
+
+
+@dataclass(frozen=True)
+class CostEstimate:
+    """Predicted cost of a render.
+
+    Attributes:
+        diagram_type: Kroki diagram type
+        complexity: Weighted sum of the structural features
+        seconds: Predicted upstream render time
+        features: Feature counts the complexity is derived from
+    """
+
+    diagram_type: str
+    complexity: float
+    seconds: float
+    features: Dict[str, int] = field(default_factory=dict)
+
+
+class CostEstimator:
+    """Predict render cost from source structure and calibrate on observations.
+
+    Attributes:
+        max_complexity (float): Complexity ceiling above which renders are
+            refused, 0 for no ceiling
+        timeout_factor (float): Upstream timeout as a multiple of the
+            predicted render time
+        min_timeout (float): Shortest upstream timeout in seconds
+        max_timeout (float): Longest upstream timeout in seconds
+        heavy_seconds (float): Predicted time from which a render is moved to
+            a lower priority lane, 0 to never move renders
+        smoothing (float): Weight of a new observation in the per-unit cost
+    """
+
+    def __init__(
+        self,
+        max_complexity: float = 0,
+        timeout_factor: float = 4.0,
+        min_timeout: float = 5.0,
+        max_timeout: float = 60.0,
+        heavy_seconds: float = 2.0,
+        smoothing: float = 0.1,
+    ) -> None:
+        self.max_complexity = max_complexity
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max(max_timeout, min_timeout)
+        self.heavy_seconds = heavy_seconds
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._costs: Dict[str, Tuple[float, float]] = dict(DEFAULT_COSTS)
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["CostEstimator"]:
+        """Build an estimator from a Flask config mapping, or None if disabled."""
+        if not config.get("COST_ESTIMATE", False):
+            return None
+        return cls(
+            max_complexity=config.get("COST_MAX_COMPLEXITY", 0),
+            timeout_factor=config.get("COST_TIMEOUT_FACTOR", 4.0),
+            min_timeout=config.get("COST_MIN_TIMEOUT", 5.0),
+            max_timeout=config.get("COST_MAX_TIMEOUT", 60.0),
+            heavy_seconds=config.get("COST_HEAVY_SECONDS", 2.0),
+        )
+
+    def estimate(self, diagram_type: str, source: str) -> CostEstimate:
+        """Estimate the render cost of a text source.
+
+        Args:
+            diagram_type: Kroki diagram type
+            source: Source as sent upstream
+
+        Returns:
+            CostEstimate: Features, complexity and predicted render time
+        """
+        counter = FEATURE_COUNTERS.get(diagram_type, _count_lines)
+        return self._predict(diagram_type, counter(source))
+
+    def estimate_size(self, diagram_type: str, size: int) -> CostEstimate:
+        """Estimate the render cost of a source known only by its size."""
+        return self._predict(diagram_type, {"lines": size // BYTES_PER_UNIT})
+
+    def exceeds_ceiling(self, estimate: CostEstimate) -> bool:
+        """Whether a render is above the configured complexity ceiling."""
+        return 0 < self.max_complexity < estimate.complexity
+
+    def timeout_for(self, estimate: CostEstimate) -> float:
+        """Upstream timeout in seconds for a render."""
+        timeout = estimate.seconds * self.timeout_factor
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def lane_for(self, estimate: CostEstimate, lane: str) -> str:
+        """Scheduling lane of a render: heavy renders move one lane down."""
+        if self.heavy_seconds > 0 and estimate.seconds >= self.heavy_seconds:
+            return _DEMOTED_LANE.get(lane, lane)
+        return lane
+
+    def observe(self, estimate: CostEstimate, seconds: float) -> float:
+        """Record an observed render time and recalibrate the type's model.
+
+        Args:
+            estimate: Estimate made before the render
+            seconds: Observed upstream render time
+
+        Returns:
+            float: Prediction error in seconds (observed minus predicted)
+        """
+        if estimate.complexity > 0:
+            with self._lock:
+                base, per_unit = self._costs.get(estimate.diagram_type, FALLBACK_COST)
+                sample = max(0.0, seconds - base) / estimate.complexity
+                per_unit += self.smoothing * (sample - per_unit)
+                self._costs[estimate.diagram_type] = (base, per_unit)
+        return seconds - estimate.seconds
+
+    def _predict(self, diagram_type: str, features: Dict[str, int]) -> CostEstimate:
+        """Score features and predict the render time."""
+        complexity = sum(
+            count * FEATURE_WEIGHTS.get(name, 1.0) for name, count in features.items()
+        )
+        with self._lock:
+            base, per_unit = self._costs.get(diagram_type, FALLBACK_COST)
+        return CostEstimate(
+            diagram_type=diagram_type,
+            complexity=complexity,
+            seconds=base + per_unit * complexity,
+            features=features,
+        )
+
+
+def _count_dot(source: str) -> Dict[str, int]:
+    """Nodes, edges and clusters of a DOT graph."""
+    try:
+        tokens = dot_tokens(source)
+    except SourceSyntaxError:
+        return _count_lines(source)
+
+    nodes = set()
+    edges = clusters = 0
+    previous = ""
+    for index, (kind, value, _, _) in enumerate(tokens):
+        following = tokens[index + 1][0] if index + 1 < len(tokens) else ""
+        if kind == TOKEN_EDGEOP:
+            edges += 1
+        elif kind == TOKEN_KEYWORD and value == "subgraph":
+            clusters += 1
+        elif kind == TOKEN_ID and previous not in ("=", TOKEN_KEYWORD):
+            # Attribute names and values, graph and subgraph names are not nodes
+            if following != "=":
+                nodes.add(value)
+        previous = kind
+    return {"nodes": len(nodes), "edges": edges, "clusters": clusters}
+
+
+def _count_mermaid(source: str) -> Dict[str, int]:
+    """Statements, links and declared participants of a Mermaid diagram."""
+    code = _code(source, "%%")
+    return {
+        "statements": code.count("\n") + 1 if code else 0,
+        "edges": len(_MERMAID_LINK_RE.findall(code)),
+        "participants": len(_MERMAID_DECL_RE.findall(code)),
+    }
+
+
+def _count_plantuml(source: str) -> Dict[str, int]:
+    """Statements, arrows and declared participants of a PlantUML diagram."""
+    code = _code(source, "'")
+    return {
+        "statements": code.count("\n") + 1 if code else 0,
+        "edges": len(_PLANTUML_LINK_RE.findall(code)),
+        "participants": len(_PLANTUML_DECL_RE.findall(code)),
+    }
+
+
+def _count_blockdiag(source: str) -> Dict[str, int]:
+    """Statements and edges of a blockdiag-family diagram."""
+    code = _code(source, "//")
+    return {
+        "statements": code.count("\n") + 1 if code else 0,
+        "edges": len(_BLOCKDIAG_LINK_RE.findall(code)),
+    }
+
+
+def _count_excalidraw(source: str) -> Dict[str, int]:
+    """Elements and path points of an Excalidraw scene."""
+    try:
+        scene = json.loads(source)
+    except ValueError:
+        return _count_lines(source)
+    elements = scene.get("elements") if isinstance(scene, dict) else None
+    if not isinstance(elements, list):
+        return {"elements": 0}
+    points = sum(
+        len(element["points"])
+        for element in elements
+        if isinstance(element, dict) and isinstance(element.get("points"), list)
+    )
+    return {"elements": len(elements), "points": points}
+
+
+def _count_lines(source: str) -> Dict[str, int]:
+    """Non-blank lines, for types without a dedicated counter."""
+    return {"lines": sum(1 for line in source.splitlines() if line.strip())}
+
+
+def _code(source: str, comment: str) -> str:
+    """Non-blank, non-comment lines of ``source`` with quoted strings emptied."""
+    lines = []
+    for line in source.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith(comment):
+            lines.append(stripped)
+    return _QUOTED_RE.sub('""', "\n".join(lines))
+
+
+# Diagram type to feature counter; other types are scored by line count
+FEATURE_COUNTERS: Dict[str, Callable[[str], Dict[str, int]]] = {
+    "graphviz": _count_dot,
+    "mermaid": _count_mermaid,
+    "plantuml": _count_plantuml,
+    "excalidraw": _count_excalidraw,
+    "blockdiag": _count_blockdiag,
+    "seqdiag": _count_blockdiag,
+    "actdiag": _count_blockdiag,
+}
@@ -0,0 +1,412 @@
+"""Hot diagram tracking and proactive pre-rendering.
+
+A small set of diagrams makes up most of the traffic. Every API render
+request is counted in a count-min sketch keyed by its render identity, a
+fixed-size table whose estimates may overcount but never undercount. The
+``capacity`` identities with the highest estimates are kept as the top-K,
+together with what is needed to render them again. Counts are halved
+periodically, so the top-K follows recent traffic.
+
+A background refresher goes through the top-K at a fixed interval, so the
+hottest renders stay in the cache (a cache hit only refreshes their place in
+the LRU, a miss renders them in the batch lane). When the settings a render
+depends on change, e.g. a new default ``DIAGRAM_THEME``, cached renders of the
+top-K are invalidated and rendered again. The top-K and the settings
+fingerprint can be saved to a file, so a restarted worker warms the hottest
+diagrams with its new settings before they are asked for.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+from src.kroki_client import KrokiClient, KrokiError
+from src.metrics import Metrics
+from src.scheduler import LANE_BATCH
+
+logger = logging.getLogger(__name__)
+
+# Settings a render depends on: changing one invalidates the hottest renders
+RENDER_SETTINGS = (
+    "KROKI_URL",
+    "DIAGRAM_THEME",
+    "SVG_NORMALIZE",
+    "SVG_OPTIMIZE",
+    "SVG_OPTIMIZE_PASSES",
+    "SVG_PRECISION",
+    "PNG_OPTIMIZE",
+    "PNG_OPTIMIZE_LEVEL",
+)
+
+
+def settings_fingerprint(config: Mapping[str, Any]) -> str:
+    """Digest of the render settings of a config mapping."""
+    settings = {name: config.get(name) for name in RENDER_SETTINGS}
+    encoded = json.dumps(settings, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class CountMinSketch:
+    """Count-min sketch of string keys.
+
+    Estimates exceed the true count by at most ``2 / width`` of the total with
+    probability ``1 - 2 ** -depth``.
+
+    Attributes:
+        width (int): Counters per row
+        depth (int): Rows, each with its own hash
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        self.width = width
+        self.depth = depth
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Count ``key`` and return its new estimate."""
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """Estimated count of ``key``."""
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def halve(self) -> None:
+        """Halve every counter, aging past traffic."""
+        for row in self._rows:
+            for i, value in enumerate(row):
+                row[i] = value >> 1
+
+    def _indexes(self, key: str) -> List[int]:
+        """Counter index of ``key`` in each row."""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * self.depth)
+        data = digest.digest()
+        return [
+            int.from_bytes(data[4 * i : 4 * i + 4], "big") % self.width
+            for i in range(self.depth)
+        ]
+
+
+@dataclass
+class HotRender:
+    """A frequently requested render and what is needed to render it again.
+
+    Attributes:
+        key: Render identity
+        diagram_type: Kroki diagram type
+        output_format: Output format (png, svg)
+        diagram_source: Diagram source
+        theme: Theme asked for by the client, None for the default
+        count: Estimated request count
+    """
+
+    key: str
+    diagram_type: str
+    output_format: str
+    diagram_source: str
+    theme: Optional[str]
+    count: int
+
+    def summary(self) -> Dict[str, Any]:
+        """Description for the admin endpoint, without the source."""
+        return {
+            "key": self.key,
+            "diagram_type": self.diagram_type,
+            "output_format": self.output_format,
+            "theme": self.theme,
+            "count": self.count,
+            "source_bytes": len(self.diagram_source.encode("utf-8")),
+        }
+
+
+class HotKeys:
+    """Thread-safe frequency sketch of render identities with a top-K.
+
+    Attributes:
+        capacity (int): Number of hottest renders kept (K)
+        decay_after (int): Recorded requests after which counts are halved
+        max_source_bytes (int): Largest source kept in the top-K
+        sketch (CountMinSketch): Frequency estimates
+    """
+
+    def __init__(
+        self,
+        capacity: int = 32,
+        width: int = 2048,
+        depth: int = 4,
+        decay_after: int = 100_000,
+        max_source_bytes: int = 64 * 1024,
+    ) -> None:
+        self.capacity = capacity
+        self.decay_after = decay_after
+        self.max_source_bytes = max_source_bytes
+        self.sketch = CountMinSketch(width, depth)
+        self.recorded = 0
+        self._since_decay = 0
+        self._lock = threading.Lock()
+        self._top: Dict[str, HotRender] = {}
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["HotKeys"]:
+        """Build the tracker from a Flask config mapping, or None if disabled."""
+        capacity = config.get("HOTKEYS_TOP_K", 0)
+        if capacity <= 0:
+            return None
+        return cls(
+            capacity=capacity,
+            width=config.get("HOTKEYS_SKETCH_WIDTH", 2048),
+            depth=config.get("HOTKEYS_SKETCH_DEPTH", 4),
+            decay_after=config.get("HOTKEYS_DECAY_AFTER", 100_000),
+        )
+
+    def record(
+        self,
+        key: str,
+        diagram_type: str,
+        output_format: str,
+        diagram_source: Any,
+        theme: Optional[str] = None,
+    ) -> int:
+        """Count a render request.
+
+        The render enters the top-K if its estimate beats the coldest one
+        there. Sources that are streamed from disk, not UTF-8 or larger than
+        ``max_source_bytes`` are counted but never kept.
+
+        Returns:
+            int: Estimated request count of the render
+        """
+        with self._lock:
+            count = self.sketch.add(key)
+            self.recorded += 1
+            self._since_decay += 1
+            hot = self._top.get(key)
+            if hot is not None:
+                hot.count = count
+            elif len(self._top) < self.capacity or count > self._coldest().count:
+                source = self._keepable_source(diagram_source)
+                if source is not None:
+                    if len(self._top) >= self.capacity:
+                        del self._top[self._coldest().key]
+                    self._top[key] = HotRender(
+                        key, diagram_type, output_format, source, theme, count
+                    )
+            if self.decay_after and self._since_decay >= self.decay_after:
+                self._decay()
+        return count
+
+    def top(self, limit: Optional[int] = None) -> List[HotRender]:
+        """Hottest renders, most requested first."""
+        with self._lock:
+            renders = sorted(self._top.values(), key=lambda hot: -hot.count)
+        return renders[:limit] if limit else renders
+
+    def load(self, renders: List[HotRender]) -> None:
+        """Seed the tracker with renders saved by a previous process."""
+        for hot in renders[: self.capacity]:
+            with self._lock:
+                count = self.sketch.add(hot.key, hot.count)
+                self._top[hot.key] = HotRender(**{**asdict(hot), "count": count})
+                while len(self._top) > self.capacity:
+                    del self._top[self._coldest().key]
+
+    def _coldest(self) -> HotRender:
+        """Render of the top-K with the lowest count (lock held)."""
+        return min(self._top.values(), key=lambda hot: hot.count)
+
+    def _keepable_source(self, diagram_source: Any) -> Optional[str]:
+        """Source as text if it may be kept in the top-K, else None."""
+        if isinstance(diagram_source, bytes):
+            try:
+                diagram_source = diagram_source.decode("utf-8")
+            except UnicodeDecodeError:
+                return None
+        if not isinstance(diagram_source, str):
+            return None
+        if len(diagram_source.encode("utf-8")) > self.max_source_bytes:
+            return None
+        return diagram_source
+
+    def _decay(self) -> None:
+        """Halve all counts (lock held)."""
+        self.sketch.halve()
+        for hot in self._top.values():
+            hot.count = self.sketch.estimate(hot.key)
+        self._since_decay = 0
+
+
+class HotKeyRefresher:
+    """Background thread keeping the hottest renders warm in the cache.
+
+    The thread starts when each worker process is initialised or on its first
+    request, like the RSS monitor, so a refresher created before the server
+    forks still runs in every worker.
+
+    Attributes:
+        app (Flask): Application whose cache and Kroki settings are used
+        hotkeys (HotKeys): Tracker providing the renders to refresh
+        interval (float): Seconds between two refresh passes
+        state_file (str): File saving the top-K and settings fingerprint
+            between restarts, or None
+        metrics (Metrics): Registry receiving the refresh counters, or None
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        hotkeys: HotKeys,
+        interval: float = 60,
+        state_file: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.app = app
+        self.hotkeys = hotkeys
+        self.interval = interval
+        self.state_file = state_file
+        self.metrics = metrics
+        self.fingerprint = settings_fingerprint(app.config)
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+        if state_file:
+            self._load_state()
+
+    @classmethod
+    def from_config(
+        cls,
+        app: Any,
+        hotkeys: Optional[HotKeys],
+        metrics: Optional[Metrics] = None,
+    ) -> Optional["HotKeyRefresher"]:
+        """Build a refresher for ``app``, or None if disabled."""
+        interval = app.config.get("HOTKEYS_REFRESH_INTERVAL", 60)
+        if hotkeys is None or interval <= 0:
+            return None
+        return cls(
+            app,
+            hotkeys,
+            interval=interval,
+            state_file=app.config.get("HOTKEYS_STATE_FILE") or None,
+            metrics=metrics,
+        )
+
+    def request_started(self) -> None:
+        """Start the refresh thread in a new worker process."""
+        self.start()
+
+    def start(self) -> None:
+        """Start the refresh thread if this process has none yet."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._stop.clear()
+                    threading.Thread(
+                        target=self._run, name="hotkey-refresher", daemon=True
+                    ).start()
+
+    def refresh(self) -> int:
+        """Render the hottest diagrams, from the cache when still there.
+
+        If the render settings changed since the previous pass, cached
+        renders are invalidated first, so they are rendered again.
+
+        Returns:
+            int: Number of renders refreshed successfully
+        """
+        refreshed = 0
+        with self.app.app_context():
+            fingerprint = settings_fingerprint(self.app.config)
+            changed = fingerprint != self.fingerprint
+            if changed:
+                logger.info("Render settings changed, re-rendering hot diagrams")
+            for hot in self.hotkeys.top():
+                client = KrokiClient(theme=hot.theme, lane=LANE_BATCH)
+                try:
+                    if changed:
+                        client.invalidate(
+                            hot.diagram_type, hot.output_format, hot.diagram_source
+                        )
+                    client.generate_diagram(
+                        hot.diagram_type, hot.output_format, hot.diagram_source
+                    )
+                except KrokiError as e:
+                    logger.warning("Could not refresh hot diagram %s: %s", hot.key, e)
+                    self._inc("hotkeys_refresh_total", result="failed")
+                    continue
+                refreshed += 1
+                self._inc(
+                    "hotkeys_refresh_total",
+                    result="rerendered" if changed else "refreshed",
+                )
+            self.fingerprint = fingerprint
+        if self.state_file:
+            self._save_state()
+        return refreshed
+
+    def stop(self) -> None:
+        """Stop the refresh thread."""
+        self._stop.set()
+
+    def _inc(self, name: str, **labels: Any) -> None:
+        if self.metrics is not None:
+            self.metrics.inc(name, **labels)
+
+    def _load_state(self) -> None:
+        """Seed the top-K from the state file, if any.
+
+        A fingerprint differing from the current settings makes the first
+        pass re-render the saved renders.
+        """
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            renders = [HotRender(**hot) for hot in state["renders"]]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring hot diagram state %s: %s", self.state_file, e)
+            return
+        self.hotkeys.load(renders)
+        self.fingerprint = state.get("fingerprint", self.fingerprint)
+
+    def _save_state(self) -> None:
+        """Write the top-K and fingerprint atomically to the state file."""
+        state = {
+            "fingerprint": self.fingerprint,
+            "renders": [asdict(hot) for hot in self.hotkeys.top()],
+        }
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning("Could not save hot diagram state: %s", e)
+
+    def _run(self) -> None:
+        """Refresh loop (refresher thread).
+
+        Renders loaded from the state file are warmed at once.
+        """
+        delay = 0 if self.hotkeys.top() else self.interval
+        while not self._stop.wait(delay):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Hot diagram refresh failed")
+            delay = self.interval
@@ -5,12 +5,62 @@ de génération de diagrammes Kroki, supportant plusieurs types de diagrammes,
 formats de sortie et fonctionnalités avancées comme les thèmes.
 """
 
-import tempfile
+import base64
+import time
+import zlib
 import requests
 import json
-from typing import Tuple, Optional
+import logging
+from contextlib import contextmanager, nullcontext
+from typing import IO, Any, Callable, Tuple, Optional, ContextManager, Iterator, Union
 from flask import current_app
 
+from src.compression import COMPRESSIBLE_TYPES, compress
+from src.cost_estimator import CostEstimate, CostEstimator
+from src.ingest import CHUNK_SIZE, Payload, payload_size
+from src.memory import MemorySample, current_memory_sample
+from src.metrics import Metrics
+from src.png_optimizer import BackgroundPngOptimizer
+from src.render_cache import (
+    VARIANT_OPTIMIZED,
+    VARIANT_RAW,
+    CacheEntry,
+    NegativeCache,
+    RenderCache,
+    render_key,
+)
+from src.request_log import REQUEST_ID_HEADER, RequestLog, current_request_log
+from src.response_classifier import classify_response, error_excerpt
+from src.scheduler import LANE_API, PriorityScheduler, SchedulerBusyError
+from src.svg_normalizer import SvgNormalizer
+from src.svg_optimizer import SvgOptimizer
+from src.tracing import Trace, current_trace
+from src.validators import PreflightValidator, SourceSyntaxError
+
+logger = logging.getLogger(__name__)
+
+# Source accepted by the client: text, UTF-8 bytes, or a spooled binary file
+DiagramSource = Union[str, bytes, IO[bytes]]
+
+# Types whose source is rewritten before rendering; others are sent as is
+PREPROCESSED_TYPES = frozenset(
+    {"mermaid", "plantuml", "blockdiag", "seqdiag", "actdiag", "excalidraw"}
+)
+
+# Our theme names mapped to Mermaid theme names
+MERMAID_THEMES = {
+    "default": "base",
+    "light": "base",
+    "dark": "dark",
+    "neutral": "neutral",
+    "forest": "forest",
+}
+
+
+def _app_extension(name: str) -> Any:
+    """Retourne l'extension ``name`` de l'application Flask courante, ou None."""
+    return current_app.extensions.get(name) if current_app else None
+
 
 class KrokiError(Exception):
     """Exception levée pour les erreurs liées à Kroki.
@@ -23,6 +73,48 @@ class KrokiError(Exception):
     pass
 
 
+class KrokiSyntaxError(KrokiError):
+    """Exception levée quand Kroki rejette le source du diagramme.
+
+    Le service a répondu 400 sans image valide : le source est invalide et
+    le même rendu échouera tant qu'il n'est pas modifié.
+    """
+
+    pass
+
+
+class KrokiBusyError(KrokiError):
+    """Exception levée quand aucun créneau de rendu n'est disponible.
+
+    Le planificateur de rendus est saturé : la file d'attente est pleine,
+    la requête a été évincée par un rendu prioritaire ou le délai d'attente
+    a expiré. Le client peut réessayer plus tard.
+    """
+
+    pass
+
+
+class KrokiTooComplexError(KrokiError):
+    """Exception levée quand un diagramme dépasse le plafond de complexité.
+
+    Le coût de rendu estimé localement est trop élevé : le diagramme est
+    refusé avant de consommer de la capacité Kroki.
+    """
+
+    pass
+
+
+class KrokiCancelledError(KrokiError):
+    """Exception levée quand le rendu n'est plus attendu par l'appelant.
+
+    Utilisée par l'aperçu en direct : une requête plus récente de la même
+    session a remplacé celle-ci pendant son attente d'un créneau, et l'appel
+    Kroki est abandonné avant d'être envoyé.
+    """
+
+    pass
+
+
 class KrokiClient:
     """Client HTTP pour le service Kroki.
 
@@ -34,6 +126,30 @@ class KrokiClient:
         base_url (str): URL du point de terminaison Kroki
         timeout (int): Délai d'expiration des requêtes HTTP en secondes
         max_bytes (int): Taille max du source avant utilisation de fichiers temporaires
+        get_max_uri (int): Longueur max d'une URL GET compressée, 0 pour désactiver
+        get_min_bytes (int): Taille min du source pour l'envoyer en GET compressé
+        theme (str): Thème demandé pour cette requête, ou None pour la configuration
+        lane (str): Voie de priorité de la requête (interactive, api, batch)
+        scheduler (PriorityScheduler): Planificateur des appels Kroki, ou None
+        cache (RenderCache): Cache des rendus et de leurs variantes, ou None
+        negative_cache (NegativeCache): Cache des erreurs de syntaxe, ou None
+        preflight (PreflightValidator): Vérification syntaxique locale, ou None
+        cost_estimator (CostEstimator): Estimation du coût de rendu qui fixe
+            le délai, la voie et le plafond de complexité, ou None
+        svg_normalizer (SvgNormalizer): Normalisation des identifiants SVG
+            générés, ou None
+        svg_optimizer (SvgOptimizer): Post-traitement des SVG, ou None
+        png_optimizer (BackgroundPngOptimizer): Recompression des PNG en
+            arrière-plan, ou None
+        metrics (Metrics): Registre de métriques, ou None
+        request_log (RequestLog): Journal de la requête HTTP en cours, qui
+            reçoit les durées par étape et dont l'ID est transmis à Kroki, ou None
+        trace (Trace): Trace de la requête HTTP en cours, qui reçoit les
+            spans du rendu (validation, cache, appel Kroki...), ou None
+        memory (MemorySample): Mesure mémoire de la requête HTTP en cours,
+            qui reçoit le pic d'allocation de chaque étape, ou None
+        cancelled (Callable[[], bool]): Indique si le rendu n'est plus
+            attendu, consulté avant l'appel Kroki, ou None
 
     Types de diagrammes supportés:
         - mermaid: Organigrammes, diagrammes de séquence, diagrammes de Gantt
@@ -50,6 +166,23 @@ class KrokiClient:
         base_url: Optional[str] = None,
         timeout: Optional[int] = None,
         max_bytes: Optional[int] = None,
+        get_max_uri: Optional[int] = None,
+        get_min_bytes: Optional[int] = None,
+        theme: Optional[str] = None,
+        lane: str = LANE_API,
+        scheduler: Optional[PriorityScheduler] = None,
+        cache: Optional[RenderCache] = None,
+        negative_cache: Optional[NegativeCache] = None,
+        preflight: Optional[PreflightValidator] = None,
+        cost_estimator: Optional[CostEstimator] = None,
+        svg_normalizer: Optional[SvgNormalizer] = None,
+        svg_optimizer: Optional[SvgOptimizer] = None,
+        png_optimizer: Optional[BackgroundPngOptimizer] = None,
+        metrics: Optional[Metrics] = None,
+        request_log: Optional[RequestLog] = None,
+        trace: Optional[Trace] = None,
+        memory: Optional[MemorySample] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
     ) -> None:
         """Initialise le client Kroki.
 
@@ -61,6 +194,42 @@ class KrokiClient:
             max_bytes: Taille maximum du source en octets avant utilisation
                       de fichiers temporaires. Si None, utilise la configuration
                       ou par défaut 1MB
+            get_max_uri: Longueur maximum de l'URL pour envoyer le source
+                        compressé (deflate + base64) en GET. Si None, utilise
+                        la configuration ; 0 désactive l'envoi en GET
+            get_min_bytes: Taille minimum du source pour tenter l'envoi en GET.
+                          Si None, utilise la configuration ou par défaut 1024
+            theme: Thème du diagramme pour cette requête. Si None, utilise
+                  DIAGRAM_THEME de la configuration
+            lane: Voie de priorité utilisée pour ordonnancer l'appel Kroki
+                 (interactive pour l'UI, api par défaut, batch pour les jobs)
+            scheduler: Planificateur des appels Kroki. Si None, utilise celui
+                      de l'application Flask s'il existe
+            cache: Cache des rendus. Si None, utilise celui de l'application
+            negative_cache: Cache court des sources rejetés par Kroki. Si None,
+                           utilise celui de l'application
+            preflight: Vérification syntaxique locale avant l'appel Kroki.
+                      Si None, utilise celle de l'application (désactivée
+                      par défaut)
+            cost_estimator: Estimation du coût de rendu. Si None, utilise celle
+                           de l'application (désactivée par défaut) ; sans
+                           estimation, ``timeout`` et ``lane`` s'appliquent tels quels
+            svg_normalizer: Normalisation déterministe des identifiants SVG.
+                           Si None, utilise celle de l'application
+            svg_optimizer: Optimiseur appliqué aux rendus SVG. Si None, utilise
+                          celui de l'application (désactivé par défaut)
+            png_optimizer: Recompression PNG sans perte exécutée hors du thread
+                          de requête. Si None, utilise celle de l'application
+            metrics: Registre de métriques. Si None, utilise celui de l'application
+            request_log: Journal de la requête. Si None, utilise celui de la
+                        requête Flask en cours s'il existe
+            trace: Trace de la requête. Si None, utilise celle de la requête
+                  Flask en cours si le traçage est activé
+            memory: Mesure mémoire de la requête. Si None, utilise celle de la
+                   requête Flask en cours si elle est mesurée
+            cancelled: Fonction indiquant si le rendu a été remplacé par une
+                      requête plus récente ; consultée après l'attente d'un
+                      créneau, juste avant l'appel Kroki
         """
         self.base_url = base_url or (
             current_app.config["KROKI_URL"] if current_app else "http://localhost:8000"
@@ -71,20 +240,52 @@ class KrokiClient:
         self.max_bytes = max_bytes or (
             current_app.config["MAX_BYTES"] if current_app else 1000000
         )
+        self.get_max_uri = (
+            get_max_uri
+            if get_max_uri is not None
+            else (current_app.config.get("KROKI_GET_MAX_URI", 0) if current_app else 0)
+        )
+        self.get_min_bytes = (
+            get_min_bytes
+            if get_min_bytes is not None
+            else (
+                current_app.config.get("KROKI_GET_MIN_BYTES", 1024)
+                if current_app
+                else 1024
+            )
+        )
+        self.theme = theme
+        self.lane = lane
+        self.scheduler = scheduler or _app_extension("scheduler")
+        self.cache = cache or _app_extension("render_cache")
+        self.negative_cache = negative_cache or _app_extension("negative_cache")
+        self.preflight = preflight or _app_extension("preflight")
+        self.cost_estimator = cost_estimator or _app_extension("cost_estimator")
+        self.svg_normalizer = svg_normalizer or _app_extension("svg_normalizer")
+        self.svg_optimizer = svg_optimizer or _app_extension("svg_optimizer")
+        self.png_optimizer = png_optimizer or _app_extension("png_optimizer")
+        self.metrics = metrics or _app_extension("metrics")
+        self.request_log = request_log or current_request_log()
+        self.trace = trace or current_trace()
+        self.memory = memory or current_memory_sample()
+        self.cancelled = cancelled
 
     def generate_diagram(
-        self, diagram_type: str, output_format: str, diagram_source: str
+        self, diagram_type: str, output_format: str, diagram_source: DiagramSource
     ) -> Tuple[bytes, str]:
         """Génère un diagramme en utilisant le service Kroki.
 
         Valide les paramètres d'entrée, préprocesse le code source du diagramme
         pour appliquer les thèmes, puis envoie une requête HTTP au service Kroki
-        pour générer l'image du diagramme.
+        pour générer l'image du diagramme. Les rendus déjà en cache sont servis
+        sans appel Kroki ; les SVG sont optimisés si l'optimiseur est activé.
 
         Args:
             diagram_type: Type de diagramme (mermaid, plantuml, graphviz)
             output_format: Format de sortie (png, svg)
-            diagram_source: Code source du diagramme
+            diagram_source: Code source du diagramme, en texte, en octets UTF-8
+                           ou sous forme de fichier binaire (corps de requête
+                           mis en tampon par src.ingest)
 
         Returns:
             Tuple[bytes, str]: Tuple contenant (données_image_binaires, content_type)
@@ -102,10 +303,267 @@ class KrokiClient:
             ...     f.write(image_data)
         """
         # Validate inputs
-        self._validate_inputs(diagram_type, output_format, diagram_source)
+        with self._span("validate"):
+            self._validate_inputs(diagram_type, output_format, diagram_source)
 
+        # Serve from the render cache when possible
+        key, entry = self._cache_lookup(diagram_type, output_format, diagram_source)
+        if entry is not None:
+            return entry.best(), entry.content_type
+
+        content, content_type = self._render_miss(
+            diagram_type, output_format, diagram_source
+        )
+        with self._stage("postprocess"):
+            data, content_type, _ = self._postprocess(
+                key, output_format, content, content_type
+            )
+        return data, content_type
+
+    def generate_encoded(
+        self,
+        diagram_type: str,
+        output_format: str,
+        diagram_source: DiagramSource,
+        encoding: Optional[str],
+    ) -> Tuple[bytes, str, Optional[str]]:
+        """Génère un diagramme et le retourne compressé si possible.
+
+        Identique à :meth:`generate_diagram`, mais les rendus compressibles
+        (SVG) sont retournés dans ``encoding``. La variante compressée est
+        mise en cache, de sorte que les hits suivants servent directement
+        les octets précompressés.
+
+        Args:
+            diagram_type: Type de diagramme (mermaid, plantuml, graphviz)
+            output_format: Format de sortie (png, svg)
+            diagram_source: Code source du diagramme
+            encoding: Content-coding négocié (gzip, br) ou None
+
+        Returns:
+            Tuple[bytes, str, Optional[str]]: Tuple contenant (données, content_type,
+                                             encodage appliqué ou None)
+
+        Raises:
+            KrokiError: Si la génération échoue
+        """
+        with self._span("validate"):
+            self._validate_inputs(diagram_type, output_format, diagram_source)
+
+        key, entry = self._cache_lookup(diagram_type, output_format, diagram_source)
+        if entry is not None:
+            content_type = entry.content_type
+            variant = entry.best_variant()
+            if encoding is not None:
+                data = entry.get(variant, encoding)
+                if data is not None:
+                    self._inc("compression_requests_total", result="precompressed")
+                    return data, content_type, encoding
+            identity = entry.get(variant)
+        else:
+            content, content_type = self._render_miss(
+                diagram_type, output_format, diagram_source
+            )
+            with self._stage("postprocess"):
+                identity, content_type, variant = self._postprocess(
+                    key, output_format, content, content_type
+                )
+
+        if encoding is None or content_type not in COMPRESSIBLE_TYPES:
+            return identity, content_type, None
+
+        started = time.perf_counter()
+        with self._span("compress", encoding=encoding):
+            data = compress(identity, encoding)
+        self._observe("compression_seconds", time.perf_counter() - started)
+        self._inc("compression_requests_total", result="compressed")
+        self._inc("compression_bytes_saved_total", len(identity) - len(data))
+        if key is not None and self.cache is not None:
+            self.cache.put(key, variant, data, content_type, encoding=encoding)
+        return data, content_type, encoding
+
+    def invalidate(
+        self, diagram_type: str, output_format: str, diagram_source: DiagramSource
+    ) -> None:
+        """Retire un rendu du cache, pour qu'il soit refait au prochain appel.
+
+        Utilisé quand les réglages dont dépend le rendu ont changé. Le rendu
+        est aussi retiré du niveau partagé du cache.
+
+        Args:
+            diagram_type: Type de diagramme
+            output_format: Format de sortie
+            diagram_source: Code source du diagramme
+        """
+        if self.cache is None:
+            return
+        self.cache.delete(
+            render_key(
+                diagram_type,
+                output_format,
+                diagram_source,
+                self._effective_theme(diagram_type),
+                canonical=self.cache.canonical,
+            )
+        )
+
+    def _cache_lookup(
+        self, diagram_type: str, output_format: str, diagram_source: DiagramSource
+    ) -> Tuple[Optional[str], Optional[CacheEntry]]:
+        """Cherche un rendu dans le cache.
+
+        Returns:
+            Tuple[Optional[str], Optional[CacheEntry]]: Identité du rendu (None si
+                                                       aucun cache n'est activé) et
+                                                       entrée trouvée
+        """
+        if self.cache is None:
+            return None, None
+        with self._span("cache") as span:
+            key = render_key(
+                diagram_type,
+                output_format,
+                diagram_source,
+                self._effective_theme(diagram_type),
+                canonical=self.cache.canonical,
+            )
+            entry = self.cache.get(key)
+            result = "hit" if entry is not None else "miss"
+            if span is not None:
+                span.attributes["result"] = result
+        self._inc(
+            "render_cache_requests_total", result=result, output_format=output_format
+        )
+        if self.request_log is not None:
+            self.request_log.set(cache=result)
+        return key, entry
+
+    def _render_miss(
+        self,
+        diagram_type: str,
+        output_format: str,
+        diagram_source: DiagramSource,
+    ) -> Tuple[bytes, str]:
+        """Rend un diagramme absent du cache, via le cache négatif.
+
+        Un source manifestement invalide est refusé par la vérification
+        locale, et un source déjà rejeté par Kroki pendant le TTL du cache
+        négatif est refusé immédiatement avec le message d'erreur mémorisé.
+        Le cache négatif est indexé par le source exact : les numéros de ligne
+        du message restent justes même si seuls les commentaires ont changé.
+
+        Args:
+            diagram_type: Type de diagramme
+            output_format: Format de sortie (png, svg)
+            diagram_source: Code source du diagramme validé
+
+        Returns:
+            Tuple[bytes, str]: Rendu brut de Kroki et content-type
+
+        Raises:
+            KrokiSyntaxError: Si le source est connu comme invalide ou rejeté
+            KrokiError: Si la génération échoue pour une autre raison
+        """
+        self._preflight(diagram_type, diagram_source)
+        if self.negative_cache is None:
+            return self._render_upstream(diagram_type, output_format, diagram_source)
+
+        key = render_key(
+            diagram_type,
+            output_format,
+            diagram_source,
+            self._effective_theme(diagram_type),
+        )
+        message = self.negative_cache.get(key)
+        self._inc(
+            "negative_cache_requests_total",
+            result="hit" if message is not None else "miss",
+        )
+        if message is not None:
+            raise KrokiSyntaxError(message)
+        try:
+            return self._render_upstream(diagram_type, output_format, diagram_source)
+        except KrokiSyntaxError as e:
+            self.negative_cache.put(key, str(e))
+            self._inc("negative_cache_stores_total")
+            raise
+
+    def _preflight(self, diagram_type: str, diagram_source: DiagramSource) -> None:
+        """Vérifie localement la syntaxe du source avant l'appel Kroki.
+
+        Seuls les sources en mémoire et décodables sont vérifiés ; un fichier
+        mis en tampon ou un source ambigu est transmis tel quel à Kroki.
+
+        Args:
+            diagram_type: Type de diagramme
+            diagram_source: Code source du diagramme validé
+
+        Raises:
+            KrokiSyntaxError: Si le source est certainement invalide
+        """
+        if self.preflight is None or not self.preflight.supports(diagram_type):
+            return
+        if isinstance(diagram_source, bytes):
+            try:
+                diagram_source = diagram_source.decode("utf-8")
+            except UnicodeDecodeError:
+                diagram_source = None
+        if not isinstance(diagram_source, str):
+            self._inc("preflight_total", diagram_type=diagram_type, result="skipped")
+            return
+
+        started = time.perf_counter()
+        try:
+            with self._span("preflight"):
+                checked = self.preflight.check(diagram_type, diagram_source)
+        except SourceSyntaxError as e:
+            self._record_preflight(diagram_type, "rejected", started)
+            raise KrokiSyntaxError(f"Invalid diagram syntax: {e}")
+        self._record_preflight(
+            diagram_type, "passed" if checked else "skipped", started
+        )
+
+    def _record_preflight(self, diagram_type: str, result: str, started: float) -> None:
+        """Enregistre l'issue et la durée d'une vérification locale."""
+        self._observe(
+            "preflight_seconds",
+            time.perf_counter() - started,
+            diagram_type=diagram_type,
+        )
+        self._inc("preflight_total", diagram_type=diagram_type, result=result)
+
+    def _render_upstream(
+        self, diagram_type: str, output_format: str, diagram_source: DiagramSource
+    ) -> Tuple[bytes, str]:
+        """Préprocesse le source et le fait rendre par le service Kroki.
+
+        Si l'estimation de coût est activée, le délai d'expiration et la voie
+        de priorité de l'appel dépendent de la complexité du diagramme, et les
+        diagrammes au-delà du plafond sont refusés sans appel Kroki.
+
+        Args:
+            diagram_type: Type de diagramme
+            output_format: Format de sortie (png, svg)
+            diagram_source: Code source du diagramme validé
+
+        Returns:
+            Tuple[bytes, str]: Rendu brut de Kroki et content-type
+
+        Raises:
+            KrokiTooComplexError: Si le diagramme dépasse le plafond de complexité
+            KrokiCancelledError: Si le rendu a été remplacé avant l'appel Kroki
+            KrokiError: Si la génération échoue
+        """
         # Preprocess diagram source based on type and theme
-        diagram_source = self._preprocess_diagram_source(diagram_type, diagram_source)
+        with self._stage("preprocess"):
+            payload = self._prepare_payload(diagram_type, diagram_source)
+            estimate = self._estimate_cost(diagram_type, payload)
+        lane, timeout = self.lane, self.timeout
+        if estimate is not None:
+            lane = self.cost_estimator.lane_for(estimate, self.lane)
+            timeout = self.cost_estimator.timeout_for(estimate)
+            if lane != self.lane:
+                self._inc("render_cost_lane_changes_total", lane=lane)
 
         # Prepare request
         url = f"{self.base_url}/{diagram_type}/{output_format}"
@@ -115,42 +573,57 @@ class KrokiClient:
                 f"image/{output_format}" if output_format != "svg" else "image/svg+xml"
             ),
         }
+        if self.request_log is not None:
+            headers[REQUEST_ID_HEADER] = self.request_log.request_id
 
         try:
-            # Handle large payloads with temporary files
-            if len(diagram_source.encode("utf-8")) > self.max_bytes:
-                return self._generate_with_tempfile(
-                    url, headers, diagram_source, output_format
-                )
-            else:
-                return self._generate_direct(
-                    url, headers, diagram_source, output_format
-                )
+            queued = time.perf_counter()
+            with self._upstream_slot(lane):
+                started = time.perf_counter()
+                self._add_stage("queue", queued, started, lane=lane)
+                # Superseded while queued: give the slot back without calling Kroki
+                if self.cancelled is not None and self.cancelled():
+                    raise KrokiCancelledError("Render superseded by a newer request")
+                with self._stage("upstream"):
+                    # Compressible sources that fit in a URL go as a compressed GET
+                    encoded = self._encode_for_get(url, payload)
+                    if encoded is not None:
+                        result = self._generate_get(
+                            encoded, headers, output_format, timeout
+                        )
+                    # Stream large payloads instead of building one request body
+                    elif payload_size(payload) > self.max_bytes:
+                        result = self._generate_streamed(
+                            url, headers, payload, output_format, timeout
+                        )
+                    else:
+                        result = self._generate_direct(
+                            url, headers, payload, output_format, timeout
+                        )
+                elapsed = time.perf_counter() - started
+                if estimate is not None:
+                    self._record_cost(estimate, elapsed)
+                return result
 
+        except SchedulerBusyError as e:
+            raise KrokiBusyError(f"Server busy - {e}")
         except requests.exceptions.Timeout:
             raise KrokiError("Request timeout - Kroki service is taking too long")
         except requests.exceptions.ConnectionError:
             raise KrokiError("Connection error - Cannot reach Kroki service")
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 400:
-                # Check if the response is actually a valid image (PNG/SVG)
-                content = e.response.content
-                if (output_format == "png" and content.startswith(b"\x89PNG")) or (
-                    output_format == "svg" and b"<svg" in content[:100]
-                ):
-                    # This is actually a successful generation, return it
-                    content_type = (
-                        f"image/{output_format}"
-                        if output_format != "svg"
-                        else "image/svg+xml"
-                    )
-                    return content, content_type
-                else:
-                    # This is a real error
-                    error_text = (
-                        e.response.text[:200] if e.response.text else "Unknown error"
-                    )
-                    raise KrokiError(f"Invalid diagram syntax: {error_text}")
+                # Some renderers answer 400 with a valid image
+                check = classify_response(
+                    e.response.content, output_format, e.response.headers
+                )
+                if check.is_image and check.error is None:
+                    return e.response.content, _content_type(output_format)
+                # This is a real error
+                error_text = (
+                    check.error or error_excerpt(e.response.content) or "Unknown error"
+                )
+                raise KrokiSyntaxError(f"Invalid diagram syntax: {error_text}")
             elif e.response.status_code >= 500:
                 raise KrokiError("Kroki service error - Please try again later")
             else:
@@ -158,6 +631,266 @@ class KrokiClient:
                     f"HTTP error {e.response.status_code}: {e.response.text}"
                 )
 
+    def _estimate_cost(
+        self, diagram_type: str, payload: Payload
+    ) -> Optional[CostEstimate]:
+        """Estime le coût de rendu d'un payload et applique le plafond.
+
+        Un fichier mis en tampon n'est pas relu : son coût est estimé
+        d'après sa taille.
+
+        Args:
+            diagram_type: Type de diagramme
+            payload: Source préprocessé
+
+        Returns:
+            Optional[CostEstimate]: Estimation, ou None si l'estimation est
+                                   désactivée
+
+        Raises:
+            KrokiTooComplexError: Si le diagramme dépasse le plafond de complexité
+        """
+        if self.cost_estimator is None:
+            return None
+        if isinstance(payload, bytes):
+            estimate = self.cost_estimator.estimate(
+                diagram_type, payload.decode("utf-8", errors="replace")
+            )
+        else:
+            estimate = self.cost_estimator.estimate_size(
+                diagram_type, payload_size(payload)
+            )
+        self._observe(
+            "render_cost_complexity", estimate.complexity, diagram_type=diagram_type
+        )
+        if self.cost_estimator.exceeds_ceiling(estimate):
+            self._inc("render_cost_rejected_total", diagram_type=diagram_type)
+            raise KrokiTooComplexError(
+                f"Diagram too complex: estimated complexity {estimate.complexity:.0f}"
+                f" exceeds the limit of {self.cost_estimator.max_complexity:.0f}"
+            )
+        return estimate
+
+    def _record_cost(self, estimate: CostEstimate, seconds: float) -> None:
+        """Enregistre la latence observée et l'erreur de l'estimation."""
+        error = self.cost_estimator.observe(estimate, seconds)
+        labels = {"diagram_type": estimate.diagram_type}
+        self._observe("render_cost_predicted_seconds", estimate.seconds, **labels)
+        self._observe("render_cost_observed_seconds", seconds, **labels)
+        self._observe("render_cost_error_seconds", abs(error), **labels)
+
+    def _prepare_payload(
+        self, diagram_type: str, diagram_source: DiagramSource
+    ) -> Payload:
+        """Construit le corps envoyé à Kroki, encodé une seule fois.
+
+        Les sources des types qui ne sont pas prétraités sont transmises telles
+        quelles : un fichier mis en tampon est envoyé en flux sans être relu.
+
+        Args:
+            diagram_type: Type de diagramme
+            diagram_source: Code source du diagramme validé
+
+        Returns:
+            Payload: Source UTF-8 en octets ou fichier binaire
+
+        Raises:
+            KrokiError: Si le source n'est pas de l'UTF-8 valide
+        """
+        if diagram_type not in PREPROCESSED_TYPES and not isinstance(
+            diagram_source, str
+        ):
+            return diagram_source
+        text = self._decode_source(diagram_source)
+        return self._preprocess_diagram_source(diagram_type, text).encode("utf-8")
+
+    def _decode_source(self, diagram_source: DiagramSource) -> str:
+        """Retourne le source sous forme de texte.
+
+        Raises:
+            KrokiError: Si le source n'est pas de l'UTF-8 valide
+        """
+        if isinstance(diagram_source, str):
+            return diagram_source
+        if not isinstance(diagram_source, bytes):
+            diagram_source = diagram_source.read()
+        try:
+            return diagram_source.decode("utf-8")
+        except UnicodeDecodeError:
+            raise KrokiError("Diagram source must be UTF-8 encoded")
+
+    def _postprocess(
+        self, key: Optional[str], output_format: str, content: bytes, content_type: str
+    ) -> Tuple[bytes, str, str]:
+        """Applique le post-traitement au rendu brut et met les variantes en cache.
+
+        Les identifiants générés des SVG sont d'abord rendus déterministes, puis
+        les SVG sont optimisés immédiatement ; les PNG sont recompressés en
+        arrière-plan et la variante optimisée est ajoutée au cache plus tard.
+
+        Args:
+            key: Identité du rendu, ou None si le cache est désactivé
+            output_format: Format de sortie (png, svg)
+            content: Rendu brut retourné par Kroki
+            content_type: Content-type du rendu
+
+        Returns:
+            Tuple[bytes, str, str]: Meilleure variante disponible, content-type
+                                   et nom de la variante
+        """
+        if output_format == "svg" and self.svg_normalizer is not None:
+            content = self.svg_normalizer.normalize(content)
+
+        data = content
+        if output_format == "svg" and self.svg_optimizer is not None:
+            data = self._optimize_svg(content)
+        variant = VARIANT_RAW if data is content else VARIANT_OPTIMIZED
+
+        if key is not None and self.cache is not None:
+            self.cache.put(key, VARIANT_RAW, content, content_type)
+            if data is not content:
+                self.cache.put(key, VARIANT_OPTIMIZED, data, content_type)
+            elif output_format == "png" and self.png_optimizer is not None:
+                # Served raw this time; later hits get the optimised variant
+                self.png_optimizer.submit(key, content)
+        return data, content_type, variant
+
+    def _optimize_svg(self, content: bytes) -> bytes:
+        """Optimise un rendu SVG et enregistre les octets économisés.
+
+        Args:
+            content: SVG brut retourné par Kroki
+
+        Returns:
+            bytes: SVG optimisé, ou ``content`` si aucun gain n'est possible
+        """
+        started = time.perf_counter()
+        optimized = self.svg_optimizer.optimize(content)
+        elapsed = time.perf_counter() - started
+
+        saved = len(content) - len(optimized)
+        self._inc("svg_optimize_bytes_in_total", len(content))
+        self._inc("svg_optimize_bytes_saved_total", saved)
+        self._observe("svg_optimize_seconds", elapsed)
+        logger.debug(
+            "SVG optimised: %d -> %d bytes (%d saved) in %.1f ms",
+            len(content),
+            len(optimized),
+            saved,
+            elapsed * 1000,
+        )
+        return optimized
+
+    def _effective_theme(self, diagram_type: str) -> Optional[str]:
+        """Retourne le thème Mermaid appliqué au rendu, ou None.
+
+        Seuls les diagrammes Mermaid dépendent du thème ; pour les autres
+        types le thème ne fait pas partie de l'identité du rendu.
+
+        Args:
+            diagram_type: Type de diagramme
+
+        Returns:
+            Optional[str]: Nom du thème Mermaid, ou None
+        """
+        if diagram_type != "mermaid":
+            return None
+        theme = self.theme or (
+            current_app.config.get("DIAGRAM_THEME", "base") if current_app else "base"
+        )
+        return MERMAID_THEMES.get(theme, "base")
+
+    def _inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Incrémente un compteur si les métriques sont activées."""
+        if self.metrics is not None:
+            self.metrics.inc(name, value, **labels)
+
+    def _observe(self, name: str, value: float, **labels: Any) -> None:
+        """Enregistre une observation si les métriques sont activées."""
+        if self.metrics is not None:
+            self.metrics.observe(name, value, **labels)
+
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        """Mesure une étape dans le journal, la trace et la mesure mémoire."""
+        log, memory = self.request_log, self.memory
+        with self._span(name):
+            with log.stage(name) if log is not None else nullcontext():
+                with memory.stage(name) if memory is not None else nullcontext():
+                    yield
+
+    def _span(self, name: str, **attributes: Any) -> ContextManager[Any]:
+        """Ouvre un span dans la trace de la requête, si elle est tracée."""
+        if self.trace is None:
+            return nullcontext()
+        return self.trace.span(name, **attributes)
+
+    def _add_stage(
+        self, name: str, started: float, ended: float, **attributes: Any
+    ) -> None:
+        """Ajoute une étape déjà mesurée au journal et à la trace.
+
+        Args:
+            name: Nom de l'étape
+            started: Début de l'étape (``time.perf_counter()``)
+            ended: Fin de l'étape (``time.perf_counter()``)
+            **attributes: Détails ajoutés au span
+        """
+        if self.request_log is not None:
+            self.request_log.add_stage(name, ended - started)
+        if self.trace is not None:
+            self.trace.add_span(name, started, ended, **attributes)
+
+    def _send(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """Envoie une requête à Kroki et trace l'attente et la réception.
+
+        L'attente couvre la connexion, l'envoi et le traitement par Kroki
+        jusqu'aux en-têtes de la réponse ; la réception couvre la lecture
+        du corps. requests n'expose pas la connexion et l'envoi séparément.
+
+        Args:
+            method: Méthode HTTP (get, post)
+            url: URL complète de l'endpoint Kroki
+            **kwargs: Arguments transmis à ``requests.request``
+
+        Returns:
+            requests.Response: Réponse de Kroki, corps déjà lu
+        """
+        if self.trace is None:
+            return requests.request(method, url, **kwargs)
+
+        headers_at = []
+        sent = time.perf_counter()
+        response = requests.request(
+            method,
+            url,
+            hooks={"response": lambda r, **_: headers_at.append(time.perf_counter())},
+            **kwargs,
+        )
+        received = time.perf_counter()
+        wait_end = headers_at[0] if headers_at else received
+        self.trace.add_span(
+            "upstream.wait", sent, wait_end, status=response.status_code
+        )
+        self.trace.add_span(
+            "upstream.receive", wait_end, received, bytes=len(response.content)
+        )
+        return response
+
+    def _upstream_slot(self, lane: str) -> ContextManager[None]:
+        """Retourne le créneau d'appel Kroki pour une voie de priorité.
+
+        Args:
+            lane: Voie de priorité de l'appel
+
+        Returns:
+            ContextManager[None]: Créneau du planificateur, ou contexte neutre
+                                 si aucun planificateur n'est configuré
+        """
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(lane)
+
     def _preprocess_diagram_source(self, diagram_type: str, diagram_source: str) -> str:
         """Prétraite le code source du diagramme pour appliquer les thèmes et le styling.
 
@@ -194,21 +927,8 @@ class KrokiClient:
         Returns:
             str: Code source avec configuration de thème ajoutée si nécessaire
         """
-        # Get theme from config or default to base (light theme)
-        theme = (
-            current_app.config.get("DIAGRAM_THEME", "base") if current_app else "base"
-        )
-
-        # Map our theme names to Mermaid theme names
-        mermaid_themes = {
-            "default": "base",
-            "light": "base",
-            "dark": "dark",
-            "neutral": "neutral",
-            "forest": "forest",
-        }
-
-        mermaid_theme = mermaid_themes.get(theme, "base")
+        # Theme from the request, then config, or default to base (light theme)
+        mermaid_theme = self._effective_theme("mermaid")
 
         # Check if the source already contains theme configuration
         if "%%{init:" in source or "theme:" in source:
@@ -340,7 +1060,7 @@ class KrokiClient:
             raise KrokiError(f"Error processing Excalidraw diagram: {str(e)}")
 
     def _validate_inputs(
-        self, diagram_type: str, output_format: str, diagram_source: str
+        self, diagram_type: str, output_format: str, diagram_source: DiagramSource
     ) -> None:
         """Valide les paramètres d'entrée.
 
@@ -375,11 +1095,16 @@ class KrokiClient:
                 f"Invalid output format: {output_format}. Must be one of {valid_formats}"
             )
 
-        if not diagram_source or not diagram_source.strip():
+        if _is_blank(diagram_source):
             raise KrokiError("Diagram source cannot be empty")
 
     def _generate_direct(
-        self, url: str, headers: dict, diagram_source: str, output_format: str
+        self,
+        url: str,
+        headers: dict,
+        payload: bytes,
+        output_format: str,
+        timeout: float,
     ) -> Tuple[bytes, str]:
         """Génère un diagramme avec une requête HTTP directe.
 
@@ -389,8 +1114,9 @@ class KrokiClient:
         Args:
             url: URL complète de l'endpoint Kroki
             headers: Headers HTTP pour la requête
-            diagram_source: Code source du diagramme
+            payload: Code source du diagramme encodé en UTF-8
             output_format: Format de sortie (png, svg)
+            timeout: Délai d'expiration de la requête en secondes
 
         Returns:
             Tuple[bytes, str]: Données binaires de l'image et content-type
@@ -399,93 +1125,150 @@ class KrokiClient:
             requests.exceptions.HTTPError: En cas d'erreur HTTP
             KrokiError: Si Kroki retourne une image d'erreur
         """
-        response = requests.post(
+        response = self._send(
+            "post",
             url,
-            data=diagram_source.encode("utf-8"),
+            data=payload,
             headers=headers,
-            timeout=self.timeout,
+            timeout=timeout,
         )
         response.raise_for_status()
 
         # If we reach here, the HTTP request was successful (status 200)
         # The response content is the generated diagram image
+        return self._check_response(response, output_format)
+
+    def _encode_for_get(self, url: str, payload: Payload) -> Optional[str]:
+        """Construit l'URL GET compressée (deflate + base64url) de Kroki.
+
+        Kroki accepte le source compressé dans le chemin
+        ``/{type}/{format}/{encoded}``, ce qui réduit fortement le volume
+        envoyé pour les gros sources textuels.
+
+        Args:
+            url: URL de l'endpoint Kroki (``/{type}/{format}``)
+            payload: Source préprocessé
+
+        Returns:
+            Optional[str]: URL complète, ou None si l'envoi en GET est désactivé,
+                          si le source est trop petit ou si l'URL serait trop longue
+        """
+        if not self.get_max_uri or not isinstance(payload, bytes):
+            return None
+        if len(payload) < self.get_min_bytes:
+            return None
+        # Text rarely compresses better than 32:1; skip hopeless attempts
+        if len(payload) > self.get_max_uri * 32:
+            return None
+
+        encoded = base64.urlsafe_b64encode(zlib.compress(payload, 9)).decode("ascii")
+        full_url = f"{url}/{encoded}"
+        if len(full_url) > self.get_max_uri:
+            return None
+        self._inc("upstream_get_bytes_saved_total", len(payload) - len(encoded))
+        return full_url
+
+    def _generate_get(
+        self, url: str, headers: dict, output_format: str, timeout: float
+    ) -> Tuple[bytes, str]:
+        """Génère un diagramme avec une requête GET au source compressé.
+
+        Args:
+            url: URL complète incluant le source encodé
+            headers: Headers HTTP pour la requête
+            output_format: Format de sortie (png, svg)
+            timeout: Délai d'expiration de la requête en secondes
 
-        content_type = (
-            f"image/{output_format}" if output_format != "svg" else "image/svg+xml"
+        Returns:
+            Tuple[bytes, str]: Données binaires de l'image et content-type
+
+        Raises:
+            requests.exceptions.HTTPError: En cas d'erreur HTTP
+            KrokiError: Si Kroki retourne une image d'erreur
+        """
+        response = self._send(
+            "get",
+            url,
+            headers={k: v for k, v in headers.items() if k != "Content-Type"},
+            timeout=timeout,
         )
-        return response.content, content_type
+        response.raise_for_status()
+        return self._check_response(response, output_format)
 
-    def _generate_with_tempfile(
-        self, url: str, headers: dict, diagram_source: str, output_format: str
+    def _generate_streamed(
+        self,
+        url: str,
+        headers: dict,
+        payload: Payload,
+        output_format: str,
+        timeout: float,
     ) -> Tuple[bytes, str]:
-        """Génère un diagramme en utilisant un fichier temporaire pour les gros payloads.
+        """Génère un diagramme en envoyant un gros payload en flux.
 
         Méthode optimisée pour les diagrammes volumineux qui dépassent la limite
-        max_bytes. Écrit le code source dans un fichier temporaire et l'envoie
-        via une requête HTTP multipart.
+        max_bytes. Un fichier mis en tampon (en mémoire ou sur disque au-delà du
+        seuil) est envoyé par blocs, sans copie intermédiaire.
 
         Args:
             url: URL complète de l'endpoint Kroki
             headers: Headers HTTP pour la requête
-            diagram_source: Code source du diagramme
+            payload: Code source encodé, en octets ou fichier binaire
             output_format: Format de sortie (png, svg)
+            timeout: Délai d'expiration de la requête en secondes
 
         Returns:
             Tuple[bytes, str]: Données binaires de l'image et content-type
 
         Raises:
             requests.exceptions.HTTPError: En cas d'erreur HTTP
-            OSError: En cas d'erreur lors de la gestion du fichier temporaire
             KrokiError: Si Kroki retourne une image d'erreur
         """
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".txt", delete=False
-        ) as tmp_file:
-            tmp_file.write(diagram_source)
-            tmp_file_path = tmp_file.name
+        response = self._send(
+            "post", url, data=payload, headers=headers, timeout=timeout
+        )
+        response.raise_for_status()
+        return self._check_response(response, output_format)
 
-        try:
-            with open(tmp_file_path, "rb") as f:
-                response = requests.post(
-                    url, data=f, headers=headers, timeout=self.timeout
-                )
-            response.raise_for_status()
-
-            # Check if Kroki returned an error image (PNG with error text)
-            if output_format == "png" and response.content.startswith(b"\x89PNG"):
-                # Try to extract error message from PNG content
-                content_str = response.content.decode("utf-8", errors="ignore")
-                if any(
-                    error_word in content_str
-                    for error_word in ["error", "invalid", "syntax", "failed"]
-                ):
-                    # Extract readable error message
-                    lines = content_str.split("\n")
-                    error_lines = [
-                        line.strip()
-                        for line in lines
-                        if line.strip() and len(line.strip()) > 3
-                    ]
-                    if error_lines:
-                        error_msg = error_lines[0][
-                            :100
-                        ]  # First meaningful line, truncated
-                        raise KrokiError(f"Diagram generation failed: {error_msg}")
-                    else:
-                        raise KrokiError(
-                            "Diagram generation failed - invalid diagram syntax"
-                        )
+    def _check_response(
+        self, response: requests.Response, output_format: str
+    ) -> Tuple[bytes, str]:
+        """Vérifie une réponse Kroki réussie et retourne l'image.
 
-            content_type = (
-                f"image/{output_format}" if output_format != "svg" else "image/svg+xml"
-            )
-            return response.content, content_type
+        Seuls les en-têtes de chunks PNG et le prologue SVG sont examinés,
+        dans un budget d'octets fixe (voir src.response_classifier).
+
+        Args:
+            response: Réponse HTTP 2xx de Kroki
+            output_format: Format de sortie (png, svg)
 
-        finally:
-            # Cleanup temporary file
-            import os
+        Returns:
+            Tuple[bytes, str]: Données binaires de l'image et content-type
 
-            try:
-                os.unlink(tmp_file_path)
-            except OSError:
-                pass
+        Raises:
+            KrokiError: Si Kroki signale une erreur dans l'image ou les en-têtes
+        """
+        check = classify_response(response.content, output_format, response.headers)
+        if check.error is not None:
+            raise KrokiError(f"Diagram generation failed: {check.error}")
+        return response.content, _content_type(output_format)
+
+
+def _content_type(output_format: str) -> str:
+    """MIME type of an output format."""
+    return f"image/{output_format}" if output_format != "svg" else "image/svg+xml"
+
+
+def _is_blank(diagram_source: DiagramSource) -> bool:
+    """Whether a source is empty or whitespace only (files are rewound)."""
+    if isinstance(diagram_source, (str, bytes)):
+        return not diagram_source.strip()
+    position = diagram_source.tell()
+    try:
+        while True:
+            chunk = diagram_source.read(CHUNK_SIZE)
+            if not chunk:
+                return True
+            if chunk.strip():
+                return False
+    finally:
+        diagram_source.seek(position)
@@ -5,9 +5,29 @@ and configuring the Kroki diagram generation web application.
 """
 
 import os
+import time
 from flask import Flask
 from typing import Optional
+from src.assets import StaticAssets
+from src.cluster import Cluster
 from src.config import config
+from src.cost_estimator import CostEstimator
+from src.hotkeys import HotKeyRefresher, HotKeys
+from src.memory import MemoryTracker, RssMonitor
+from src.metrics import Metrics
+from src.permalinks import PermalinkStore
+from src.png_optimizer import BackgroundPngOptimizer
+from src.preview import PreviewSessions
+from src.profiling import RequestProfiler
+from src.render_cache import NegativeCache, RenderCache
+from src.request_log import RequestLogger, configure_logging
+from src.scheduler import PriorityScheduler
+from src.startup import StartupTimer
+from src.svg_normalizer import SvgNormalizer
+from src.svg_optimizer import SvgOptimizer
+from src.tracing import Tracer
+from src.validators import PreflightValidator
+from src.warmup import WarmUp
 
 
 def create_app(config_name: Optional[str] = None) -> Flask:
@@ -28,6 +48,7 @@ def create_app(config_name: Optional[str] = None) -> Flask:
         >>> app = create_app('development')
         >>> app.run(debug=True)
     """
+    started = time.perf_counter()
     if config_name is None:
         config_name = os.getenv("FLASK_CONFIG", "default")
 
@@ -35,11 +56,51 @@ def create_app(config_name: Optional[str] = None) -> Flask:
 
     app.config.from_object(config[config_name])
 
+    configure_logging(app.config)
+    app.extensions["request_logger"] = RequestLogger.from_config(app.config)
+    app.extensions["tracer"] = Tracer.from_config(app.config)
+    app.extensions["profiler"] = RequestProfiler.from_config(app.config)
+    app.extensions["memory_tracker"] = MemoryTracker.from_config(app.config)
+
+    # Per-process upstream render scheduler (priority lanes)
+    app.extensions["scheduler"] = PriorityScheduler.from_config(app.config)
+    app.extensions["metrics"] = Metrics()
+    app.extensions["rss_monitor"] = RssMonitor.from_config(
+        app.config, app.extensions["metrics"]
+    )
+    app.extensions["render_cache"] = RenderCache.from_config(app.config)
+    app.extensions["negative_cache"] = NegativeCache.from_config(app.config)
+    app.extensions["preflight"] = PreflightValidator.from_config(app.config)
+    app.extensions["cost_estimator"] = CostEstimator.from_config(app.config)
+    app.extensions["svg_normalizer"] = SvgNormalizer.from_config(app.config)
+    app.extensions["svg_optimizer"] = SvgOptimizer.from_config(app.config)
+    app.extensions["png_optimizer"] = BackgroundPngOptimizer.from_config(
+        app.config, app.extensions["render_cache"], app.extensions["metrics"]
+    )
+    app.extensions["preview_sessions"] = PreviewSessions.from_config(app.config)
+    app.extensions["permalinks"] = PermalinkStore.from_config(app.config)
+    app.extensions["cluster"] = Cluster.from_config(app.config)
+    app.extensions["hotkeys"] = HotKeys.from_config(app.config)
+    app.extensions["hotkey_refresher"] = HotKeyRefresher.from_config(
+        app, app.extensions["hotkeys"], app.extensions["metrics"]
+    )
+
+    # Fingerprinted static files, referenced from templates with asset_url()
+    app.extensions["assets"] = StaticAssets.from_config(app.config, app.static_folder)
+    app.jinja_env.globals["asset_url"] = app.extensions["assets"].url
+
     # Register blueprints
     from src.routes import main_bp
 
     app.register_blueprint(main_bp)
 
+    # Render the seed corpus into the cache before reporting ready, started
+    # by src.startup or on the first request
+    app.extensions["warmup"] = WarmUp.from_config(app, app.extensions["metrics"])
+
+    app.extensions["startup"] = StartupTimer(app.extensions["metrics"])
+    app.extensions["startup"].record("create_app", time.perf_counter() - started)
+
     return app
 
 
@@ -0,0 +1,294 @@
+"""Per-request memory accounting and worker RSS monitoring.
+
+:class:`MemoryTracker` measures, with tracemalloc, the peak Python heap
+allocated by a request and by each of its stages (body read, preprocessing,
+upstream response, post-processing, response building). tracemalloc is only
+running while a request is measured, and one request per process is measured
+at a time; allocations made meanwhile by other threads of the process are
+included in its figures.
+
+:class:`RssMonitor` samples the resident set size of the worker in a
+background thread, exports it as a gauge and, when configured, recycles the
+worker once its RSS has grown too much since its first sample: the worker
+sends itself SIGTERM, which process managers such as gunicorn treat as a
+graceful shutdown followed by a replacement worker.
+"""
+
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+from flask import g, has_request_context
+
+from src.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Source size classes used as a metric label
+SIZE_CLASSES = ((10 * 1024, "<10KB"), (100 * 1024, "<100KB"), (1024 * 1024, "<1MB"))
+
+
+def size_class(size: int) -> str:
+    """Bucket of a source size, bounded for use as a metric label."""
+    for limit, name in SIZE_CLASSES:
+        if size < limit:
+            return name
+    return ">=1MB"
+
+
+@dataclass
+class _Frame:
+    """An open measurement: traced memory at its start and highest since."""
+
+    name: str
+    baseline: int
+    high: int
+
+
+class MemorySample:
+    """Peak heap allocation of one request and of its stages.
+
+    Stages nest; the peak of a stage includes the peaks of its sub-stages.
+    Peaks are measured above the traced memory at the start of the stage.
+
+    Attributes:
+        stages (dict): Stage name to peak bytes (largest if repeated)
+        peak (int): Peak bytes of the whole request, set by ``close``
+    """
+
+    def __init__(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self.stages: Dict[str, int] = {}
+        self.peak = 0
+        self._stack: List[_Frame] = [_Frame("request", current, current)]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measure the peak allocation of the enclosed block."""
+        current = self._fold()
+        tracemalloc.reset_peak()
+        frame = _Frame(name, current, current)
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._fold()
+            self._stack.pop()
+            self._stack[-1].high = max(self._stack[-1].high, frame.high)
+            self.stages[name] = max(
+                self.stages.get(name, 0), frame.high - frame.baseline
+            )
+
+    def close(self) -> None:
+        """Record the peak of the whole request."""
+        self._fold()
+        root = self._stack[0]
+        self.peak = root.high - root.baseline
+
+    def _fold(self) -> int:
+        """Fold the traced peak into the open frames; returns current bytes."""
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame.high = max(frame.high, peak)
+        return current
+
+
+class MemoryTracker:
+    """Measures the memory of sampled requests with tracemalloc.
+
+    Attributes:
+        sample_rate (float): Fraction of requests measured
+    """
+
+    def __init__(self, sample_rate: float = 1.0) -> None:
+        self.sample_rate = sample_rate
+        self._busy = threading.Lock()
+        self._started_tracing = False
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["MemoryTracker"]:
+        """Build a tracker from a Flask config mapping, or None if disabled."""
+        if not config.get("MEMORY_TRACKING", False):
+            return None
+        return cls(sample_rate=config.get("MEMORY_SAMPLE_RATE", 1.0))
+
+    def start(self) -> Optional[MemorySample]:
+        """Start measuring the current request.
+
+        Returns:
+            Optional[MemorySample]: Running sample, or None if the request is
+                not sampled or another request is being measured
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        # Leave tracing alone if it was started elsewhere (PYTHONTRACEMALLOC)
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        return MemorySample()
+
+    def finish(self, sample: MemorySample) -> MemorySample:
+        """Stop measuring and return the completed sample."""
+        try:
+            sample.close()
+        finally:
+            if self._started_tracing:
+                tracemalloc.stop()
+            self._busy.release()
+        return sample
+
+
+def current_memory_sample() -> Optional[MemorySample]:
+    """Memory sample of the request being handled, or None."""
+    if not has_request_context():
+        return None
+    return g.get("memory")
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size of the process, or None if unknown.
+
+    Reads ``/proc/self/statm`` on Linux; elsewhere falls back to the peak
+    RSS reported by ``getrusage``.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssMonitor:
+    """Samples the worker RSS periodically and recycles bloated workers.
+
+    The sampling thread starts when each worker process is initialised or on
+    its first request, so a monitor created before the server forks its
+    workers still runs in every worker.
+
+    Attributes:
+        interval (float): Seconds between samples
+        max_growth (int): RSS growth in bytes above the first sample after
+            which the worker is recycled, 0 to never recycle
+        min_requests (int): Requests a worker serves before it may be recycled
+        metrics (Metrics): Registry receiving the gauges, or None
+    """
+
+    def __init__(
+        self,
+        interval: float = 15.0,
+        max_growth: int = 0,
+        min_requests: int = 100,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.interval = interval
+        self.max_growth = max_growth
+        self.min_requests = min_requests
+        self.metrics = metrics
+        self.requests = 0
+        self.baseline: Optional[int] = None
+        self.recycling = False
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(
+        cls, config: Mapping[str, Any], metrics: Optional[Metrics] = None
+    ) -> Optional["RssMonitor"]:
+        """Build a monitor from a Flask config mapping, or None if disabled."""
+        interval = config.get("MEMORY_RSS_INTERVAL", 15)
+        if interval <= 0:
+            return None
+        return cls(
+            interval=interval,
+            max_growth=config.get("MEMORY_MAX_GROWTH_MB", 0) * 1024 * 1024,
+            min_requests=config.get("MEMORY_RECYCLE_MIN_REQUESTS", 100),
+            metrics=metrics,
+        )
+
+    def request_started(self) -> None:
+        """Count a request, starting the sampling thread in a new worker."""
+        self.start()
+        self.requests += 1
+
+    def start(self) -> None:
+        """Start the sampling thread if this process has none yet."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.requests = 0
+                    self.baseline = None
+                    self.recycling = False
+                    self._stop.clear()
+                    threading.Thread(
+                        target=self._run, name="rss-monitor", daemon=True
+                    ).start()
+
+    def sample(self) -> Optional[int]:
+        """Sample the RSS, update the gauges and recycle if needed."""
+        rss = rss_bytes()
+        if rss is None:
+            return None
+        if self.baseline is None:
+            self.baseline = rss
+        growth = rss - self.baseline
+        if self.metrics is not None:
+            self.metrics.set_gauge("process_resident_memory_bytes", rss)
+            self.metrics.set_gauge("process_resident_memory_growth_bytes", growth)
+        if self._should_recycle(growth):
+            self.recycle(growth)
+        return rss
+
+    def recycle(self, growth: int) -> None:
+        """Ask the process manager to replace this worker."""
+        self.recycling = True
+        logger.warning(
+            "Recycling worker %d: RSS grew by %d bytes after %d requests",
+            os.getpid(),
+            growth,
+            self.requests,
+        )
+        if self.metrics is not None:
+            self.metrics.inc("worker_recycles_total")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def stop(self) -> None:
+        """Stop the sampling thread."""
+        self._stop.set()
+
+    def _should_recycle(self, growth: int) -> bool:
+        """Whether the worker has grown enough to be replaced."""
+        return (
+            self.max_growth > 0
+            and not self.recycling
+            and self.requests >= self.min_requests
+            and growth > self.max_growth
+        )
+
+    def _run(self) -> None:
+        """Sampling loop (monitor thread)."""
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("RSS sampling failed")
+            if self._stop.wait(self.interval):
+                return
@@ -0,0 +1,111 @@
+"""In-process metrics registry.
+
+This module provides a minimal, dependency-free metrics registry with
+counters, gauges and summaries, rendered in the Prometheus text exposition
+format by the ``/metrics`` endpoint.
+"""
+
+import threading
+from typing import Any, Dict, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    """Normalise a label dict into a hashable, sorted key."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    """Render a label key as a Prometheus label set."""
+    if not key:
+        return ""
+    parts = []
+    for name, value in key:
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and summaries.
+
+    Metric names are created on first use. Summaries track count, sum and
+    maximum of the observed values.
+
+    Example:
+        >>> metrics = Metrics()
+        >>> metrics.inc("render_cache_hits_total", output_format="svg")
+        >>> metrics.observe("upstream_seconds", 0.12, diagram_type="mermaid")
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._summaries: Dict[str, Dict[LabelKey, List[float]]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        """Increment a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        """Set a gauge to an absolute value."""
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Record an observation in a summary."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            stats = series.get(key)
+            if stats is None:
+                series[key] = [1.0, float(value), float(value)]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                stats[2] = max(stats[2], value)
+
+    def get(self, name: str, **labels: Any) -> float:
+        """Return the current value of a counter or gauge (0 if unknown)."""
+        key = _label_key(labels)
+        with self._lock:
+            for family in (self._counters, self._gauges):
+                if name in family and key in family[name]:
+                    return family[name][key]
+        return 0.0
+
+    def summary(self, name: str, **labels: Any) -> Dict[str, float]:
+        """Return count, sum and max of a summary series."""
+        key = _label_key(labels)
+        with self._lock:
+            stats = self._summaries.get(name, {}).get(key)
+            if stats is None:
+                return {"count": 0.0, "sum": 0.0, "max": 0.0}
+            return {"count": stats[0], "sum": stats[1], "max": stats[2]}
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name in sorted(self._gauges):
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in sorted(self._gauges[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name in sorted(self._summaries):
+                lines.append(f"# TYPE {name} summary")
+                for key, (count, total, peak) in sorted(self._summaries[name].items()):
+                    labels = _format_labels(key)
+                    lines.append(f"{name}_count{labels} {count:g}")
+                    lines.append(f"{name}_sum{labels} {total:g}")
+                    lines.append(f"{name}_max{labels} {peak:g}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,251 @@
+"""Stored renders served by permalink.
+
+A client asking ``/api/generate`` for a permalink gets the render stored under
+a short ID derived from its bytes, returned in the ``X-Permalink`` header as
+``/d/<id>.<format>``. The permalink serves the stored bytes with no Kroki call,
+and since identical renders share an ID the content behind a permalink never
+changes, so it is served with immutable caching headers. Renders are served
+from the application's origin, and an SVG may carry links or scripts: a
+restrictive ``Content-Security-Policy`` with ``sandbox`` keeps it inert.
+
+Stores are chosen with ``PERMALINK_STORE``: ``memory`` (per process, for
+development and tests) or ``filesystem`` (a directory, which may be shared by
+the workers of a node). Both apply the same retention policies: renders older
+than ``PERMALINK_TTL`` are dropped, and the oldest renders are dropped once the
+store grows beyond ``PERMALINK_MAX_BYTES``. Storing a render again refreshes
+its age.
+"""
+
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Mapping, Optional, Tuple
+
+STORE_MEMORY = "memory"
+STORE_FILESYSTEM = "filesystem"
+
+PERMALINK_HEADER = "X-Permalink"
+
+# Output formats that can be stored, with the content type they are served as
+PERMALINK_CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# Headers of permalink responses, so that a stored SVG cannot run active content
+PERMALINK_SECURITY_HEADERS = {
+    "Content-Security-Policy": (
+        "default-src 'none'; style-src 'unsafe-inline'; img-src data:; sandbox"
+    ),
+    "X-Content-Type-Options": "nosniff",
+}
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{16}$")
+
+
+def permalink_id(data: bytes) -> str:
+    """Short ID of a render: 96 bits of its SHA-256, URL-safe base64."""
+    return base64.urlsafe_b64encode(hashlib.sha256(data).digest()[:12]).decode()
+
+
+def valid_permalink(permalink: str, output_format: str) -> bool:
+    """Whether a permalink ID and format are well formed."""
+    return bool(_ID_RE.match(permalink)) and output_format in PERMALINK_CONTENT_TYPES
+
+
+class PermalinkStore:
+    """Base class of the permalink stores.
+
+    Subclasses implement :meth:`_read`, :meth:`_write` and :meth:`prune`.
+
+    Attributes:
+        max_bytes (int): Total size above which the oldest renders are dropped
+        ttl (float): Age in seconds after which a render is dropped, 0 to keep
+            renders until the size bound is reached
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 0) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["PermalinkStore"]:
+        """Build the store selected by ``PERMALINK_STORE``, or None if disabled.
+
+        Raises:
+            ValueError: If the store name is unknown
+        """
+        name = (config.get("PERMALINK_STORE") or "").lower()
+        if not name:
+            return None
+        max_bytes = config.get("PERMALINK_MAX_BYTES", 256 * 1024 * 1024)
+        ttl = config.get("PERMALINK_TTL", 0)
+        if name == STORE_MEMORY:
+            return MemoryPermalinkStore(max_bytes=max_bytes, ttl=ttl)
+        if name == STORE_FILESYSTEM:
+            return FilesystemPermalinkStore(
+                config.get("PERMALINK_DIR")
+                or os.path.join(tempfile.gettempdir(), "kroki-permalinks"),
+                max_bytes=max_bytes,
+                ttl=ttl,
+            )
+        raise ValueError(f"Unknown permalink store: {name}")
+
+    def put(self, data: bytes, output_format: str) -> str:
+        """Store a render and return its permalink ID.
+
+        Raises:
+            ValueError: If the output format cannot be stored
+        """
+        if output_format not in PERMALINK_CONTENT_TYPES:
+            raise ValueError(f"Cannot store {output_format} renders")
+        permalink = permalink_id(data)
+        self._write(permalink, output_format, data)
+        return permalink
+
+    def get(self, permalink: str, output_format: str) -> Optional[bytes]:
+        """Stored render of a permalink, or None if unknown or expired."""
+        if not valid_permalink(permalink, output_format):
+            return None
+        return self._read(permalink, output_format)
+
+    def prune(self) -> None:
+        """Apply the retention policies."""
+        raise NotImplementedError
+
+    def _expired(self, stored_at: float) -> bool:
+        """Whether a render stored at ``stored_at`` (epoch) is too old."""
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _read(self, permalink: str, output_format: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def _write(self, permalink: str, output_format: str, data: bytes) -> None:
+        raise NotImplementedError
+
+
+class MemoryPermalinkStore(PermalinkStore):
+    """Thread-safe permalink store kept in process memory."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 0) -> None:
+        super().__init__(max_bytes=max_bytes, ttl=ttl)
+        self._lock = threading.Lock()
+        self._renders: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._size = 0
+
+    def prune(self) -> None:
+        """Drop expired renders, then the oldest beyond ``max_bytes``."""
+        with self._lock:
+            # Oldest first: stop at the first render worth keeping
+            for name, (data, stored_at) in list(self._renders.items()):
+                if not self._expired(stored_at) and self._size <= self.max_bytes:
+                    break
+                del self._renders[name]
+                self._size -= len(data)
+
+    def _read(self, permalink: str, output_format: str) -> Optional[bytes]:
+        with self._lock:
+            stored = self._renders.get(f"{permalink}.{output_format}")
+        if stored is None or self._expired(stored[1]):
+            return None
+        return stored[0]
+
+    def _write(self, permalink: str, output_format: str, data: bytes) -> None:
+        name = f"{permalink}.{output_format}"
+        with self._lock:
+            previous = self._renders.pop(name, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+            self._renders[name] = (data, time.time())
+            self._size += len(data)
+        self.prune()
+
+
+class FilesystemPermalinkStore(PermalinkStore):
+    """Permalink store keeping one file per render in a directory.
+
+    Files are written atomically, so several workers may share the
+    directory. The modification time of a file is the time its render was
+    last stored. The directory is pruned at most every ``prune_interval``
+    seconds per process, after a write.
+
+    Attributes:
+        directory (str): Directory holding the renders
+        prune_interval (float): Minimum seconds between two prunes
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 0,
+        prune_interval: float = 60,
+    ) -> None:
+        super().__init__(max_bytes=max_bytes, ttl=ttl)
+        self.directory = directory
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def prune(self) -> None:
+        """Remove expired renders, then the oldest beyond ``max_bytes``."""
+        self._last_prune = time.monotonic()
+        files: List[Tuple[float, int, str]] = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith("."):
+                    # Render being written
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if not self._expired(mtime) and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another worker
+                pass
+            total -= size
+
+    def _path(self, permalink: str, output_format: str) -> str:
+        """Path of a render, fanned out by the first two ID characters."""
+        return os.path.join(
+            self.directory, permalink[:2], f"{permalink}.{output_format}"
+        )
+
+    def _read(self, permalink: str, output_format: str) -> Optional[bytes]:
+        path = self._path(permalink, output_format)
+        try:
+            if self._expired(os.path.getmtime(path)):
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, permalink: str, output_format: str, data: bytes) -> None:
+        path = self._path(permalink, output_format)
+        try:
+            # Same ID, same bytes: only refresh the age of the render
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune()
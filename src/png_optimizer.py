@@ -0,0 +1,418 @@
+"""Lossless PNG recompression for Kroki renders.
+
+Kroki encodes PNGs for speed. This module re-deflates the image data at a
+higher compression level, drops metadata chunks and, when it is lossless,
+reduces the colour type (RGBA without transparency to RGB, grey RGB to
+greyscale). The work runs in a background thread pool and the result is
+stored as the optimised variant of the cached render, so the CPU cost is paid
+once per unique diagram and never on the request thread.
+"""
+
+import logging
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Mapping, Optional, Set, Tuple
+
+from src.metrics import Metrics
+from src.render_cache import VARIANT_OPTIMIZED, RenderCache
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Ancillary chunks that affect how pixels are displayed
+RENDERING_CHUNKS = frozenset({b"tRNS", b"sRGB", b"gAMA", b"cHRM", b"iCCP"})
+
+# Colour types: channels per pixel at bit depth 8
+_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+Chunk = Tuple[bytes, bytes]
+
+
+class PngFormatError(ValueError):
+    """Raised when the input is not a PNG this module can process."""
+
+    pass
+
+
+def read_chunks(data: bytes) -> List[Chunk]:
+    """Split a PNG file into (type, payload) chunks.
+
+    Raises:
+        PngFormatError: If the signature or chunk framing is invalid
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise PngFormatError("Missing PNG signature")
+    chunks = []
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[offset : offset + 8])
+        end = offset + 12 + length
+        if end > len(data):
+            raise PngFormatError(f"Truncated {chunk_type!r} chunk")
+        chunks.append((chunk_type, data[offset + 8 : offset + 8 + length]))
+        offset = end
+        if chunk_type == b"IEND":
+            break
+    if not chunks or chunks[0][0] != b"IHDR" or chunks[-1][0] != b"IEND":
+        raise PngFormatError("Missing IHDR or IEND chunk")
+    return chunks
+
+
+def write_chunks(chunks: List[Chunk]) -> bytes:
+    """Serialise (type, payload) chunks into a PNG file."""
+    out = [PNG_SIGNATURE]
+    for chunk_type, payload in chunks:
+        crc = zlib.crc32(chunk_type + payload) & 0xFFFFFFFF
+        out.append(struct.pack(">I4s", len(payload), chunk_type))
+        out.append(payload)
+        out.append(struct.pack(">I", crc))
+    return b"".join(out)
+
+
+class PngOptimizer:
+    """Lossless PNG optimizer.
+
+    Attributes:
+        level (int): zlib compression level for the recompressed image data
+        reduce_color (bool): Whether to try lossless colour type reductions
+        max_reduce_pixels (int): Largest image (in pixels) eligible for colour
+            reduction, which needs a pure Python unfilter pass
+    """
+
+    def __init__(
+        self,
+        level: int = 9,
+        reduce_color: bool = True,
+        max_reduce_pixels: int = 4_000_000,
+    ) -> None:
+        self.level = level
+        self.reduce_color = reduce_color
+        self.max_reduce_pixels = max_reduce_pixels
+
+    def optimize(self, data: bytes) -> bytes:
+        """Return a smaller, pixel-identical PNG.
+
+        Args:
+            data: PNG file
+
+        Returns:
+            bytes: Optimised PNG, or ``data`` if nothing could be gained
+
+        Raises:
+            PngFormatError: If ``data`` is not a valid PNG
+        """
+        chunks = read_chunks(data)
+        ihdr = chunks[0][1]
+        width, height, bit_depth, color_type, _, _, interlace = struct.unpack(
+            ">IIBBBBB", ihdr
+        )
+
+        kept = [
+            (chunk_type, payload)
+            for chunk_type, payload in chunks
+            if chunk_type[0:1].isupper() or chunk_type in RENDERING_CHUNKS
+        ]
+        kept_types = {chunk_type for chunk_type, _ in kept}
+        try:
+            filtered = zlib.decompress(
+                b"".join(
+                    payload for chunk_type, payload in kept if chunk_type == b"IDAT"
+                )
+            )
+        except zlib.error as e:
+            raise PngFormatError(f"Corrupt image data: {e}")
+
+        candidates = [(ihdr, zlib.compress(filtered, self.level))]
+
+        if (
+            self.reduce_color
+            and bit_depth == 8
+            and interlace == 0
+            and color_type in (2, 4, 6)
+            and width * height <= self.max_reduce_pixels
+            and not kept_types & (RENDERING_CHUNKS - {b"sRGB", b"gAMA"})
+        ):
+            reduced = _reduce_color(filtered, width, height, color_type)
+            if reduced is not None:
+                new_type, pixels = reduced
+                new_ihdr = ihdr[:9] + bytes([new_type]) + ihdr[10:]
+                stride = len(pixels) // height
+                for filter_type in (0, 2):
+                    scanlines = _filter_scanlines(pixels, stride, filter_type)
+                    candidates.append((new_ihdr, zlib.compress(scanlines, self.level)))
+
+        best_ihdr, best_idat = min(candidates, key=lambda item: len(item[1]))
+        rebuilt = [(b"IHDR", best_ihdr)]
+        idat_written = False
+        for chunk_type, payload in kept[1:]:
+            if chunk_type == b"IDAT":
+                if not idat_written:
+                    rebuilt.append((b"IDAT", best_idat))
+                    idat_written = True
+                continue
+            rebuilt.append((chunk_type, payload))
+
+        result = write_chunks(rebuilt)
+        return result if len(result) < len(data) else data
+
+
+def _reduce_color(
+    filtered: bytes, width: int, height: int, color_type: int
+) -> Optional[Tuple[int, bytes]]:
+    """Find a lossless colour type reduction of an 8-bit image.
+
+    Returns:
+        Optional[Tuple[int, bytes]]: New colour type and raw pixel bytes,
+            or None if no reduction applies
+    """
+    channels = _CHANNELS[color_type]
+    pixels = _unfilter(filtered, width, height, channels)
+
+    has_alpha = color_type in (4, 6)
+    color_channels = channels - 1 if has_alpha else channels
+    opaque = not has_alpha or pixels[channels - 1 :: channels] == b"\xff" * (
+        width * height
+    )
+    grey = color_channels == 1 or (
+        pixels[0::channels] == pixels[1::channels] == pixels[2::channels]
+    )
+
+    if opaque and grey:
+        new_type, planes = 0, [pixels[0::channels]]
+    elif opaque:
+        if not has_alpha:
+            return None
+        new_type, planes = 2, [pixels[i::channels] for i in range(3)]
+    elif grey and color_channels == 3:
+        new_type, planes = 4, [pixels[0::channels], pixels[3::channels]]
+    else:
+        return None
+
+    new_channels = len(planes)
+    packed = bytearray(width * height * new_channels)
+    for index, plane in enumerate(planes):
+        packed[index::new_channels] = plane
+    return new_type, bytes(packed)
+
+
+def _filter_scanlines(pixels: bytes, stride: int, filter_type: int) -> bytes:
+    """Filter raw pixel rows with a single filter type (0 = None, 2 = Up)."""
+    out = bytearray()
+    prev = bytes(stride)
+    for start in range(0, len(pixels), stride):
+        line = pixels[start : start + stride]
+        out.append(filter_type)
+        out += line if filter_type == 0 else _sub_bytes(line, prev)
+        prev = line
+    return bytes(out)
+
+
+def _unfilter(filtered: bytes, width: int, height: int, bpp: int) -> bytes:
+    """Reverse PNG scanline filters for an 8-bit, non-interlaced image.
+
+    Returns:
+        bytes: Raw pixel bytes, row after row
+
+    Raises:
+        PngFormatError: If the data length or a filter type is invalid
+    """
+    stride = width * bpp
+    if len(filtered) < height * (stride + 1):
+        raise PngFormatError("Image data shorter than declared size")
+    out = bytearray(height * stride)
+    prev = bytearray(stride)
+    for row in range(height):
+        start = row * (stride + 1)
+        filter_type = filtered[start]
+        line = bytearray(filtered[start + 1 : start + 1 + stride])
+        if filter_type == 0:
+            pass
+        elif filter_type == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif filter_type == 2:
+            line = bytearray(_add_bytes(line, prev))
+        elif filter_type == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                a = line[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                c = prev[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                if pa <= pb and pa <= pc:
+                    predictor = a
+                elif pb <= pc:
+                    predictor = b
+                else:
+                    predictor = c
+                line[i] = (line[i] + predictor) & 0xFF
+        else:
+            raise PngFormatError(f"Invalid filter type {filter_type}")
+        out[row * stride : (row + 1) * stride] = line
+        prev = line
+    return bytes(out)
+
+
+def _add_bytes(left: bytes, right: bytes) -> bytes:
+    """Byte-wise addition modulo 256 of two equal-length buffers.
+
+    Uses SIMD-within-a-register arithmetic on Python integers so the Up
+    filter, the most common one in renderer output, avoids a per-byte loop.
+    """
+    size = len(left)
+    if not size:
+        return b""
+    a = int.from_bytes(left, "big")
+    b = int.from_bytes(right, "big")
+    low = int.from_bytes(b"\x7f" * size, "big")
+    high = int.from_bytes(b"\x80" * size, "big")
+    total = ((a & low) + (b & low)) ^ ((a ^ b) & high)
+    return total.to_bytes(size, "big")
+
+
+def _sub_bytes(left: bytes, right: bytes) -> bytes:
+    """Byte-wise subtraction modulo 256 of two equal-length buffers."""
+    size = len(left)
+    if not size:
+        return b""
+    a = int.from_bytes(left, "big")
+    b = int.from_bytes(right, "big")
+    low = int.from_bytes(b"\x7f" * size, "big")
+    high = int.from_bytes(b"\x80" * size, "big")
+    total = ((a | high) - (b & low)) ^ ((a ^ ~b) & high)
+    return total.to_bytes(size, "big")
+
+
+class BackgroundPngOptimizer:
+    """Runs PNG optimisation off the request thread and caches the result.
+
+    The optimised PNG is attached to the render cache entry as its
+    optimised variant. Each render is optimised at most once at a time,
+    and submissions beyond ``max_pending`` are dropped rather than queued.
+
+    Attributes:
+        optimizer (PngOptimizer): Transformation applied to each render
+        cache (RenderCache): Cache receiving the optimised variants
+        metrics (Metrics): Registry for size and CPU cost, or None
+        max_workers (int): Threads optimising renders
+        max_pending (int): Maximum number of queued or running jobs
+    """
+
+    def __init__(
+        self,
+        optimizer: PngOptimizer,
+        cache: RenderCache,
+        metrics: Optional[Metrics] = None,
+        max_workers: int = 1,
+        max_pending: int = 32,
+    ) -> None:
+        self.optimizer = optimizer
+        self.cache = cache
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="png-optimizer"
+        )
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Mapping[str, Any],
+        cache: Optional[RenderCache],
+        metrics: Optional[Metrics] = None,
+    ) -> Optional["BackgroundPngOptimizer"]:
+        """Build from a Flask config mapping, or None if disabled.
+
+        Optimisation needs the render cache to keep its result, so it is
+        disabled when the cache is.
+        """
+        if not config.get("PNG_OPTIMIZE", False) or cache is None:
+            return None
+        optimizer = PngOptimizer(
+            level=config.get("PNG_OPTIMIZE_LEVEL", 9),
+            max_reduce_pixels=config.get("PNG_OPTIMIZE_MAX_PIXELS", 4_000_000),
+        )
+        return cls(
+            optimizer,
+            cache,
+            metrics,
+            max_workers=config.get("PNG_OPTIMIZE_WORKERS", 1),
+            max_pending=config.get("PNG_OPTIMIZE_MAX_PENDING", 32),
+        )
+
+    def submit(self, key: str, data: bytes) -> bool:
+        """Schedule optimisation of the render ``key``.
+
+        Returns:
+            bool: True if a job was scheduled
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self._inc("png_optimize_total", result="dropped")
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, key, data)
+        return True
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker threads."""
+        self._executor.shutdown(wait=wait)
+
+    def drain(self) -> None:
+        """Wait for the scheduled jobs, leaving no worker thread running.
+
+        Called before the server forks its workers, so that no thread holds
+        a lock the workers would inherit; the next job starts new threads.
+        """
+        executor = self._executor
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="png-optimizer"
+        )
+        executor.shutdown(wait=True)
+
+    def _run(self, key: str, data: bytes) -> None:
+        """Optimise one render and store the variant (worker thread)."""
+        started = time.thread_time()
+        try:
+            optimized = self.optimizer.optimize(data)
+        except PngFormatError as e:
+            logger.debug("PNG optimisation skipped for %s: %s", key, e)
+            self._inc("png_optimize_total", result="invalid")
+            return
+        except Exception:
+            logger.exception("PNG optimisation failed for %s", key)
+            self._inc("png_optimize_total", result="error")
+            return
+        finally:
+            cpu = time.thread_time() - started
+            if self.metrics is not None:
+                self.metrics.observe("png_optimize_cpu_seconds", cpu)
+            with self._lock:
+                self._pending.discard(key)
+
+        saved = len(data) - len(optimized)
+        self._inc("png_optimize_bytes_in_total", len(data))
+        self._inc("png_optimize_bytes_saved_total", saved)
+        if optimized is data:
+            self._inc("png_optimize_total", result="unchanged")
+            return
+        self._inc("png_optimize_total", result="optimized")
+        self.cache.put(key, VARIANT_OPTIMIZED, optimized, "image/png")
+
+    def _inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Increment a counter if metrics are enabled."""
+        if self.metrics is not None:
+            self.metrics.inc(name, value, **labels)
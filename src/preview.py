@@ -0,0 +1,133 @@
+"""Live-preview sessions with latest-wins semantics.
+
+The editor sends a preview request as the user types, tagged with a session
+ID and an increasing sequence number. Each request supersedes the previous
+ones of its session: a request older than the latest seen is refused at
+once, and a render superseded while it waits for an upstream slot is dropped
+before Kroki is called. Renders superseded while Kroki is already working
+on them still complete and are cached, but their result is discarded.
+
+The debounce delay suggested to the editor follows the measured preview
+latency of the session (exponentially weighted), so slow diagrams are sent
+less often and fast ones feel immediate.
+
+Sessions are kept per worker process, in a bounded LRU.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+PREVIEW_SESSION_HEADER = "X-Preview-Session"
+PREVIEW_SEQUENCE_HEADER = "X-Preview-Seq"
+DEBOUNCE_HEADER = "X-Debounce-Ms"
+
+_SESSION_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+@dataclass
+class _Session:
+    """Latest sequence number and smoothed latency of a preview session."""
+
+    latest: int = 0
+    latency_ms: Optional[float] = None
+
+
+class PreviewSessions:
+    """Tracks preview sessions to supersede stale renders and pace the editor.
+
+    Attributes:
+        max_sessions (int): Number of sessions kept, least recently used
+            dropped first
+        smoothing (float): Weight of a new latency in the session average
+        min_debounce_ms (float): Shortest suggested debounce
+        max_debounce_ms (float): Longest suggested debounce
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        smoothing: float = 0.3,
+        min_debounce_ms: float = 150,
+        max_debounce_ms: float = 2000,
+    ) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.smoothing = smoothing
+        self.min_debounce_ms = min_debounce_ms
+        self.max_debounce_ms = max(max_debounce_ms, min_debounce_ms)
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["PreviewSessions"]:
+        """Build the session registry from a Flask config mapping, or None."""
+        if not config.get("PREVIEW_ENABLED", True):
+            return None
+        return cls(
+            max_sessions=config.get("PREVIEW_MAX_SESSIONS", 1000),
+            min_debounce_ms=config.get("PREVIEW_MIN_DEBOUNCE_MS", 150),
+            max_debounce_ms=config.get("PREVIEW_MAX_DEBOUNCE_MS", 2000),
+        )
+
+    @staticmethod
+    def valid_session(session_id: Optional[str]) -> bool:
+        """Whether a client-provided session ID is well formed."""
+        return bool(session_id) and bool(_SESSION_RE.match(session_id))
+
+    def begin(self, session_id: str, sequence: Optional[int] = None) -> Optional[int]:
+        """Register a preview request as the latest of its session.
+
+        Args:
+            session_id: ID of the editor session
+            sequence: Sequence number sent by the editor; None to number
+                requests in arrival order
+
+        Returns:
+            Optional[int]: Sequence number of the request, or None if a newer
+                request of the session was already seen
+        """
+        with self._lock:
+            session = self._session(session_id)
+            if sequence is None:
+                sequence = session.latest + 1
+            elif sequence < session.latest:
+                return None
+            session.latest = sequence
+            return sequence
+
+    def is_current(self, session_id: str, sequence: int) -> bool:
+        """Whether the request is still the latest of its session."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session is None or session.latest <= sequence
+
+    def observe(self, session_id: str, latency_ms: float) -> None:
+        """Record the latency of a completed preview."""
+        with self._lock:
+            session = self._session(session_id)
+            if session.latency_ms is None:
+                session.latency_ms = latency_ms
+            else:
+                session.latency_ms += self.smoothing * (latency_ms - session.latency_ms)
+
+    def debounce_ms(self, session_id: str) -> int:
+        """Debounce delay suggested to the editor of a session."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            latency = session.latency_ms if session is not None else None
+        if latency is None:
+            latency = self.min_debounce_ms
+        return int(min(self.max_debounce_ms, max(self.min_debounce_ms, latency)))
+
+    def _session(self, session_id: str) -> _Session:
+        """Get or create a session and mark it recently used (lock held)."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return session
@@ -0,0 +1,183 @@
+"""Opt-in CPU profiling of individual requests.
+
+A request is profiled with cProfile when an admin asks for it with the
+``X-Profile`` header, or when it is picked by the configured sampling rate.
+Each profile is written to a bounded directory as a ``.prof`` file (readable
+with ``pstats`` or snakeviz) next to a small JSON file describing the request;
+the oldest profiles are removed beyond the configured count.
+
+When profiling is disabled no profiler object exists and requests pay nothing.
+Only one request per process is profiled at a time, as the interpreter
+supports a single active profiler.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_SUFFIX = ".prof"
+
+# Profile names: millisecond timestamp and sanitised request ID
+_NAME_RE = re.compile(r"^\d+-[A-Za-z0-9_-]{1,128}$")
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+@dataclass
+class ActiveProfile:
+    """A profile being recorded for one request.
+
+    Attributes:
+        name: Name of the profile, unique in the profile directory
+        profile: Running cProfile profiler
+        started: ``time.perf_counter()`` at the start of the profile
+    """
+
+    name: str
+    profile: cProfile.Profile
+    started: float
+
+
+class RequestProfiler:
+    """Profiles selected requests and keeps their profiles on disk.
+
+    Attributes:
+        directory (str): Directory the profiles are written to
+        sample_rate (float): Fraction of requests profiled without being asked
+        max_files (int): Number of profiles kept, oldest removed first
+    """
+
+    def __init__(
+        self, directory: str, sample_rate: float = 0.0, max_files: int = 20
+    ) -> None:
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_files = max(1, max_files)
+        self._busy = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["RequestProfiler"]:
+        """Build a profiler from a Flask config mapping, or None if disabled."""
+        if not config.get("PROFILE_ENABLED", False):
+            return None
+        return cls(
+            directory=config.get("PROFILE_DIR")
+            or os.path.join(tempfile.gettempdir(), "kroki-profiles"),
+            sample_rate=config.get("PROFILE_SAMPLE_RATE", 0.0),
+            max_files=config.get("PROFILE_MAX_FILES", 20),
+        )
+
+    def should_profile(self, requested: bool) -> bool:
+        """Whether to profile a request, asked for or picked by sampling."""
+        return requested or (
+            self.sample_rate > 0 and random.random() < self.sample_rate
+        )
+
+    def start(self, request_id: str) -> Optional[ActiveProfile]:
+        """Start profiling the current request.
+
+        Returns:
+            Optional[ActiveProfile]: Running profile, or None if another
+                request of this process is already being profiled
+        """
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            self._busy.release()
+            return None
+        name = f"{int(time.time() * 1000)}-{_UNSAFE_RE.sub('_', request_id)[:128]}"
+        return ActiveProfile(name, profile, time.perf_counter())
+
+    def finish(self, active: ActiveProfile, **details: Any) -> str:
+        """Stop a profile, write it to disk and prune old profiles.
+
+        Args:
+            active: Profile returned by :meth:`start`
+            **details: Request details stored next to the profile
+
+        Returns:
+            str: Name of the written profile
+        """
+        try:
+            active.profile.disable()
+        finally:
+            self._busy.release()
+        duration_ms = (time.perf_counter() - active.started) * 1000
+
+        path = os.path.join(self.directory, active.name)
+        active.profile.dump_stats(path + PROFILE_SUFFIX)
+        details.update(name=active.name, duration_ms=round(duration_ms, 2))
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump(details, f)
+        self._prune()
+        return active.name
+
+    def profiles(self) -> List[Dict[str, Any]]:
+        """Details of the kept profiles, most recent first."""
+        profiles = []
+        for name in self._names():
+            try:
+                with open(
+                    os.path.join(self.directory, name + ".json"), encoding="utf-8"
+                ) as f:
+                    details = json.load(f)
+                size = os.path.getsize(
+                    os.path.join(self.directory, name + PROFILE_SUFFIX)
+                )
+            except (OSError, ValueError):
+                # Pruned by another worker, or still being written
+                continue
+            details["size"] = size
+            profiles.append(details)
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        """Path of the ``.prof`` file of a kept profile, or None."""
+        if not _NAME_RE.match(name):
+            return None
+        path = os.path.join(self.directory, name + PROFILE_SUFFIX)
+        return path if os.path.isfile(path) else None
+
+    def summary(self, name: str, limit: int = 30) -> Optional[str]:
+        """Text summary of a profile, sorted by cumulative time."""
+        path = self.path(name)
+        if path is None:
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return output.getvalue()
+
+    def _names(self) -> List[str]:
+        """Names of the profiles in the directory, most recent first."""
+        names = [
+            entry[: -len(PROFILE_SUFFIX)]
+            for entry in os.listdir(self.directory)
+            if entry.endswith(PROFILE_SUFFIX)
+            and _NAME_RE.match(entry[: -len(PROFILE_SUFFIX)])
+        ]
+        return sorted(names, key=lambda name: int(name.split("-", 1)[0]), reverse=True)
+
+    def _prune(self) -> None:
+        """Remove the oldest profiles beyond ``max_files``."""
+        for name in self._names()[self.max_files :]:
+            for suffix in (PROFILE_SUFFIX, ".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except OSError:
+                    pass
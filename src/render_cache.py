@@ -0,0 +1,560 @@
+"""In-memory cache of rendered diagrams.
+
+This module provides the render identity used to key cached renders and a
+thread-safe, byte-bounded LRU cache. Each entry stores the raw Kroki output
+together with post-processed variants (e.g. an optimised SVG) and their
+precompressed encodings, so post-processing and compression are paid once per
+unique diagram. Text sources are keyed by their canonical form (see
+src.canonicalize), so edits to comments or whitespace do not cause a new
+render. Compressible renders can be kept in compressed form only and
+decompressed on demand, which fits far more entries in the same budget.
+
+With several replicas, the per-process cache can be backed by a shared second
+tier (see src.cache_backends): a local miss is looked up in the shared store,
+and new renders are written through to it, so a diagram rendered by one node
+is served by all. The shared tier is best effort: when its store is
+unreachable, lookups count as misses and it is left alone for a while, so
+renders go on uncached rather than failing.
+
+A separate, short-lived negative cache remembers syntax errors so that a broken
+source sent over and over during live editing is refused without calling Kroki.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import IO, Any, Dict, Mapping, Optional, Tuple, Union
+
+from src.cache_backends import CacheBackend, CacheBackendError
+from src.canonicalize import canonical_source
+from src.compression import COMPRESSIBLE_TYPES, ENCODING_GZIP, compress, decompress
+
+logger = logging.getLogger(__name__)
+
+VARIANT_RAW = "raw"
+VARIANT_OPTIMIZED = "optimized"
+
+
+def _slot(variant: str, encoding: Optional[str]) -> str:
+    """Storage slot of a variant in a given content encoding."""
+    return f"{variant}+{encoding}" if encoding else variant
+
+
+def render_key(
+    diagram_type: str,
+    output_format: str,
+    diagram_source: Union[str, bytes, IO[bytes]],
+    theme: Optional[str] = None,
+    canonical: bool = False,
+) -> str:
+    """Compute the render identity of a diagram request.
+
+    Two requests with the same identity produce the same upstream render.
+
+    Args:
+        diagram_type: Kroki diagram type
+        output_format: Output format (png, svg)
+        diagram_source: Diagram source as sent by the client; a binary file is
+                       hashed in chunks and rewound
+        theme: Effective theme when it affects the render, else None
+        canonical: Hash the canonical form of a text source, so that variants
+                  differing only in comments or whitespace share an identity
+
+    Returns:
+        str: Hex SHA-256 digest identifying the render
+    """
+    if canonical and isinstance(diagram_source, bytes):
+        try:
+            diagram_source = diagram_source.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    if isinstance(diagram_source, str):
+        if canonical:
+            diagram_source = canonical_source(diagram_type, diagram_source)
+        diagram_source = diagram_source.encode("utf-8")
+    digest = hashlib.sha256()
+    digest.update(f"{diagram_type}\0{output_format}\0{theme or ''}\0".encode())
+    if isinstance(diagram_source, bytes):
+        digest.update(diagram_source)
+    else:
+        position = diagram_source.tell()
+        for chunk in iter(lambda: diagram_source.read(64 * 1024), b""):
+            digest.update(chunk)
+        diagram_source.seek(position)
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    """A cached render and its post-processed, possibly compressed variants.
+
+    Attributes:
+        content_type: MIME type of the render
+        variants: Storage slot (``variant`` or ``variant+encoding``) to bytes
+        expires_at: Monotonic deadline after which the entry is stale
+    """
+
+    content_type: str
+    variants: Dict[str, bytes] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        """Total payload size of all variants in bytes."""
+        return sum(len(data) for data in self.variants.values())
+
+    def has(self, variant: str) -> bool:
+        """Whether ``variant`` is stored in any encoding."""
+        return any(
+            slot == variant or slot.startswith(variant + "+") for slot in self.variants
+        )
+
+    def best_variant(self) -> str:
+        """Name of the variant to serve: optimised if present, else raw."""
+        return VARIANT_OPTIMIZED if self.has(VARIANT_OPTIMIZED) else VARIANT_RAW
+
+    def get(self, variant: str, encoding: Optional[str] = None) -> Optional[bytes]:
+        """Return ``variant`` in ``encoding`` (None = identity).
+
+        An identity request for a variant stored only gzip-compressed is
+        decompressed on demand.
+        """
+        data = self.variants.get(_slot(variant, encoding))
+        if data is None and encoding is None:
+            compressed = self.variants.get(_slot(variant, ENCODING_GZIP))
+            if compressed is not None:
+                data = decompress(compressed, ENCODING_GZIP)
+        return data
+
+    def best(self, encoding: Optional[str] = None) -> Optional[bytes]:
+        """Return the best variant in ``encoding``.
+
+        Returns:
+            Optional[bytes]: Payload, always present for identity; None if the
+                            best variant is not cached in that encoding
+        """
+        return self.get(self.best_variant(), encoding)
+
+
+class RenderCache:
+    """Thread-safe LRU cache of renders bounded by total payload bytes.
+
+    Attributes:
+        max_bytes (int): Memory budget for cached payloads
+        ttl (float): Entry lifetime in seconds
+        store_compressed (bool): Keep compressible renders gzip-compressed
+            only, decompressing them on demand for identity clients
+        canonical (bool): Key renders by canonical source, so that sources
+            differing only in comments or whitespace share an entry
+        shared (SharedRenderCache): Shared second tier, or None
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600,
+        store_compressed: bool = False,
+        canonical: bool = True,
+        shared: Optional["SharedRenderCache"] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store_compressed = store_compressed
+        self.canonical = canonical
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["RenderCache"]:
+        """Build a cache from a Flask config mapping, or None if disabled."""
+        max_bytes = config.get("RENDER_CACHE_MAX_BYTES", 0)
+        if max_bytes <= 0:
+            return None
+        return cls(
+            max_bytes=max_bytes,
+            ttl=config.get("RENDER_CACHE_TTL", 3600),
+            store_compressed=config.get("RENDER_CACHE_STORE_COMPRESSED", False),
+            canonical=config.get("RENDER_CACHE_CANONICAL", True),
+            shared=SharedRenderCache.from_config(config),
+        )
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for ``key`` if present and fresh.
+
+        A local miss is looked up in the shared tier, and a render found there
+        is kept locally.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        if self.shared is None:
+            return None
+        record = self.shared.get(key)
+        if record is None:
+            return None
+        return self._load(key, *record)
+
+    def put(
+        self,
+        key: str,
+        variant: str,
+        data: bytes,
+        content_type: str,
+        encoding: Optional[str] = None,
+    ) -> Optional[CacheEntry]:
+        """Store ``data`` as ``variant`` of the render ``key``.
+
+        Storing the identity raw variant replaces the whole entry (and resets
+        its TTL); other variants and encodings are attached to the existing
+        entry. With ``store_compressed``, identity payloads of compressible
+        types are stored gzip-compressed instead. Identity raw and optimised
+        variants are also written to the shared tier.
+
+        Returns:
+            Optional[CacheEntry]: The updated entry, or None if it does not fit
+        """
+        if self.shared is not None and encoding is None:
+            if variant in (VARIANT_RAW, VARIANT_OPTIMIZED):
+                self.shared.put(key, variant, data, content_type)
+        if (
+            self.store_compressed
+            and encoding is None
+            and content_type in COMPRESSIBLE_TYPES
+        ):
+            data, encoding = compress(data, ENCODING_GZIP), ENCODING_GZIP
+            fresh = variant == VARIANT_RAW
+        else:
+            fresh = variant == VARIANT_RAW and encoding is None
+        slot = _slot(variant, encoding)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or fresh:
+                if not fresh:
+                    # Variants are only kept next to their raw render
+                    return None
+                if entry is not None:
+                    self._remove(key)
+                entry = CacheEntry(
+                    content_type=content_type,
+                    expires_at=time.monotonic() + self.ttl,
+                )
+                self._entries[key] = entry
+            else:
+                self._size -= len(entry.variants.get(slot, b""))
+
+            entry.variants[slot] = data
+            self._size += len(data)
+            self._entries.move_to_end(key)
+
+            if entry.size > self.max_bytes:
+                self._remove(key)
+                return None
+            self._evict()
+            return entry
+
+    def delete(self, key: str) -> None:
+        """Remove ``key`` from the cache (and the shared tier) if present."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of cache occupancy and hit counters."""
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        if self.shared is not None:
+            for name, value in self.shared.stats().items():
+                stats[f"shared_{name}"] = value
+        return stats
+
+    def _load(
+        self,
+        key: str,
+        variant: str,
+        content_type: str,
+        encoding: Optional[str],
+        data: bytes,
+    ) -> Optional[CacheEntry]:
+        """Keep locally a render found in the shared tier.
+
+        Returns:
+            Optional[CacheEntry]: The new entry (even if it does not fit the
+                local budget), or None if the payload is corrupt
+        """
+        entry = CacheEntry(
+            content_type=content_type, expires_at=time.monotonic() + self.ttl
+        )
+        entry.variants[_slot(variant, encoding)] = data
+        if encoding is not None and not self.store_compressed:
+            try:
+                entry.variants[variant] = decompress(data, encoding)
+            except (OSError, ValueError):
+                return None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if entry.size > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._size += entry.size
+            self._evict()
+        return entry
+
+    def _remove(self, key: str) -> None:
+        """Drop an entry and release its budget (lock held)."""
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+
+    def _evict(self) -> None:
+        """Evict least recently used entries until within budget (lock held)."""
+        while self._size > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+
+class SharedRenderCache:
+    """Shared second tier of the render cache, over a cache backend.
+
+    Each render is stored as one value: a header naming its variant, content
+    type and encoding, followed by the payload, gzip-compressed for
+    compressible types. Values expire after ``ttl`` seconds in the store.
+
+    Backend errors never reach the caller: a failed lookup is a miss and a
+    failed write is dropped. After an error the tier is suspended for
+    ``retry_after`` seconds, so an unreachable store costs one timeout per
+    period rather than one per request.
+
+    Attributes:
+        backend (CacheBackend): Store holding the renders
+        ttl (float): Lifetime of a render in the store, in seconds
+        retry_after (float): Seconds the tier is suspended after an error
+        prefix (str): Prefix of the keys in the store
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        ttl: float = 86400,
+        retry_after: float = 30,
+        prefix: str = "kroki:render:",
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._suspended_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["SharedRenderCache"]:
+        """Build the shared tier from a Flask config mapping, or None if disabled."""
+        backend = CacheBackend.from_config(config)
+        if backend is None:
+            return None
+        return cls(
+            backend,
+            ttl=config.get("RENDER_CACHE_SHARED_TTL", 86400),
+            retry_after=config.get("RENDER_CACHE_SHARED_RETRY_AFTER", 30),
+        )
+
+    @property
+    def available(self) -> bool:
+        """Whether the tier is in use (not suspended after an error)."""
+        return time.monotonic() >= self._suspended_until
+
+    def get(self, key: str) -> Optional[Tuple[str, str, Optional[str], bytes]]:
+        """Look up a render.
+
+        Returns:
+            Optional[Tuple[str, str, Optional[str], bytes]]: Variant, content
+                type, encoding and payload, or None on a miss
+        """
+        if not self.available:
+            return None
+        try:
+            value = self.backend.get(self.prefix + key)
+        except CacheBackendError as e:
+            self._suspend(e)
+            return None
+        record = _decode_record(value) if value is not None else None
+        with self._lock:
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return record
+
+    def put(self, key: str, variant: str, data: bytes, content_type: str) -> None:
+        """Store the identity bytes of a render variant."""
+        if not self.available:
+            return
+        encoding = None
+        if content_type in COMPRESSIBLE_TYPES:
+            data, encoding = compress(data, ENCODING_GZIP), ENCODING_GZIP
+        header = f"{variant}\n{content_type}\n{encoding or ''}\n".encode("utf-8")
+        try:
+            self.backend.set(self.prefix + key, header + data, self.ttl)
+        except CacheBackendError as e:
+            self._suspend(e)
+
+    def delete(self, key: str) -> None:
+        """Remove a render from the store."""
+        if not self.available:
+            return
+        try:
+            self.backend.delete(self.prefix + key)
+        except CacheBackendError as e:
+            self._suspend(e)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and error counters, and whether the tier is in use."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "available": int(self.available),
+            }
+
+    def _suspend(self, error: CacheBackendError) -> None:
+        """Leave the store alone for ``retry_after`` seconds after an error."""
+        with self._lock:
+            self.errors += 1
+            first = self.available
+            self._suspended_until = time.monotonic() + self.retry_after
+        if first:
+            logger.warning(
+                "Shared render cache unavailable, rendering uncached for %ss: %s",
+                self.retry_after,
+                error,
+            )
+
+
+def _decode_record(
+    value: bytes,
+) -> Optional[Tuple[str, str, Optional[str], bytes]]:
+    """Split a stored render into its header fields and payload."""
+    parts = value.split(b"\n", 3)
+    if len(parts) != 4:
+        return None
+    try:
+        variant, content_type, encoding = (part.decode("ascii") for part in parts[:3])
+    except UnicodeDecodeError:
+        return None
+    if variant not in (VARIANT_RAW, VARIANT_OPTIMIZED):
+        return None
+    return variant, content_type, encoding or None, parts[3]
+
+
+class NegativeCache:
+    """Thread-safe LRU cache of render failures with a short TTL.
+
+    Stores the error message of renders Kroki rejected as invalid, under its
+    own byte budget so that failures never evict successful renders.
+
+    Attributes:
+        max_bytes (int): Memory budget for cached error messages
+        ttl (float): Entry lifetime in seconds
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 1024, ttl: float = 30) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["NegativeCache"]:
+        """Build a negative cache from a Flask config mapping, or None if disabled."""
+        max_bytes = config.get("NEGATIVE_CACHE_MAX_BYTES", 0)
+        if max_bytes <= 0 or config.get("NEGATIVE_CACHE_TTL", 30) <= 0:
+            return None
+        return cls(max_bytes=max_bytes, ttl=config.get("NEGATIVE_CACHE_TTL", 30))
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached error message for ``key`` if present and fresh."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[1] <= time.monotonic():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: str, message: str) -> None:
+        """Remember that the render ``key`` failed with ``message``."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if _message_size(key, message) > self.max_bytes:
+                return
+            self._entries[key] = (message, time.monotonic() + self.ttl)
+            self._size += _message_size(key, message)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of cache occupancy and hit counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: str) -> None:
+        """Drop an entry and release its budget (lock held)."""
+        message, _ = self._entries.pop(key)
+        self._size -= _message_size(key, message)
+
+
+def _message_size(key: str, message: str) -> int:
+    """Approximate memory charged for a negative cache entry."""
+    return len(key) + len(message.encode("utf-8"))
@@ -0,0 +1,216 @@
+"""Structured, sampled request logging.
+
+Each request gets an ID (taken from the ``X-Request-ID`` header or generated)
+that is echoed in the response and forwarded to Kroki, and a
+:class:`RequestLog` that accumulates per-stage timings and fields. A single
+JSON line is emitted when the request finishes: always for errors and slow
+requests, and for a configurable fraction of successful ones. Nothing is
+formatted for requests that are not logged.
+"""
+
+import json
+import logging
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+from flask import g, has_request_context
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Incoming request IDs are reused only if they are short and header-safe
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+logger = logging.getLogger("src.requests")
+
+# Standard LogRecord attributes, not copied into the JSON document
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__.keys()
+    | {"message", "asctime"}
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line.
+
+    Fields passed with ``extra=`` are added to the object as is.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        document: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRS and not name.startswith("_"):
+                document[name] = value
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str, ensure_ascii=False)
+
+
+def configure_logging(config: Mapping[str, Any]) -> None:
+    """Attach the application log handler to the ``src`` logger.
+
+    Calling it again (e.g. for a second app in tests) replaces the handler
+    instead of adding another one.
+    """
+    app_logger = logging.getLogger("src")
+    for handler in list(app_logger.handlers):
+        if getattr(handler, "_kroki_handler", False):
+            app_logger.removeHandler(handler)
+
+    handler = logging.StreamHandler()
+    handler._kroki_handler = True  # type: ignore[attr-defined]
+    if config.get("LOG_FORMAT", "json") == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+    app_logger.addHandler(handler)
+    app_logger.setLevel(config.get("LOG_LEVEL", "INFO"))
+
+
+class RequestLog:
+    """Timings and fields of one request, logged once when it finishes.
+
+    Attributes:
+        request_id (str): ID of the request
+        fields (dict): Extra fields of the log line
+        stages (dict): Stage name to accumulated seconds
+    """
+
+    def __init__(
+        self, request_id: str, sample_rate: float = 1.0, slow_ms: float = 1000
+    ) -> None:
+        self.request_id = request_id
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.fields: Dict[str, Any] = {}
+        self.stages: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.exc_info: Any = None
+        self.quiet = False
+        self._started = time.perf_counter()
+
+    def set(self, **fields: Any) -> None:
+        """Add fields to the log line."""
+        self.fields.update(fields)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Add ``seconds`` to the time spent in stage ``name``."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as stage ``name``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def fail(self, error: str, exc_info: bool = False) -> None:
+        """Mark the request as failed; with ``exc_info``, keep the traceback."""
+        self.error = error
+        if exc_info:
+            self.exc_info = sys.exc_info()
+
+    def should_log(self, status: int, duration_ms: float) -> bool:
+        """Whether the request is logged: errors and slow ones always are."""
+        if status >= 400 or self.error is not None or duration_ms >= self.slow_ms:
+            return True
+        if self.quiet:
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def finish(self, method: str, path: str, status: int) -> bool:
+        """Emit the log line of the request if it is selected.
+
+        Returns:
+            bool: True if a line was emitted
+        """
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        if not self.should_log(status, duration_ms):
+            return False
+
+        if status >= 500 or self.exc_info is not None:
+            level = logging.ERROR
+        elif status >= 400 or self.error is not None:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+        if not logger.isEnabledFor(level):
+            return False
+
+        extra: Dict[str, Any] = {
+            "request_id": self.request_id,
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "stages_ms": {
+                name: round(seconds * 1000, 2) for name, seconds in self.stages.items()
+            },
+            "slow": duration_ms >= self.slow_ms,
+        }
+        extra.update(self.fields)
+        if self.error is not None:
+            extra["error"] = self.error
+        logger.log(
+            level,
+            "%s %s %d in %.1f ms",
+            method,
+            path,
+            status,
+            duration_ms,
+            extra=extra,
+            exc_info=self.exc_info,
+        )
+        return True
+
+
+class RequestLogger:
+    """Factory of per-request logs, shared by the application.
+
+    Attributes:
+        sample_rate (float): Fraction of successful requests logged
+        slow_ms (float): Duration from which a request is always logged
+    """
+
+    def __init__(self, sample_rate: float = 1.0, slow_ms: float = 1000) -> None:
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> "RequestLogger":
+        """Build a request logger from a Flask config mapping."""
+        return cls(
+            sample_rate=config.get("LOG_SAMPLE_RATE", 1.0),
+            slow_ms=config.get("LOG_SLOW_MS", 1000),
+        )
+
+    def start(self, request_id: Optional[str] = None) -> RequestLog:
+        """Start the log of a request, reusing a well-formed incoming ID."""
+        if not request_id or not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        return RequestLog(request_id, self.sample_rate, self.slow_ms)
+
+
+def current_request_log() -> Optional[RequestLog]:
+    """Log of the request being handled, or None outside of a request."""
+    if not has_request_context():
+        return None
+    return g.get("request_log")
+
+
+def current_request_id() -> Optional[str]:
+    """ID of the request being handled, or None outside of a request."""
+    log = current_request_log()
+    return log.request_id if log is not None else None
@@ -0,0 +1,152 @@
+"""Bounded-cost classification of Kroki responses.
+
+Kroki answers with an image on success and usually with a plain-text message
+on failure, but some renderers return an error *image* or a 400 status with a
+valid image. This module tells these cases apart by parsing only the PNG chunk
+headers and the SVG prologue within a fixed byte budget, and extracts the
+error text from response headers or PNG text chunks when present. The cost is
+independent of the image size.
+"""
+
+from dataclasses import dataclass
+from typing import Mapping, Optional
+
+from src.png_optimizer import PNG_SIGNATURE
+
+KIND_PNG = "png"
+KIND_SVG = "svg"
+KIND_UNKNOWN = "unknown"
+
+# Bytes of the body inspected at most
+PROBE_BYTES = 4096
+# Longest error message extracted from a response
+MAX_ERROR_CHARS = 200
+
+# Headers carrying the renderer's error message (PlantUML sets them on errors)
+ERROR_HEADERS = ("X-PlantUML-Diagram-Error",)
+ERROR_LINE_HEADER = "X-PlantUML-Diagram-Error-Line"
+# Keywords of PNG text chunks holding an error message
+ERROR_TEXT_KEYWORDS = frozenset({b"error", b"kroki-error", b"plantuml-error"})
+
+
+@dataclass(frozen=True)
+class ResponseCheck:
+    """Outcome of a response classification.
+
+    Attributes:
+        kind: Detected payload kind (png, svg or unknown)
+        error: Error message found in headers or metadata, if any
+    """
+
+    kind: str
+    error: Optional[str] = None
+
+    @property
+    def is_image(self) -> bool:
+        """Whether the body is a well-formed image of a known format."""
+        return self.kind != KIND_UNKNOWN
+
+
+def classify_response(
+    content: bytes,
+    output_format: str,
+    headers: Optional[Mapping[str, str]] = None,
+    budget: int = PROBE_BYTES,
+) -> ResponseCheck:
+    """Classify a Kroki response body without decoding it.
+
+    Args:
+        content: Response body
+        output_format: Requested output format (png, svg)
+        headers: Response headers (case-insensitive mapping), if any
+        budget: Maximum number of body bytes inspected
+
+    Returns:
+        ResponseCheck: Detected kind and error message
+    """
+    error = _header_error(headers) if headers is not None else None
+    head = content[:budget]
+
+    kind = KIND_UNKNOWN
+    if output_format == "png" and _is_png(head):
+        kind = KIND_PNG
+        error = error or _png_text_error(head)
+    elif output_format == "svg" and _is_svg(head):
+        kind = KIND_SVG
+    return ResponseCheck(kind=kind, error=error)
+
+
+def error_excerpt(content: bytes, limit: int = MAX_ERROR_CHARS) -> str:
+    """Readable excerpt of a non-image error body."""
+    return content[: limit * 4].decode("utf-8", errors="replace").strip()[:limit]
+
+
+def _header_error(headers: Mapping[str, str]) -> Optional[str]:
+    """Error message advertised in the response headers."""
+    for name in ERROR_HEADERS:
+        message = headers.get(name)
+        if message:
+            line = headers.get(ERROR_LINE_HEADER)
+            if line:
+                message = f"{message} (line {line})"
+            return message[:MAX_ERROR_CHARS]
+    return None
+
+
+def _is_png(head: bytes) -> bool:
+    """Whether ``head`` starts with a PNG signature and an IHDR chunk."""
+    return head.startswith(PNG_SIGNATURE) and head[12:16] == b"IHDR"
+
+
+def _png_text_error(head: bytes) -> Optional[str]:
+    """Error message from an uncompressed tEXt chunk, walking chunk headers only.
+
+    Chunk data is skipped by length, so only the headers that fall within
+    ``head`` are read, whatever the image size.
+    """
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(head):
+        length = int.from_bytes(head[offset : offset + 4], "big")
+        chunk_type = head[offset + 4 : offset + 8]
+        if chunk_type in (b"IDAT", b"IEND"):
+            # Text chunks after the image data are not worth the scan
+            return None
+        data_start = offset + 8
+        if chunk_type == b"tEXt" and data_start + length <= len(head):
+            keyword, _, text = head[data_start : data_start + length].partition(b"\0")
+            if keyword.lower() in ERROR_TEXT_KEYWORDS and text:
+                return text.decode("latin-1").strip()[:MAX_ERROR_CHARS]
+        offset = data_start + length + 4
+    return None
+
+
+def _is_svg(head: bytes) -> bool:
+    """Whether the prologue in ``head`` leads to an ``<svg`` root element.
+
+    Skips a BOM, whitespace, the XML declaration, comments, processing
+    instructions and a DOCTYPE (with internal subset).
+    """
+    position = 3 if head.startswith(b"\xef\xbb\xbf") else 0
+    size = len(head)
+    while position < size:
+        while position < size and head[position] in b" \t\r\n":
+            position += 1
+        if head.startswith(b"<?", position):
+            end = head.find(b"?>", position)
+            position = -1 if end < 0 else end + 2
+        elif head.startswith(b"<!--", position):
+            end = head.find(b"-->", position)
+            position = -1 if end < 0 else end + 3
+        elif head.startswith(b"<!DOCTYPE", position):
+            bracket = head.find(b"[", position)
+            close = head.find(b">", position)
+            if 0 <= bracket < close:
+                end = head.find(b"]", bracket)
+                close = -1 if end < 0 else head.find(b">", end)
+            position = -1 if close < 0 else close + 1
+        else:
+            tag = head[position : position + 5]
+            return tag[:4] == b"<svg" and (len(tag) < 5 or tag[4:5] in b" \t\r\n>/")
+        if position < 0:
+            return False
+    return False
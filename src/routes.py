@@ -4,14 +4,356 @@ This module contains all HTTP route handlers for the Kroki diagram generation
 web application, including the main UI, health checks, and API endpoints.
 """
 
-from flask import Blueprint, render_template, jsonify, request, Response
-from typing import Dict, Any, Tuple, Union
-from src.kroki_client import KrokiClient, KrokiError
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import requests
+from flask import (
+    Blueprint,
+    current_app,
+    g,
+    render_template,
+    jsonify,
+    request,
+    Response,
+    send_file,
+)
+from typing import Dict, Any, Iterator, Optional, Tuple, Union
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.datastructures import Headers
+from src.assets import IMMUTABLE_CACHE_CONTROL, Asset
+from src.cluster import CLIENT_HEADER, ClusterForwardError
+from src.compression import choose_encoding, decompress
+from src.ingest import (
+    InvalidBodyError,
+    Payload,
+    PayloadTooLargeError,
+    UnsupportedEncodingError,
+    close_payload,
+    payload_size,
+    read_body,
+)
+from src.kroki_client import (
+    KrokiBusyError,
+    KrokiCancelledError,
+    KrokiClient,
+    KrokiError,
+    KrokiTooComplexError,
+)
+from src.memory import current_memory_sample, size_class
+from src.permalinks import (
+    PERMALINK_CONTENT_TYPES,
+    PERMALINK_HEADER,
+    PERMALINK_SECURITY_HEADERS,
+)
+from src.preview import (
+    DEBOUNCE_HEADER,
+    PREVIEW_SEQUENCE_HEADER,
+    PREVIEW_SESSION_HEADER,
+    PreviewSessions,
+)
+from src.profiling import PROFILE_HEADER, PROFILE_ID_HEADER
+from src.render_cache import render_key
+from src.request_log import (
+    REQUEST_ID_HEADER,
+    current_request_id,
+    current_request_log,
+)
+from src.scheduler import LANE_API, LANE_INTERACTIVE, classify_client
+from src.tracing import ORDER_RECENT, ORDER_SLOWEST, chrome_trace, current_trace
 import logging
 
 main_bp = Blueprint("main", __name__)
 logger = logging.getLogger(__name__)
 
+# Signed cookie set with the index page, marking requests of the web UI
+UI_COOKIE = "kroki_ui"
+
+# Endpoints only logged when they fail or are slow, never sampled, traced
+# or profiled
+QUIET_ENDPOINTS = frozenset(
+    {
+        "main.asset",
+        "main.health",
+        "main.ready",
+        "main.metrics",
+        "main.debug_traces",
+        "main.debug_profiles",
+        "main.debug_profile",
+        "main.admin_hotkeys",
+    }
+)
+
+
+@main_bp.before_request
+def start_first_request_timer() -> None:
+    """Time the first request served by this process."""
+    startup = current_app.extensions.get("startup")
+    if startup is not None and startup.first_request():
+        g.first_request_started = time.perf_counter()
+
+
+@main_bp.after_request
+def finish_first_request_timer(response: Response) -> Response:
+    """Export the latency of the first request served by this process."""
+    started = g.pop("first_request_started", None)
+    if started is not None:
+        current_app.extensions["startup"].record(
+            "first_request", time.perf_counter() - started
+        )
+    return response
+
+
+@main_bp.before_request
+def start_request_log() -> None:
+    """Start the structured log and the trace of the request."""
+    request_logger = current_app.extensions.get("request_logger")
+    if request_logger is not None:
+        g.request_log = request_logger.start(request.headers.get(REQUEST_ID_HEADER))
+        g.request_log.quiet = request.endpoint in QUIET_ENDPOINTS
+
+    tracer = current_app.extensions.get("tracer")
+    if tracer is not None and request.endpoint not in QUIET_ENDPOINTS:
+        log = current_request_log()
+        g.trace = tracer.start(
+            log.request_id if log is not None else uuid.uuid4().hex,
+            f"{request.method} {request.path}",
+        )
+
+
+@main_bp.after_request
+def finish_request_log(response: Response) -> Response:
+    """Echo the request ID, emit the request log line and keep the trace."""
+    log = current_request_log()
+    if log is not None:
+        response.headers[REQUEST_ID_HEADER] = log.request_id
+        log.finish(request.method, request.path, response.status_code)
+
+    trace = current_trace()
+    if trace is not None:
+        trace.finish(status=response.status_code)
+        current_app.extensions["tracer"].record(trace)
+    return response
+
+
+@main_bp.before_request
+def start_profile() -> None:
+    """Profile the request if an admin asked for it or it is sampled."""
+    profiler = current_app.extensions.get("profiler")
+    if profiler is None or request.endpoint in QUIET_ENDPOINTS:
+        return
+    requested = request.headers.get(PROFILE_HEADER) == "1" and _admin_token_valid()
+    if profiler.should_profile(requested):
+        log = current_request_log()
+        g.profile = profiler.start(
+            log.request_id if log is not None else uuid.uuid4().hex
+        )
+
+
+@main_bp.after_request
+def finish_profile(response: Response) -> Response:
+    """Write the profile of the request and return its name."""
+    active = g.pop("profile", None)
+    if active is not None:
+        log = current_request_log()
+        name = current_app.extensions["profiler"].finish(
+            active,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+            request_id=log.request_id if log is not None else None,
+        )
+        response.headers[PROFILE_ID_HEADER] = name
+    return response
+
+
+@main_bp.before_request
+def start_hotkey_refresher() -> None:
+    """Start the hot diagram refresher in a new worker."""
+    refresher = current_app.extensions.get("hotkey_refresher")
+    if refresher is not None:
+        refresher.request_started()
+
+
+@main_bp.before_request
+def start_warmup() -> None:
+    """Start the render cache warm-up in a new worker."""
+    warmup = current_app.extensions.get("warmup")
+    if warmup is not None:
+        warmup.request_started()
+
+
+@main_bp.before_request
+def start_memory_sample() -> None:
+    """Count the request for the RSS monitor and measure its memory."""
+    rss_monitor = current_app.extensions.get("rss_monitor")
+    if rss_monitor is not None:
+        rss_monitor.request_started()
+    tracker = current_app.extensions.get("memory_tracker")
+    if (
+        tracker is not None
+        and request.method == "POST"
+        and request.endpoint not in QUIET_ENDPOINTS
+    ):
+        g.memory = tracker.start()
+
+
+@main_bp.after_request
+def finish_memory_sample(response: Response) -> Response:
+    """Export the memory figures of a measured request to metrics and logs."""
+    sample = g.pop("memory", None)
+    if sample is None:
+        return response
+    current_app.extensions["memory_tracker"].finish(sample)
+
+    log = current_request_log()
+    fields = log.fields if log is not None else {}
+    diagram_type = fields.get("diagram_type") or "unknown"
+    registry = current_app.extensions["metrics"]
+    registry.observe(
+        "request_memory_peak_bytes",
+        sample.peak,
+        diagram_type=diagram_type,
+        size_class=size_class(fields.get("bytes_in", 0)),
+    )
+    for stage, peak in sample.stages.items():
+        registry.observe(
+            "request_memory_stage_peak_bytes",
+            peak,
+            diagram_type=diagram_type,
+            stage=stage,
+        )
+    if log is not None:
+        log.set(memory_peak_bytes=sample.peak, memory_stages=sample.stages)
+    return response
+
+
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    """Time a stage of the current request in its log and trace."""
+    log = current_request_log()
+    trace = current_trace()
+    memory = current_memory_sample()
+    with trace.span(name) if trace is not None else nullcontext():
+        with log.stage(name) if log is not None else nullcontext():
+            with memory.stage(name) if memory is not None else nullcontext():
+                yield
+
+
+def _log_fields(**fields: Any) -> None:
+    """Add fields to the log line of the current request."""
+    log = current_request_log()
+    if log is not None:
+        log.set(**fields)
+
+
+def _log_failure(message: str, exc_info: bool = False) -> None:
+    """Record why the current request failed; it is then always logged."""
+    log = current_request_log()
+    if log is not None:
+        log.fail(message, exc_info=exc_info)
+    else:
+        logger.warning("%s", message, exc_info=exc_info)
+
+
+def _request_lane() -> str:
+    """Classify the current request into a scheduling lane.
+
+    Only the web UI gets the interactive lane: its requests carry the signed
+    cookie set when the index page is served. Other requests are API
+    traffic. The ``X-Kroki-Client`` header (``api``, ``batch``/``job``) can
+    only lower the lane. Requests forwarded by a peer, with a valid
+    signature, keep the lane the peer decided.
+
+    Returns:
+        str: Scheduling lane name
+    """
+    hint = request.headers.get(CLIENT_HEADER)
+    cluster = current_app.extensions.get("cluster")
+    if hint and cluster is not None and cluster.is_forwarded(request.headers):
+        return classify_client(hint, LANE_INTERACTIVE)
+    default = LANE_INTERACTIVE if _is_ui_request() else LANE_API
+    return classify_client(hint, default)
+
+
+def _ui_signer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.secret_key, salt=UI_COOKIE)
+
+
+def _is_ui_request() -> bool:
+    """Whether the current request carries a valid UI cookie.
+
+    A dedicated cookie rather than the Flask session: reading the session
+    adds ``Vary: Cookie``, which would keep renders out of shared caches.
+    """
+    token = request.cookies.get(UI_COOKIE)
+    if not token:
+        return False
+    try:
+        return _ui_signer().loads(token) is True
+    except BadSignature:
+        return False
+
+
+def _render(
+    kroki_client: KrokiClient, data: Dict[str, Any]
+) -> Tuple[bytes, str, Optional[str]]:
+    """Render a validated request, compressing SVG when the client accepts it.
+
+    Returns:
+        Tuple[bytes, str, Optional[str]]: Image bytes, content type and the
+            content-coding applied, or None
+    """
+    encoding = None
+    if data["output_format"] == "svg":
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding:
+        return kroki_client.generate_encoded(
+            diagram_type=data["diagram_type"],
+            output_format=data["output_format"],
+            diagram_source=data["diagram_source"],
+            encoding=encoding,
+        )
+    image_data, content_type = kroki_client.generate_diagram(
+        diagram_type=data["diagram_type"],
+        output_format=data["output_format"],
+        diagram_source=data["diagram_source"],
+    )
+    return image_data, content_type, None
+
+
+def _image_response(
+    image_data: bytes,
+    content_type: str,
+    encoding: Optional[str],
+    output_format: str,
+) -> Response:
+    """Build the image response, or 304 if the client already has these bytes."""
+    filename = f"diagram.{output_format}"
+    etag = hashlib.sha256(image_data).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(
+            image_data,
+            mimetype=content_type,
+            headers={
+                "Content-Disposition": f"inline; filename={filename}",
+                "Cache-Control": "no-cache, no-store, must-revalidate",
+            },
+        )
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    if output_format == "svg":
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
 
 @main_bp.route("/", methods=["GET", "POST"])
 def index() -> Union[str, Response]:
@@ -40,29 +382,14 @@ def index() -> Union[str, Response]:
                 )
 
             # Generate diagram using the same logic as API
-            kroki_client = KrokiClient()
-
-            # Set theme if provided
-            if diagram_theme:
-                from flask import current_app
-
-                original_theme = current_app.config.get("DIAGRAM_THEME")
-                current_app.config["DIAGRAM_THEME"] = diagram_theme
-
-            try:
-                image_data, content_type = kroki_client.generate_diagram(
-                    diagram_type=diagram_type,
-                    output_format=output_format,
-                    diagram_source=diagram_source,
-                )
-            finally:
-                # Restore original theme
-                if (
-                    diagram_theme
-                    and "original_theme" in locals()
-                    and original_theme is not None
-                ):
-                    current_app.config["DIAGRAM_THEME"] = original_theme
+            kroki_client = KrokiClient(
+                theme=diagram_theme or None, lane=_request_lane()
+            )
+            image_data, content_type = kroki_client.generate_diagram(
+                diagram_type=diagram_type,
+                output_format=output_format,
+                diagram_source=diagram_source,
+            )
 
             # Return binary response
             filename = f"diagram.{output_format}"
@@ -74,24 +401,85 @@ def index() -> Union[str, Response]:
                     "Cache-Control": "no-cache, no-store, must-revalidate",
                 },
             )
-            logger.info(f"Generated {diagram_type} diagram via fallback form")
+            _log_fields(diagram_type=diagram_type, output_format=output_format)
             return response
 
         except KrokiError as e:
-            logger.warning(f"Kroki error in fallback: {str(e)}")
+            _log_failure(f"Kroki error in fallback: {e}")
             return render_template(
                 "index.html",
                 error=f"Diagram generation failed: {str(e)}",
                 form_data=request.form,
             )
         except Exception as e:
-            logger.error(f"Unexpected error in fallback: {str(e)}")
+            _log_failure(f"Unexpected error in fallback: {e}", exc_info=True)
             return render_template(
                 "index.html", error=f"Internal error: {str(e)}", form_data=request.form
             )
 
-    # GET request - normal page load
-    return render_template("index.html")
+    # GET request - the page does not depend on the request: rendered once,
+    # then served from the page cache or answered 304
+    page = current_app.extensions["assets"].page(
+        "index.html", lambda: render_template("index.html")
+    )
+    response = _send_asset(page, "no-cache")
+    if not _is_ui_request():
+        # Renders requested from the page get the interactive lane
+        response.set_cookie(
+            UI_COOKIE,
+            _ui_signer().dumps(True),
+            max_age=current_app.permanent_session_lifetime,
+            secure=request.is_secure,
+            httponly=True,
+            samesite="Strict",
+        )
+    return response
+
+
+@main_bp.route("/assets/<path:name>")
+def asset(name: str) -> Union[Response, Tuple[Response, int]]:
+    """Serve a fingerprinted static file.
+
+    The URL changes with the file content (see ``asset_url`` in templates),
+    so the response may be cached for a year without revalidation.
+
+    Args:
+        name: Static file path with its fingerprint before the extension
+
+    Returns:
+        Union[Response, Tuple[Response, int]]: File content, precompressed
+            when the client accepts it, or 404 for unknown names
+    """
+    found = current_app.extensions["assets"].get(name)
+    if found is None:
+        return jsonify({"error": "Not found"}), 404
+    return _send_asset(found, IMMUTABLE_CACHE_CONTROL)
+
+
+def _send_asset(asset: Asset, cache_control: str) -> Response:
+    """Send a static file or cached page, or 304 if the client has it.
+
+    The precompressed variant accepted by the client is sent as is; each
+    variant has its own ETag.
+    """
+    encoding = None
+    if asset.variants:
+        encoding = choose_encoding(
+            request.headers.get("Accept-Encoding"), tuple(asset.variants)
+        )
+    data, encoding = asset.body(encoding)
+    etag = asset.fingerprint if encoding is None else f"{asset.fingerprint}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(data, content_type=asset.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    if asset.variants:
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 
 @main_bp.route("/health")
@@ -120,10 +508,6 @@ def health() -> Tuple[Dict[str, Any], int]:
             }
         }
     """
-    from flask import current_app
-    import requests
-    from datetime import datetime
-
     health_status = {
         "service": "kroki-flask-generator",
         "version": "0.1.0",
@@ -185,6 +569,223 @@ def health() -> Tuple[Dict[str, Any], int]:
     return jsonify(health_status), status_code
 
 
+@main_bp.route("/ready")
+def ready() -> Tuple[Response, int]:
+    """Readiness endpoint, ready once the render cache warm-up is over.
+
+    Unlike ``/health``, this does not check Kroki: a replica is taken into
+    rotation once its cache holds the seed corpus, or the warm-up timed out.
+
+    Returns:
+        Tuple[Response, int]: Readiness JSON, 200 when ready, 503 while the
+        warm-up runs
+    """
+    warmup = current_app.extensions.get("warmup")
+    if warmup is None:
+        return jsonify({"status": "ready", "warmup": None}), 200
+    is_ready = warmup.ready
+    body = {"status": "ready" if is_ready else "warming", "warmup": warmup.status()}
+    return jsonify(body), 200 if is_ready else 503
+
+
+@main_bp.route("/metrics")
+def metrics() -> Response:
+    """Expose in-process metrics in the Prometheus text format.
+
+    Point-in-time gauges (render cache occupancy, scheduler queues) are
+    refreshed on each scrape.
+
+    Returns:
+        Response: Metrics in text/plain exposition format
+    """
+    registry = current_app.extensions["metrics"]
+
+    cache = current_app.extensions.get("render_cache")
+    if cache is not None:
+        for name, value in cache.stats().items():
+            registry.set_gauge(f"render_cache_{name}", value)
+
+    negative_cache = current_app.extensions.get("negative_cache")
+    if negative_cache is not None:
+        for name, value in negative_cache.stats().items():
+            registry.set_gauge(f"negative_cache_{name}", value)
+
+    cluster = current_app.extensions.get("cluster")
+    if cluster is not None:
+        for node, value in cluster.loads().items():
+            registry.set_gauge("cluster_in_flight", value, node=node)
+
+    rss_monitor = current_app.extensions.get("rss_monitor")
+    if rss_monitor is not None:
+        rss_monitor.sample()
+
+    scheduler = current_app.extensions.get("scheduler")
+    if scheduler is not None:
+        stats = scheduler.stats()
+        for state in ("in_flight", "queued", "rejected"):
+            for lane, value in stats[state].items():
+                registry.set_gauge(f"scheduler_{state}", value, lane=lane)
+
+    return Response(registry.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+def _admin_token_valid() -> bool:
+    """Whether the request carries the configured admin token.
+
+    The token is read from ``Authorization: Bearer <token>`` or
+    ``X-Admin-Token``; no token is valid while ``ADMIN_TOKEN`` is unset.
+    """
+    expected = current_app.config.get("ADMIN_TOKEN", "")
+    if not expected:
+        return False
+    token = request.headers.get("X-Admin-Token", "")
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        token = authorization[len("Bearer ") :]
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+def _check_admin_token() -> Optional[Tuple[Response, int]]:
+    """Refuse access to an admin endpoint without the configured token.
+
+    Admin endpoints do not exist while ``ADMIN_TOKEN`` is unset.
+
+    Returns:
+        Optional[Tuple[Response, int]]: Error response, or None if allowed
+    """
+    if not current_app.config.get("ADMIN_TOKEN", ""):
+        return jsonify({"error": "Not found"}), 404
+    if not _admin_token_valid():
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@main_bp.route("/debug/traces")
+def debug_traces() -> Union[Response, Tuple[Response, int]]:
+    """Serve the request traces kept by this worker.
+
+    Query Parameters:
+        order: ``slowest`` (default) or ``recent``
+        limit: Maximum number of traces, all kept traces by default
+        format: ``json`` (default) or ``chrome`` for the Chrome trace event
+                format, loadable in chrome://tracing or Perfetto
+
+    Returns:
+        Union[Response, Tuple[Response, int]]: Traces as JSON
+        - 401: Missing or wrong admin token
+        - 404: ADMIN_TOKEN unset or tracing disabled
+    """
+    denied = _check_admin_token()
+    if denied is not None:
+        return denied
+    tracer = current_app.extensions.get("tracer")
+    if tracer is None:
+        return jsonify({"error": "Tracing is disabled"}), 404
+
+    order = request.args.get("order", ORDER_SLOWEST)
+    if order not in (ORDER_SLOWEST, ORDER_RECENT):
+        return jsonify({"error": "order must be slowest or recent"}), 400
+    traces = tracer.traces(order, request.args.get("limit", 0, type=int))
+    if request.args.get("format") == "chrome":
+        return jsonify(chrome_trace(traces))
+    return jsonify(
+        {
+            "order": order,
+            "recorded": tracer.recorded,
+            "traces": [trace.to_dict() for trace in traces],
+        }
+    )
+
+
+@main_bp.route("/debug/profiles")
+def debug_profiles() -> Union[Response, Tuple[Response, int]]:
+    """List the request profiles kept in the profile directory.
+
+    A request is profiled when sent with ``X-Profile: 1`` and the admin
+    token, or when picked by PROFILE_SAMPLE_RATE; its response then carries
+    the profile name in ``X-Profile-Id``.
+
+    Returns:
+        Union[Response, Tuple[Response, int]]: Profiles, most recent first
+        - 401: Missing or wrong admin token
+        - 404: ADMIN_TOKEN unset or profiling disabled
+    """
+    denied = _check_admin_token()
+    if denied is not None:
+        return denied
+    profiler = current_app.extensions.get("profiler")
+    if profiler is None:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    return jsonify({"profiles": profiler.profiles()})
+
+
+@main_bp.route("/debug/profiles/<name>")
+def debug_profile(name: str) -> Union[Response, Tuple[Response, int]]:
+    """Download a request profile.
+
+    Query Parameters:
+        format: ``prof`` (default) for the cProfile file, to open with
+                pstats or snakeviz, or ``text`` for a summary sorted by
+                cumulative time
+
+    Returns:
+        Union[Response, Tuple[Response, int]]: Profile file or summary
+        - 401: Missing or wrong admin token
+        - 404: Unknown profile, ADMIN_TOKEN unset or profiling disabled
+    """
+    denied = _check_admin_token()
+    if denied is not None:
+        return denied
+    profiler = current_app.extensions.get("profiler")
+    path = profiler.path(name) if profiler is not None else None
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    if request.args.get("format") == "text":
+        summary = profiler.summary(name)
+        if summary is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return Response(summary, mimetype="text/plain")
+    return send_file(
+        path,
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=os.path.basename(path),
+    )
+
+
+@main_bp.route("/admin/hotkeys")
+def admin_hotkeys() -> Union[Response, Tuple[Response, int]]:
+    """Serve the most requested renders seen by this worker.
+
+    Query Parameters:
+        limit: Maximum number of renders, the whole top-K by default
+
+    Returns:
+        Union[Response, Tuple[Response, int]]: Hottest renders with their
+            estimated request counts, most requested first
+        - 401: Missing or wrong admin token
+        - 404: ADMIN_TOKEN unset or hot-key tracking disabled
+    """
+    denied = _check_admin_token()
+    if denied is not None:
+        return denied
+    hotkeys = current_app.extensions.get("hotkeys")
+    if hotkeys is None:
+        return jsonify({"error": "Hot-key tracking is disabled"}), 404
+    refresher = current_app.extensions.get("hotkey_refresher")
+    return jsonify(
+        {
+            "recorded": hotkeys.recorded,
+            "capacity": hotkeys.capacity,
+            "settings": refresher.fingerprint if refresher is not None else None,
+            "hotkeys": [
+                hot.summary()
+                for hot in hotkeys.top(request.args.get("limit", 0, type=int))
+            ],
+        }
+    )
+
+
 @main_bp.route("/api/generate", methods=["POST"])
 def generate_diagram() -> Union[Response, Tuple[Dict[str, str], int]]:
     """Generate diagram via Kroki API.
@@ -199,12 +800,16 @@ def generate_diagram() -> Union[Response, Tuple[Dict[str, str], int]]:
                 "diagram_type": "mermaid|plantuml|graphviz",
                 "output_format": "png|svg",
                 "diagram_source": "diagram source code",
-                "diagram_theme": "default|light|dark|neutral|forest" (optional)
+                "diagram_theme": "default|light|dark|neutral|forest" (optional),
+                "permalink": true (optional)
             }
 
         Text (text/plain + query params):
             POST /api/generate?diagram_type=mermaid&output_format=png
             Body: raw diagram source code
+            (add ``&permalink=1`` to store the render)
+
+        Either body may be sent with ``Content-Encoding: gzip`` or ``deflate``.
 
     Returns:
         Union[Response, Tuple[Dict[str, str], int]]:
@@ -215,42 +820,76 @@ def generate_diagram() -> Union[Response, Tuple[Dict[str, str], int]]:
         Content-Type: image/png, image/svg+xml
         Content-Disposition: inline; filename=diagram.{format}
         Cache-Control: no-cache, no-store, must-revalidate
+        Content-Encoding: gzip or br for SVG when accepted by the client
+        Vary: Accept-Encoding (SVG only)
+        ETag: Digest of the response body; identical diagrams get identical
+              ETags on every node
+        X-Permalink: Path of the stored render (``/d/<id>.<format>``), when
+                     asked for and permalinks are enabled
 
     Status Codes:
         200: Diagram generated successfully
+        304: Body matches the request's If-None-Match
         400: Invalid request data or diagram syntax error
+        413: Request body larger than MAX_REQUEST_BYTES (after decompression)
+        415: Unsupported request Content-Encoding
+        422: Diagram above the configured complexity ceiling
         500: Internal server error
+        503: Render queue saturated, retry later
+
+    Scheduling:
+        Requests from the web UI (with the cookie set by the index page)
+        use the interactive lane, others the API lane. The optional
+        ``X-Kroki-Client`` header (api, batch, job) lowers the lane. With
+        cost estimation enabled, renders predicted to be slow move one lane
+        down.
+
+    Cluster:
+        With ``CLUSTER_PEERS`` set, the request is forwarded to the replica
+        owning its render identity and that replica's response is relayed.
 
     Raises:
         KrokiError: Diagram generation failures from Kroki service
     """
-    logger.info(f"Received request: Content-Type={request.content_type}")
+    body = None
     try:
+        if request.content_type not in ("application/json", "text/plain"):
+            return (
+                jsonify(
+                    {"error": "Content-Type must be application/json or text/plain"}
+                ),
+                400,
+            )
+
+        # Stream the body in, refusing oversized payloads as early as possible
+        with _stage("read"):
+            body = read_body(
+                request.stream,
+                limit=current_app.config["MAX_REQUEST_BYTES"],
+                spool_threshold=current_app.config["MAX_BYTES"],
+                content_length=request.content_length,
+                content_encoding=request.headers.get("Content-Encoding"),
+            )
+        _log_fields(bytes_in=payload_size(body))
+
         # Parse request data
         if request.content_type == "application/json":
             try:
-                data = request.get_json(force=True)
+                with _stage("parse"):
+                    data = json.loads(body if isinstance(body, bytes) else body.read())
                 if not data:
                     return jsonify({"error": "Invalid JSON data"}), 400
             except Exception:
                 return jsonify({"error": "Invalid JSON data"}), 400
-        elif request.content_type == "text/plain":
-            # Support text/plain with query parameters
+        else:
+            # Support text/plain with query parameters; the body is passed
+            # through as bytes (or a spooled file) without decoding
             data = {
-                "diagram_source": request.get_data(as_text=True),
+                "diagram_source": body,
                 "diagram_type": request.args.get("diagram_type"),
                 "output_format": request.args.get("output_format"),
+                "permalink": request.args.get("permalink") in ("1", "true"),
             }
-        else:
-            return (
-                jsonify(
-                    {"error": "Content-Type must be application/json or text/plain"}
-                ),
-                400,
-            )
-
-        # Log received data
-        logger.info(f"Parsed data keys: {list(data.keys()) if data else 'None'}")
 
         # Validate required fields
         required_fields = ["diagram_type", "output_format", "diagram_source"]
@@ -263,51 +902,382 @@ def generate_diagram() -> Union[Response, Tuple[Dict[str, str], int]]:
                 400,
             )
 
+        _log_fields(
+            diagram_type=data["diagram_type"], output_format=data["output_format"]
+        )
+
+        # In cluster mode, the replica owning the render identity renders it
+        key = _request_identity(data)
+        forwarded = _forward_to_owner(body, data, key)
+        if forwarded is not None:
+            return forwarded
+        _record_hotkey(data, key)
+
         # Generate diagram
-        kroki_client = KrokiClient()
+        kroki_client = KrokiClient(
+            theme=data.get("diagram_theme") or None, lane=_request_lane()
+        )
+        with _stage("render"):
+            image_data, content_type, encoding = _render(kroki_client, data)
 
-        # Set theme if provided
-        if "diagram_theme" in data:
-            # Temporarily set theme in current_app config for this request
-            from flask import current_app
+        # Return binary response, or 304 if the client already has these bytes
+        with _stage("respond"):
+            response = _image_response(
+                image_data, content_type, encoding, data["output_format"]
+            )
+            if data.get("permalink"):
+                path = _store_permalink(image_data, encoding, data["output_format"])
+                if path is not None:
+                    response.headers[PERMALINK_HEADER] = path
 
-            original_theme = current_app.config.get("DIAGRAM_THEME")
-            current_app.config["DIAGRAM_THEME"] = data["diagram_theme"]
+        _log_fields(bytes_out=len(image_data), encoding=encoding)
+        return response
 
-        try:
-            image_data, content_type = kroki_client.generate_diagram(
-                diagram_type=data["diagram_type"],
-                output_format=data["output_format"],
-                diagram_source=data["diagram_source"],
+    except PayloadTooLargeError as e:
+        _log_failure(f"Rejected request body: {e}")
+        return jsonify({"error": str(e)}), 413
+    except UnsupportedEncodingError as e:
+        _log_failure(f"Rejected request body: {e}")
+        return jsonify({"error": str(e)}), 415
+    except InvalidBodyError as e:
+        _log_failure(f"Rejected request body: {e}")
+        return jsonify({"error": str(e)}), 400
+    except KrokiBusyError as e:
+        _log_failure(f"Kroki busy: {e}")
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    except KrokiTooComplexError as e:
+        _log_failure(f"Rejected diagram: {e}")
+        return jsonify({"error": str(e)}), 422
+    except KrokiError as e:
+        _log_failure(f"Kroki error: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        _log_failure(f"Unexpected error in generate_diagram: {e}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        _release_cluster_slot()
+        close_payload(body)
+
+
+def _request_identity(data: Dict[str, Any]) -> Optional[str]:
+    """Render identity of a request, for cluster routing and hot-key tracking.
+
+    The identity uses the theme asked for by the client rather than the
+    effective one, so it does not change with the configured default.
+
+    Returns:
+        Optional[str]: Identity, or None if neither feature is enabled
+    """
+    if (
+        current_app.extensions.get("cluster") is None
+        and current_app.extensions.get("hotkeys") is None
+    ):
+        return None
+    return render_key(
+        data["diagram_type"],
+        data["output_format"],
+        data["diagram_source"],
+        data.get("diagram_theme") or None,
+        canonical=True,
+    )
+
+
+def _forward_to_owner(
+    body: Payload, data: Dict[str, Any], key: Optional[str]
+) -> Optional[Response]:
+    """Forward a render request to the replica owning its render identity.
+
+    Requests already forwarded by a peer, and requests owned by this
+    replica, are left to render locally; so are requests whose owner
+    cannot be reached. A forwarding header without a valid signature of a
+    peer is ignored.
+
+    Returns:
+        Optional[Response]: Response of the owning replica, or None to render
+            locally
+    """
+    cluster = current_app.extensions.get("cluster")
+    if cluster is None or cluster.is_forwarded(request.headers):
+        return None
+    metrics = current_app.extensions["metrics"]
+
+    node = cluster.acquire(key)
+    if cluster.is_local(node):
+        # Counted in the load of this replica until the render completes
+        g.cluster_node = node
+        metrics.inc("cluster_requests_total", result="local")
+        return None
+
+    try:
+        _rewind(body)
+        with _stage("forward"):
+            # The owner does not trust the client's hint: pass the lane decided here
+            headers = Headers(request.headers)
+            headers[CLIENT_HEADER] = _request_lane()
+            headers[REQUEST_ID_HEADER] = current_request_id() or ""
+            forwarded = cluster.forward(node, request.full_path, body, headers)
+    except ClusterForwardError as e:
+        logger.warning("Rendering locally, forward failed: %s", e)
+        metrics.inc("cluster_requests_total", result="forward_failed")
+        _rewind(body)
+        return None
+    finally:
+        cluster.release(node)
+
+    metrics.inc("cluster_requests_total", result="forwarded")
+    _log_fields(forwarded_to=node, bytes_out=len(forwarded.body))
+    return Response(
+        forwarded.body,
+        status=forwarded.status,
+        headers=forwarded.headers,
+        direct_passthrough=True,
+    )
+
+
+def _record_hotkey(data: Dict[str, Any], key: Optional[str]) -> None:
+    """Count a render request rendered by this replica in the hot-key sketch."""
+    hotkeys = current_app.extensions.get("hotkeys")
+    if hotkeys is None:
+        return
+    hotkeys.record(
+        key,
+        data["diagram_type"],
+        data["output_format"],
+        data["diagram_source"],
+        data.get("diagram_theme") or None,
+    )
+
+
+def _rewind(body: Payload) -> None:
+    """Rewind a spooled request body so it can be read again."""
+    if not isinstance(body, bytes):
+        body.seek(0)
+
+
+def _release_cluster_slot() -> None:
+    """Remove a local render from the cluster load, once it is finished."""
+    node = g.pop("cluster_node", None)
+    if node is not None:
+        current_app.extensions["cluster"].release(node)
+
+
+@main_bp.route("/api/preview", methods=["POST"])
+def preview_diagram() -> Union[Response, Tuple[Response, int]]:
+    """Render a diagram for the editor's live preview.
+
+    Takes the same JSON body as ``/api/generate`` and renders in the
+    interactive lane. The editor tags each request with its session ID and
+    an increasing sequence number; within a session the latest request wins.
+    A request older than one already seen is refused at once, and a request
+    superseded while it waits for a render slot is dropped before Kroki is
+    called. A request superseded while rendering completes (its render is
+    cached) but its image is not sent.
+
+    Request Headers:
+        X-Preview-Session: Random ID of the editor session (8-64 characters
+                           among letters, digits, ``-`` and ``_``)
+        X-Preview-Seq: Sequence number of the request in its session
+                       (optional; arrival order otherwise)
+
+    Response Headers:
+        X-Debounce-Ms: Delay the editor should wait after a change before
+                       sending its next preview, following the measured
+                       preview latency of the session
+        Other headers as for ``/api/generate``
+
+    Status Codes:
+        200: Diagram generated successfully
+        304: Body matches the request's If-None-Match
+        400: Invalid request data, session header or diagram syntax error
+        404: Live preview disabled
+        409: Superseded by a newer request of the same session
+        413: Request body larger than MAX_REQUEST_BYTES
+        422: Diagram above the configured complexity ceiling
+        503: Render queue saturated, retry later
+    """
+    sessions = current_app.extensions.get("preview_sessions")
+    if sessions is None:
+        return jsonify({"error": "Live preview is disabled"}), 404
+    session_id = request.headers.get(PREVIEW_SESSION_HEADER)
+    if not sessions.valid_session(session_id):
+        return (
+            jsonify({"error": f"Missing or invalid {PREVIEW_SESSION_HEADER} header"}),
+            400,
+        )
+    if request.content_type != "application/json":
+        return jsonify({"error": "Content-Type must be application/json"}), 400
+
+    started = time.perf_counter()
+    sequence = sessions.begin(
+        session_id, request.headers.get(PREVIEW_SEQUENCE_HEADER, type=int)
+    )
+    if sequence is None:
+        response, status = _preview_superseded()
+    else:
+        response, status = _preview(sessions, session_id, sequence)
+        if status in (200, 304):
+            sessions.observe(session_id, (time.perf_counter() - started) * 1000)
+    response.headers[DEBOUNCE_HEADER] = str(sessions.debounce_ms(session_id))
+    return response, status
+
+
+def _preview(
+    sessions: PreviewSessions, session_id: str, sequence: int
+) -> Tuple[Response, int]:
+    """Render the current preview request unless it gets superseded."""
+    body = None
+    try:
+        with _stage("read"):
+            body = read_body(
+                request.stream,
+                limit=current_app.config["MAX_REQUEST_BYTES"],
+                spool_threshold=current_app.config["MAX_BYTES"],
+                content_length=request.content_length,
+                content_encoding=request.headers.get("Content-Encoding"),
             )
-        finally:
-            # Restore original theme
-            if "diagram_theme" in data and original_theme is not None:
-                current_app.config["DIAGRAM_THEME"] = original_theme
+        _log_fields(bytes_in=payload_size(body))
+        try:
+            with _stage("parse"):
+                data = json.loads(body if isinstance(body, bytes) else body.read())
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return jsonify({"error": "Invalid JSON data"}), 400
 
-        # Return binary response
-        filename = f"diagram.{data['output_format']}"
-        response = Response(
-            image_data,
-            mimetype=content_type,
-            headers={
-                "Content-Disposition": f"inline; filename={filename}",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-            },
+        required_fields = ["diagram_type", "output_format", "diagram_source"]
+        missing_fields = [field for field in required_fields if not data.get(field)]
+        if missing_fields:
+            return (
+                jsonify(
+                    {"error": f"Missing required fields: {', '.join(missing_fields)}"}
+                ),
+                400,
+            )
+        _log_fields(
+            diagram_type=data["diagram_type"], output_format=data["output_format"]
         )
 
-        logger.info(
-            f"Generated {data['diagram_type']} diagram in {data['output_format']} format"
+        kroki_client = KrokiClient(
+            theme=data.get("diagram_theme") or None,
+            lane=_request_lane(),
+            cancelled=lambda: not sessions.is_current(session_id, sequence),
         )
-        return response
+        with _stage("render"):
+            image_data, content_type, encoding = _render(kroki_client, data)
+        if not sessions.is_current(session_id, sequence):
+            return _preview_superseded()
+
+        with _stage("respond"):
+            response = _image_response(
+                image_data, content_type, encoding, data["output_format"]
+            )
+        _log_fields(bytes_out=len(image_data), encoding=encoding)
+        _count_preview("rendered")
+        return response, response.status_code
 
+    except KrokiCancelledError:
+        return _preview_superseded()
+    except PayloadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+    except (UnsupportedEncodingError, InvalidBodyError) as e:
+        return jsonify({"error": str(e)}), 400
+    except KrokiBusyError as e:
+        _log_failure(f"Kroki busy: {e}")
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    except KrokiTooComplexError as e:
+        return jsonify({"error": str(e)}), 422
     except KrokiError as e:
-        logger.warning(f"Kroki error: {str(e)}")
+        # Syntax errors are expected while typing: not logged as failures
+        _count_preview("error")
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Unexpected error in generate_diagram: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        import traceback
-
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        _log_failure(f"Unexpected error in preview_diagram: {e}", exc_info=True)
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        close_payload(body)
+
+
+def _preview_superseded() -> Tuple[Response, int]:
+    """Response for a preview request replaced by a newer one."""
+    _count_preview("superseded")
+    _log_fields(preview="superseded")
+    return jsonify({"error": "Superseded by a newer preview"}), 409
+
+
+def _count_preview(result: str) -> None:
+    """Count a preview request by outcome."""
+    current_app.extensions["metrics"].inc("preview_requests_total", result=result)
+
+
+def _store_permalink(
+    image_data: bytes, encoding: Optional[str], output_format: str
+) -> Optional[str]:
+    """Store a render for its permalink.
+
+    Returns:
+        Optional[str]: Permalink path, or None if permalinks are disabled or
+            the render could not be stored
+    """
+    store = current_app.extensions.get("permalinks")
+    if store is None:
+        return None
+    if encoding:
+        image_data = decompress(image_data, encoding)
+    try:
+        permalink = store.put(image_data, output_format)
+    except (OSError, ValueError) as e:
+        # The render itself succeeded: serve it without permalink
+        logger.warning("Could not store permalink: %s", e)
+        return None
+    current_app.extensions["metrics"].inc(
+        "permalink_stores_total", output_format=output_format
+    )
+    _log_fields(permalink=permalink)
+    return f"/d/{permalink}.{output_format}"
+
+
+@main_bp.route("/d/<permalink>.<output_format>")
+def permalink(
+    permalink: str, output_format: str
+) -> Union[Response, Tuple[Response, int]]:
+    """Serve a stored render by permalink.
+
+    The bytes behind a permalink never change (the ID is derived from them),
+    so the response may be cached for a year. Kroki is never called. The
+    render is sandboxed by its Content-Security-Policy, so links or scripts
+    in a stored SVG do not run on this origin.
+
+    Args:
+        permalink: ID returned in ``X-Permalink`` by ``/api/generate``
+        output_format: Output format of the render (png, svg)
+
+    Returns:
+        Union[Response, Tuple[Response, int]]: Stored render, 304 if the
+            client already has it, or 404 if unknown, expired or disabled
+    """
+    store = current_app.extensions.get("permalinks")
+    data = store.get(permalink, output_format) if store is not None else None
+    current_app.extensions["metrics"].inc(
+        "permalink_requests_total", result="hit" if data is not None else "miss"
+    )
+    if data is None:
+        return jsonify({"error": "Diagram not found"}), 404
+
+    if request.if_none_match.contains(permalink):
+        response = Response(status=304)
+    else:
+        response = Response(
+            data,
+            mimetype=PERMALINK_CONTENT_TYPES[output_format],
+            headers={
+                "Content-Disposition": f"inline; filename={permalink}.{output_format}"
+            },
+        )
+    response.set_etag(permalink)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.headers.update(PERMALINK_SECURITY_HEADERS)
+    return response
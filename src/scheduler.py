@@ -0,0 +1,259 @@
+"""Priority scheduling for upstream Kroki renders.
+
+This module provides a small in-process scheduler that sits in front of the
+Kroki HTTP calls. Requests are classified into lanes (interactive UI renders,
+scripted API calls and batch jobs); interactive renders get reserved upstream
+capacity and always jump ahead of queued bulk work.
+"""
+
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+LANE_INTERACTIVE = "interactive"
+LANE_API = "api"
+LANE_BATCH = "batch"
+
+LANES = (LANE_INTERACTIVE, LANE_API, LANE_BATCH)
+
+# Lower value = served first
+LANE_PRIORITY: Dict[str, int] = {
+    LANE_INTERACTIVE: 0,
+    LANE_API: 1,
+    LANE_BATCH: 2,
+}
+
+# Values accepted in the X-Kroki-Client request header
+CLIENT_LANES: Dict[str, str] = {
+    "ui": LANE_INTERACTIVE,
+    "interactive": LANE_INTERACTIVE,
+    "api": LANE_API,
+    "batch": LANE_BATCH,
+    "job": LANE_BATCH,
+}
+
+
+def classify_client(client_hint: Optional[str], default: str = LANE_API) -> str:
+    """Map a client hint (e.g. the X-Kroki-Client header) to a lane.
+
+    The hint is chosen by the caller, so it can only lower the priority of
+    ``default``: sending ``ui`` does not give a script interactive capacity.
+
+    Args:
+        client_hint: Raw hint sent by the caller, case-insensitive
+        default: Lane decided by the server, used when the hint is missing,
+            unknown or of higher priority
+
+    Returns:
+        str: One of LANES
+    """
+    if not client_hint:
+        return default
+    lane = CLIENT_LANES.get(client_hint.strip().lower(), default)
+    return lane if LANE_PRIORITY[lane] > LANE_PRIORITY[default] else default
+
+
+class SchedulerBusyError(Exception):
+    """Raised when a render cannot get an upstream slot.
+
+    Either the wait queue is full, the request was evicted by higher priority
+    work, or no slot became free before the queue timeout.
+    """
+
+    pass
+
+
+class _Waiter:
+    """Queued acquisition request."""
+
+    __slots__ = ("lane", "granted", "rejected")
+
+    def __init__(self, lane: str) -> None:
+        self.lane = lane
+        self.granted = False
+        self.rejected = False
+
+
+class PriorityScheduler:
+    """Bounded-concurrency scheduler with priority lanes.
+
+    At most ``max_concurrency`` renders run upstream at the same time.
+    ``reserved_interactive`` of those slots can only be used by the
+    interactive lane, so bulk traffic can never starve the web UI. Waiting
+    requests are served in lane priority order (FIFO within a lane). When the
+    queue is full, an incoming interactive request evicts the most recently
+    queued bulk request instead of being rejected.
+
+    Attributes:
+        max_concurrency (int): Total number of concurrent upstream renders
+        reserved_interactive (int): Slots reserved for the interactive lane
+        max_queue (int): Maximum number of waiting requests
+        queue_timeout (float): Maximum time in seconds to wait for a slot
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        reserved_interactive: int = 2,
+        max_queue: int = 32,
+        queue_timeout: float = 10.0,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        # Bulk lanes always keep at least one slot
+        self.reserved_interactive = max(
+            0, min(reserved_interactive, max_concurrency - 1)
+        )
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._in_flight: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._completed: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._rejected: Dict[str, int] = {lane: 0 for lane in LANES}
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> "PriorityScheduler":
+        """Build a scheduler from a Flask config mapping."""
+        return cls(
+            max_concurrency=config.get("SCHEDULER_MAX_CONCURRENCY", 8),
+            reserved_interactive=config.get("SCHEDULER_RESERVED_INTERACTIVE", 2),
+            max_queue=config.get("SCHEDULER_MAX_QUEUE", 32),
+            queue_timeout=config.get("SCHEDULER_QUEUE_TIMEOUT", 10.0),
+        )
+
+    @contextmanager
+    def slot(self, lane: str, timeout: Optional[float] = None) -> Iterator[None]:
+        """Hold an upstream slot for the duration of the ``with`` block.
+
+        Args:
+            lane: Lane of the request (see LANES)
+            timeout: Maximum wait in seconds, defaults to ``queue_timeout``
+
+        Raises:
+            SchedulerBusyError: If no slot could be obtained
+        """
+        self.acquire(lane, timeout)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def acquire(self, lane: str, timeout: Optional[float] = None) -> None:
+        """Block until a slot is available for ``lane``.
+
+        Raises:
+            SchedulerBusyError: If the queue is full, the request was evicted
+                or the timeout expired
+        """
+        if lane not in LANE_PRIORITY:
+            raise ValueError(f"Unknown lane: {lane}")
+        timeout = self.queue_timeout if timeout is None else timeout
+
+        priority = LANE_PRIORITY[lane]
+        with self._cond:
+            # Fast path: nothing of equal or higher priority is waiting
+            if self._can_run(lane) and all(item[0] > priority for item in self._heap):
+                self._in_flight[lane] += 1
+                return
+
+            if len(self._heap) >= self.max_queue and not self._evict_for(lane):
+                self._rejected[lane] += 1
+                raise SchedulerBusyError("Render queue is full")
+
+            waiter = _Waiter(lane)
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+            self._dispatch()
+
+            granted = self._cond.wait_for(
+                lambda: waiter.granted or waiter.rejected, timeout=timeout
+            )
+            if waiter.granted:
+                return
+
+            if not granted:
+                # Timed out: withdraw from the queue
+                waiter.rejected = True
+                self._heap = [item for item in self._heap if item[2] is not waiter]
+                heapq.heapify(self._heap)
+                self._rejected[lane] += 1
+                raise SchedulerBusyError("Timed out waiting for a render slot")
+
+            self._rejected[lane] += 1
+            raise SchedulerBusyError("Preempted by higher priority renders")
+
+    def release(self, lane: str) -> None:
+        """Return a slot taken by :meth:`acquire`."""
+        with self._cond:
+            self._in_flight[lane] -= 1
+            self._completed[lane] += 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of scheduler state, for health and metrics reporting."""
+        with self._cond:
+            queued = {lane: 0 for lane in LANES}
+            for _, _, waiter in self._heap:
+                queued[waiter.lane] += 1
+            return {
+                "max_concurrency": self.max_concurrency,
+                "reserved_interactive": self.reserved_interactive,
+                "in_flight": dict(self._in_flight),
+                "queued": queued,
+                "completed": dict(self._completed),
+                "rejected": dict(self._rejected),
+            }
+
+    def _can_run(self, lane: str) -> bool:
+        """Whether a request of ``lane`` may start now (lock held)."""
+        total = sum(self._in_flight.values())
+        if total >= self.max_concurrency:
+            return False
+        if lane == LANE_INTERACTIVE:
+            return True
+        bulk = total - self._in_flight[LANE_INTERACTIVE]
+        return bulk < self.max_concurrency - self.reserved_interactive
+
+    def _dispatch(self) -> None:
+        """Grant free slots to queued requests in priority order (lock held)."""
+        if not self._heap:
+            return
+        remaining = []
+        woke = False
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            waiter = item[2]
+            if waiter.rejected:
+                continue
+            if self._can_run(waiter.lane):
+                waiter.granted = True
+                self._in_flight[waiter.lane] += 1
+                woke = True
+            else:
+                remaining.append(item)
+        for item in remaining:
+            heapq.heappush(self._heap, item)
+        if woke:
+            self._cond.notify_all()
+
+    def _evict_for(self, lane: str) -> bool:
+        """Evict the newest queued request of a lower priority lane (lock held).
+
+        Returns:
+            bool: True if a queue position was freed
+        """
+        priority = LANE_PRIORITY[lane]
+        victims = [item for item in self._heap if item[0] > priority]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda item: (item[0], item[1]))
+        victim[2].rejected = True
+        self._heap.remove(victim)
+        heapq.heapify(self._heap)
+        self._cond.notify_all()
+        return True
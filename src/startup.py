@@ -0,0 +1,175 @@
+"""Application boot path for pre-forking servers.
+
+Under gunicorn with ``preload_app`` (see ``gunicorn.conf.py``), the master
+imports the application and runs :func:`src.main.create_app` once: heavy
+modules, the configuration, compiled regular expressions and the static
+asset table are loaded before the workers are forked and shared with them
+copy-on-write. :func:`preload` then finishes the shared read-only state in
+the master: it compiles the templates, runs the startup warm-up so that the
+workers inherit a warm render cache, waits for background jobs so that no
+thread holds a lock across the fork, and freezes the garbage collector so
+that collections in the workers do not touch (and copy) the shared objects.
+
+After each fork, :func:`init_worker` creates the per-worker resources: the
+background threads of the RSS monitor, the hot diagram refresher and the
+warm-up (when it did not run in the master). Connection pools detect the
+fork themselves.
+
+Boot times are exported as gauges: ``startup_create_app_seconds``,
+``startup_preload_seconds``, ``startup_worker_init_seconds`` and
+``startup_first_request_seconds``, the latency of the first request served
+by a process. :func:`measure_startup` benchmarks a cold start in a fresh
+interpreter; ``python -m src.startup`` prints it, and the test suite checks
+it against :data:`STARTUP_BUDGET`.
+"""
+
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from src.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for each phase of a cold start, measured by measure_startup
+STARTUP_BUDGET: Dict[str, float] = {
+    "import": 2.0,
+    "create_app": 0.5,
+    "first_request": 0.5,
+    "total": 4.0,
+}
+
+# Extensions running a background thread in each worker
+WORKER_THREADS = ("rss_monitor", "hotkey_refresher", "warmup")
+
+_BENCHMARK = """
+import json, sys, time
+started = time.perf_counter()
+from src.main import create_app
+imported = time.perf_counter()
+app = create_app(sys.argv[1])
+created = time.perf_counter()
+status = app.test_client().get("/").status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "create_app": created - imported,
+    "first_request": served - created,
+    "status": status,
+}))
+"""
+
+
+class StartupTimer:
+    """Exports the boot times of the application and its workers.
+
+    Attributes:
+        metrics (Metrics): Registry receiving the gauges, or None
+    """
+
+    def __init__(self, metrics: Optional[Metrics] = None) -> None:
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def record(self, phase: str, seconds: float) -> None:
+        """Export the duration of a boot phase."""
+        logger.debug("Startup phase %s took %.3fs", phase, seconds)
+        if self.metrics is not None:
+            self.metrics.set_gauge(f"startup_{phase}_seconds", seconds)
+
+    def first_request(self) -> bool:
+        """Whether the calling request is the first one of this process."""
+        if self._pid == os.getpid():
+            return False
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            return True
+
+
+def preload(app: Any) -> None:
+    """Finish the shared state of ``app`` in the master, before forking.
+
+    Args:
+        app: Application created by :func:`src.main.create_app`
+    """
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    warmup = app.extensions.get("warmup")
+    if warmup is not None:
+        warmup.run(drain=True)
+    png_optimizer = app.extensions.get("png_optimizer")
+    if png_optimizer is not None:
+        png_optimizer.drain()
+
+    gc.collect()
+    gc.freeze()
+    _record(app, "preload", time.perf_counter() - started)
+
+
+def init_worker(app: Any) -> None:
+    """Create the per-worker resources of ``app`` in a new worker."""
+    started = time.perf_counter()
+    for name in WORKER_THREADS:
+        extension = app.extensions.get(name)
+        if extension is not None:
+            extension.start()
+    _record(app, "worker_init", time.perf_counter() - started)
+
+
+def measure_startup(config_name: str = "testing") -> Dict[str, float]:
+    """Benchmark a cold start of the application in a fresh interpreter.
+
+    Measures the import of the application, :func:`src.main.create_app` and
+    a first request to the index page, which needs no Kroki service.
+
+    Args:
+        config_name: Configuration to start the application with
+
+    Returns:
+        Dict[str, float]: Seconds per phase, and ``total`` including the
+            interpreter start
+
+    Raises:
+        RuntimeError: If the application fails to start
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", _BENCHMARK, config_name],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    total = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Application failed to start: {result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    if timings.pop("status") != 200:
+        raise RuntimeError("First request to the index page failed")
+    timings["total"] = total
+    return timings
+
+
+def _record(app: Any, phase: str, seconds: float) -> None:
+    timer = app.extensions.get("startup")
+    if timer is not None:
+        timer.record(phase, seconds)
+
+
+if __name__ == "__main__":
+    timings = measure_startup(sys.argv[1] if len(sys.argv) > 1 else "testing")
+    for phase, seconds in timings.items():
+        budget = STARTUP_BUDGET.get(phase)
+        print(f"{phase:15} {seconds * 1000:8.1f} ms  (budget {budget * 1000:.0f} ms)")
@@ -0,0 +1,136 @@
+"""Deterministic normalisation of generated SVG identifiers.
+
+Some renderers embed random or time-based identifiers in their SVG output:
+Mermaid prefixes every id, marker and CSS selector with ``mermaid-<timestamp>``
+and PlantUML names its filters and gradients with random strings. Two renders
+of the same diagram therefore differ byte-wise, which defeats deduplication,
+CDN caching and ETag comparison across nodes.
+
+This module rewrites such identifiers, and every reference to them, to values
+derived from the document content with the identifiers masked out, so that
+identical diagrams produce identical bytes. Only ``id`` attributes,
+``url(#...)`` and ``href="#..."`` references and ``<style>`` blocks are
+rewritten: labels mentioning an identifier are left as they are.
+"""
+
+import hashlib
+import re
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+# Identifiers known to be generated per render
+_MERMAID_ID_RE = re.compile(r"\bmermaid-(?:svg-)?[0-9A-Za-z]*\d[0-9A-Za-z]*")
+_TIMESTAMP_ID_RE = re.compile(r"[A-Za-z_][\w.-]*?\d{10,}")
+# Paint servers and effects are only referenced by id, PlantUML names them randomly
+_DEF_ID_RE = re.compile(
+    r'<(?:filter|linearGradient|radialGradient|pattern|clipPath|mask)\b[^>]*?\sid="([^"]+)"'
+)
+# Random PlantUML ids mix lower-case letters and digits (``f1ll8dhagyoxf6``);
+# short or structured ids such as Graphviz ``l_0`` are deterministic
+_RANDOM_ID_RE = re.compile(r"[a-z](?=[a-z]*\d)[a-z0-9]{9,}")
+_ID_ATTR_RE = re.compile(r'\sid="([^"]+)"')
+# Places where identifiers are defined or referenced, the name in group 1-4
+_ID_CONTEXT_RE = re.compile(
+    r'\sid="([^"]*)"|url\(#([^)]*)\)|href="#([^"]*)"|<style\b[^>]*>(.*?)</style>',
+    re.DOTALL,
+)
+# Characters that may continue an identifier token
+_TOKEN_TAIL = "[0-9A-Za-z]"
+
+
+class SvgNormalizer:
+    """Rewrite generated SVG identifiers to content-derived values.
+
+    Attributes:
+        digest_size (int): Hex digits of the content digest used in new ids
+    """
+
+    def __init__(self, digest_size: int = 10) -> None:
+        self.digest_size = digest_size
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["SvgNormalizer"]:
+        """Build a normalizer from a Flask config mapping, or None if disabled."""
+        if not config.get("SVG_NORMALIZE", True):
+            return None
+        return cls()
+
+    def normalize(self, svg: bytes) -> bytes:
+        """Return ``svg`` with generated identifiers made deterministic.
+
+        Args:
+            svg: UTF-8 encoded SVG document
+
+        Returns:
+            bytes: Normalised document, or ``svg`` unchanged if it contains
+                  no generated identifiers or is not valid UTF-8
+        """
+        try:
+            text = svg.decode("utf-8")
+        except UnicodeDecodeError:
+            return svg
+
+        tokens = generated_ids(text)
+        if not tokens:
+            return svg
+
+        # Longest first so that a token never matches inside a longer one
+        pattern = re.compile(
+            "|".join(
+                rf"(?<![\w-]){re.escape(token)}(?!{_TOKEN_TAIL})"
+                for token in sorted(tokens, key=len, reverse=True)
+            )
+        )
+        masked = _sub_ids(pattern, lambda m: "\0", text)
+        digest = hashlib.sha256(masked.encode("utf-8")).hexdigest()[: self.digest_size]
+
+        replacements = {
+            token: _replacement(token, digest, index)
+            for index, token in enumerate(tokens)
+        }
+        normalized = _sub_ids(pattern, lambda m: replacements[m.group(0)], text)
+        return normalized.encode("utf-8")
+
+
+def generated_ids(text: str) -> List[str]:
+    """List the generated identifier tokens of an SVG document.
+
+    Args:
+        text: SVG document
+
+    Returns:
+        List[str]: Distinct tokens in order of first appearance
+    """
+    found: Dict[str, int] = {}
+    for match in _ID_ATTR_RE.finditer(text):
+        value = match.group(1)
+        for regex in (_MERMAID_ID_RE, _TIMESTAMP_ID_RE):
+            for token in regex.findall(value):
+                found.setdefault(token, match.start(1))
+    for match in _DEF_ID_RE.finditer(text):
+        if _RANDOM_ID_RE.fullmatch(match.group(1)):
+            found.setdefault(match.group(1), match.start(1))
+
+    return sorted(found, key=found.get)
+
+
+def _sub_ids(pattern: re.Pattern, repl: Callable[[re.Match], str], text: str) -> str:
+    """Apply ``pattern.sub(repl)`` to the identifier contexts of ``text`` only."""
+
+    def sub_context(match: re.Match) -> str:
+        group = match.lastindex
+        start, end = match.span(group)
+        inner = pattern.sub(repl, match.group(group))
+        return (
+            match.string[match.start() : start]
+            + inner
+            + match.string[end : match.end()]
+        )
+
+    return _ID_CONTEXT_RE.sub(sub_context, text)
+
+
+def _replacement(token: str, digest: str, index: int) -> str:
+    """Deterministic replacement for the ``index``-th generated token."""
+    if token.startswith("mermaid-"):
+        return f"mermaid-{digest}{index}"
+    return f"id{digest}{index}"
@@ -0,0 +1,196 @@
+"""Lossless SVG minification for Kroki renders.
+
+This module implements a set of conservative, text-level optimisation passes
+for the SVG documents returned by Kroki. Mermaid output in particular carries
+large inline ``<style>`` blocks, formatting whitespace, comments and excess
+float precision. Content whose whitespace is significant (``<text>``,
+``<foreignObject>``, ``<script>``) is never touched, and a result that no
+longer parses as XML is discarded in favour of the original document.
+"""
+
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Iterable, Mapping, Optional, Tuple
+
+PASS_COMMENTS = "comments"
+PASS_DOCTYPE = "doctype"
+PASS_METADATA = "metadata"
+PASS_WHITESPACE = "whitespace"
+PASS_STYLE = "style"
+PASS_PRECISION = "precision"
+PASS_EMPTY_ATTRS = "empty_attrs"
+
+PASSES: Tuple[str, ...] = (
+    PASS_COMMENTS,
+    PASS_DOCTYPE,
+    PASS_METADATA,
+    PASS_WHITESPACE,
+    PASS_STYLE,
+    PASS_PRECISION,
+    PASS_EMPTY_ATTRS,
+)
+
+# Regions copied verbatim (except <style>, which gets the CSS pass)
+_PROTECTED_RE = re.compile(
+    r"(<!\[CDATA\[.*?\]\]>"
+    r"|<style\b[^>]*>.*?</style>"
+    r"|<script\b.*?</script>"
+    r"|<foreignObject\b.*?</foreignObject>"
+    r"|<text\b.*?</text>)",
+    re.S,
+)
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.S)
+_DOCTYPE_RE = re.compile(r"<!DOCTYPE[^\[>]*>", re.I)
+_METADATA_RE = re.compile(r"<metadata\b[^>]*/>|<metadata\b.*?</metadata>", re.S)
+_INTER_TAG_WS_RE = re.compile(r">\s+<")
+_TAG_RE = re.compile(r"<[A-Za-z][^>]*>")
+_TAG_WS_RE = re.compile(r"\s{2,}")
+_EMPTY_ATTR_RE = re.compile(r'\s(?:class|style|id)=""')
+
+# Attributes whose numeric content is purely geometric
+_GEOMETRY_ATTRS = (
+    "d|points|transform|x|y|x1|x2|y1|y2|cx|cy|r|rx|ry|width|height|viewBox"
+    "|stroke-width|dx|dy|offset"
+)
+_GEOMETRY_ATTR_RE = re.compile(r"(\s(?:" + _GEOMETRY_ATTRS + r')=")([^"]*)(")')
+_FLOAT_RE = re.compile(r"-?\d*\.\d+(?:[eE][-+]?\d+)?")
+
+_STYLE_RE = re.compile(r"(<style\b[^>]*>)(.*?)(</style>)", re.S)
+_CSS_STRING_RE = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')")
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+_CSS_WS_RE = re.compile(r"\s+")
+_CSS_PUNCT_RE = re.compile(r"\s*([{};,])\s*")
+_CSS_COLON_RE = re.compile(r":\s+")
+
+
+class SvgOptimizer:
+    """Configurable SVG minifier.
+
+    Attributes:
+        passes (frozenset): Enabled optimisation passes (see PASSES)
+        precision (int): Decimal places kept in geometric attributes
+    """
+
+    def __init__(
+        self, passes: Optional[Iterable[str]] = None, precision: int = 3
+    ) -> None:
+        passes = PASSES if passes is None else tuple(passes)
+        unknown = set(passes) - set(PASSES)
+        if unknown:
+            raise ValueError(f"Unknown SVG optimisation passes: {sorted(unknown)}")
+        self.passes = frozenset(passes)
+        self.precision = precision
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["SvgOptimizer"]:
+        """Build an optimizer from a Flask config mapping, or None if disabled."""
+        if not config.get("SVG_OPTIMIZE", False):
+            return None
+        passes = config.get("SVG_OPTIMIZE_PASSES") or ""
+        return cls(
+            passes=[p.strip() for p in passes.split(",") if p.strip()] or None,
+            precision=config.get("SVG_PRECISION", 3),
+        )
+
+    def optimize(self, svg: bytes) -> bytes:
+        """Return a smaller, equivalent SVG document.
+
+        Args:
+            svg: UTF-8 encoded SVG document
+
+        Returns:
+            bytes: Optimised document, or ``svg`` unchanged if it cannot be
+                  optimised safely
+        """
+        try:
+            text = svg.decode("utf-8")
+        except UnicodeDecodeError:
+            return svg
+
+        if PASS_DOCTYPE in self.passes:
+            text = _DOCTYPE_RE.sub("", text, count=1)
+
+        parts = _PROTECTED_RE.split(text)
+        # re.split with one group: even indexes are free text, odd are protected
+        for index in range(0, len(parts), 2):
+            parts[index] = self._optimize_markup(parts[index])
+        if PASS_STYLE in self.passes:
+            for index in range(1, len(parts), 2):
+                parts[index] = _STYLE_RE.sub(self._minify_style_match, parts[index])
+
+        result = "".join(parts).strip().encode("utf-8")
+        if len(result) >= len(svg) or not _is_well_formed(result):
+            return svg
+        return result
+
+    def _optimize_markup(self, markup: str) -> str:
+        """Apply markup-level passes to an unprotected region."""
+        if PASS_COMMENTS in self.passes:
+            markup = _COMMENT_RE.sub("", markup)
+        if PASS_METADATA in self.passes:
+            markup = _METADATA_RE.sub("", markup)
+        if PASS_WHITESPACE in self.passes:
+            markup = _INTER_TAG_WS_RE.sub("><", markup)
+            markup = _TAG_RE.sub(
+                lambda m: _TAG_WS_RE.sub(" ", m.group(0)).replace(" >", ">"), markup
+            )
+        if PASS_PRECISION in self.passes:
+            markup = _GEOMETRY_ATTR_RE.sub(self._round_attr_match, markup)
+        if PASS_EMPTY_ATTRS in self.passes:
+            markup = _EMPTY_ATTR_RE.sub("", markup)
+        return markup
+
+    def _round_attr_match(self, match: "re.Match[str]") -> str:
+        """Round the floats of one geometric attribute value."""
+        value = _FLOAT_RE.sub(self._round_float_match, match.group(2))
+        return match.group(1) + value + match.group(3)
+
+    def _round_float_match(self, match: "re.Match[str]") -> str:
+        """Round one float literal to the configured precision."""
+        literal = match.group(0)
+        rounded = f"{float(literal):.{self.precision}f}".rstrip("0").rstrip(".")
+        if rounded in ("", "-", "-0"):
+            rounded = "0"
+        if "." not in rounded and match.string.startswith(".", match.end()):
+            # "0.0001.5" is two numbers; "0.5" would be one
+            rounded += " "
+        return rounded if len(rounded) < len(literal) else literal
+
+    def _minify_style_match(self, match: "re.Match[str]") -> str:
+        """Minify the CSS of one <style> element."""
+        css = match.group(2)
+        cdata = css.strip().startswith("<![CDATA[")
+        if cdata:
+            css = css.strip()[len("<![CDATA[") : -len("]]>")]
+        css = minify_css(css)
+        if cdata:
+            css = f"<![CDATA[{css}]]>"
+        return match.group(1) + css + match.group(3)
+
+
+def minify_css(css: str) -> str:
+    """Minify a CSS stylesheet without touching string literals.
+
+    Args:
+        css: Stylesheet text
+
+    Returns:
+        str: Equivalent stylesheet with comments and redundant whitespace removed
+    """
+    pieces = _CSS_STRING_RE.split(css)
+    for index in range(0, len(pieces), 2):
+        piece = _CSS_COMMENT_RE.sub("", pieces[index])
+        piece = _CSS_WS_RE.sub(" ", piece)
+        piece = _CSS_PUNCT_RE.sub(r"\1", piece)
+        piece = _CSS_COLON_RE.sub(":", piece)
+        pieces[index] = piece.replace(";}", "}")
+    return "".join(pieces).strip()
+
+
+def _is_well_formed(document: bytes) -> bool:
+    """Whether ``document`` parses as XML."""
+    try:
+        ET.fromstring(document)
+    except ET.ParseError:
+        return False
+    return True
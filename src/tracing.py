@@ -0,0 +1,257 @@
+"""Lightweight in-process request tracing.
+
+A :class:`Trace` records the spans of one request (parse, validate,
+preprocess, cache lookup, queue, upstream wait and receive, post-process,
+respond) with monotonic timestamps relative to the start of the request.
+Finished traces are kept in memory by a :class:`Tracer`: the slowest ones in
+a bounded min-heap and the most recent ones in a ring buffer, so tail
+latency can be inspected without an external collector.
+
+Traces are served as JSON by ``/debug/traces``, or in the Chrome trace event
+format understood by ``chrome://tracing`` and Perfetto.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from flask import g, has_request_context
+
+ORDER_SLOWEST = "slowest"
+ORDER_RECENT = "recent"
+
+
+@dataclass
+class Span:
+    """A timed operation within a trace.
+
+    Attributes:
+        name: Operation name, e.g. ``upstream.wait``
+        start: Start in seconds from the beginning of the trace
+        duration: Duration in seconds
+        span_id: Identifier of the span within its trace
+        parent_id: Identifier of the enclosing span, 0 for top-level spans
+        attributes: Extra details (sizes, cache outcome, lane...)
+    """
+
+    name: str
+    start: float
+    duration: float = 0.0
+    span_id: int = 0
+    parent_id: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON representation with times in milliseconds."""
+        document: Dict[str, Any] = {
+            "name": self.name,
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "start_ms": round(self.start * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.attributes:
+            document["attributes"] = self.attributes
+        return document
+
+
+class Trace:
+    """Spans of one request.
+
+    Spans opened with :meth:`span` nest: a span opened inside another one
+    becomes its child. Spans measured elsewhere are added with
+    :meth:`add_span`, under the span currently open.
+
+    Attributes:
+        trace_id (str): ID of the trace, the request ID
+        name (str): Name of the traced operation, e.g. ``POST /api/generate``
+        started_at (float): Wall-clock start time (epoch seconds)
+        duration (float): Total duration in seconds, set by :meth:`finish`
+        attributes (dict): Request-level details (status...)
+    """
+
+    def __init__(self, trace_id: str, name: str) -> None:
+        self.trace_id = trace_id
+        self.name = name
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.attributes: Dict[str, Any] = {}
+        self.spans: List[Span] = []
+        self._origin = time.perf_counter()
+        self._ids = itertools.count(1)
+        self._open: List[int] = []
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Time the enclosed block as a span named ``name``."""
+        span = self._new_span(name, time.perf_counter(), attributes)
+        self._open.append(span.span_id)
+        try:
+            yield span
+        finally:
+            self._open.pop()
+            span.duration = time.perf_counter() - self._origin - span.start
+
+    def add_span(
+        self, name: str, started: float, ended: float, **attributes: Any
+    ) -> Span:
+        """Add a span measured with ``time.perf_counter()`` timestamps."""
+        span = self._new_span(name, started, attributes)
+        span.duration = max(0.0, ended - started)
+        return span
+
+    def finish(self, **attributes: Any) -> None:
+        """Close the trace and record request-level attributes."""
+        self.duration = time.perf_counter() - self._origin
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON representation of the trace and its spans."""
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def to_chrome_events(self, tid: int = 1, pid: int = 1) -> List[Dict[str, Any]]:
+        """Complete ("X") events in the Chrome trace event format.
+
+        Args:
+            tid: Thread row of the trace in the viewer; traces exported
+                together get distinct rows so that they do not overlap
+            pid: Process ID shown by the viewer
+        """
+        origin_us = self.started_at * 1_000_000
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": self.trace_id},
+            },
+            {
+                "name": self.name,
+                "ph": "X",
+                "pid": pid,
+                "tid": tid,
+                "ts": round(origin_us, 1),
+                "dur": round(self.duration * 1_000_000, 1),
+                "args": dict(self.attributes, trace_id=self.trace_id),
+            },
+        ]
+        for span in self.spans:
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": round(origin_us + span.start * 1_000_000, 1),
+                    "dur": round(span.duration * 1_000_000, 1),
+                    "args": span.attributes,
+                }
+            )
+        return events
+
+    def _new_span(self, name: str, started: float, attributes: Dict[str, Any]) -> Span:
+        """Create and register a span starting at ``started``."""
+        span = Span(
+            name=name,
+            start=started - self._origin,
+            span_id=next(self._ids),
+            parent_id=self._open[-1] if self._open else 0,
+            attributes=attributes,
+        )
+        self.spans.append(span)
+        return span
+
+
+class Tracer:
+    """Keeps the slowest and the most recent finished traces in memory.
+
+    Attributes:
+        capacity (int): Number of traces kept in each buffer
+        min_ms (float): Shortest request kept among the slowest, in
+            milliseconds
+    """
+
+    def __init__(self, capacity: int = 50, min_ms: float = 0) -> None:
+        self.capacity = max(1, capacity)
+        self.min_ms = min_ms
+        self._lock = threading.Lock()
+        # Min-heap of (duration, sequence, trace): the root is evicted first
+        self._slowest: List[Tuple[float, int, Trace]] = []
+        self._recent: Deque[Trace] = deque(maxlen=self.capacity)
+        self._sequence = itertools.count()
+        self.recorded = 0
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["Tracer"]:
+        """Build a tracer from a Flask config mapping, or None if disabled."""
+        if not config.get("TRACE_ENABLED", False):
+            return None
+        return cls(
+            capacity=config.get("TRACE_BUFFER_SIZE", 50),
+            min_ms=config.get("TRACE_MIN_MS", 0),
+        )
+
+    def start(self, trace_id: str, name: str) -> Trace:
+        """Start the trace of a request."""
+        return Trace(trace_id, name)
+
+    def record(self, trace: Trace) -> None:
+        """Keep a finished trace if it is among the slowest or recent ones."""
+        item = (trace.duration, next(self._sequence), trace)
+        with self._lock:
+            self.recorded += 1
+            self._recent.append(trace)
+            if trace.duration * 1000 < self.min_ms:
+                return
+            if len(self._slowest) < self.capacity:
+                heapq.heappush(self._slowest, item)
+            elif trace.duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def traces(self, order: str = ORDER_SLOWEST, limit: int = 0) -> List[Trace]:
+        """Kept traces, slowest first or most recent first.
+
+        Args:
+            order: ``slowest`` or ``recent``
+            limit: Maximum number of traces returned, 0 for all
+        """
+        with self._lock:
+            if order == ORDER_RECENT:
+                traces = list(reversed(self._recent))
+            else:
+                traces = [item[2] for item in sorted(self._slowest, reverse=True)]
+        return traces[:limit] if limit > 0 else traces
+
+    def clear(self) -> None:
+        """Drop all kept traces."""
+        with self._lock:
+            self._slowest.clear()
+            self._recent.clear()
+
+
+def chrome_trace(traces: List[Trace]) -> Dict[str, Any]:
+    """Chrome trace event document (JSON object format) for ``traces``."""
+    events: List[Dict[str, Any]] = []
+    for row, trace in enumerate(traces, 1):
+        events.extend(trace.to_chrome_events(tid=row))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace of the request being handled, or None if it is not traced."""
+    if not has_request_context():
+        return None
+    return g.get("trace")
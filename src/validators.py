@@ -0,0 +1,509 @@
+"""Local pre-flight syntax checks for diagram sources.
+
+Kroki finds a syntax error only after a full upstream round-trip. This module
+catches clearly malformed sources locally, in microseconds, and reports the
+line and column of the problem:
+
+- Graphviz: a recursive-descent parser for the DOT language grammar
+  (https://graphviz.org/doc/info/lang.html).
+- Mermaid: a header and block-structure checker (flowchart direction,
+  balanced ``subgraph``/``loop``/``alt`` … ``end`` blocks, terminated
+  strings). Diagram keywords are not checked, as Kroki may render types
+  newer than this module.
+
+The checks are conservative: anything they cannot decide with certainty is
+passed through to Kroki, so a rejected source is always invalid.
+"""
+
+import re
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+
+class SourceSyntaxError(ValueError):
+    """Raised when a diagram source is certainly malformed.
+
+    Attributes:
+        message: Description of the problem
+        line: 1-based line of the problem
+        column: 1-based column of the problem
+    """
+
+    def __init__(self, message: str, line: int, column: int) -> None:
+        super().__init__(f"line {line}, column {column}: {message}")
+        self.message = message
+        self.line = line
+        self.column = column
+
+
+# --------------------------------------------------------------------------
+# Graphviz DOT
+# --------------------------------------------------------------------------
+
+_DOT_KEYWORDS = frozenset({"strict", "graph", "digraph", "node", "edge", "subgraph"})
+_DOT_PUNCT = frozenset("{}[];,=:+")
+_DOT_ID_START_RE = re.compile(r"[A-Za-z_\u0080-\U0010ffff]")
+_DOT_ID_RE = re.compile(r"[A-Za-z_0-9\u0080-\U0010ffff]*")
+_DOT_NUMBER_RE = re.compile(r"-?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)")
+
+# Token kinds
+TOKEN_ID = "id"
+TOKEN_KEYWORD = "keyword"
+TOKEN_EDGEOP = "edgeop"
+TOKEN_EOF = "eof"
+
+Token = Tuple[str, str, int, int]  # kind, value, line, column
+
+
+def dot_tokens(source: str) -> List[Token]:
+    """Split a DOT source into tokens, dropping whitespace and comments.
+
+    Raises:
+        SourceSyntaxError: On unterminated strings or comments and stray
+            characters
+    """
+    tokens: List[Token] = []
+    position = 0
+    line = 1
+    line_start = 0
+    size = len(source)
+
+    def error(message: str, at: int) -> SourceSyntaxError:
+        row = source.count("\n", 0, at) + 1
+        return SourceSyntaxError(message, row, at - source.rfind("\n", 0, at))
+
+    while position < size:
+        char = source[position]
+        column = position - line_start + 1
+
+        if char == "\n":
+            line += 1
+            position += 1
+            line_start = position
+        elif char in " \t\r\f\v\ufeff":
+            position += 1
+        elif char == "#" and not source[line_start:position].strip():
+            # Preprocessor output lines are ignored by Graphviz
+            end = source.find("\n", position)
+            position = size if end < 0 else end
+        elif source.startswith("//", position):
+            end = source.find("\n", position)
+            position = size if end < 0 else end
+        elif source.startswith("/*", position):
+            end = source.find("*/", position + 2)
+            if end < 0:
+                raise error("unterminated comment", position)
+            line += source.count("\n", position, end)
+            if "\n" in source[position:end]:
+                line_start = source.rfind("\n", position, end) + 1
+            position = end + 2
+        elif char == '"':
+            end = position + 1
+            while end < size and source[end] != '"':
+                end += 2 if source[end] == "\\" else 1
+            if end >= size:
+                raise error("unterminated string", position)
+            tokens.append((TOKEN_ID, source[position : end + 1], line, column))
+            line += source.count("\n", position, end)
+            if "\n" in source[position:end]:
+                line_start = source.rfind("\n", position, end) + 1
+            position = end + 1
+        elif char == "<":
+            depth = 0
+            end = position
+            while end < size:
+                if source[end] == "<":
+                    depth += 1
+                elif source[end] == ">":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                end += 1
+            if end >= size:
+                raise error("unterminated HTML string", position)
+            tokens.append((TOKEN_ID, source[position : end + 1], line, column))
+            line += source.count("\n", position, end)
+            if "\n" in source[position:end]:
+                line_start = source.rfind("\n", position, end) + 1
+            position = end + 1
+        elif source.startswith("->", position) or source.startswith("--", position):
+            tokens.append((TOKEN_EDGEOP, source[position : position + 2], line, column))
+            position += 2
+        elif char in _DOT_PUNCT:
+            tokens.append((char, char, line, column))
+            position += 1
+        else:
+            match = _DOT_NUMBER_RE.match(source, position)
+            if match:
+                end = match.end()
+            elif _DOT_ID_START_RE.match(char):
+                end = _DOT_ID_RE.match(source, position + 1).end()
+            else:
+                raise error(f"unexpected character {char!r}", position)
+            value = source[position:end]
+            kind = TOKEN_KEYWORD if value.lower() in _DOT_KEYWORDS else TOKEN_ID
+            tokens.append(
+                (kind, value.lower() if kind == TOKEN_KEYWORD else value, line, column)
+            )
+            position = end
+
+    tokens.append((TOKEN_EOF, "", line, position - line_start + 1))
+    return tokens
+
+
+class _DotParser:
+    """Recursive-descent parser for the DOT grammar."""
+
+    def __init__(self, tokens: List[Token]) -> None:
+        self.tokens = tokens
+        self.index = 0
+        self.directed = False
+
+    def peek(self, kind: str, value: Optional[str] = None) -> bool:
+        """Whether the current token has ``kind`` (and ``value``)."""
+        token = self.tokens[self.index]
+        return token[0] == kind and (value is None or token[1] == value)
+
+    def advance(self) -> Token:
+        """Consume and return the current token."""
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, kind: str, what: str) -> Token:
+        """Consume a token of ``kind`` or fail describing ``what`` was expected."""
+        if not self.peek(kind):
+            self.fail(f"expected {what}")
+        return self.advance()
+
+    def fail(self, message: str) -> None:
+        """Raise a syntax error at the current token."""
+        kind, value, line, column = self.tokens[self.index]
+        found = "end of input" if kind == TOKEN_EOF else repr(value)
+        raise SourceSyntaxError(f"{message}, found {found}", line, column)
+
+    def parse(self) -> None:
+        """graphs : graph+"""
+        self.graph()
+        while not self.peek(TOKEN_EOF):
+            self.graph()
+
+    def graph(self) -> None:
+        """graph : [strict] (graph | digraph) [ID] '{' stmt_list '}'"""
+        if self.peek(TOKEN_KEYWORD, "strict"):
+            self.advance()
+        if self.peek(TOKEN_KEYWORD, "graph") or self.peek(TOKEN_KEYWORD, "digraph"):
+            self.directed = self.advance()[1] == "digraph"
+        else:
+            self.fail("expected 'graph' or 'digraph'")
+        if self.peek(TOKEN_ID):
+            self.identifier()
+        self.body()
+
+    def body(self) -> None:
+        """'{' stmt_list '}'"""
+        opening = self.expect("{", "'{'")
+        while not self.peek("}"):
+            if self.peek(TOKEN_EOF):
+                raise SourceSyntaxError("'{' is never closed", opening[2], opening[3])
+            self.statement()
+            if self.peek(";"):
+                self.advance()
+        self.advance()
+
+    def statement(self) -> None:
+        """stmt : node_stmt | edge_stmt | attr_stmt | ID '=' ID | subgraph"""
+        if (
+            self.peek(TOKEN_KEYWORD, "graph")
+            or self.peek(TOKEN_KEYWORD, "node")
+            or self.peek(TOKEN_KEYWORD, "edge")
+        ):
+            self.advance()
+            if self.peek(TOKEN_ID):
+                # graph ID '=' ID
+                self.assignment()
+            else:
+                self.attr_list(required=True)
+        elif self.peek(TOKEN_KEYWORD, "subgraph") or self.peek("{"):
+            self.subgraph()
+            self.edge_rhs()
+        elif self.peek(TOKEN_ID):
+            self.identifier()
+            if self.peek("="):
+                self.advance()
+                self.identifier()
+                return
+            self.port()
+            self.edge_rhs()
+        else:
+            self.fail("expected a statement")
+
+    def edge_rhs(self) -> None:
+        """edgeRHS : edgeop (node_id | subgraph) [edgeRHS] ; then [attr_list]"""
+        while self.peek(TOKEN_EDGEOP):
+            op = self.tokens[self.index]
+            if (op[1] == "->") != self.directed:
+                kind = "digraph" if self.directed else "graph"
+                raise SourceSyntaxError(
+                    f"edge operator {op[1]!r} not allowed in a {kind}", op[2], op[3]
+                )
+            self.advance()
+            if self.peek(TOKEN_KEYWORD, "subgraph") or self.peek("{"):
+                self.subgraph()
+            elif self.peek(TOKEN_ID):
+                self.identifier()
+                self.port()
+            else:
+                self.fail("expected a node or subgraph after edge operator")
+        self.attr_list(required=False)
+
+    def subgraph(self) -> None:
+        """subgraph : [subgraph [ID]] '{' stmt_list '}'"""
+        if self.peek(TOKEN_KEYWORD, "subgraph"):
+            self.advance()
+            if self.peek(TOKEN_ID):
+                self.identifier()
+        self.body()
+
+    def port(self) -> None:
+        """port : ':' ID [':' ID]"""
+        for _ in range(2):
+            if not self.peek(":"):
+                return
+            self.advance()
+            self.identifier()
+
+    def attr_list(self, required: bool) -> None:
+        """attr_list : '[' [a_list] ']' [attr_list]"""
+        if required and not self.peek("["):
+            self.fail("expected '['")
+        while self.peek("["):
+            opening = self.advance()
+            while not self.peek("]"):
+                if self.peek(TOKEN_EOF):
+                    raise SourceSyntaxError(
+                        "'[' is never closed", opening[2], opening[3]
+                    )
+                self.assignment()
+                if self.peek(";") or self.peek(","):
+                    self.advance()
+            self.advance()
+
+    def assignment(self) -> None:
+        """a_list item : ID '=' ID"""
+        self.identifier()
+        self.expect("=", "'='")
+        self.identifier()
+
+    def identifier(self) -> None:
+        """ID, with '+' concatenation of quoted strings."""
+        token = self.expect(TOKEN_ID, "an identifier")
+        while self.peek("+") and token[1].startswith('"'):
+            self.advance()
+            token = self.expect(TOKEN_ID, "a string after '+'")
+
+
+def validate_dot(source: str) -> None:
+    """Check a Graphviz DOT source against the DOT grammar.
+
+    Raises:
+        SourceSyntaxError: If the source is not valid DOT
+    """
+    _DotParser(dot_tokens(source)).parse()
+
+
+# --------------------------------------------------------------------------
+# Mermaid
+# --------------------------------------------------------------------------
+
+_FLOWCHART_DIRECTIONS = frozenset({"TB", "TD", "BT", "RL", "LR", ">", "<", "^", "v"})
+_FLOWCHART_BLOCKS = frozenset({"subgraph"})
+_SEQUENCE_BLOCKS = frozenset(
+    {"loop", "alt", "opt", "par", "par_over", "critical", "break", "rect", "box"}
+)
+_SEQUENCE_BRANCHES = {"else": "alt", "and": "par", "option": "critical"}
+_HEADER_TOKEN_RE = re.compile(r"[^\s;:]+")
+
+
+def validate_mermaid(source: str) -> None:
+    """Check a Mermaid source header and block structure.
+
+    Raises:
+        SourceSyntaxError: If the diagram type is missing, the flowchart
+            direction is invalid, a block is unbalanced or a flowchart string
+            is unterminated
+    """
+    lines = source.splitlines()
+    index = _skip_mermaid_preamble(lines)
+    if index >= len(lines):
+        raise SourceSyntaxError("missing diagram type", len(lines) or 1, 1)
+
+    header = lines[index]
+    match = _HEADER_TOKEN_RE.search(header)
+    keyword = match.group(0)
+
+    if keyword in ("graph", "flowchart", "flowchart-elk"):
+        direction = None
+        if header[match.end() : match.end() + 1].isspace():
+            direction = _HEADER_TOKEN_RE.search(header, match.end())
+        if direction and direction.group(0) not in _FLOWCHART_DIRECTIONS:
+            raise SourceSyntaxError(
+                f"invalid flowchart direction {direction.group(0)!r}",
+                index + 1,
+                direction.start() + 1,
+            )
+        _check_blocks(lines, index + 1, _FLOWCHART_BLOCKS, {}, ignore_case=False)
+        _check_strings(lines, index + 1)
+    elif keyword == "sequenceDiagram":
+        # The sequence diagram lexer is case-insensitive
+        _check_blocks(
+            lines, index + 1, _SEQUENCE_BLOCKS, _SEQUENCE_BRANCHES, ignore_case=True
+        )
+
+
+def _skip_mermaid_preamble(lines: List[str]) -> int:
+    """Index of the header line, after front matter, directives and comments."""
+    index = 0
+    if lines and lines[0].strip() == "---":
+        for index in range(1, len(lines)):
+            if lines[index].strip() == "---":
+                index += 1
+                break
+        else:
+            raise SourceSyntaxError("front matter is never closed", 1, 1)
+
+    while index < len(lines):
+        stripped = lines[index].strip()
+        if stripped.startswith("%%{") and "}%%" not in stripped:
+            # Multi-line directive
+            while index < len(lines) and "}%%" not in lines[index]:
+                index += 1
+        elif stripped and not stripped.startswith("%%"):
+            return index
+        index += 1
+    return index
+
+
+def _check_blocks(
+    lines: List[str],
+    start: int,
+    openers: frozenset,
+    branches: Dict[str, str],
+    ignore_case: bool,
+) -> None:
+    """Check that ``openers`` … ``end`` blocks are balanced."""
+    stack: List[Tuple[str, int, int]] = []
+    for number in range(start, len(lines)):
+        text = lines[number]
+        stripped = text.strip()
+        if not stripped or stripped.startswith("%%"):
+            continue
+        column = text.index(stripped) + 1
+        if ignore_case:
+            stripped = stripped.lower()
+        word = stripped.split(None, 1)[0].rstrip(";")
+        if word in openers:
+            stack.append((word, number + 1, column))
+        elif word in branches:
+            if not stack:
+                raise SourceSyntaxError(
+                    f"'{word}' outside of a block", number + 1, column
+                )
+        elif stripped.rstrip(";") == "end":
+            if not stack:
+                raise SourceSyntaxError(
+                    "'end' without an open block", number + 1, column
+                )
+            stack.pop()
+    if stack:
+        word, line, column = stack[-1]
+        raise SourceSyntaxError(f"'{word}' block is never closed", line, column)
+
+
+def _check_strings(lines: List[str], start: int) -> None:
+    """Check that double-quoted flowchart strings are terminated.
+
+    Strings may span lines, as Mermaid's lexer allows; a markdown string
+    (``"`…`"``) ends at the next backtick and quote. A string still open at
+    the end of the source is reported where it starts.
+    """
+    # Closing delimiter and position of the string open at the end of a line
+    open_string: Optional[Tuple[str, int, int]] = None
+    for number in range(start, len(lines)):
+        text = lines[number]
+        position = 0
+        if open_string is None and text.lstrip().startswith("%%"):
+            continue
+        while True:
+            if open_string is None:
+                opening = text.find('"', position)
+                if opening < 0:
+                    break
+                markdown = text.startswith('"`', opening)
+                closing = '`"' if markdown else '"'
+                open_string = (closing, number + 1, opening + 1)
+                position = opening + (2 if markdown else 1)
+            end = text.find(open_string[0], position)
+            if end < 0:
+                break
+            position = end + len(open_string[0])
+            open_string = None
+    if open_string is not None:
+        raise SourceSyntaxError("unterminated string", *open_string[1:])
+
+
+# --------------------------------------------------------------------------
+# Pre-flight stage
+# --------------------------------------------------------------------------
+
+VALIDATORS: Dict[str, Callable[[str], None]] = {
+    "graphviz": validate_dot,
+    "mermaid": validate_mermaid,
+}
+
+
+class PreflightValidator:
+    """Dispatch diagram sources to their local syntax checker.
+
+    Attributes:
+        validators (dict): Diagram type to checker function
+        max_chars (int): Sources longer than this are passed through unchecked
+    """
+
+    def __init__(
+        self,
+        validators: Optional[Mapping[str, Callable[[str], None]]] = None,
+        max_chars: int = 200_000,
+    ) -> None:
+        self.validators = dict(VALIDATORS if validators is None else validators)
+        self.max_chars = max_chars
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> Optional["PreflightValidator"]:
+        """Build a validator from a Flask config mapping, or None if disabled."""
+        if not config.get("PREFLIGHT_VALIDATE", False):
+            return None
+        return cls(max_chars=config.get("PREFLIGHT_MAX_CHARS", 200_000))
+
+    def supports(self, diagram_type: str) -> bool:
+        """Whether a local checker exists for ``diagram_type``."""
+        return diagram_type in self.validators
+
+    def check(self, diagram_type: str, source: str) -> bool:
+        """Check ``source`` with the checker of ``diagram_type``.
+
+        Returns:
+            bool: True if the source was checked, False if it was passed
+                 through (no checker, too long or too deeply nested)
+
+        Raises:
+            SourceSyntaxError: If the source is certainly malformed
+        """
+        validator = self.validators.get(diagram_type)
+        if validator is None or len(source) > self.max_chars:
+            return False
+        try:
+            validator(source)
+        except RecursionError:
+            # Too deeply nested to decide locally; Kroki will tell
+            return False
+        return True
@@ -0,0 +1,323 @@
+"""Render cache warm-up at startup.
+
+After a deploy the render cache is empty, and the first users clicking the
+quick-use templates of the index page pay the full cold render latency. The
+warm-up renders a seed corpus into the cache before the worker reports ready:
+
+- the built-in templates, read from ``templates/index.html`` so that the
+  corpus follows the page, in every output format their type supports and
+  with the theme the page selects by default;
+- an optional JSON corpus (``WARMUP_CORPUS``), a list of objects with
+  ``diagram_type``, ``output_format`` (a format or a list of formats),
+  ``diagram_source`` and an optional ``diagram_theme``.
+
+Renders run in the batch lane on a bounded thread pool. ``/ready`` reports
+ready once the warm-up has finished or ``WARMUP_TIMEOUT`` has elapsed; renders
+still pending then are dropped.
+
+Under gunicorn with ``preload_app``, the warm-up runs once in the master
+before the workers are forked (see :mod:`src.startup`), and the workers
+inherit the warm cache. Otherwise it starts in each worker, when the worker
+is initialised or on its first request.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.kroki_client import KrokiClient, KrokiError
+from src.metrics import Metrics
+from src.scheduler import LANE_BATCH
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ("png", "svg")
+
+# Diagram types Kroki only renders to some formats
+TYPE_FORMATS = {"excalidraw": ("svg",)}
+
+STATE_PENDING = "pending"
+STATE_WARMING = "warming"
+STATE_READY = "ready"
+STATE_TIMED_OUT = "timed_out"
+
+
+@dataclass(frozen=True)
+class SeedRender:
+    """A render of the warm-up corpus.
+
+    Attributes:
+        diagram_type: Kroki diagram type
+        output_format: Output format (png, svg)
+        diagram_source: Diagram source
+        theme: Theme sent with the request, None for the default
+    """
+
+    diagram_type: str
+    output_format: str
+    diagram_source: str
+    theme: Optional[str] = None
+
+
+class _TemplateParser(HTMLParser):
+    """Collects the quick-use templates and default theme of the index page."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.templates: List[Tuple[str, str]] = []
+        self.theme: Optional[str] = None
+        self._in_theme_select = False
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = dict(attrs)
+        classes = (attributes.get("class") or "").split()
+        if "example-template" in classes:
+            diagram_type = attributes.get("data-type")
+            source = attributes.get("data-source")
+            if diagram_type and source:
+                self.templates.append((diagram_type, source))
+        elif tag == "select":
+            self._in_theme_select = attributes.get("id") == "diagram_theme"
+        elif tag == "option" and self._in_theme_select and "selected" in attributes:
+            self.theme = attributes.get("value")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "select":
+            self._in_theme_select = False
+
+
+def template_seeds(path: str) -> List[SeedRender]:
+    """Renders of the quick-use templates of a page, in every format.
+
+    Args:
+        path: Path of the page template (``templates/index.html``)
+
+    Returns:
+        List[SeedRender]: One render per template and supported format, with
+            the theme selected by default on the page
+    """
+    parser = _TemplateParser()
+    with open(path, "r", encoding="utf-8") as f:
+        parser.feed(f.read())
+    return [
+        SeedRender(diagram_type, output_format, source, parser.theme)
+        for diagram_type, source in parser.templates
+        for output_format in TYPE_FORMATS.get(diagram_type, OUTPUT_FORMATS)
+    ]
+
+
+def load_corpus(path: str) -> List[SeedRender]:
+    """Renders of a JSON seed corpus.
+
+    Raises:
+        ValueError: If the file is not a list of valid seed objects
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError(f"{path}: expected a list of diagrams")
+    seeds = []
+    for item in items:
+        try:
+            formats = item["output_format"]
+            if isinstance(formats, str):
+                formats = [formats]
+            for output_format in formats:
+                seeds.append(
+                    SeedRender(
+                        item["diagram_type"],
+                        output_format,
+                        item["diagram_source"],
+                        item.get("diagram_theme") or None,
+                    )
+                )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"{path}: invalid diagram {item!r}") from e
+    return seeds
+
+
+class WarmUp:
+    """Renders a seed corpus into the render cache, once per process.
+
+    Attributes:
+        app (Flask): Application whose cache and Kroki settings are used
+        seeds (List[SeedRender]): Renders to warm, duplicates removed
+        concurrency (int): Renders run at the same time
+        timeout (float): Seconds after which the warm-up is abandoned
+        metrics (Metrics): Registry receiving the warm-up counters, or None
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        seeds: List[SeedRender],
+        concurrency: int = 4,
+        timeout: float = 60,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.app = app
+        self.seeds = list(dict.fromkeys(seeds))
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.metrics = metrics
+        self.state = STATE_PENDING
+        self.rendered = 0
+        self.failed = 0
+        self.duration: Optional[float] = None
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._deadline: Optional[float] = None
+
+    @classmethod
+    def from_config(
+        cls, app: Any, metrics: Optional[Metrics] = None
+    ) -> Optional["WarmUp"]:
+        """Build the warm-up of ``app`` from its config, or None if disabled.
+
+        Without a render cache there is nothing to warm.
+
+        Raises:
+            ValueError: If the seed corpus cannot be read
+        """
+        if not app.config.get("WARMUP_ENABLED", False):
+            return None
+        if app.extensions.get("render_cache") is None:
+            logger.warning("Warm-up disabled: the render cache is disabled")
+            return None
+        seeds = []
+        if app.config.get("WARMUP_TEMPLATES", True):
+            seeds += template_seeds(
+                os.path.join(app.root_path, app.template_folder, "index.html")
+            )
+        corpus = app.config.get("WARMUP_CORPUS")
+        if corpus:
+            try:
+                seeds += load_corpus(corpus)
+            except OSError as e:
+                raise ValueError(f"Cannot read warm-up corpus {corpus}: {e}") from e
+        return cls(
+            app,
+            seeds,
+            concurrency=app.config.get("WARMUP_CONCURRENCY", 4),
+            timeout=app.config.get("WARMUP_TIMEOUT", 60),
+            metrics=metrics,
+        )
+
+    @property
+    def ready(self) -> bool:
+        """Whether the warm-up has finished or timed out in this process."""
+        if self._finished():
+            return True
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def start(self) -> None:
+        """Start the warm-up in a background thread of this process.
+
+        Does nothing if the process already ran or inherited a finished
+        warm-up, or if one is running.
+        """
+        if self._pid == os.getpid() or self._finished():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.state = STATE_WARMING
+            self._deadline = time.monotonic() + self.timeout
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def request_started(self) -> None:
+        """Start the warm-up in a new worker that did not inherit it."""
+        self.start()
+
+    def run(self, drain: bool = False) -> None:
+        """Render the corpus, blocking until done or timed out.
+
+        Args:
+            drain: Also wait for the renders still running at the timeout,
+                so that no warm-up thread is left (before forking workers)
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._pid = os.getpid()
+            self.state = STATE_WARMING
+            if self._deadline is None:
+                self._deadline = started + self.timeout
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="warmup"
+        )
+        futures = [executor.submit(self._render, seed) for seed in self.seeds]
+        _, pending = wait(futures, timeout=max(0.0, self._deadline - started))
+        executor.shutdown(wait=drain, cancel_futures=True)
+
+        self.duration = time.monotonic() - started
+        self.state = STATE_TIMED_OUT if pending else STATE_READY
+        if pending:
+            logger.warning(
+                "Warm-up timed out after %.1fs: %d of %d renders pending",
+                self.duration,
+                len(pending),
+                len(self.seeds),
+            )
+            self._inc("warmup_renders_total", len(pending), result="timed_out")
+        else:
+            logger.info(
+                "Warm-up finished in %.1fs: %d rendered, %d failed",
+                self.duration,
+                self.rendered,
+                self.failed,
+            )
+        if self.metrics is not None:
+            self.metrics.set_gauge("warmup_seconds", self.duration)
+
+    def status(self) -> Dict[str, Any]:
+        """Progress of the warm-up, for the readiness endpoint."""
+        state = self.state
+        if state == STATE_WARMING and self.ready:
+            state = STATE_TIMED_OUT
+        return {
+            "state": state,
+            "total": len(self.seeds),
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "duration_s": (
+                round(self.duration, 3) if self.duration is not None else None
+            ),
+        }
+
+    def _finished(self) -> bool:
+        return self.state in (STATE_READY, STATE_TIMED_OUT)
+
+    def _render(self, seed: SeedRender) -> None:
+        """Render one seed into the cache (pool thread)."""
+        with self.app.app_context():
+            client = KrokiClient(theme=seed.theme, lane=LANE_BATCH)
+            try:
+                client.generate_diagram(
+                    seed.diagram_type, seed.output_format, seed.diagram_source
+                )
+            except KrokiError as e:
+                logger.warning(
+                    "Warm-up render of %s/%s failed: %s",
+                    seed.diagram_type,
+                    seed.output_format,
+                    e,
+                )
+                with self._lock:
+                    self.failed += 1
+                self._inc("warmup_renders_total", result="failed")
+                return
+        with self._lock:
+            self.rendered += 1
+        self._inc("warmup_renders_total", result="rendered")
+
+    def _inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        if self.metrics is not None:
+            self.metrics.inc(name, value, **labels)
@@ -0,0 +1,732 @@
+// Session history management
+const HISTORY_KEY = 'kroki_diagram_history';
+const MAX_HISTORY = 5;
+
+// Load history from localStorage
+function loadHistory() {
+    try {
+        return JSON.parse(localStorage.getItem(HISTORY_KEY) || '[]');
+    } catch {
+        return [];
+    }
+}
+
+// Save history to localStorage
+function saveHistory(history) {
+    try {
+        localStorage.setItem(HISTORY_KEY, JSON.stringify(history));
+    } catch (e) {
+        console.warn('Could not save to localStorage:', e);
+    }
+}
+
+// Add item to history
+function addToHistory(item) {
+    const history = loadHistory();
+    history.unshift(item);
+    if (history.length > MAX_HISTORY) {
+        history.splice(MAX_HISTORY);
+    }
+    saveHistory(history);
+    renderHistory();
+}
+
+// Render history UI
+function renderHistory() {
+    const history = loadHistory();
+    const historyDiv = document.getElementById('diagramHistory');
+    const clearBtn = document.getElementById('clearHistoryBtn');
+    
+    if (history.length === 0) {
+        historyDiv.innerHTML = '<p class="text-muted text-center mb-0">No recent diagrams</p>';
+        clearBtn.style.display = 'none';
+        return;
+    }
+    
+    clearBtn.style.display = 'inline-block';
+    
+    const historyHtml = history.map((item, index) => `
+        <div class="history-item d-flex align-items-center" data-index="${index}">
+            <img class="history-thumbnail me-2" alt="" style="display: none;">
+            <div class="flex-grow-1 overflow-hidden">
+                <div class="d-flex justify-content-between align-items-center">
+                    <span class="fw-bold text-primary">${item.type} • ${item.format}</span>
+                    <small class="text-muted">${new Date(item.timestamp).toLocaleTimeString()}</small>
+                </div>
+                <div class="text-truncate small text-muted" style="max-width: 200px;">
+                    ${item.source.substring(0, 50)}...
+                </div>
+            </div>
+        </div>
+    `).join('');
+    
+    historyDiv.innerHTML = historyHtml;
+    
+    // Add click handlers and thumbnails of the renders still cached
+    historyDiv.querySelectorAll('.history-item').forEach(item => {
+        const historyItem = history[parseInt(item.dataset.index)];
+        const key = renderKey({
+            diagram_type: historyItem.type,
+            output_format: historyItem.format,
+            diagram_theme: historyItem.theme,
+            diagram_source: historyItem.source
+        });
+        getCachedThumbnail(key).then(thumbnail => {
+            if (thumbnail) {
+                const img = item.querySelector('.history-thumbnail');
+                img.src = thumbnail;
+                img.style.display = 'block';
+            }
+        });
+        
+        item.addEventListener('click', function() {
+            const diagramType = document.getElementById('diagram_type');
+            diagramType.value = historyItem.type;
+            // Update the theme and format field states for the restored type,
+            // so that the form matches the request of the cached render
+            diagramType.dispatchEvent(new Event('change'));
+            document.getElementById('output_format').value = historyItem.format;
+            if (historyItem.theme) {
+                document.getElementById('diagram_theme').value = historyItem.theme;
+            }
+            document.getElementById('diagram_source').value = historyItem.source;
+            showHistoryRender(key);
+        });
+    });
+}
+
+// Rendered diagrams cached in IndexedDB: blobs are stored by ETag, and each
+// request (type, format, theme, source) points to its ETag and thumbnail.
+// The least recently used blobs are evicted beyond RENDER_STORE_MAX_BYTES.
+const RENDER_STORE_NAME = 'kroki-renders';
+const RENDER_STORE_MAX_BYTES = 20 * 1024 * 1024;
+const THUMBNAIL_SIZE = 96;
+let renderStorePromise = null;
+let historyUrl = null;
+
+function openRenderStore() {
+    if (!renderStorePromise) {
+        renderStorePromise = new Promise((resolve, reject) => {
+            if (!window.indexedDB) {
+                reject(new Error('IndexedDB is not available'));
+                return;
+            }
+            const open = indexedDB.open(RENDER_STORE_NAME, 1);
+            open.onupgradeneeded = function() {
+                const db = open.result;
+                db.createObjectStore('blobs', { keyPath: 'etag' }).createIndex('lastUsed', 'lastUsed');
+                db.createObjectStore('renders', { keyPath: 'key' });
+            };
+            open.onsuccess = () => resolve(open.result);
+            open.onerror = () => reject(open.error);
+        });
+    }
+    return renderStorePromise;
+}
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function idbTransactionDone(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = () => resolve();
+        tx.onerror = tx.onabort = () => reject(tx.error);
+    });
+}
+
+function renderKey(data) {
+    return JSON.stringify([
+        data.diagram_type, data.output_format, data.diagram_theme || '', data.diagram_source
+    ]);
+}
+
+// Cached render of a request as { etag, blob }, or null
+async function getCachedRender(key) {
+    try {
+        const db = await openRenderStore();
+        const tx = db.transaction(['renders', 'blobs'], 'readwrite');
+        const render = await idbRequest(tx.objectStore('renders').get(key));
+        if (!render) return null;
+        const entry = await idbRequest(tx.objectStore('blobs').get(render.etag));
+        if (!entry) return null;
+        entry.lastUsed = Date.now();
+        tx.objectStore('blobs').put(entry);
+        return { etag: render.etag, blob: entry.blob };
+    } catch (err) {
+        console.warn('Render cache unavailable:', err);
+        return null;
+    }
+}
+
+async function getCachedThumbnail(key) {
+    try {
+        const db = await openRenderStore();
+        const render = await idbRequest(db.transaction('renders').objectStore('renders').get(key));
+        return render ? render.thumbnail : null;
+    } catch {
+        return null;
+    }
+}
+
+async function storeRender(key, etag, blob) {
+    if (!etag) return;
+    try {
+        const thumbnail = await makeThumbnail(blob);
+        const db = await openRenderStore();
+        const tx = db.transaction(['renders', 'blobs'], 'readwrite');
+        tx.objectStore('blobs').put({ etag: etag, blob: blob, size: blob.size, lastUsed: Date.now() });
+        tx.objectStore('renders').put({ key: key, etag: etag, thumbnail: thumbnail });
+        await idbTransactionDone(tx);
+        await evictRenders(db);
+    } catch (err) {
+        console.warn('Could not cache render:', err);
+    }
+}
+
+// Drop the least recently used blobs, and the requests pointing to them
+async function evictRenders(db) {
+    const tx = db.transaction(['renders', 'blobs'], 'readwrite');
+    const entries = await idbRequest(tx.objectStore('blobs').index('lastUsed').getAll());
+    let total = entries.reduce((sum, entry) => sum + entry.size, 0);
+    const evicted = new Set();
+    for (const entry of entries) {
+        if (total <= RENDER_STORE_MAX_BYTES) break;
+        tx.objectStore('blobs').delete(entry.etag);
+        evicted.add(entry.etag);
+        total -= entry.size;
+    }
+    if (evicted.size > 0) {
+        const renders = await idbRequest(tx.objectStore('renders').getAll());
+        renders
+            .filter(render => evicted.has(render.etag))
+            .forEach(render => tx.objectStore('renders').delete(render.key));
+    }
+    await idbTransactionDone(tx);
+}
+
+async function clearRenderStore() {
+    try {
+        const db = await openRenderStore();
+        const tx = db.transaction(['renders', 'blobs'], 'readwrite');
+        tx.objectStore('renders').clear();
+        tx.objectStore('blobs').clear();
+        await idbTransactionDone(tx);
+    } catch (err) {
+        console.warn('Could not clear render cache:', err);
+    }
+}
+
+// Small PNG data URL of a rendered diagram, or null if it cannot be drawn
+function makeThumbnail(blob) {
+    return new Promise(resolve => {
+        const url = URL.createObjectURL(blob);
+        const img = new Image();
+        img.onload = function() {
+            try {
+                const width = img.naturalWidth || THUMBNAIL_SIZE;
+                const height = img.naturalHeight || THUMBNAIL_SIZE;
+                const scale = Math.min(1, THUMBNAIL_SIZE / Math.max(width, height));
+                const canvas = document.createElement('canvas');
+                canvas.width = Math.max(1, Math.round(width * scale));
+                canvas.height = Math.max(1, Math.round(height * scale));
+                canvas.getContext('2d').drawImage(img, 0, 0, canvas.width, canvas.height);
+                resolve(canvas.toDataURL('image/png'));
+            } catch {
+                // SVGs with embedded HTML taint the canvas in some browsers
+                resolve(null);
+            } finally {
+                URL.revokeObjectURL(url);
+            }
+        };
+        img.onerror = function() {
+            URL.revokeObjectURL(url);
+            resolve(null);
+        };
+        img.src = url;
+    });
+}
+
+// Show a history entry from the cache at once, then revalidate it
+async function showHistoryRender(key) {
+    const cached = await getCachedRender(key);
+    if (!cached) return;
+    const data = Object.fromEntries(new FormData(document.getElementById('diagramForm')));
+    if (renderKey(data) !== key) return;
+    
+    if (historyUrl) URL.revokeObjectURL(historyUrl);
+    historyUrl = URL.createObjectURL(cached.blob);
+    document.getElementById('error').style.display = 'none';
+    showDiagram(historyUrl, data);
+    
+    try {
+        const response = await fetch('/api/generate', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Kroki-Client': 'ui',
+                'If-None-Match': cached.etag,
+            },
+            body: JSON.stringify(data)
+        });
+        // 304: the cached render is still current
+        if (!response.ok) return;
+        const blob = await response.blob();
+        await storeRender(key, response.headers.get('ETag'), blob);
+        if (renderKey(Object.fromEntries(new FormData(document.getElementById('diagramForm')))) === key) {
+            URL.revokeObjectURL(historyUrl);
+            historyUrl = URL.createObjectURL(blob);
+            showDiagram(historyUrl, data);
+        }
+    } catch (err) {
+        console.warn('Could not revalidate cached render:', err);
+    }
+}
+
+// Template click handlers
+document.addEventListener('DOMContentLoaded', function() {
+    // Render initial history
+    renderHistory();
+    
+    // Handle diagram theme field state
+    const diagramTypeSelect = document.getElementById('diagram_type');
+    const diagramThemeSelect = document.getElementById('diagram_theme');
+    const outputFormatSelect = document.getElementById('output_format');
+    
+    function updateThemeFieldState() {
+        const selectedType = diagramTypeSelect.value;
+        if (selectedType === 'mermaid') {
+            diagramThemeSelect.disabled = false;
+            diagramThemeSelect.style.opacity = '1';
+        } else {
+            diagramThemeSelect.disabled = true;
+            diagramThemeSelect.style.opacity = '0.6';
+            diagramThemeSelect.value = 'light'; // Reset to default
+        }
+    }
+    
+    function updateOutputFormatState() {
+        const selectedType = diagramTypeSelect.value;
+        const pngOption = outputFormatSelect.querySelector('option[value="png"]');
+        
+        if (selectedType === 'excalidraw') {
+            // Disable PNG for Excalidraw
+            pngOption.disabled = true;
+            pngOption.style.color = '#6c757d';
+            // Switch to SVG if PNG was selected
+            if (outputFormatSelect.value === 'png') {
+                outputFormatSelect.value = 'svg';
+            }
+        } else {
+            // Enable PNG for other diagram types
+            pngOption.disabled = false;
+            pngOption.style.color = '';
+        }
+    }
+    
+    // Initial state
+    updateThemeFieldState();
+    updateOutputFormatState();
+    
+    // Listen for diagram type changes
+    diagramTypeSelect.addEventListener('change', function() {
+        updateThemeFieldState();
+        updateOutputFormatState();
+    });
+    
+    // Clear source button handler
+    document.getElementById('clearSourceBtn').addEventListener('click', function() {
+        const diagramSource = document.getElementById('diagram_source');
+        const result = document.getElementById('result');
+        const downloadBtn = document.getElementById('downloadBtn');
+        const error = document.getElementById('error');
+        
+        // Clear diagram source
+        diagramSource.value = '';
+        diagramSource.focus();
+        
+        // Clear result window
+        result.innerHTML = '<p class="text-muted">Generated diagram will appear here</p>';
+        
+        // Hide download button and error messages
+        downloadBtn.style.display = 'none';
+        error.style.display = 'none';
+    });
+    
+    // Template buttons
+    document.querySelectorAll('.use-template-btn').forEach(btn => {
+        btn.addEventListener('click', function(e) {
+            e.stopPropagation();
+            const template = this.closest('.example-template');
+            
+            document.getElementById('diagram_type').value = template.dataset.type;
+            document.getElementById('output_format').value = template.dataset.format;
+            document.getElementById('diagram_source').value = template.dataset.source.replace(/&#10;/g, '\n').replace(/&gt;/g, '>').replace(/&lt;/g, '<').replace(/&quot;/g, '"');
+            
+            // Update field states after setting values
+            updateThemeFieldState();
+            updateOutputFormatState();
+            
+            // Scroll to form
+            document.getElementById('diagramForm').scrollIntoView({ behavior: 'smooth' });
+        });
+    });
+});
+
+// Excalidraw template toggle function
+function toggleExcalidrawTemplate(button) {
+    const wrapper = button.previousElementSibling;
+    const isExpanded = wrapper.classList.contains('expanded');
+    
+    if (isExpanded) {
+        wrapper.classList.remove('expanded');
+        button.innerHTML = '▼ Show more';
+    } else {
+        wrapper.classList.add('expanded');
+        button.innerHTML = '▲ Show less';
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    // Clear history button
+    document.getElementById('clearHistoryBtn').addEventListener('click', function() {
+        if (confirm('Clear all diagram history?')) {
+            localStorage.removeItem(HISTORY_KEY);
+            clearRenderStore();
+            renderHistory();
+        }
+    });
+    
+    // Drag & Drop functionality
+    const dropZone = document.getElementById('dropZone');
+    const fileInput = document.getElementById('fileInput');
+    const diagramSource = document.getElementById('diagram_source');
+    
+    // Make drop zone clickable
+    dropZone.addEventListener('click', () => fileInput.click());
+    
+    // Drag & Drop events
+    dropZone.addEventListener('dragover', function(e) {
+        e.preventDefault();
+        this.classList.add('dragover');
+    });
+    
+    dropZone.addEventListener('dragleave', function(e) {
+        e.preventDefault();
+        this.classList.remove('dragover');
+    });
+    
+    dropZone.addEventListener('drop', function(e) {
+        e.preventDefault();
+        this.classList.remove('dragover');
+        
+        const files = e.dataTransfer.files;
+        if (files.length > 0) {
+            handleFile(files[0]);
+        }
+    });
+    
+    // File input change
+    fileInput.addEventListener('change', function(e) {
+        if (this.files.length > 0) {
+            handleFile(this.files[0]);
+        }
+    });
+    
+    // Handle file reading
+    function handleFile(file) {
+        if (file.size > 1000000) { // 1MB limit
+            alert('File too large. Maximum size is 1MB.');
+            return;
+        }
+        
+        const reader = new FileReader();
+        reader.onload = function(e) {
+            diagramSource.value = e.target.result;
+            
+            // Auto-detect diagram type from filename
+            const filename = file.name.toLowerCase();
+            const diagramTypeSelect = document.getElementById('diagram_type');
+            
+            if (filename.includes('mermaid') || filename.endsWith('.mmd')) {
+                diagramTypeSelect.value = 'mermaid';
+            } else if (filename.includes('plantuml') || filename.endsWith('.puml') || filename.endsWith('.plantuml')) {
+                diagramTypeSelect.value = 'plantuml';
+            } else if (filename.includes('graphviz') || filename.endsWith('.dot')) {
+                diagramTypeSelect.value = 'graphviz';
+            } else if (filename.includes('blockdiag')) {
+                diagramTypeSelect.value = 'blockdiag';
+            } else if (filename.includes('ditaa')) {
+                diagramTypeSelect.value = 'ditaa';
+            }
+        };
+        reader.readAsText(file);
+    }
+});
+
+// Debug function
+function showDebugMessage(message) {
+    const debug = document.getElementById('debug');
+    const debugMessage = document.getElementById('debugMessage');
+    debugMessage.textContent = message;
+    debug.style.display = 'block';
+    setTimeout(() => debug.style.display = 'none', 5000);
+}
+
+// Display a rendered diagram and set up its download
+function showDiagram(url, data) {
+    const result = document.getElementById('result');
+    const downloadBtn = document.getElementById('downloadBtn');
+    
+    const img = document.createElement('img');
+    img.src = url;
+    img.style.maxWidth = '100%';
+    img.onerror = function() {
+        console.error('Image failed to load');
+        showDebugMessage('Error: Image failed to load');
+    };
+    
+    // Apply background color
+    const bgColor = data.background_color || 'white';
+    if (bgColor !== 'transparent') {
+        img.style.backgroundColor = bgColor;
+        img.style.borderRadius = '0.25rem';
+        img.style.padding = '0.5rem';
+    }
+    
+    result.innerHTML = '';
+    result.appendChild(img);
+    
+    // Setup download
+    downloadBtn.style.display = 'inline-block';
+    downloadBtn.onclick = function() {
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = `diagram.${data.output_format}`;
+        a.click();
+    };
+}
+
+// Live preview: each change supersedes the previous render. The pending
+// request is aborted, the server drops renders it no longer needs, and the
+// debounce follows the preview latency it measures (X-Debounce-Ms).
+const livePreview = {
+    session: null,
+    sequence: 0,
+    controller: null,
+    timer: null,
+    debounceMs: 300,
+    blobs: new Map(),
+    maxBlobs: 20
+};
+
+function previewSession() {
+    // One session per page load: sequence numbers restart with the page
+    if (!livePreview.session) {
+        livePreview.session = window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+    return livePreview.session;
+}
+
+function rememberPreviewBlob(key, url) {
+    // Most recently used last; the oldest object URLs are released
+    livePreview.blobs.delete(key);
+    livePreview.blobs.set(key, url);
+    while (livePreview.blobs.size > livePreview.maxBlobs) {
+        const [oldKey, oldUrl] = livePreview.blobs.entries().next().value;
+        livePreview.blobs.delete(oldKey);
+        URL.revokeObjectURL(oldUrl);
+    }
+}
+
+function schedulePreview() {
+    clearTimeout(livePreview.timer);
+    if (!document.getElementById('livePreview').checked) {
+        if (livePreview.controller) livePreview.controller.abort();
+        return;
+    }
+    livePreview.timer = setTimeout(runPreview, livePreview.debounceMs);
+}
+
+async function runPreview() {
+    const data = Object.fromEntries(new FormData(document.getElementById('diagramForm')));
+    if (!data.diagram_type || !data.output_format || !(data.diagram_source || '').trim()) {
+        return;
+    }
+    const error = document.getElementById('error');
+    const key = JSON.stringify([
+        data.diagram_type, data.output_format, data.diagram_theme || '', data.diagram_source
+    ]);
+    
+    // The pending preview is no longer wanted
+    if (livePreview.controller) livePreview.controller.abort();
+    const sequence = ++livePreview.sequence;
+    
+    // Reuse diagrams already rendered in this page (undo, format toggles...)
+    const cached = livePreview.blobs.get(key);
+    if (cached) {
+        rememberPreviewBlob(key, cached);
+        error.style.display = 'none';
+        showDiagram(cached, data);
+        return;
+    }
+    
+    const controller = new AbortController();
+    livePreview.controller = controller;
+    try {
+        const response = await fetch('/api/preview', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Kroki-Client': 'ui',
+                'X-Preview-Session': previewSession(),
+                'X-Preview-Seq': String(sequence),
+            },
+            body: JSON.stringify(data),
+            signal: controller.signal
+        });
+        
+        const debounceMs = parseInt(response.headers.get('X-Debounce-Ms'), 10);
+        if (debounceMs > 0) livePreview.debounceMs = debounceMs;
+        // Superseded on the server or while the response was on its way
+        if (response.status === 409 || sequence !== livePreview.sequence) return;
+        
+        if (!response.ok) {
+            // Keep the last good diagram on screen while the source is edited
+            const errorData = await response.json();
+            error.textContent = errorData.error || 'Failed to render preview';
+            error.style.display = 'block';
+            return;
+        }
+        
+        const url = URL.createObjectURL(await response.blob());
+        rememberPreviewBlob(key, url);
+        if (sequence !== livePreview.sequence) return;
+        error.style.display = 'none';
+        showDiagram(url, data);
+    } catch (err) {
+        if (err.name !== 'AbortError') {
+            console.error('Live preview failed:', err);
+            showDebugMessage(`Preview error: ${err.message}`);
+        }
+    } finally {
+        if (livePreview.controller === controller) livePreview.controller = null;
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('diagramForm');
+    form.addEventListener('input', schedulePreview);
+    form.addEventListener('change', schedulePreview);
+});
+
+// Form submission with history
+document.getElementById('diagramForm').addEventListener('submit', async function(e) {
+    e.preventDefault();
+    console.log('Form submitted - starting diagram generation');
+    showDebugMessage('Starting diagram generation...');
+    
+    const form = e.target;
+    const submitBtn = form.querySelector('button[type="submit"]');
+    const loading = submitBtn.querySelector('.loading');
+    const result = document.getElementById('result');
+    const error = document.getElementById('error');
+    const downloadBtn = document.getElementById('downloadBtn');
+    
+    // Show loading state
+    loading.style.display = 'inline-block';
+    submitBtn.disabled = true;
+    error.style.display = 'none';
+    downloadBtn.style.display = 'none';
+    console.log('Loading state activated');
+    
+    try {
+        const formData = new FormData(form);
+        const data = Object.fromEntries(formData);
+        console.log('Form data collected:', data);
+        showDebugMessage('Sending request to API...');
+        
+        // Revalidate a render cached in this browser instead of downloading it again
+        const key = renderKey(data);
+        const cached = await getCachedRender(key);
+        const headers = {
+            'Content-Type': 'application/json',
+            'X-Kroki-Client': 'ui',
+        };
+        if (cached) {
+            headers['If-None-Match'] = cached.etag;
+        }
+        
+        const response = await fetch('/api/generate', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify(data)
+        });
+        
+        console.log('API response status:', response.status, response.statusText);
+        showDebugMessage(`API responded with status ${response.status}`);
+        
+        let blob;
+        if (response.status === 304 && cached) {
+            blob = cached.blob;
+            console.log('Cached render still current, size:', blob.size);
+        } else {
+            if (!response.ok) {
+                const errorData = await response.json();
+                console.error('API error response:', errorData);
+                throw new Error(errorData.error || 'Failed to generate diagram');
+            }
+            
+            blob = await response.blob();
+            console.log('Blob received, size:', blob.size, 'type:', blob.type);
+            showDebugMessage(`Received ${blob.type} blob of ${blob.size} bytes`);
+            storeRender(key, response.headers.get('ETag'), blob).then(renderHistory);
+        }
+        
+        const url = URL.createObjectURL(blob);
+        console.log('Object URL created:', url);
+        
+        // Display result
+        showDiagram(url, data);
+        showDebugMessage('Diagram generated successfully!');
+        
+        // Add to history on success
+        addToHistory({
+            type: data.diagram_type,
+            format: data.output_format,
+            theme: data.diagram_theme || '',
+            source: data.diagram_source,
+            timestamp: new Date().toISOString()
+        });
+        console.log('Added to history successfully');
+        
+    } catch (err) {
+        console.error('Error during diagram generation:', err);
+        error.textContent = err.message;
+        error.style.display = 'block';
+        result.innerHTML = '<p class="text-muted">Generated diagram will appear here</p>';
+        showDebugMessage(`Error: ${err.message}`);
+    } finally {
+        loading.style.display = 'none';
+        submitBtn.disabled = false;
+        console.log('Form submission completed');
+    }
+});
+
+// Fallback mode button
+document.getElementById('fallbackBtn').addEventListener('click', function() {
+    console.log('Activating fallback mode');
+    showDebugMessage('Switching to fallback mode...');
+    
+    // Remove JavaScript handler and let form submit normally
+    const form = document.getElementById('diagramForm');
+    const newForm = form.cloneNode(true);
+    form.parentNode.replaceChild(newForm, form);
+    
+    showDebugMessage('Fallback mode activated - form will submit normally');
+});
@@ -0,0 +1,82 @@
+"""Tests for fingerprinted static assets and cached pages."""
+
+import gzip
+import os
+from src.assets import Asset, StaticAssets
+
+
+class TestStaticAssets:
+    """Test cases for StaticAssets."""
+
+    def test_fingerprinted_url(self, tmp_path):
+        """Test asset URLs carry a digest of the file content."""
+        (tmp_path / "css").mkdir()
+        (tmp_path / "css" / "app.css").write_text("body { color: red; }")
+        assets = StaticAssets(str(tmp_path))
+
+        url = assets.url("css/app.css")
+
+        assert url.startswith("/assets/css/app.")
+        assert url.endswith(".css")
+        asset = assets.get(url[len("/assets/") :])
+        assert asset.data == b"body { color: red; }"
+        assert asset.mimetype == "text/css; charset=utf-8"
+
+    def test_unknown_asset(self, tmp_path):
+        """Test unknown paths fall back to the plain static URL."""
+        assets = StaticAssets(str(tmp_path))
+
+        assert assets.url("js/missing.js") == "/static/js/missing.js"
+        assert assets.get("js/missing.0123456789abcdef.js") is None
+
+    def test_precompressed_variants(self, tmp_path):
+        """Test text assets are precompressed, binary ones are not."""
+        (tmp_path / "app.js").write_text("console.log('kroki');\n" * 200)
+        (tmp_path / "logo.png").write_bytes(os.urandom(256))
+        assets = StaticAssets(str(tmp_path))
+
+        script = assets.get(assets.url("app.js").rsplit("/", 1)[1])
+        image = assets.get(assets.url("logo.png").rsplit("/", 1)[1])
+
+        assert gzip.decompress(script.variants["gzip"]) == script.data
+        assert script.body("gzip") == (script.variants["gzip"], "gzip")
+        assert image.variants == {}
+        assert image.body("gzip") == (image.data, None)
+
+    def test_auto_reload(self, tmp_path):
+        """Test changed files get a new URL when auto-reloading."""
+        path = tmp_path / "app.css"
+        path.write_text("a {}")
+        assets = StaticAssets(str(tmp_path), auto_reload=True)
+        first = assets.url("app.css")
+
+        path.write_text("b {}")
+        os.utime(path, (0, 0))
+
+        assert assets.url("app.css") != first
+
+    def test_page_rendered_once(self, tmp_path):
+        """Test pages are cached unless auto-reloading."""
+        renders = []
+
+        def render():
+            renders.append(1)
+            return "<html></html>"
+
+        assets = StaticAssets(str(tmp_path))
+        page = assets.page("index.html", render)
+        assert assets.page("index.html", render) is page
+        assert len(renders) == 1
+        assert page.mimetype == "text/html; charset=utf-8"
+
+        StaticAssets(str(tmp_path), auto_reload=True).page("index.html", render)
+        StaticAssets(str(tmp_path), auto_reload=True).page("index.html", render)
+        assert len(renders) == 3
+
+    def test_fingerprint_follows_content(self):
+        """Test identical content gives identical fingerprints."""
+        first = Asset.build("a.css", b"x {}")
+        second = Asset.build("b.css", b"x {}")
+
+        assert first.fingerprint == second.fingerprint
+        assert first.fingerprinted_name == f"a.{first.fingerprint}.css"
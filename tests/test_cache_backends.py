@@ -0,0 +1,239 @@
+"""Tests for the shared render cache backends."""
+
+import os
+import socket
+import socketserver
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from src.cache_backends import (
+    CacheBackend,
+    CacheBackendError,
+    FilesystemBackend,
+    MemoryBackend,
+    RedisBackend,
+    _RespConnection,
+)
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """Minimal RESP server understanding the commands used by RedisBackend."""
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].upper()
+            self.server.commands.append(command)
+            if command in (b"PING", b"SELECT"):
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"AUTH":
+                ok = args[1] == self.server.password
+                self.wfile.write(b"+OK\r\n" if ok else b"-WRONGPASS\r\n")
+            elif command == b"SET":
+                expires_at = time.monotonic() + int(args[4]) / 1000
+                store[args[1]] = (args[2], expires_at)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"GET":
+                value, expires_at = store.get(args[1], (None, 0))
+                if value is None or expires_at <= time.monotonic():
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"DEL":
+                removed = store.pop(args[1], None) is not None
+                self.wfile.write(b":%d\r\n" % removed)
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def resp_server():
+    """Local stand-in for a Redis server."""
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _RespHandler)
+    server.daemon_threads = True
+    server.store = {}
+    server.commands = []
+    server.password = b"secret"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestMemoryBackend:
+    """Test cases for MemoryBackend."""
+
+    def test_set_get_delete(self):
+        """Test values are stored, expired and deleted."""
+        backend = MemoryBackend()
+        backend.set("a", b"1", ttl=60)
+        backend.set("b", b"2", ttl=0)
+
+        assert backend.get("a") == b"1"
+        assert backend.get("b") is None
+
+        backend.delete("a")
+        assert backend.get("a") is None
+
+    def test_lru_bound(self):
+        """Test least recently used values are dropped beyond the budget."""
+        backend = MemoryBackend(max_bytes=8)
+        backend.set("a", b"aaaa", ttl=60)
+        backend.set("b", b"bbbb", ttl=60)
+        backend.get("a")
+        backend.set("c", b"cccc", ttl=60)
+
+        assert backend.get("a") == b"aaaa"
+        assert backend.get("b") is None
+
+
+class TestFilesystemBackend:
+    """Test cases for FilesystemBackend."""
+
+    def test_shared_between_instances(self, tmp_path):
+        """Test values written by one worker are read by another."""
+        FilesystemBackend(str(tmp_path)).set("kroki:render:k", b"data", ttl=60)
+        other = FilesystemBackend(str(tmp_path))
+
+        assert other.get("kroki:render:k") == b"data"
+        other.delete("kroki:render:k")
+        assert other.get("kroki:render:k") is None
+        other.delete("kroki:render:k")
+
+    def test_expiry_and_prune(self, tmp_path):
+        """Test expired values are misses and pruned with the oldest files."""
+        backend = FilesystemBackend(str(tmp_path), max_bytes=30)
+        backend.set("expired", b"x", ttl=-1)
+        backend.set("old", b"o" * 16, ttl=60)
+        backend.set("new", b"n" * 16, ttl=60)
+        os.utime(backend._path("old"), (0, 0))
+
+        assert backend.get("expired") is None
+        backend.prune()
+
+        remaining = [f for _, _, files in os.walk(tmp_path) for f in files]
+        assert len(remaining) == 1
+        assert backend.get("new") == b"n" * 16
+
+    def test_read_error(self, tmp_path):
+        """Test unreadable values raise CacheBackendError."""
+        backend = FilesystemBackend(str(tmp_path))
+        backend.set("k", b"data", ttl=60)
+
+        with patch("builtins.open", side_effect=PermissionError("denied")):
+            with pytest.raises(CacheBackendError):
+                backend.get("k")
+
+
+class TestRedisBackend:
+    """Test cases for RedisBackend against a local RESP server."""
+
+    def test_set_get_delete(self, resp_server):
+        """Test values round-trip with a TTL and connections are reused."""
+        port = resp_server.server_address[1]
+        backend = RedisBackend(f"redis://:secret@127.0.0.1:{port}/2")
+
+        backend.set("k", b"\x00binary\r\n", ttl=60)
+        assert backend.get("k") == b"\x00binary\r\n"
+        assert backend.get("missing") is None
+        backend.delete("k")
+        assert backend.get("k") is None
+
+        assert resp_server.commands.count(b"AUTH") == 1
+        assert resp_server.commands.count(b"SELECT") == 1
+
+    def test_pool_not_shared_after_fork(self, resp_server):
+        """Test a forked process opens its own connections."""
+        port = resp_server.server_address[1]
+        backend = RedisBackend(f"redis://:secret@127.0.0.1:{port}")
+        backend.get("k")
+
+        backend._pid = -1
+        backend.get("k")
+
+        assert resp_server.commands.count(b"AUTH") == 2
+
+    def test_ttl(self, resp_server):
+        """Test values expire after their TTL."""
+        port = resp_server.server_address[1]
+        backend = RedisBackend(f"redis://:secret@127.0.0.1:{port}")
+
+        backend.set("k", b"v", ttl=0.001)
+        time.sleep(0.01)
+
+        assert backend.get("k") is None
+
+    def test_server_error(self, resp_server):
+        """Test error replies raise CacheBackendError."""
+        port = resp_server.server_address[1]
+
+        with pytest.raises(CacheBackendError):
+            RedisBackend(f"redis://:wrong@127.0.0.1:{port}").get("k")
+
+    def test_failed_handshake_closes_connection(self, resp_server):
+        """Test a connection rejected by AUTH is closed, not leaked."""
+        port = resp_server.server_address[1]
+        backend = RedisBackend(f"redis://:wrong@127.0.0.1:{port}")
+
+        with patch.object(_RespConnection, "close", autospec=True) as mock_close:
+            with pytest.raises(CacheBackendError):
+                backend.get("k")
+
+        mock_close.assert_called_once()
+
+    def test_unreachable(self):
+        """Test connection failures raise CacheBackendError."""
+        backend = RedisBackend(f"redis://127.0.0.1:{_unused_port()}", timeout=0.1)
+
+        with pytest.raises(CacheBackendError):
+            backend.get("k")
+
+    def test_invalid_url(self):
+        """Test only redis:// URLs are accepted."""
+        with pytest.raises(ValueError):
+            RedisBackend("http://localhost")
+
+
+class TestFromConfig:
+    """Test cases for CacheBackend.from_config."""
+
+    def test_backends(self, tmp_path):
+        """Test the backend is chosen by name and disabled by default."""
+        assert CacheBackend.from_config({}) is None
+        assert isinstance(
+            CacheBackend.from_config({"RENDER_CACHE_SHARED": "memory"}), MemoryBackend
+        )
+        backend = CacheBackend.from_config(
+            {
+                "RENDER_CACHE_SHARED": "filesystem",
+                "RENDER_CACHE_SHARED_URL": str(tmp_path),
+            }
+        )
+        assert backend.directory == str(tmp_path)
+        backend = CacheBackend.from_config(
+            {
+                "RENDER_CACHE_SHARED": "redis",
+                "RENDER_CACHE_SHARED_URL": "redis://cache:6380/1",
+            }
+        )
+        assert (backend.host, backend.port, backend.db) == ("cache", 6380, 1)
+
+        with pytest.raises(ValueError):
+            CacheBackend.from_config({"RENDER_CACHE_SHARED": "memcached"})
@@ -0,0 +1,123 @@
+"""Tests for canonical diagram sources used as cache keys."""
+
+import json
+
+import pytest
+
+from src.canonicalize import canonical_source
+from src.render_cache import render_key
+from src.validators import dot_tokens
+
+# Variants of one diagram that must share a cache key
+EQUIVALENT = {
+    "mermaid": [
+        "graph TD\n    A-->B\n    B-->C",
+        "graph TD\r\n    A-->B   \r\n    B-->C\r\n",
+        "%% header comment\ngraph TD\n    A-->B\n    %% why\n    B-->C\n\n",
+    ],
+    "plantuml": [
+        "@startuml\nAlice -> Bob: hi\n@enduml",
+        "@startuml\r\n' greet\r\nAlice -> Bob: hi  \r\n@enduml\r\n",
+        "@startuml\n/' multi-line\n   comment '/\nAlice -> Bob: hi\n  ' done\n@enduml",
+    ],
+    "graphviz": [
+        'digraph G { a -> b [label="x  y"] }',
+        'digraph G {\n  a -> b [label="x  y"]\n}\n',
+        '// graph\ndigraph G {\r\n\ta /* from */ -> b\t[label="x  y"]\n}',
+        '#line 1\ndigraph   G {  a ->  b [label="x  y"]   }',
+    ],
+    "excalidraw": [
+        '{"type": "excalidraw", "elements": [{"id": "a", "x": 1}]}',
+        '{\n  "elements": [{"x": 1, "id": "a"}],\n  "type": "excalidraw"\n}\n',
+    ],
+}
+
+# Pairs differing in a way that may change the render
+DISTINCT = [
+    ("mermaid", "mindmap\n  root\n    child", "mindmap\n  root\n  child"),
+    ("mermaid", "%%{init: {'theme': 'dark'}}%%\ngraph TD\nA-->B", "graph TD\nA-->B"),
+    ("mermaid", 'graph TD\nA["a  b"]', 'graph TD\nA["a b"]'),
+    # A theme: anywhere in the source stops the theme injection
+    ("mermaid", "%% theme: x\ngraph TD\nA-->B", "graph TD\nA-->B"),
+    (
+        "plantuml",
+        "@startuml\nA -> B : it's\n@enduml",
+        "@startuml\nA -> B : it\n@enduml",
+    ),
+    ("plantuml", "@startuml\n/' a '/ A -> B\n@enduml", "@startuml\n@enduml"),
+    # Theme preprocessing only applies to sources starting with @startuml
+    (
+        "plantuml",
+        "' note\n@startuml\nA -> B\n@enduml",
+        "@startuml\nA -> B\n@enduml",
+    ),
+    ("plantuml", "\n@startuml\nA -> B\n@enduml", "@startuml\nA -> B\n@enduml"),
+    ("graphviz", 'digraph { a [label="x  y"] }', 'digraph { a [label="x y"] }'),
+    ("graphviz", 'digraph { a [label="//"] }', 'digraph { a [label=""] }'),
+    ("graphviz", "digraph { a -> b }", "digraph { a - > b }"),
+    ("graphviz", "digraph { a <<b>x  y</b>> }", "digraph { a <<b>x y</b>> }"),
+    ("excalidraw", '{"elements": [1, 2]}', '{"elements": [2, 1]}'),
+    ("ditaa", "+--+\n|  |", "+--+\n| |"),
+]
+
+
+class TestCanonicalSource:
+    """Test cases for canonical_source."""
+
+    @pytest.mark.parametrize("diagram_type", sorted(EQUIVALENT))
+    def test_variants_share_a_key(self, diagram_type):
+        """Test variants differing only in comments or whitespace share a key."""
+        keys = {
+            render_key(diagram_type, "svg", source, canonical=True)
+            for source in EQUIVALENT[diagram_type]
+        }
+        assert len(keys) == 1
+
+    @pytest.mark.parametrize("diagram_type, first, second", DISTINCT)
+    def test_significant_changes_keep_distinct_keys(self, diagram_type, first, second):
+        """Test changes that may affect the render never collapse to one key."""
+        assert render_key(diagram_type, "svg", first, canonical=True) != render_key(
+            diagram_type, "svg", second, canonical=True
+        )
+
+    @pytest.mark.parametrize(
+        "diagram_type, source",
+        [(t, s) for t, sources in EQUIVALENT.items() for s in sources],
+    )
+    def test_idempotent(self, diagram_type, source):
+        """Test the canonical form of a canonical form is itself."""
+        canonical = canonical_source(diagram_type, source)
+        assert canonical_source(diagram_type, canonical) == canonical
+
+    @pytest.mark.parametrize("source", EQUIVALENT["graphviz"])
+    def test_dot_variants_tokenize_identically(self, source):
+        """Test DOT variants yield the same token stream as Graphviz would read."""
+
+        def tokens(text):
+            return [(kind, value) for kind, value, _, _ in dot_tokens(text)]
+
+        assert tokens(source) == tokens(EQUIVALENT["graphviz"][0])
+
+    @pytest.mark.parametrize("source", EQUIVALENT["excalidraw"])
+    def test_excalidraw_variants_parse_identically(self, source):
+        """Test Excalidraw variants decode to the same document."""
+        assert json.loads(source) == json.loads(EQUIVALENT["excalidraw"][0])
+
+    def test_unterminated_constructs_are_kept(self):
+        """Test malformed sources are not silently repaired."""
+        assert canonical_source("graphviz", 'a /* b\n  "c') == 'a /* b\n  "c'
+        assert canonical_source("plantuml", "/' open\nA -> B") == "/' open\nA -> B"
+
+    def test_other_types_only_normalise_line_endings(self):
+        """Test ASCII-art sources keep their spacing."""
+        assert canonical_source("ditaa", "+--+  \r\n|  |\r") == "+--+  \n|  |\n"
+
+    def test_key_is_exact_unless_canonical(self):
+        """Test render_key hashes the exact source by default."""
+        first, second = EQUIVALENT["mermaid"][:2]
+        assert render_key("mermaid", "svg", first) != render_key(
+            "mermaid", "svg", second
+        )
+        assert render_key("mermaid", "svg", b"\xff", canonical=True) == render_key(
+            "mermaid", "svg", b"\xff"
+        )
@@ -0,0 +1,207 @@
+"""Tests for cache-aware routing across replicas."""
+
+import gzip
+import time
+
+import pytest
+import requests
+
+from src.cluster import (
+    FORWARDED_HEADER,
+    FORWARDED_SIGNATURE_HEADER,
+    Cluster,
+    ClusterForwardError,
+    HashRing,
+)
+from src.request_log import REQUEST_ID_HEADER
+
+NODES = ["http://a:5000", "http://b:5000", "http://c:5000"]
+
+
+class TestHashRing:
+    """Test cases for HashRing."""
+
+    def test_walk_visits_each_node_once(self):
+        """Test the walk starts at the owner and yields every node once."""
+        ring = HashRing(NODES)
+
+        for key in ("k1", "k2", "k3"):
+            walk = list(ring.walk(key))
+            assert sorted(walk) == sorted(NODES)
+            assert walk[0] == next(ring.walk(key))
+
+    def test_keys_spread_and_stay_put(self):
+        """Test keys spread over nodes and few move when a node joins."""
+        keys = [f"key-{i}" for i in range(3000)]
+        ring = HashRing(NODES)
+        owners = {key: next(ring.walk(key)) for key in keys}
+
+        for node in NODES:
+            assert 700 < list(owners.values()).count(node) < 1300
+
+        grown = HashRing(NODES + ["http://d:5000"])
+        moved = [key for key in keys if next(grown.walk(key)) != owners[key]]
+        assert all(next(grown.walk(key)) == "http://d:5000" for key in moved)
+        assert len(moved) < len(keys) / 3
+
+    def test_empty_ring(self):
+        """Test a ring needs nodes."""
+        with pytest.raises(ValueError):
+            HashRing([])
+
+
+class TestCluster:
+    """Test cases for Cluster."""
+
+    def test_owner_is_stable(self):
+        """Test every replica routes a key to the same owner."""
+        cluster_a = Cluster("http://a:5000/", NODES)
+        cluster_b = Cluster("http://b:5000", NODES)
+
+        node = cluster_a.acquire("key")
+        assert cluster_b.acquire("key") == node
+        assert cluster_a.is_local("http://a:5000")
+
+    def test_bounded_load_spills_to_next_node(self):
+        """Test a loaded owner hands renders to the next replica."""
+        cluster = Cluster("http://a:5000", NODES, load_factor=1.0)
+        owner, second = list(cluster.ring.walk("hot"))[:2]
+
+        assert cluster.acquire("hot") == owner
+        assert cluster.acquire("hot") == second
+        assert cluster.loads()[owner] == 1
+
+        cluster.release(second)
+        cluster.release(owner)
+        assert cluster.acquire("hot") == owner
+
+    def test_from_config(self):
+        """Test routing is enabled by listing peers and this replica."""
+        assert Cluster.from_config({}) is None
+        assert Cluster.from_config({"CLUSTER_PEERS": ",".join(NODES)}) is None
+
+        cluster = Cluster.from_config(
+            {
+                "CLUSTER_PEERS": "http://b:5000, http://c:5000",
+                "CLUSTER_SELF_URL": "http://a:5000",
+                "CLUSTER_LOAD_FACTOR": 2,
+                "SECRET_KEY": "key",
+            }
+        )
+        assert sorted(cluster.ring.nodes) == NODES
+        assert cluster.load_factor == 2
+
+        with pytest.raises(ValueError):
+            Cluster.from_config(
+                {"CLUSTER_PEERS": "http://b:5000", "CLUSTER_SELF_URL": "http://a:5000"}
+            )
+
+    def test_from_config_needs_shared_permalinks(self):
+        """Test per-replica permalink stores are refused in cluster mode."""
+        config = {
+            "CLUSTER_PEERS": "http://b:5000",
+            "CLUSTER_SELF_URL": "http://a:5000",
+            "SECRET_KEY": "key",
+        }
+
+        for store in ("memory", "filesystem"):
+            with pytest.raises(ValueError):
+                Cluster.from_config({**config, "PERMALINK_STORE": store})
+        assert Cluster.from_config(
+            {**config, "PERMALINK_STORE": "filesystem", "PERMALINK_SHARED": True}
+        )
+
+    def test_is_peer(self):
+        """Test only other replicas of the ring are peers."""
+        cluster = Cluster("http://a:5000", NODES)
+
+        assert cluster.is_peer("http://b:5000/")
+        assert not cluster.is_peer("http://a:5000")
+        assert not cluster.is_peer("http://d:5000")
+        assert not cluster.is_peer("")
+
+    def test_is_forwarded(self):
+        """Test only fresh requests signed by a peer with the shared key count."""
+        receiver = Cluster("http://a:5000", NODES, secret="key")
+        sender = Cluster("http://b:5000", NODES, secret="key")
+        outsider = Cluster("http://b:5000", NODES, secret="other")
+
+        def headers(signer, lane="interactive", **changes):
+            signed = {
+                FORWARDED_HEADER: "http://b:5000",
+                REQUEST_ID_HEADER: "r1",
+                "X-Kroki-Client": "interactive",
+                FORWARDED_SIGNATURE_HEADER: signer.sign("r1", lane),
+            }
+            return {**signed, **changes}
+
+        assert receiver.is_forwarded(headers(sender))
+        assert not receiver.is_forwarded(headers(outsider))
+        assert not receiver.is_forwarded(headers(sender, lane="batch"))
+        assert not receiver.is_forwarded(headers(sender, **{FORWARDED_HEADER: "x"}))
+        assert not receiver.is_forwarded(
+            headers(sender, **{FORWARDED_SIGNATURE_HEADER: "1:bad"})
+        )
+        stale = sender.sign("r1", "interactive", int(time.time()) - 120)
+        assert not receiver.is_forwarded(
+            headers(sender, **{FORWARDED_SIGNATURE_HEADER: stale})
+        )
+        assert not receiver.is_forwarded({FORWARDED_HEADER: "http://b:5000"})
+
+
+class TestForward:
+    """Test cases for Cluster.forward."""
+
+    def test_relays_response_unchanged(self, requests_mock):
+        """Test the request is tagged and the encoded body is relayed as is."""
+        body = gzip.compress(b"<svg/>")
+        requests_mock.post(
+            "http://b:5000/api/generate",
+            content=body,
+            headers={
+                "Content-Type": "image/svg+xml",
+                "Content-Encoding": "gzip",
+                "ETag": '"abc"',
+                "Server": "peer",
+            },
+        )
+        cluster = Cluster("http://a:5000", NODES, secret="key")
+
+        forwarded = cluster.forward(
+            "http://b:5000",
+            "/api/generate",
+            b"{}",
+            {"Content-Type": "application/json", "Cookie": "secret"},
+        )
+
+        assert forwarded.status == 200
+        assert forwarded.body == body
+        assert forwarded.headers == {
+            "Content-Type": "image/svg+xml",
+            "Content-Encoding": "gzip",
+            "ETag": '"abc"',
+        }
+        sent = requests_mock.last_request
+        assert sent.headers[FORWARDED_HEADER] == "http://a:5000"
+        assert "Cookie" not in sent.headers
+        assert Cluster("http://b:5000", NODES, secret="key").is_forwarded(sent.headers)
+
+    def test_client_errors_are_relayed(self, requests_mock):
+        """Test a peer's 4xx answer is a response, not a failure."""
+        requests_mock.post("http://b:5000/api/generate", status_code=400, json={})
+        cluster = Cluster("http://a:5000", NODES)
+
+        assert cluster.forward("http://b:5000", "/api/generate", b"", {}).status == 400
+
+    def test_failures(self, requests_mock):
+        """Test unreachable or failing peers raise ClusterForwardError."""
+        cluster = Cluster("http://a:5000", NODES)
+        requests_mock.post("http://b:5000/api/generate", status_code=503)
+        requests_mock.post(
+            "http://c:5000/api/generate", exc=requests.exceptions.ConnectTimeout
+        )
+
+        with pytest.raises(ClusterForwardError):
+            cluster.forward("http://b:5000", "/api/generate", b"", {})
+        with pytest.raises(ClusterForwardError):
+            cluster.forward("http://c:5000", "/api/generate", b"", {})
@@ -0,0 +1,50 @@
+"""Tests for response compression helpers."""
+
+import pytest
+
+from src.compression import (
+    ENCODING_BROTLI,
+    ENCODING_GZIP,
+    choose_encoding,
+    compress,
+    decompress,
+)
+
+
+class TestChooseEncoding:
+    """Test cases for Accept-Encoding negotiation."""
+
+    def test_no_header_means_identity(self):
+        """Test a missing header selects no encoding."""
+        assert choose_encoding(None, [ENCODING_GZIP]) is None
+        assert choose_encoding("", [ENCODING_GZIP]) is None
+
+    def test_preference_order_and_quality(self):
+        """Test server preference applies among equally weighted encodings."""
+        available = [ENCODING_BROTLI, ENCODING_GZIP]
+        assert choose_encoding("gzip, deflate, br", available) == ENCODING_BROTLI
+        assert choose_encoding("gzip;q=1.0, br;q=0.5", available) == ENCODING_GZIP
+        assert choose_encoding("deflate", available) is None
+
+    def test_zero_quality_and_wildcard(self):
+        """Test q=0 refuses an encoding and * matches the others."""
+        available = [ENCODING_BROTLI, ENCODING_GZIP]
+        assert choose_encoding("br;q=0, *", available) == ENCODING_GZIP
+        assert choose_encoding("*;q=0", available) is None
+
+
+class TestCodecs:
+    """Test cases for compress/decompress."""
+
+    def test_gzip_round_trip_is_deterministic(self):
+        """Test gzip output is stable and reversible."""
+        data = b"<svg>" + b"<g/>" * 100 + b"</svg>"
+        compressed = compress(data, ENCODING_GZIP)
+        assert compressed == compress(data, ENCODING_GZIP)
+        assert len(compressed) < len(data)
+        assert decompress(compressed, ENCODING_GZIP) == data
+
+    def test_unknown_encoding(self):
+        """Test unsupported encodings are rejected."""
+        with pytest.raises(ValueError):
+            compress(b"data", "compress")
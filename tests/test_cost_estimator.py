@@ -0,0 +1,131 @@
+"""Tests for the render-cost estimator."""
+
+import json
+
+import pytest
+
+from src.cost_estimator import CostEstimate, CostEstimator
+from src.scheduler import LANE_API, LANE_BATCH, LANE_INTERACTIVE
+
+
+def chain(count):
+    """DOT graph with ``count`` nodes in a chain."""
+    edges = "\n".join(f"  n{i} -> n{i + 1} [color=red];" for i in range(count - 1))
+    return f'digraph G {{\n  node [shape=box]\n{edges}\n  n0 [label="start"]\n}}'
+
+
+class TestFeatures:
+    """Test cases for per-type feature counts."""
+
+    def test_dot_counts_nodes_edges_and_clusters(self):
+        """Test attribute names, values and graph names are not counted as nodes."""
+        estimate = CostEstimator().estimate(
+            "graphviz",
+            'digraph G { a -> b -> c; subgraph cluster_x { d -> a } e [label="x"] }',
+        )
+        assert estimate.features == {"nodes": 5, "edges": 3, "clusters": 1}
+
+    def test_mermaid_counts_links_and_participants(self):
+        """Test Mermaid links, declarations and statements are counted."""
+        estimate = CostEstimator().estimate(
+            "mermaid",
+            "sequenceDiagram\n  participant A\n  actor B\n  A->>B: hi\n"
+            "  %% comment\n  B-->>A: yo",
+        )
+        assert estimate.features == {"statements": 5, "edges": 2, "participants": 2}
+
+    def test_plantuml_ignores_arrows_in_strings(self):
+        """Test arrows inside quoted labels are not edges."""
+        estimate = CostEstimator().estimate(
+            "plantuml",
+            '@startuml\nactor U\nU -> S: "a -> b"\nS ..> U\n\' c -> d\n@enduml',
+        )
+        assert estimate.features["edges"] == 2
+        assert estimate.features["participants"] == 1
+
+    def test_excalidraw_counts_elements_and_points(self):
+        """Test Excalidraw scenes are scored by elements and path points."""
+        scene = {
+            "elements": [
+                {"type": "line", "points": [[0, 0], [1, 1], [2, 0]]},
+                {"type": "rectangle"},
+            ]
+        }
+        estimate = CostEstimator().estimate("excalidraw", json.dumps(scene))
+        assert estimate.features == {"elements": 2, "points": 3}
+
+    def test_fallbacks(self):
+        """Test malformed sources and other types are scored by line count."""
+        estimator = CostEstimator()
+        assert estimator.estimate("graphviz", 'digraph { a [label="x').features == {
+            "lines": 1
+        }
+        assert estimator.estimate("ditaa", "+--+\n\n|  |\n").features == {"lines": 2}
+        assert estimator.estimate_size("graphviz", 4000).features == {"lines": 100}
+
+    def test_complexity_grows_with_structure(self):
+        """Test a larger graph predicts a longer render than a smaller one."""
+        estimator = CostEstimator()
+        small = estimator.estimate("graphviz", chain(10))
+        large = estimator.estimate("graphviz", chain(1000))
+        assert large.complexity > 50 * small.complexity
+        assert large.seconds > small.seconds
+
+
+class TestPolicy:
+    """Test cases for timeouts, lanes and the complexity ceiling."""
+
+    def estimate(self, seconds, complexity=10):
+        """Build an estimate with a given prediction."""
+        return CostEstimate("graphviz", complexity=complexity, seconds=seconds)
+
+    def test_timeout_is_bounded_multiple_of_prediction(self):
+        """Test the timeout scales with the prediction within bounds."""
+        estimator = CostEstimator(timeout_factor=4, min_timeout=5, max_timeout=60)
+        assert estimator.timeout_for(self.estimate(0.1)) == 5
+        assert estimator.timeout_for(self.estimate(3)) == 12
+        assert estimator.timeout_for(self.estimate(100)) == 60
+
+    def test_heavy_renders_move_one_lane_down(self):
+        """Test slow renders are demoted and fast ones keep their lane."""
+        estimator = CostEstimator(heavy_seconds=2)
+        assert estimator.lane_for(self.estimate(0.5), LANE_INTERACTIVE) == (
+            LANE_INTERACTIVE
+        )
+        assert estimator.lane_for(self.estimate(2), LANE_INTERACTIVE) == LANE_API
+        assert estimator.lane_for(self.estimate(5), LANE_API) == LANE_BATCH
+        assert estimator.lane_for(self.estimate(5), LANE_BATCH) == LANE_BATCH
+        assert CostEstimator(heavy_seconds=0).lane_for(self.estimate(5), LANE_API) == (
+            LANE_API
+        )
+
+    def test_ceiling(self):
+        """Test the ceiling only applies when configured."""
+        assert not CostEstimator().exceeds_ceiling(self.estimate(1, complexity=1e9))
+        estimator = CostEstimator(max_complexity=100)
+        assert estimator.exceeds_ceiling(self.estimate(1, complexity=101))
+        assert not estimator.exceeds_ceiling(self.estimate(1, complexity=100))
+
+    def test_observe_recalibrates_towards_observed_latency(self):
+        """Test repeated observations shrink the prediction error."""
+        estimator = CostEstimator(smoothing=0.5)
+        source = chain(200)
+        first = estimator.estimate("graphviz", source)
+        observed = first.seconds * 3
+
+        errors = []
+        for _ in range(10):
+            estimate = estimator.estimate("graphviz", source)
+            errors.append(abs(estimator.observe(estimate, observed)))
+
+        assert errors[0] == pytest.approx(observed - first.seconds)
+        assert errors[-1] < errors[0] / 100
+
+    def test_from_config(self):
+        """Test the estimator is opt-in and reads its settings."""
+        assert CostEstimator.from_config({}) is None
+        estimator = CostEstimator.from_config(
+            {"COST_ESTIMATE": True, "COST_MAX_COMPLEXITY": 500, "COST_MAX_TIMEOUT": 30}
+        )
+        assert estimator.max_complexity == 500
+        assert estimator.max_timeout == 30
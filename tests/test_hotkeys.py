@@ -0,0 +1,192 @@
+"""Tests for hot diagram tracking and pre-rendering."""
+
+import json
+from unittest.mock import patch
+
+from src.hotkeys import (
+    CountMinSketch,
+    HotKeyRefresher,
+    HotKeys,
+    HotRender,
+    settings_fingerprint,
+)
+from src.main import create_app
+from src.metrics import Metrics
+from src.render_cache import RenderCache
+
+
+class TestCountMinSketch:
+    """Test cases for CountMinSketch."""
+
+    def test_estimates_never_undercount(self):
+        """Test estimates are at least the true counts."""
+        sketch = CountMinSketch(width=64, depth=4)
+        for i in range(500):
+            sketch.add(f"key-{i % 50}")
+
+        assert all(sketch.estimate(f"key-{i}") >= 10 for i in range(50))
+        assert sketch.add("key-0", 5) >= 15
+
+    def test_halve(self):
+        """Test halving ages every count."""
+        sketch = CountMinSketch()
+        sketch.add("a", 9)
+        sketch.halve()
+        assert sketch.estimate("a") == 4
+
+
+class TestHotKeys:
+    """Test cases for HotKeys."""
+
+    def test_top_k(self):
+        """Test the most requested renders are kept, hottest first."""
+        hotkeys = HotKeys(capacity=2)
+        for key, times in (("a", 3), ("b", 1), ("c", 5)):
+            for _ in range(times):
+                hotkeys.record(key, "graphviz", "svg", f"digraph {{ {key} }}")
+
+        top = hotkeys.top()
+        assert [hot.key for hot in top] == ["c", "a"]
+        assert top[0].count == 5
+        assert top[0].diagram_source == "digraph { c }"
+        assert [hot.key for hot in hotkeys.top(1)] == ["c"]
+        assert hotkeys.recorded == 9
+
+    def test_unkeepable_sources_are_only_counted(self):
+        """Test streamed, binary or oversized sources stay out of the top-K."""
+        hotkeys = HotKeys(capacity=4, max_source_bytes=10)
+        with open(__file__, "rb") as f:
+            hotkeys.record("file", "graphviz", "png", f)
+        hotkeys.record("binary", "graphviz", "png", b"\xff\xfe")
+        hotkeys.record("large", "graphviz", "png", "x" * 11)
+        hotkeys.record("bytes", "graphviz", "png", b"digraph {}")
+
+        assert [hot.key for hot in hotkeys.top()] == ["bytes"]
+        assert hotkeys.top()[0].diagram_source == "digraph {}"
+        assert hotkeys.sketch.estimate("large") == 1
+
+    def test_decay(self):
+        """Test counts are halved after decay_after requests."""
+        hotkeys = HotKeys(decay_after=4)
+        for _ in range(4):
+            hotkeys.record("a", "graphviz", "svg", "digraph {}")
+
+        assert hotkeys.top()[0].count == 2
+
+    def test_summary_omits_source(self):
+        """Test the admin summary reports the source size only."""
+        hot = HotRender("k", "graphviz", "svg", "digraph {}", None, 3)
+        assert hot.summary() == {
+            "key": "k",
+            "diagram_type": "graphviz",
+            "output_format": "svg",
+            "theme": None,
+            "count": 3,
+            "source_bytes": 10,
+        }
+
+    def test_from_config(self):
+        """Test tracking is disabled unless a top-K size is set."""
+        assert HotKeys.from_config({}) is None
+        assert HotKeys.from_config({"HOTKEYS_TOP_K": 8}).capacity == 8
+
+
+class TestHotKeyRefresher:
+    """Test cases for HotKeyRefresher."""
+
+    def _app(self, **config):
+        app = create_app("testing")
+        app.config.update({"KROKI_URL": "http://test-kroki:8000", **config})
+        app.extensions["render_cache"] = RenderCache(max_bytes=10000)
+        return app
+
+    def test_refresh_keeps_renders_cached(self, requests_mock):
+        """Test hot renders are rendered once, then refreshed from the cache."""
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        hotkeys = HotKeys()
+        hotkeys.record("k", "graphviz", "png", "digraph { a }")
+        metrics = Metrics()
+        refresher = HotKeyRefresher(self._app(), hotkeys, metrics=metrics)
+
+        assert refresher.refresh() == 1
+        assert refresher.refresh() == 1
+
+        assert requests_mock.call_count == 1
+        assert metrics.get("hotkeys_refresh_total", result="refreshed") == 2
+
+    def test_settings_change_rerenders(self, requests_mock):
+        """Test hot renders are rendered again when render settings change."""
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        app = self._app()
+        hotkeys = HotKeys()
+        hotkeys.record("k", "graphviz", "png", "digraph { a }")
+        metrics = Metrics()
+        refresher = HotKeyRefresher(app, hotkeys, metrics=metrics)
+        refresher.refresh()
+
+        app.config["SVG_PRECISION"] = 1
+        refresher.refresh()
+        refresher.refresh()
+
+        assert requests_mock.call_count == 2
+        assert metrics.get("hotkeys_refresh_total", result="rerendered") == 1
+        assert refresher.fingerprint == settings_fingerprint(app.config)
+
+    def test_failures_are_counted(self, requests_mock):
+        """Test a failing render does not stop the pass."""
+        requests_mock.post("http://test-kroki:8000/graphviz/png", status_code=400)
+        hotkeys = HotKeys()
+        hotkeys.record("k", "graphviz", "png", "digraph { a }")
+        metrics = Metrics()
+
+        assert HotKeyRefresher(self._app(), hotkeys, metrics=metrics).refresh() == 0
+        assert metrics.get("hotkeys_refresh_total", result="failed") == 1
+
+    def test_state_survives_restart(self, tmp_path, requests_mock):
+        """Test a new process warms the saved renders with its new settings."""
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        state_file = str(tmp_path / "hotkeys.json")
+        hotkeys = HotKeys()
+        hotkeys.record("k", "graphviz", "png", "digraph { a }")
+        HotKeyRefresher(self._app(), hotkeys, state_file=state_file).refresh()
+
+        with open(state_file) as f:
+            saved = json.load(f)
+        assert saved["renders"][0]["key"] == "k"
+
+        restarted = HotKeys()
+        refresher = HotKeyRefresher(
+            self._app(DIAGRAM_THEME="dark"), restarted, state_file=state_file
+        )
+        assert [hot.key for hot in restarted.top()] == ["k"]
+        assert refresher.fingerprint == saved["fingerprint"]
+        with patch("src.hotkeys.KrokiClient.invalidate") as mock_invalidate:
+            refresher.refresh()
+        mock_invalidate.assert_called_once_with("graphviz", "png", "digraph { a }")
+
+    def test_corrupt_state_is_ignored(self, tmp_path):
+        """Test an unreadable state file starts an empty tracker."""
+        state_file = tmp_path / "hotkeys.json"
+        state_file.write_text("{not json")
+        hotkeys = HotKeys()
+
+        HotKeyRefresher(self._app(), hotkeys, state_file=str(state_file))
+
+        assert hotkeys.top() == []
+
+    def test_from_config(self):
+        """Test the refresher needs tracking and a positive interval."""
+        app = self._app(HOTKEYS_REFRESH_INTERVAL=0)
+        assert HotKeyRefresher.from_config(app, HotKeys()) is None
+        assert HotKeyRefresher.from_config(self._app(), None) is None
+        assert HotKeyRefresher.from_config(self._app(), HotKeys()).interval == 60
+
+    def test_thread_starts_per_process(self):
+        """Test the refresh thread starts on the first request only."""
+        refresher = HotKeyRefresher(self._app(), HotKeys())
+
+        with patch("src.hotkeys.threading.Thread") as mock_thread:
+            refresher.request_started()
+            refresher.request_started()
+
+        mock_thread.return_value.start.assert_called_once()
@@ -0,0 +1,103 @@
+"""Tests for streaming request ingestion."""
+
+import gzip
+import io
+import zlib
+
+import pytest
+
+from src.ingest import (
+    InvalidBodyError,
+    PayloadTooLargeError,
+    UnsupportedEncodingError,
+    close_payload,
+    payload_size,
+    read_body,
+)
+
+
+class TestReadBody:
+    """Test cases for read_body."""
+
+    def test_small_body_returned_as_bytes(self):
+        """Test bodies under the spool threshold come back as bytes."""
+        body = read_body(io.BytesIO(b"digraph {}"), limit=100, spool_threshold=50)
+        assert body == b"digraph {}"
+
+    def test_large_body_spooled(self):
+        """Test bodies over the spool threshold stay in a rewound file."""
+        body = read_body(io.BytesIO(b"x" * 100), limit=1000, spool_threshold=10)
+        try:
+            assert payload_size(body) == 100
+            assert body.read() == b"x" * 100
+        finally:
+            close_payload(body)
+        assert body.closed
+
+    def test_declared_length_rejected_before_reading(self):
+        """Test a Content-Length over the limit is refused without reading."""
+        stream = io.BytesIO(b"x" * 10)
+        with pytest.raises(PayloadTooLargeError):
+            read_body(stream, limit=5, spool_threshold=5, content_length=10)
+        assert stream.tell() == 0
+
+    def test_undeclared_length_cut_off(self):
+        """Test a body without Content-Length is cut off at the limit."""
+        with pytest.raises(PayloadTooLargeError) as exc_info:
+            read_body(io.BytesIO(b"x" * 200_000), limit=100_000, spool_threshold=10)
+        assert exc_info.value.limit == 100_000
+
+
+class TestCompressedBody:
+    """Test cases for Content-Encoding request bodies."""
+
+    SOURCE = b"@startuml\n" + b"A -> B: hello\n" * 500 + b"@enduml"
+
+    @pytest.mark.parametrize(
+        "encoding,compressor",
+        [
+            ("gzip", gzip.compress),
+            ("deflate", zlib.compress),
+            ("deflate", lambda data: zlib.compress(data)[2:-4]),  # raw deflate
+        ],
+    )
+    def test_decompressed(self, encoding, compressor):
+        """Test gzip, zlib and raw deflate bodies are decoded."""
+        body = read_body(
+            io.BytesIO(compressor(self.SOURCE)),
+            limit=100_000,
+            spool_threshold=100_000,
+            content_encoding=encoding,
+        )
+        assert body == self.SOURCE
+
+    def test_bomb_stopped_at_limit(self):
+        """Test the limit applies to the decompressed size."""
+        bomb = gzip.compress(b"\0" * 10_000_000)
+        assert len(bomb) < 20_000
+        with pytest.raises(PayloadTooLargeError):
+            read_body(
+                io.BytesIO(bomb),
+                limit=100_000,
+                spool_threshold=100_000,
+                content_length=len(bomb),
+                content_encoding="gzip",
+            )
+
+    def test_corrupt_and_truncated(self):
+        """Test undecodable bodies are rejected."""
+        compressed = gzip.compress(self.SOURCE)
+        with pytest.raises(InvalidBodyError):
+            read_body(io.BytesIO(b"not gzip"), 1000, 1000, content_encoding="gzip")
+        with pytest.raises(InvalidBodyError):
+            read_body(
+                io.BytesIO(compressed[: len(compressed) // 2]),
+                100_000,
+                100_000,
+                content_encoding="gzip",
+            )
+
+    def test_unsupported_encoding(self):
+        """Test unknown content codings are refused."""
+        with pytest.raises(UnsupportedEncodingError):
+            read_body(io.BytesIO(b"data"), 1000, 1000, content_encoding="br")
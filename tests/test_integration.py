@@ -4,7 +4,10 @@ import pytest
 import requests
 import time
 import json
+import os
 
+from src.svg_normalizer import SvgNormalizer
+from tests.test_canonicalize import EQUIVALENT
 
 pytestmark = pytest.mark.integration
 
@@ -182,3 +185,34 @@ Bob -> Alice: Hi there!
         assert response_time < 2.0  # Health check should be fast
 
         print(f"Health check response time: {response_time:.3f}s")
+
+
+class TestCanonicalRenders:
+    """Renders of sources sharing a canonical cache key, straight from Kroki."""
+
+    @pytest.fixture(scope="class")
+    def kroki_url(self):
+        """Base URL of the Kroki service, skipping when unreachable."""
+        url = os.getenv("KROKI_URL", "http://localhost:8000")
+        try:
+            requests.get(f"{url}/health", timeout=5)
+        except requests.exceptions.RequestException:
+            pytest.skip(f"Kroki not reachable at {url}")
+        return url
+
+    @pytest.mark.parametrize("diagram_type", sorted(EQUIVALENT))
+    def test_equivalent_sources_render_identically(self, kroki_url, diagram_type):
+        """Test every variant of a canonical source renders to the same SVG."""
+        normalizer = SvgNormalizer()
+        renders = set()
+        for source in EQUIVALENT[diagram_type]:
+            response = requests.post(
+                f"{kroki_url}/{diagram_type}/svg",
+                data=source.encode("utf-8"),
+                headers={"Content-Type": "text/plain"},
+                timeout=30,
+            )
+            assert response.status_code == 200
+            renders.add(normalizer.normalize(response.content))
+
+        assert len(renders) == 1
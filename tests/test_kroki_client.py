@@ -1,8 +1,30 @@
 """Tests for Kroki client."""
 
+import base64
+import io
+import re
+import zlib
 import pytest
 import requests
-from src.kroki_client import KrokiClient, KrokiError
+from unittest.mock import MagicMock
+from src.kroki_client import (
+    KrokiTooComplexError,
+    KrokiBusyError,
+    KrokiCancelledError,
+    KrokiClient,
+    KrokiError,
+    KrokiSyntaxError,
+)
+from src.compression import decompress
+from src.cost_estimator import CostEstimator
+from src.metrics import Metrics
+from src.request_log import RequestLog
+from src.render_cache import VARIANT_OPTIMIZED, VARIANT_RAW, NegativeCache, RenderCache
+from src.scheduler import LANE_API, LANE_BATCH, LANE_INTERACTIVE, PriorityScheduler
+from src.svg_normalizer import SvgNormalizer
+from src.svg_optimizer import SvgOptimizer
+from src.tracing import Trace
+from src.validators import PreflightValidator
 
 
 class TestKrokiClient:
@@ -228,3 +250,461 @@ class TestKrokiClient:
 
         assert result_data == mock_image_data
         assert content_type == "image/png"
+
+    def test_generate_diagram_busy(self, requests_mock):
+        """Test scheduler saturation is reported as KrokiBusyError."""
+        scheduler = PriorityScheduler(max_concurrency=1, max_queue=0)
+        scheduler.acquire(LANE_INTERACTIVE)
+        client = KrokiClient(
+            "http://test-kroki:8000", timeout=5, lane=LANE_BATCH, scheduler=scheduler
+        )
+
+        with pytest.raises(KrokiBusyError, match="Server busy"):
+            client.generate_diagram("mermaid", "png", "graph TD\nA --> B")
+        assert requests_mock.call_count == 0
+
+    def test_generate_diagram_uses_scheduler_slot(self, requests_mock):
+        """Test the upstream call holds a scheduler slot for its lane."""
+        scheduler = PriorityScheduler(max_concurrency=2)
+        requests_mock.post("http://test-kroki:8000/mermaid/png", content=b"png")
+        client = KrokiClient(
+            "http://test-kroki:8000", lane=LANE_INTERACTIVE, scheduler=scheduler
+        )
+
+        client.generate_diagram("mermaid", "png", "graph TD\nA --> B")
+
+        stats = scheduler.stats()
+        assert stats["completed"][LANE_INTERACTIVE] == 1
+        assert stats["in_flight"][LANE_INTERACTIVE] == 0
+
+    def test_cost_estimate_sets_timeout_and_lane(self, requests_mock):
+        """Test a heavy render gets a longer timeout and a lower lane."""
+        scheduler = PriorityScheduler(max_concurrency=2)
+        metrics = Metrics()
+        estimator = CostEstimator(min_timeout=1, heavy_seconds=1)
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        client = KrokiClient(
+            "http://test-kroki:8000",
+            lane=LANE_INTERACTIVE,
+            scheduler=scheduler,
+            cost_estimator=estimator,
+            metrics=metrics,
+        )
+        edges = "".join(f"n{i} -> n{i + 1};" for i in range(300))
+
+        client.generate_diagram("graphviz", "svg", "digraph { a -> b }")
+        assert requests_mock.last_request.timeout == 1
+        client.generate_diagram("graphviz", "svg", f"digraph {{ {edges} }}")
+
+        assert requests_mock.last_request.timeout > 4
+        stats = scheduler.stats()["completed"]
+        assert stats[LANE_INTERACTIVE] == 1 and stats[LANE_API] == 1
+        assert metrics.get("render_cost_lane_changes_total", lane=LANE_API) == 1
+        summary = metrics.summary("render_cost_error_seconds", diagram_type="graphviz")
+        assert summary["count"] == 2
+
+    def test_cost_ceiling_rejects_without_calling_kroki(self, requests_mock):
+        """Test a diagram above the complexity ceiling is refused."""
+        metrics = Metrics()
+        client = KrokiClient(
+            "http://test-kroki:8000",
+            cost_estimator=CostEstimator(max_complexity=10),
+            metrics=metrics,
+        )
+        edges = "".join(f"n{i} -> n{i + 1};" for i in range(10))
+
+        with pytest.raises(KrokiTooComplexError, match="exceeds the limit of 10"):
+            client.generate_diagram("graphviz", "svg", f"digraph {{ {edges} }}")
+
+        assert requests_mock.call_count == 0
+        assert metrics.get("render_cost_rejected_total", diagram_type="graphviz") == 1
+
+    def test_request_id_forwarded(self, requests_mock):
+        """Test the request ID is sent to Kroki and stages are timed."""
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        log = RequestLog("req-42")
+        client = KrokiClient("http://test-kroki:8000", request_log=log)
+
+        client.generate_diagram("graphviz", "svg", "digraph { a -> b }")
+
+        assert requests_mock.last_request.headers["X-Request-ID"] == "req-42"
+        assert {"queue", "upstream", "postprocess"} <= set(log.stages)
+
+    def test_trace_spans(self, requests_mock):
+        """Test a traced render records its spans, upstream phases nested."""
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        trace = Trace("req-42", "POST /api/generate")
+        client = KrokiClient(
+            "http://test-kroki:8000", cache=RenderCache(max_bytes=10000), trace=trace
+        )
+
+        client.generate_diagram("graphviz", "svg", "digraph { a -> b }")
+
+        spans = {span.name: span for span in trace.spans}
+        assert list(spans) == [
+            "validate",
+            "cache",
+            "preprocess",
+            "queue",
+            "upstream",
+            "upstream.wait",
+            "upstream.receive",
+            "postprocess",
+        ]
+        assert spans["cache"].attributes == {"result": "miss"}
+        assert spans["upstream.wait"].parent_id == spans["upstream"].span_id
+        assert spans["upstream.receive"].attributes == {"bytes": 6}
+
+    def test_cancelled_before_upstream(self, requests_mock):
+        """Test a render superseded while queued never reaches Kroki."""
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        scheduler = PriorityScheduler(max_concurrency=1, max_queue=0)
+        client = KrokiClient(
+            "http://test-kroki:8000", scheduler=scheduler, cancelled=lambda: True
+        )
+
+        with pytest.raises(KrokiCancelledError):
+            client.generate_diagram("graphviz", "svg", "digraph { a -> b }")
+
+        assert not requests_mock.called
+        # The slot was given back
+        with scheduler.slot(LANE_API):
+            pass
+
+    def test_preprocess_mermaid_request_theme(self):
+        """Test the per-request theme overrides the configured theme."""
+        client = KrokiClient("http://test-kroki:8000", theme="dark")
+        result = client._preprocess_mermaid("graph TD\nA --> B")
+        assert result.startswith("%%{init: {'theme': 'dark'}}%%")
+
+    def test_generate_diagram_served_from_cache(self, requests_mock):
+        """Test a cached render is returned without calling Kroki."""
+        cache = RenderCache(max_bytes=10000)
+        metrics = Metrics()
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        client = KrokiClient("http://test-kroki:8000", cache=cache, metrics=metrics)
+
+        first = client.generate_diagram("graphviz", "png", "digraph { A -> B }")
+        second = client.generate_diagram("graphviz", "png", "digraph { A -> B }")
+
+        assert first == second == (b"png", "image/png")
+        assert requests_mock.call_count == 1
+        assert (
+            metrics.get(
+                "render_cache_requests_total", result="hit", output_format="png"
+            )
+            == 1
+        )
+
+    def test_invalidate(self, requests_mock):
+        """Test an invalidated render is rendered again."""
+        cache = RenderCache(max_bytes=10000)
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        client = KrokiClient("http://test-kroki:8000", cache=cache)
+
+        client.generate_diagram("graphviz", "png", "digraph { A -> B }")
+        client.invalidate("graphviz", "png", "digraph { A -> B }")
+        client.generate_diagram("graphviz", "png", "digraph { A -> B }")
+
+        assert requests_mock.call_count == 2
+
+    def test_generate_diagram_cache_key_includes_theme(self, requests_mock):
+        """Test Mermaid renders with different themes are cached separately."""
+        cache = RenderCache(max_bytes=10000)
+        requests_mock.post("http://test-kroki:8000/mermaid/svg", content=b"<svg/>")
+
+        KrokiClient(
+            "http://test-kroki:8000", theme="dark", cache=cache
+        ).generate_diagram("mermaid", "svg", "graph TD\nA --> B")
+        KrokiClient(
+            "http://test-kroki:8000", theme="forest", cache=cache
+        ).generate_diagram("mermaid", "svg", "graph TD\nA --> B")
+
+        assert requests_mock.call_count == 2
+
+    def test_generate_diagram_svg_optimized_and_cached(self, requests_mock):
+        """Test SVG post-processing result is cached next to the raw render."""
+        raw_svg = (
+            b'<svg xmlns="http://www.w3.org/2000/svg">\n  <!-- c -->\n  <g/>\n</svg>'
+        )
+        cache = RenderCache(max_bytes=10000)
+        metrics = Metrics()
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=raw_svg)
+        client = KrokiClient(
+            "http://test-kroki:8000",
+            cache=cache,
+            svg_optimizer=SvgOptimizer(),
+            metrics=metrics,
+        )
+
+        data, content_type = client.generate_diagram("graphviz", "svg", "digraph {}")
+
+        assert data == b'<svg xmlns="http://www.w3.org/2000/svg"><g/></svg>'
+        assert content_type == "image/svg+xml"
+        entry = next(iter(cache._entries.values()))
+        assert entry.variants[VARIANT_RAW] == raw_svg
+        assert entry.variants[VARIANT_OPTIMIZED] == data
+        assert metrics.get("svg_optimize_bytes_saved_total") == len(raw_svg) - len(data)
+
+    def test_generate_diagram_png_optimized_in_background(self, requests_mock):
+        """Test PNG renders are served raw and optimised off the request path."""
+        cache = RenderCache(max_bytes=10000)
+        png_optimizer = MagicMock()
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        client = KrokiClient(
+            "http://test-kroki:8000", cache=cache, png_optimizer=png_optimizer
+        )
+
+        data, _ = client.generate_diagram("graphviz", "png", "digraph {}")
+
+        assert data == b"png"
+        key = next(iter(cache._entries))
+        png_optimizer.submit.assert_called_once_with(key, b"png")
+
+    def test_generate_encoded_caches_compressed_variant(self, requests_mock):
+        """Test compressed SVG is cached and reused on later hits."""
+        svg = b"<svg>" + b"<g/>" * 100 + b"</svg>"
+        cache = RenderCache(max_bytes=10000)
+        metrics = Metrics()
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=svg)
+        client = KrokiClient("http://test-kroki:8000", cache=cache, metrics=metrics)
+
+        first = client.generate_encoded("graphviz", "svg", "digraph {}", "gzip")
+        second = client.generate_encoded("graphviz", "svg", "digraph {}", "gzip")
+        identity = client.generate_encoded("graphviz", "svg", "digraph {}", None)
+
+        assert first == second
+        assert first[1:] == ("image/svg+xml", "gzip")
+        assert decompress(first[0], "gzip") == svg
+        assert identity == (svg, "image/svg+xml", None)
+        assert requests_mock.call_count == 1
+        assert metrics.get("compression_requests_total", result="compressed") == 1
+        assert metrics.get("compression_requests_total", result="precompressed") == 1
+
+    def test_generate_encoded_skips_png(self, requests_mock):
+        """Test already compressed formats are returned as is."""
+        requests_mock.post("http://test-kroki:8000/graphviz/png", content=b"png")
+        client = KrokiClient("http://test-kroki:8000")
+
+        result = client.generate_encoded("graphviz", "png", "digraph {}", "gzip")
+
+        assert result == (b"png", "image/png", None)
+
+    def test_generate_diagram_svg_normalized(self, requests_mock):
+        """Test renders differing only by generated ids give identical bytes."""
+        first_svg = (
+            b'<svg id="mermaid-1697040123456"><g id="mermaid-1697040123456_a"/></svg>'
+        )
+        second_svg = first_svg.replace(b"123456", b"987654")
+        requests_mock.post(
+            "http://test-kroki:8000/mermaid/svg",
+            [{"content": first_svg}, {"content": second_svg}],
+        )
+        client = KrokiClient("http://test-kroki:8000", svg_normalizer=SvgNormalizer())
+
+        first, _ = client.generate_diagram("mermaid", "svg", "graph TD\nA --> B")
+        second, _ = client.generate_diagram("mermaid", "svg", "graph TD\nA --> B")
+
+        assert first == second
+        assert b"1697040" not in first
+
+    def test_generate_diagram_streams_file_source(self, requests_mock):
+        """Test a large spooled source is streamed to Kroki untouched."""
+        source = io.BytesIO(b"digraph { A -> B }")
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        client = KrokiClient("http://test-kroki:8000", max_bytes=4)
+
+        result = client.generate_diagram("graphviz", "svg", source)
+
+        assert result == (b"<svg/>", "image/svg+xml")
+        assert requests_mock.last_request.body is source
+
+    def test_generate_diagram_bytes_source_preprocessed(self, requests_mock):
+        """Test byte sources are decoded for types that need preprocessing."""
+        requests_mock.post("http://test-kroki:8000/mermaid/svg", content=b"<svg/>")
+
+        self.client.generate_diagram("mermaid", "svg", "graph TD\nA --> É".encode())
+
+        body = requests_mock.last_request.body
+        assert body.startswith(b"%%{init:")
+        assert body.endswith("A --> É".encode())
+
+    def test_generate_diagram_invalid_utf8(self):
+        """Test undecodable byte sources are rejected."""
+        with pytest.raises(KrokiError, match="UTF-8"):
+            self.client.generate_diagram("mermaid", "svg", b"graph TD\n\xff")
+
+    def test_validate_inputs_blank_file(self):
+        """Test whitespace-only file sources are rejected and rewound."""
+        source = io.BytesIO(b"  \n ")
+        with pytest.raises(KrokiError, match="empty"):
+            self.client._validate_inputs("graphviz", "svg", source)
+        assert source.tell() == 0
+
+    def test_generate_diagram_compressed_get(self, requests_mock):
+        """Test large compressible sources are sent as a deflate+base64 GET."""
+        source = "digraph G {\n" + "  A -> B;\n" * 200 + "}"
+        requests_mock.get(
+            re.compile(r"http://test-kroki:8000/graphviz/svg/.+"),
+            content=b"<svg/>",
+        )
+        client = KrokiClient(
+            "http://test-kroki:8000", get_max_uri=4096, get_min_bytes=1024
+        )
+
+        result = client.generate_diagram("graphviz", "svg", source)
+
+        assert result == (b"<svg/>", "image/svg+xml")
+        request = requests_mock.last_request
+        assert request.method == "GET"
+        encoded = request.url.rsplit("/", 1)[1]
+        decoded = zlib.decompress(base64.urlsafe_b64decode(encoded))
+        assert decoded == source.encode()
+
+    def test_generate_diagram_get_falls_back_to_post(self, requests_mock):
+        """Test sources too small or too large for a GET URL are POSTed."""
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        client = KrokiClient("http://test-kroki:8000", get_max_uri=64)
+
+        client.generate_diagram("graphviz", "svg", "digraph { A -> B }")
+        client.generate_diagram("graphviz", "svg", "digraph { %s }" % ("x" * 2000))
+
+        assert [r.method for r in requests_mock.request_history] == ["POST", "POST"]
+
+    def test_generate_diagram_400_with_valid_svg(self, requests_mock):
+        """Test a 400 carrying a well-formed SVG is treated as a render."""
+        svg = b'<?xml version="1.0"?>\n<!DOCTYPE svg>\n<!-- generated -->\n<svg/>'
+        requests_mock.post(
+            "http://test-kroki:8000/graphviz/svg", status_code=400, content=svg
+        )
+
+        result = self.client.generate_diagram("graphviz", "svg", "digraph {}")
+
+        assert result == (svg, "image/svg+xml")
+
+    def test_generate_diagram_error_header(self, requests_mock):
+        """Test renderer error headers fail the render on both paths."""
+        requests_mock.post(
+            "http://test-kroki:8000/plantuml/png",
+            content=b"\x89PNG\r\n\x1a\n",
+            headers={"X-PlantUML-Diagram-Error": "Syntax Error?"},
+        )
+        large_client = KrokiClient("http://test-kroki:8000", max_bytes=4)
+
+        for client in (self.client, large_client):
+            with pytest.raises(KrokiError, match="Syntax Error"):
+                client.generate_diagram("plantuml", "png", "@startuml\nA -\n@enduml")
+
+    def test_generate_diagram_negative_cache(self, requests_mock):
+        """Test a rejected source fails fast without calling Kroki again."""
+        negative_cache = NegativeCache(max_bytes=1000, ttl=30)
+        metrics = Metrics()
+        requests_mock.post(
+            "http://test-kroki:8000/graphviz/svg", status_code=400, text="line 1"
+        )
+        client = KrokiClient(
+            "http://test-kroki:8000", negative_cache=negative_cache, metrics=metrics
+        )
+
+        for _ in range(3):
+            with pytest.raises(
+                KrokiSyntaxError, match="Invalid diagram syntax: line 1"
+            ):
+                client.generate_diagram("graphviz", "svg", "digraph {")
+
+        assert requests_mock.call_count == 1
+        assert metrics.get("negative_cache_requests_total", result="hit") == 2
+        assert metrics.get("negative_cache_stores_total") == 1
+
+    def test_canonical_variants_share_one_render(self, requests_mock):
+        """Test comment and whitespace variants hit the cache, source unchanged."""
+        cache = RenderCache(max_bytes=10000)
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", content=b"<svg/>")
+        client = KrokiClient("http://test-kroki:8000", cache=cache)
+        first = "digraph {\n  a -> b // first\n}\n"
+
+        client.generate_diagram("graphviz", "svg", first)
+        client.generate_diagram("graphviz", "svg", "digraph { a -> b }")
+        client.generate_diagram("graphviz", "svg", b"digraph {\r\n\ta -> b\r\n}")
+
+        assert requests_mock.call_count == 1
+        assert requests_mock.last_request.body == first.encode("utf-8")
+        assert cache.stats()["hits"] == 2
+
+    def test_negative_cache_is_keyed_by_exact_source(self, requests_mock):
+        """Test a cached error is not reused for a variant with other line numbers."""
+        requests_mock.post(
+            "http://test-kroki:8000/graphviz/svg",
+            [
+                {"status_code": 400, "text": "syntax error in line 1"},
+                {"status_code": 400, "text": "syntax error in line 2"},
+            ],
+        )
+        client = KrokiClient(
+            "http://test-kroki:8000",
+            cache=RenderCache(max_bytes=10000),
+            negative_cache=NegativeCache(max_bytes=1000, ttl=30),
+        )
+
+        with pytest.raises(KrokiSyntaxError, match="line 1"):
+            client.generate_diagram("graphviz", "svg", "digraph { a -> }")
+        with pytest.raises(KrokiSyntaxError, match="line 2"):
+            client.generate_diagram("graphviz", "svg", "// note\ndigraph { a -> }")
+
+    def test_preflight_rejects_without_calling_kroki(self, requests_mock):
+        """Test a malformed source is refused locally with its position."""
+        metrics = Metrics()
+        client = KrokiClient(
+            "http://test-kroki:8000", preflight=PreflightValidator(), metrics=metrics
+        )
+
+        with pytest.raises(
+            KrokiSyntaxError,
+            match="Invalid diagram syntax: line 1, column 11: '{' is never closed",
+        ):
+            client.generate_diagram("graphviz", "svg", b"digraph G {\n  a -> b")
+
+        assert requests_mock.call_count == 0
+        assert (
+            metrics.get("preflight_total", diagram_type="graphviz", result="rejected")
+            == 1
+        )
+        assert metrics.summary("preflight_seconds", diagram_type="graphviz")["count"]
+
+    def test_preflight_passes_through(self, requests_mock):
+        """Test valid, unsupported and streamed sources reach Kroki."""
+        metrics = Metrics()
+        for diagram_type in ("graphviz", "plantuml"):
+            requests_mock.post(
+                f"http://test-kroki:8000/{diagram_type}/svg", content=b"<svg></svg>"
+            )
+        client = KrokiClient(
+            "http://test-kroki:8000", preflight=PreflightValidator(), metrics=metrics
+        )
+
+        client.generate_diagram("graphviz", "svg", "digraph { a -> b }")
+        client.generate_diagram("graphviz", "svg", io.BytesIO(b"digraph {"))
+        client.generate_diagram("plantuml", "svg", "@startuml\nA -> B\n@enduml")
+
+        assert requests_mock.call_count == 3
+        assert (
+            metrics.get("preflight_total", diagram_type="graphviz", result="passed")
+            == 1
+        )
+        assert (
+            metrics.get("preflight_total", diagram_type="graphviz", result="skipped")
+            == 1
+        )
+
+    def test_negative_cache_ignores_transient_errors(self, requests_mock):
+        """Test server errors are not remembered as bad sources."""
+        negative_cache = NegativeCache(max_bytes=1000, ttl=30)
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", status_code=500)
+        client = KrokiClient("http://test-kroki:8000", negative_cache=negative_cache)
+
+        for _ in range(2):
+            with pytest.raises(KrokiError, match="Kroki service error"):
+                client.generate_diagram("graphviz", "svg", "digraph {}")
+
+        assert requests_mock.call_count == 2
+        assert negative_cache.stats()["entries"] == 0
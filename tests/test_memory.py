@@ -0,0 +1,131 @@
+"""Tests for per-request memory accounting and RSS monitoring."""
+
+import signal
+import tracemalloc
+from unittest.mock import patch
+from src.memory import MemoryTracker, RssMonitor, rss_bytes, size_class
+from src.metrics import Metrics
+
+
+class TestMemoryTracker:
+    """Test cases for MemoryTracker and MemorySample."""
+
+    def test_stage_peaks(self):
+        """Test stage peaks are measured and nested stages roll up."""
+        tracker = MemoryTracker()
+
+        sample = tracker.start()
+        with sample.stage("render"):
+            with sample.stage("upstream"):
+                data = bytearray(2_000_000)
+                del data
+            with sample.stage("postprocess"):
+                data = bytearray(500_000)
+                del data
+        tracker.finish(sample)
+
+        assert sample.stages["upstream"] >= 2_000_000
+        assert 500_000 <= sample.stages["postprocess"] < 2_000_000
+        assert sample.stages["render"] >= sample.stages["upstream"]
+        assert sample.peak >= sample.stages["render"]
+        assert not tracemalloc.is_tracing()
+
+    def test_one_request_at_a_time(self):
+        """Test a second concurrent measurement is skipped."""
+        tracker = MemoryTracker()
+
+        sample = tracker.start()
+        assert tracker.start() is None
+        tracker.finish(sample)
+        tracker.finish(tracker.start())
+
+    def test_keeps_external_tracing(self):
+        """Test tracing started elsewhere is left running."""
+        tracemalloc.start()
+        try:
+            tracker = MemoryTracker()
+            tracker.finish(tracker.start())
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+    def test_sampling(self):
+        """Test unsampled requests are not measured."""
+        assert MemoryTracker(sample_rate=0.0).start() is None
+
+    def test_from_config(self):
+        """Test memory tracking is disabled unless enabled in config."""
+        assert MemoryTracker.from_config({}) is None
+        tracker = MemoryTracker.from_config(
+            {"MEMORY_TRACKING": True, "MEMORY_SAMPLE_RATE": 0.5}
+        )
+        assert tracker.sample_rate == 0.5
+
+    def test_size_class(self):
+        """Test source sizes map to a bounded set of labels."""
+        assert size_class(0) == "<10KB"
+        assert size_class(50 * 1024) == "<100KB"
+        assert size_class(500 * 1024) == "<1MB"
+        assert size_class(5 * 1024 * 1024) == ">=1MB"
+
+
+class TestRssMonitor:
+    """Test cases for RssMonitor."""
+
+    def test_rss_bytes(self):
+        """Test the process RSS can be read."""
+        assert rss_bytes() > 0
+
+    def test_sample_sets_gauges(self):
+        """Test samples export the RSS and its growth."""
+        metrics = Metrics()
+        monitor = RssMonitor(metrics=metrics)
+
+        with patch("src.memory.rss_bytes", side_effect=[100, 150]):
+            monitor.sample()
+            monitor.sample()
+
+        assert metrics.get("process_resident_memory_bytes") == 150
+        assert metrics.get("process_resident_memory_growth_bytes") == 50
+
+    @patch("src.memory.os.kill")
+    def test_recycle_on_growth(self, mock_kill):
+        """Test a grown worker recycles itself once, after enough requests."""
+        metrics = Metrics()
+        monitor = RssMonitor(max_growth=100, min_requests=2, metrics=metrics)
+        monitor.baseline = 1000
+        monitor.requests = 1
+
+        with patch("src.memory.rss_bytes", return_value=2000):
+            monitor.sample()
+            mock_kill.assert_not_called()
+
+            monitor.requests = 2
+            monitor.sample()
+            monitor.sample()
+
+        mock_kill.assert_called_once()
+        assert mock_kill.call_args[0][1] == signal.SIGTERM
+        assert metrics.get("worker_recycles_total") == 1
+
+    def test_thread_starts_per_process(self):
+        """Test the sampling thread starts on the first request only."""
+        monitor = RssMonitor(interval=60)
+
+        with patch("src.memory.threading.Thread") as mock_thread:
+            monitor.request_started()
+            monitor.request_started()
+
+        mock_thread.return_value.start.assert_called_once()
+        assert monitor.requests == 2
+
+    def test_from_config(self):
+        """Test building a monitor from config."""
+        assert RssMonitor.from_config({"MEMORY_RSS_INTERVAL": 0}) is None
+
+        monitor = RssMonitor.from_config(
+            {"MEMORY_RSS_INTERVAL": 5, "MEMORY_MAX_GROWTH_MB": 256}
+        )
+
+        assert monitor.interval == 5
+        assert monitor.max_growth == 256 * 1024 * 1024
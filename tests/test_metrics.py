@@ -0,0 +1,43 @@
+"""Tests for the metrics registry."""
+
+from src.metrics import Metrics
+
+
+class TestMetrics:
+    """Test cases for Metrics."""
+
+    def test_counters_and_gauges(self):
+        """Test counters accumulate and gauges overwrite."""
+        metrics = Metrics()
+        metrics.inc("hits_total", output_format="svg")
+        metrics.inc("hits_total", 2, output_format="svg")
+        metrics.set_gauge("entries", 5)
+        metrics.set_gauge("entries", 3)
+
+        assert metrics.get("hits_total", output_format="svg") == 3
+        assert metrics.get("hits_total", output_format="png") == 0
+        assert metrics.get("entries") == 3
+
+    def test_summary(self):
+        """Test summaries track count, sum and max."""
+        metrics = Metrics()
+        metrics.observe("latency_seconds", 0.5)
+        metrics.observe("latency_seconds", 1.5)
+
+        assert metrics.summary("latency_seconds") == {
+            "count": 2,
+            "sum": 2.0,
+            "max": 1.5,
+        }
+
+    def test_render_prometheus(self):
+        """Test the text exposition format."""
+        metrics = Metrics()
+        metrics.inc("hits_total", lane="ui", kind='a"b')
+        metrics.observe("latency_seconds", 0.25)
+
+        text = metrics.render_prometheus()
+        assert "# TYPE hits_total counter" in text
+        assert 'hits_total{kind="a\\"b",lane="ui"} 1' in text
+        assert "latency_seconds_count 1" in text
+        assert "latency_seconds_sum 0.25" in text
@@ -0,0 +1,94 @@
+"""Tests for render permalinks."""
+
+import os
+import time
+import pytest
+from src.permalinks import (
+    FilesystemPermalinkStore,
+    MemoryPermalinkStore,
+    PermalinkStore,
+    permalink_id,
+)
+
+
+class TestPermalinkStores:
+    """Test cases for the permalink stores."""
+
+    @pytest.fixture(params=["memory", "filesystem"])
+    def store(self, request, tmp_path):
+        """Each store implementation."""
+        if request.param == "memory":
+            return MemoryPermalinkStore(max_bytes=1000)
+        return FilesystemPermalinkStore(str(tmp_path), max_bytes=1000, prune_interval=0)
+
+    def test_put_and_get(self, store):
+        """Test a stored render is served back under its content ID."""
+        permalink = store.put(b"<svg/>", "svg")
+
+        assert permalink == permalink_id(b"<svg/>")
+        assert len(permalink) == 16
+        assert store.get(permalink, "svg") == b"<svg/>"
+        assert store.get(permalink, "png") is None
+        assert store.get("AAAAAAAAAAAAAAAA", "svg") is None
+
+    def test_rejects_unsafe_ids(self, store):
+        """Test malformed IDs and formats are never looked up."""
+        assert store.get("../../etc/passwd", "svg") is None
+        assert store.get(store.put(b"x", "png"), "pdf") is None
+        with pytest.raises(ValueError):
+            store.put(b"x", "pdf")
+
+    def test_size_bound(self, store):
+        """Test the oldest renders are dropped beyond the size bound."""
+        first = store.put(b"a" * 600, "png")
+        if isinstance(store, FilesystemPermalinkStore):
+            # Make the file order unambiguous
+            path = store._path(first, "png")
+            os.utime(path, (time.time() - 10, time.time() - 10))
+        second = store.put(b"b" * 600, "png")
+
+        assert store.get(first, "png") is None
+        assert store.get(second, "png") == b"b" * 600
+
+    def test_ttl(self, store):
+        """Test expired renders are not served."""
+        store.ttl = 0.05
+        permalink = store.put(b"<svg/>", "svg")
+        assert store.get(permalink, "svg") == b"<svg/>"
+
+        time.sleep(0.1)
+
+        assert store.get(permalink, "svg") is None
+
+    def test_restore_refreshes_age(self, tmp_path):
+        """Test storing a render again keeps it from expiring."""
+        store = FilesystemPermalinkStore(str(tmp_path), ttl=60)
+        permalink = store.put(b"<svg/>", "svg")
+        path = store._path(permalink, "svg")
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        assert store.get(permalink, "svg") is None
+
+        store.put(b"<svg/>", "svg")
+
+        assert store.get(permalink, "svg") == b"<svg/>"
+
+    def test_from_config(self, tmp_path):
+        """Test building a store from config."""
+        assert PermalinkStore.from_config({}) is None
+        assert isinstance(
+            PermalinkStore.from_config({"PERMALINK_STORE": "memory"}),
+            MemoryPermalinkStore,
+        )
+
+        store = PermalinkStore.from_config(
+            {
+                "PERMALINK_STORE": "filesystem",
+                "PERMALINK_DIR": str(tmp_path),
+                "PERMALINK_TTL": 3600,
+            }
+        )
+
+        assert store.directory == str(tmp_path)
+        assert store.ttl == 3600
+        with pytest.raises(ValueError):
+            PermalinkStore.from_config({"PERMALINK_STORE": "s3"})
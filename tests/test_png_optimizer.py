@@ -0,0 +1,220 @@
+"""Tests for lossless PNG optimisation."""
+
+import struct
+import zlib
+
+import pytest
+from src.metrics import Metrics
+from src.png_optimizer import (
+    BackgroundPngOptimizer,
+    PngFormatError,
+    PngOptimizer,
+    _unfilter,
+    read_chunks,
+    write_chunks,
+)
+from src.render_cache import VARIANT_OPTIMIZED, VARIANT_RAW, RenderCache
+
+CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+def _filter_row(row, prev, filter_type, bpp):
+    """Apply one PNG filter to a scanline (reference implementation)."""
+    out = bytearray()
+    for i, value in enumerate(row):
+        a = row[i - bpp] if i >= bpp else 0
+        b = prev[i]
+        c = prev[i - bpp] if i >= bpp else 0
+        if filter_type == 0:
+            predictor = 0
+        elif filter_type == 1:
+            predictor = a
+        elif filter_type == 2:
+            predictor = b
+        elif filter_type == 3:
+            predictor = (a + b) >> 1
+        else:
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            predictor = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+        out.append((value - predictor) & 0xFF)
+    return bytes(out)
+
+
+def make_png(rows, color_type, extra_chunks=(), level=1):
+    """Build an 8-bit PNG cycling through all filter types."""
+    bpp = CHANNELS[color_type]
+    width = len(rows[0]) // bpp
+    ihdr = struct.pack(">IIBBBBB", width, len(rows), 8, color_type, 0, 0, 0)
+    prev = bytes(len(rows[0]))
+    filtered = bytearray()
+    for index, row in enumerate(rows):
+        filter_type = index % 5
+        filtered.append(filter_type)
+        filtered += _filter_row(row, prev, filter_type, bpp)
+        prev = row
+    chunks = [(b"IHDR", ihdr), *extra_chunks]
+    chunks += [(b"IDAT", zlib.compress(bytes(filtered), level)), (b"IEND", b"")]
+    return write_chunks(chunks)
+
+
+def decode_rgba(png):
+    """Decode an 8-bit PNG into RGBA bytes."""
+    chunks = read_chunks(png)
+    width, height, _, color_type = struct.unpack(">IIBB", chunks[0][1][:10])
+    bpp = CHANNELS[color_type]
+    idat = b"".join(payload for kind, payload in chunks if kind == b"IDAT")
+    pixels = _unfilter(zlib.decompress(idat), width, height, bpp)
+    out = bytearray()
+    for i in range(0, len(pixels), bpp):
+        px = pixels[i : i + bpp]
+        if color_type == 0:
+            out += bytes([px[0]] * 3 + [255])
+        elif color_type == 2:
+            out += px + b"\xff"
+        elif color_type == 4:
+            out += bytes([px[0]] * 3 + [px[1]])
+        else:
+            out += px
+    return bytes(out)
+
+
+def grey_rgba_rows(width=16, height=10, alpha=255):
+    """Rows of an opaque (or uniformly translucent) grey gradient."""
+    return [
+        bytes(
+            channel
+            for x in range(width)
+            for channel in ((x * 16 + y) % 256,) * 3 + (alpha,)
+        )
+        for y in range(height)
+    ]
+
+
+class TestPngOptimizer:
+    """Test cases for PngOptimizer."""
+
+    def test_opaque_grey_rgba_reduced_to_greyscale(self):
+        """Test RGBA without transparency and colour becomes greyscale."""
+        original = make_png(grey_rgba_rows(), 6, [(b"tEXt", b"Software\x00kroki")])
+        result = PngOptimizer().optimize(original)
+
+        assert len(result) < len(original)
+        assert read_chunks(result)[0][1][9] == 0
+        assert b"tEXt" not in result
+        assert decode_rgba(result) == decode_rgba(original)
+
+    def test_opaque_color_rgba_reduced_to_rgb(self):
+        """Test RGBA without transparency becomes RGB."""
+        rows = [
+            bytes(c for x in range(16) for c in (x * 15, y * 20, 200, 255))
+            for y in range(10)
+        ]
+        original = make_png(rows, 6)
+        result = PngOptimizer().optimize(original)
+
+        assert read_chunks(result)[0][1][9] == 2
+        assert decode_rgba(result) == decode_rgba(original)
+
+    def test_translucent_grey_reduced_to_grey_alpha(self):
+        """Test grey RGBA with transparency becomes grey + alpha."""
+        original = make_png(grey_rgba_rows(alpha=128), 6)
+        result = PngOptimizer().optimize(original)
+
+        assert read_chunks(result)[0][1][9] == 4
+        assert decode_rgba(result) == decode_rgba(original)
+
+    def test_rendering_chunks_kept_and_block_reduction(self):
+        """Test tRNS is preserved and disables colour reduction."""
+        rows = [bytes([x, x, x] * 1) * 1 for x in range(0, 200, 20)]
+        original = make_png(rows, 2, [(b"tRNS", b"\x00\x00\x00\x00\x00\x00")])
+        result = PngOptimizer().optimize(original)
+
+        kinds = [kind for kind, _ in read_chunks(result)]
+        assert b"tRNS" in kinds
+        assert read_chunks(result)[0][1][9] == 2
+
+    def test_reduction_disabled_still_recompresses(self):
+        """Test recompression alone keeps the colour type."""
+        original = make_png(grey_rgba_rows(64, 32), 6, level=0)
+        result = PngOptimizer(reduce_color=False).optimize(original)
+
+        assert len(result) < len(original)
+        assert read_chunks(result)[0][1][9] == 6
+        assert decode_rgba(result) == decode_rgba(original)
+
+    def test_already_optimal_returned_unchanged(self):
+        """Test a PNG that cannot be improved is returned as is."""
+        original = PngOptimizer().optimize(make_png(grey_rgba_rows(), 6))
+        assert PngOptimizer().optimize(original) is original
+
+    def test_invalid_png(self):
+        """Test non-PNG input is rejected."""
+        with pytest.raises(PngFormatError):
+            PngOptimizer().optimize(b"not a png")
+
+
+class TestBackgroundPngOptimizer:
+    """Test cases for BackgroundPngOptimizer."""
+
+    def test_result_cached_as_variant(self):
+        """Test the optimised PNG is attached to the cached render."""
+        cache = RenderCache(max_bytes=100000)
+        metrics = Metrics()
+        original = make_png(grey_rgba_rows(), 6)
+        cache.put("k", VARIANT_RAW, original, "image/png")
+        background = BackgroundPngOptimizer(PngOptimizer(), cache, metrics)
+
+        assert background.submit("k", original) is True
+        background.shutdown()
+
+        entry = cache.get("k")
+        assert len(entry.variants[VARIANT_OPTIMIZED]) < len(original)
+        assert metrics.get("png_optimize_total", result="optimized") == 1
+        assert metrics.get("png_optimize_bytes_saved_total") > 0
+        assert metrics.summary("png_optimize_cpu_seconds")["count"] == 1
+
+    def test_invalid_input_counted(self):
+        """Test invalid renders are counted and not cached."""
+        cache = RenderCache(max_bytes=1000)
+        metrics = Metrics()
+        background = BackgroundPngOptimizer(PngOptimizer(), cache, metrics)
+
+        background.submit("k", b"garbage")
+        background.shutdown()
+
+        assert metrics.get("png_optimize_total", result="invalid") == 1
+
+    def test_drain(self):
+        """Test draining waits for the jobs and keeps accepting new ones."""
+        cache = RenderCache(max_bytes=100000)
+        metrics = Metrics()
+        original = make_png(grey_rgba_rows(), 6)
+        cache.put("k", VARIANT_RAW, original, "image/png")
+        background = BackgroundPngOptimizer(PngOptimizer(), cache, metrics)
+
+        background.submit("k", original)
+        background.drain()
+        assert metrics.get("png_optimize_total", result="optimized") == 1
+
+        background.submit("other", b"garbage")
+        background.shutdown()
+        assert metrics.get("png_optimize_total", result="invalid") == 1
+
+    def test_pending_limit(self):
+        """Test submissions beyond the pending limit are dropped."""
+        cache = RenderCache(max_bytes=1000)
+        metrics = Metrics()
+        background = BackgroundPngOptimizer(
+            PngOptimizer(), cache, metrics, max_pending=0
+        )
+
+        assert background.submit("k", b"data") is False
+        assert metrics.get("png_optimize_total", result="dropped") == 1
+
+    def test_from_config_requires_cache(self):
+        """Test PNG optimisation is disabled without a render cache."""
+        config = {"PNG_OPTIMIZE": True}
+        assert BackgroundPngOptimizer.from_config(config, None) is None
+        assert BackgroundPngOptimizer.from_config({}, RenderCache()) is None
+        assert BackgroundPngOptimizer.from_config(config, RenderCache()) is not None
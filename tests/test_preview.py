@@ -0,0 +1,85 @@
+"""Tests for live-preview sessions."""
+
+from src.preview import PreviewSessions
+
+
+class TestPreviewSessions:
+    """Test cases for PreviewSessions."""
+
+    def test_latest_request_wins(self):
+        """Test a newer request supersedes the older ones of its session."""
+        sessions = PreviewSessions()
+
+        assert sessions.begin("session-a", 1) == 1
+        assert sessions.begin("session-a", 2) == 2
+
+        assert not sessions.is_current("session-a", 1)
+        assert sessions.is_current("session-a", 2)
+        assert sessions.begin("session-a", 1) is None
+
+    def test_sessions_are_independent(self):
+        """Test requests only supersede requests of their own session."""
+        sessions = PreviewSessions()
+
+        sessions.begin("session-a", 7)
+        assert sessions.begin("session-b", 1) == 1
+        assert sessions.is_current("session-a", 7)
+
+    def test_arrival_order_without_sequence(self):
+        """Test requests without sequence number are numbered on arrival."""
+        sessions = PreviewSessions()
+
+        first = sessions.begin("session-a")
+        second = sessions.begin("session-a")
+
+        assert second == first + 1
+        assert not sessions.is_current("session-a", first)
+
+    def test_debounce_follows_latency(self):
+        """Test the suggested debounce tracks latency within its bounds."""
+        sessions = PreviewSessions(min_debounce_ms=100, max_debounce_ms=1000)
+        assert sessions.debounce_ms("session-a") == 100
+
+        sessions.observe("session-a", 400)
+        assert sessions.debounce_ms("session-a") == 400
+
+        sessions.observe("session-a", 800)
+        assert 400 < sessions.debounce_ms("session-a") < 800
+
+        for _ in range(20):
+            sessions.observe("session-a", 5000)
+        assert sessions.debounce_ms("session-a") == 1000
+
+        sessions.observe("session-b", 10)
+        assert sessions.debounce_ms("session-b") == 100
+
+    def test_sessions_are_bounded(self):
+        """Test the least recently used sessions are dropped."""
+        sessions = PreviewSessions(max_sessions=2)
+
+        sessions.begin("session-a", 5)
+        sessions.begin("session-b", 1)
+        sessions.begin("session-a", 6)
+        sessions.begin("session-c", 1)
+
+        assert sessions.begin("session-a", 5) is None
+        # session-b was evicted: its sequence numbers start over
+        assert sessions.begin("session-b", 0) == 0
+
+    def test_valid_session(self):
+        """Test session IDs are checked before use."""
+        assert PreviewSessions.valid_session("0f8fad5b-d9cb-469f-a165-70867728950e")
+        assert not PreviewSessions.valid_session(None)
+        assert not PreviewSessions.valid_session("short")
+        assert not PreviewSessions.valid_session("../../etc/passwd")
+
+    def test_from_config(self):
+        """Test building sessions from config."""
+        assert PreviewSessions.from_config({"PREVIEW_ENABLED": False}) is None
+
+        sessions = PreviewSessions.from_config(
+            {"PREVIEW_MAX_SESSIONS": 10, "PREVIEW_MAX_DEBOUNCE_MS": 500}
+        )
+
+        assert sessions.max_sessions == 10
+        assert sessions.max_debounce_ms == 500
@@ -0,0 +1,99 @@
+"""Tests for per-request CPU profiling."""
+
+import json
+import os
+from src.profiling import RequestProfiler
+
+
+def _work():
+    """Some Python code for the profiler to see."""
+    return sum(i * i for i in range(1000))
+
+
+class TestRequestProfiler:
+    """Test cases for RequestProfiler."""
+
+    def test_profile_written_and_listed(self, tmp_path):
+        """Test a finished profile is written with its details."""
+        profiler = RequestProfiler(str(tmp_path))
+
+        active = profiler.start("req-42")
+        _work()
+        name = profiler.finish(active, method="POST", path="/api/generate")
+
+        assert name.endswith("-req-42")
+        assert os.path.isfile(tmp_path / f"{name}.prof")
+        profiles = profiler.profiles()
+        assert [profile["name"] for profile in profiles] == [name]
+        assert profiles[0]["path"] == "/api/generate"
+        assert profiles[0]["size"] > 0
+        assert "_work" in profiler.summary(name)
+
+    def test_one_profile_at_a_time(self, tmp_path):
+        """Test a second concurrent profile is refused, then allowed again."""
+        profiler = RequestProfiler(str(tmp_path))
+
+        active = profiler.start("first")
+        assert profiler.start("second") is None
+        profiler.finish(active)
+
+        active = profiler.start("third")
+        assert active is not None
+        profiler.finish(active)
+
+    def test_directory_is_bounded(self, tmp_path):
+        """Test only the most recent profiles are kept."""
+        profiler = RequestProfiler(str(tmp_path), max_files=2)
+        names = []
+        for index in range(4):
+            active = profiler.start(f"req-{index}")
+            active.name = f"{1000 + index}-req-{index}"
+            names.append(profiler.finish(active))
+
+        assert [profile["name"] for profile in profiler.profiles()] == [
+            names[3],
+            names[2],
+        ]
+        assert len(os.listdir(tmp_path)) == 4
+
+    def test_path_rejects_unsafe_names(self, tmp_path):
+        """Test profile names cannot escape the profile directory."""
+        profiler = RequestProfiler(str(tmp_path / "profiles"))
+        (tmp_path / "secret.prof").write_bytes(b"x")
+
+        assert profiler.path("../secret") is None
+        assert profiler.path("123-missing") is None
+        assert profiler.summary("../secret") is None
+
+    def test_request_id_sanitised(self, tmp_path):
+        """Test request IDs are made safe for file names."""
+        profiler = RequestProfiler(str(tmp_path))
+
+        name = profiler.finish(profiler.start("a.b:c"))
+
+        assert name.endswith("-a_b_c")
+        with open(tmp_path / f"{name}.json") as f:
+            assert json.load(f)["name"] == name
+
+    def test_sampling(self, tmp_path):
+        """Test requests are profiled when asked or sampled."""
+        assert RequestProfiler(str(tmp_path)).should_profile(True)
+        assert not RequestProfiler(str(tmp_path)).should_profile(False)
+        assert RequestProfiler(str(tmp_path), sample_rate=1.0).should_profile(False)
+
+    def test_from_config(self, tmp_path):
+        """Test profiling is disabled unless enabled in config."""
+        assert RequestProfiler.from_config({}) is None
+
+        profiler = RequestProfiler.from_config(
+            {
+                "PROFILE_ENABLED": True,
+                "PROFILE_DIR": str(tmp_path),
+                "PROFILE_SAMPLE_RATE": 0.01,
+                "PROFILE_MAX_FILES": 5,
+            }
+        )
+
+        assert profiler.directory == str(tmp_path)
+        assert profiler.sample_rate == 0.01
+        assert profiler.max_files == 5
@@ -0,0 +1,257 @@
+"""Tests for the render cache."""
+
+from unittest.mock import patch
+
+from src.cache_backends import CacheBackendError, MemoryBackend
+from src.compression import ENCODING_GZIP, compress
+from src.render_cache import (
+    VARIANT_OPTIMIZED,
+    VARIANT_RAW,
+    NegativeCache,
+    RenderCache,
+    SharedRenderCache,
+    render_key,
+)
+
+
+class TestRenderKey:
+    """Test cases for render identity."""
+
+    def test_key_is_stable_and_discriminating(self):
+        """Test identical requests share a key and different ones do not."""
+        key = render_key("mermaid", "svg", "graph TD\nA-->B", "base")
+        assert key == render_key("mermaid", "svg", b"graph TD\nA-->B", "base")
+        assert key != render_key("mermaid", "png", "graph TD\nA-->B", "base")
+        assert key != render_key("mermaid", "svg", "graph TD\nA-->B", "dark")
+        assert key != render_key("graphviz", "svg", "graph TD\nA-->B", "base")
+
+
+class TestRenderCache:
+    """Test cases for RenderCache."""
+
+    def test_put_and_get_variants(self):
+        """Test variants are stored next to the raw render."""
+        cache = RenderCache(max_bytes=1000)
+        cache.put("k", VARIANT_RAW, b"raw-svg", "image/svg+xml")
+        cache.put("k", VARIANT_OPTIMIZED, b"opt", "image/svg+xml")
+
+        entry = cache.get("k")
+        assert entry.content_type == "image/svg+xml"
+        assert entry.variants == {VARIANT_RAW: b"raw-svg", VARIANT_OPTIMIZED: b"opt"}
+        assert entry.best() == b"opt"
+        assert cache.stats()["bytes"] == len(b"raw-svg") + len(b"opt")
+
+    def test_encoded_variants(self):
+        """Test compressed variants are stored and dropped with the raw render."""
+        cache = RenderCache(max_bytes=1000)
+        cache.put("k", VARIANT_RAW, b"<svg/>", "image/svg+xml")
+        cache.put("k", VARIANT_RAW, b"gz", "image/svg+xml", encoding=ENCODING_GZIP)
+
+        entry = cache.get("k")
+        assert entry.get(VARIANT_RAW) == b"<svg/>"
+        assert entry.best(ENCODING_GZIP) == b"gz"
+        assert entry.best("br") is None
+
+        cache.put("k", VARIANT_RAW, b"<svg></svg>", "image/svg+xml")
+        assert cache.get("k").best(ENCODING_GZIP) is None
+
+    def test_store_compressed(self):
+        """Test compressible renders are kept compressed and decompressed on demand."""
+        svg = b"<svg>" + b"<g/>" * 200 + b"</svg>"
+        cache = RenderCache(max_bytes=1000, store_compressed=True)
+        cache.put("svg", VARIANT_RAW, svg, "image/svg+xml")
+        cache.put("png", VARIANT_RAW, b"png", "image/png")
+
+        entry = cache.get("svg")
+        assert entry.variants == {"raw+gzip": compress(svg, ENCODING_GZIP)}
+        assert entry.best() == svg
+        assert entry.best(ENCODING_GZIP) == compress(svg, ENCODING_GZIP)
+        assert cache.get("png").variants == {VARIANT_RAW: b"png"}
+        assert cache.stats()["bytes"] < len(svg)
+
+    def test_variant_without_raw_is_ignored(self):
+        """Test orphan variants are not cached."""
+        cache = RenderCache(max_bytes=1000)
+        assert cache.put("k", VARIANT_OPTIMIZED, b"opt", "image/svg+xml") is None
+        assert cache.get("k") is None
+
+    def test_lru_eviction_by_bytes(self):
+        """Test least recently used entries are evicted to fit the budget."""
+        cache = RenderCache(max_bytes=10)
+        cache.put("a", VARIANT_RAW, b"aaaa", "image/png")
+        cache.put("b", VARIANT_RAW, b"bbbb", "image/png")
+        cache.get("a")
+        cache.put("c", VARIANT_RAW, b"cccc", "image/png")
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_oversized_entry_not_cached(self):
+        """Test a render larger than the budget is not cached."""
+        cache = RenderCache(max_bytes=3)
+        assert cache.put("a", VARIANT_RAW, b"abcd", "image/png") is None
+        assert cache.stats()["bytes"] == 0
+
+    def test_expired_entry_is_a_miss(self):
+        """Test entries past their TTL are dropped."""
+        cache = RenderCache(max_bytes=100, ttl=10)
+        with patch("src.render_cache.time.monotonic", return_value=100.0):
+            cache.put("a", VARIANT_RAW, b"data", "image/png")
+        with patch("src.render_cache.time.monotonic", return_value=111.0):
+            assert cache.get("a") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_from_config(self):
+        """Test a zero budget disables the cache."""
+        assert RenderCache.from_config({"RENDER_CACHE_MAX_BYTES": 0}) is None
+        cache = RenderCache.from_config(
+            {
+                "RENDER_CACHE_MAX_BYTES": 100,
+                "RENDER_CACHE_TTL": 5,
+                "RENDER_CACHE_STORE_COMPRESSED": True,
+            }
+        )
+        assert cache.max_bytes == 100
+        assert cache.ttl == 5
+        assert cache.store_compressed is True
+
+
+class TestSharedRenderCache:
+    """Test cases for the shared tier of the render cache."""
+
+    def test_renders_shared_between_nodes(self):
+        """Test a render cached by one node is served to another."""
+        backend = MemoryBackend()
+        svg = b"<svg>" + b"<g/>" * 200 + b"</svg>"
+        node_a = RenderCache(max_bytes=10000, shared=SharedRenderCache(backend))
+        node_b = RenderCache(max_bytes=10000, shared=SharedRenderCache(backend))
+
+        node_a.put("k", VARIANT_RAW, svg, "image/svg+xml")
+        node_a.put("k", VARIANT_OPTIMIZED, b"<svg/>", "image/svg+xml")
+        entry = node_b.get("k")
+
+        assert entry.content_type == "image/svg+xml"
+        assert entry.best_variant() == VARIANT_OPTIMIZED
+        assert entry.best() == b"<svg/>"
+        assert node_b.get("k") is entry
+        assert node_b.stats()["shared_hits"] == 1
+        assert node_b.stats()["hits"] == 1
+
+    def test_payload_compressed(self):
+        """Test compressible renders are stored gzip-compressed."""
+        backend = MemoryBackend()
+        svg = b"<svg>" + b"<g/>" * 200 + b"</svg>"
+        RenderCache(max_bytes=10000, shared=SharedRenderCache(backend)).put(
+            "k", VARIANT_RAW, svg, "image/svg+xml"
+        )
+
+        assert len(backend.get("kroki:render:k")) < len(svg)
+        cache = RenderCache(
+            max_bytes=10000,
+            store_compressed=True,
+            shared=SharedRenderCache(backend),
+        )
+        entry = cache.get("k")
+        assert set(entry.variants) == {"raw+gzip"}
+        assert entry.best() == svg
+
+    def test_ttl(self):
+        """Test renders are written with the shared TTL."""
+        backend = MemoryBackend()
+        cache = RenderCache(max_bytes=1000, shared=SharedRenderCache(backend, ttl=7))
+
+        with patch.object(backend, "set") as mock_set:
+            cache.put("k", VARIANT_RAW, b"png", "image/png")
+            cache.put("k", VARIANT_RAW, b"gz", "image/png", encoding=ENCODING_GZIP)
+
+        mock_set.assert_called_once()
+        assert mock_set.call_args[0][2] == 7
+
+    def test_corrupt_value_is_a_miss(self):
+        """Test values that are not renders are ignored."""
+        backend = MemoryBackend()
+        backend.set("kroki:render:k", b"garbage", ttl=60)
+        cache = RenderCache(max_bytes=1000, shared=SharedRenderCache(backend))
+
+        assert cache.get("k") is None
+
+    def test_unavailable_backend_degrades(self):
+        """Test backend errors are misses and suspend the shared tier."""
+        backend = MemoryBackend()
+        shared = SharedRenderCache(backend, retry_after=30)
+        cache = RenderCache(max_bytes=1000, shared=shared)
+        error = CacheBackendError("connection refused")
+
+        with patch.object(backend, "get", side_effect=error) as mock_get:
+            with patch.object(backend, "set", side_effect=error) as mock_set:
+                assert cache.get("k") is None
+                assert cache.get("k") is None
+                cache.put("k", VARIANT_RAW, b"png", "image/png")
+
+        assert mock_get.call_count == 1
+        mock_set.assert_not_called()
+        assert cache.get("k").best() == b"png"
+        assert cache.stats()["shared_errors"] == 1
+        assert cache.stats()["shared_available"] == 0
+
+        with patch("src.render_cache.time.monotonic", return_value=1e12):
+            assert shared.available
+
+    def test_from_config(self):
+        """Test the shared tier is enabled by naming a backend."""
+        cache = RenderCache.from_config({"RENDER_CACHE_MAX_BYTES": 100})
+        assert cache.shared is None
+
+        cache = RenderCache.from_config(
+            {
+                "RENDER_CACHE_MAX_BYTES": 100,
+                "RENDER_CACHE_SHARED": "memory",
+                "RENDER_CACHE_SHARED_TTL": 60,
+            }
+        )
+        assert isinstance(cache.shared.backend, MemoryBackend)
+        assert cache.shared.ttl == 60
+
+
+class TestNegativeCache:
+    """Test cases for NegativeCache."""
+
+    def test_put_get_and_expiry(self):
+        """Test failures are remembered for the TTL only."""
+        cache = NegativeCache(max_bytes=1000, ttl=5)
+        with patch("src.render_cache.time.monotonic", return_value=100.0):
+            cache.put("k", "Invalid diagram syntax: line 1")
+            assert cache.get("k") == "Invalid diagram syntax: line 1"
+        with patch("src.render_cache.time.monotonic", return_value=105.0):
+            assert cache.get("k") is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["bytes"] == 0
+
+    def test_own_budget(self):
+        """Test the oldest failures are evicted to fit the budget."""
+        cache = NegativeCache(max_bytes=10, ttl=30)
+        cache.put("a", "1234")
+        cache.put("b", "1234")
+        cache.put("c", "1234")
+
+        assert cache.get("a") is None
+        assert cache.get("c") == "1234"
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] == 10
+
+    def test_from_config(self):
+        """Test a zero budget or TTL disables the negative cache."""
+        assert NegativeCache.from_config({"NEGATIVE_CACHE_MAX_BYTES": 0}) is None
+        assert (
+            NegativeCache.from_config(
+                {"NEGATIVE_CACHE_MAX_BYTES": 10, "NEGATIVE_CACHE_TTL": 0}
+            )
+            is None
+        )
+        cache = NegativeCache.from_config(
+            {"NEGATIVE_CACHE_MAX_BYTES": 10, "NEGATIVE_CACHE_TTL": 3}
+        )
+        assert (cache.max_bytes, cache.ttl) == (10, 3)
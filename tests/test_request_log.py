@@ -0,0 +1,157 @@
+"""Tests for structured request logging."""
+
+import json
+import logging
+import sys
+from unittest.mock import patch
+from src.request_log import (
+    JsonFormatter,
+    RequestLog,
+    RequestLogger,
+    configure_logging,
+)
+
+
+class TestJsonFormatter:
+    """Test cases for JsonFormatter."""
+
+    def test_format_includes_extras(self):
+        """Test extras are added to the JSON document."""
+        record = logging.LogRecord(
+            "src.requests", logging.INFO, __file__, 1, "%s done", ("GET",), None
+        )
+        record.request_id = "abc"
+        record.stages_ms = {"render": 1.5}
+
+        document = json.loads(JsonFormatter().format(record))
+
+        assert document["message"] == "GET done"
+        assert document["level"] == "INFO"
+        assert document["logger"] == "src.requests"
+        assert document["request_id"] == "abc"
+        assert document["stages_ms"] == {"render": 1.5}
+
+    def test_format_exception(self):
+        """Test the traceback is included for exceptions."""
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord(
+                "src", logging.ERROR, __file__, 1, "failed", (), sys.exc_info()
+            )
+
+        document = json.loads(JsonFormatter().format(record))
+
+        assert "ValueError: boom" in document["exception"]
+
+    def test_configure_logging_replaces_handler(self):
+        """Test configuring twice keeps a single application handler."""
+        configure_logging({"LOG_FORMAT": "json", "LOG_LEVEL": "INFO"})
+        configure_logging({"LOG_FORMAT": "text", "LOG_LEVEL": "WARNING"})
+
+        app_logger = logging.getLogger("src")
+        handlers = [h for h in app_logger.handlers if getattr(h, "_kroki_handler", 0)]
+        assert len(handlers) == 1
+        assert not isinstance(handlers[0].formatter, JsonFormatter)
+        assert app_logger.level == logging.WARNING
+
+        configure_logging({"LOG_FORMAT": "json", "LOG_LEVEL": "INFO"})
+
+
+class TestRequestLog:
+    """Test cases for RequestLog."""
+
+    def test_start_reuses_valid_request_id(self):
+        """Test a well-formed incoming request ID is kept."""
+        assert RequestLogger().start("client-42").request_id == "client-42"
+
+    def test_start_generates_request_id(self):
+        """Test missing or unsafe request IDs are replaced."""
+        request_logger = RequestLogger()
+        generated = request_logger.start(None).request_id
+        unsafe = request_logger.start("bad id\r\nX-Evil: 1").request_id
+
+        assert len(generated) == 32
+        assert unsafe != "bad id\r\nX-Evil: 1"
+        assert request_logger.start("x" * 200).request_id != "x" * 200
+
+    def test_stages_accumulate(self):
+        """Test repeated stages add up."""
+        log = RequestLog("id")
+        log.add_stage("upstream", 0.25)
+        log.add_stage("upstream", 0.5)
+        with log.stage("render"):
+            pass
+
+        assert log.stages["upstream"] == 0.75
+        assert "render" in log.stages
+
+    def test_sampling_skips_successes(self):
+        """Test unsampled successful requests are not formatted at all."""
+        log = RequestLog("id", sample_rate=0.0)
+
+        with patch("src.request_log.logger") as mock_logger:
+            assert log.finish("GET", "/", 200) is False
+
+        mock_logger.log.assert_not_called()
+
+    def test_errors_and_slow_requests_always_logged(self):
+        """Test failures and slow requests bypass sampling."""
+        assert RequestLog("id", sample_rate=0.0).should_log(500, 1)
+        assert RequestLog("id", sample_rate=0.0).should_log(400, 1)
+        assert RequestLog("id", sample_rate=0.0, slow_ms=100).should_log(200, 150)
+
+        failed = RequestLog("id", sample_rate=0.0)
+        failed.fail("Kroki busy")
+        assert failed.should_log(200, 1)
+
+    def test_quiet_requests_logged_only_on_failure(self):
+        """Test quiet requests are skipped even at full sampling."""
+        log = RequestLog("id", sample_rate=1.0)
+        log.quiet = True
+
+        assert not log.should_log(200, 1)
+        assert log.should_log(503, 1)
+
+    def test_finish_emits_one_line(self, caplog):
+        """Test the log line carries the ID, status, stages and fields."""
+        log = RequestLog("req-1")
+        log.set(diagram_type="graphviz")
+        log.add_stage("upstream", 0.01)
+        log.fail("Kroki error: Invalid diagram syntax")
+
+        with caplog.at_level(logging.INFO, logger="src.requests"):
+            assert log.finish("POST", "/api/generate", 400) is True
+
+        assert len(caplog.records) == 1
+        record = caplog.records[0]
+        assert record.levelno == logging.WARNING
+        assert record.request_id == "req-1"
+        assert record.status == 400
+        assert record.diagram_type == "graphviz"
+        assert record.stages_ms == {"upstream": 10.0}
+        assert record.error == "Kroki error: Invalid diagram syntax"
+        assert record.getMessage().startswith("POST /api/generate 400 in ")
+
+    def test_finish_logs_traceback_as_error(self, caplog):
+        """Test unexpected errors are logged at ERROR with the traceback."""
+        log = RequestLog("req-1")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            log.fail("Unexpected error", exc_info=True)
+
+        with caplog.at_level(logging.INFO, logger="src.requests"):
+            log.finish("POST", "/api/generate", 500)
+
+        assert caplog.records[0].levelno == logging.ERROR
+        assert caplog.records[0].exc_info[0] is ValueError
+
+    def test_from_config(self):
+        """Test building a request logger from config."""
+        request_logger = RequestLogger.from_config(
+            {"LOG_SAMPLE_RATE": 0.1, "LOG_SLOW_MS": 250}
+        )
+
+        assert request_logger.sample_rate == 0.1
+        assert request_logger.slow_ms == 250
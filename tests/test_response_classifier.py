@@ -0,0 +1,88 @@
+"""Tests for bounded-cost Kroki response classification."""
+
+import struct
+import zlib
+from pathlib import Path
+
+from src.png_optimizer import write_chunks
+from src.response_classifier import (
+    KIND_PNG,
+    KIND_SVG,
+    KIND_UNKNOWN,
+    classify_response,
+    error_excerpt,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures" / "svg"
+
+
+def png(*extra_chunks, idat=b""):
+    """Build a 1x1 grey PNG with extra chunks before IDAT."""
+    ihdr = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    idat = idat or zlib.compress(b"\0\x80")
+    return write_chunks(
+        [(b"IHDR", ihdr), *extra_chunks, (b"IDAT", idat), (b"IEND", b"")]
+    )
+
+
+class TestClassifyResponse:
+    """Test cases for classify_response."""
+
+    def test_png(self):
+        """Test a PNG is recognised from its signature and IHDR."""
+        check = classify_response(png(), "png")
+        assert check.kind == KIND_PNG
+        assert check.is_image
+        assert check.error is None
+
+    def test_png_error_text_chunk(self):
+        """Test an error message stored in a tEXt chunk is extracted."""
+        check = classify_response(png((b"tEXt", b"Error\0Syntax error line 2")), "png")
+        assert check.kind == KIND_PNG
+        assert check.error == "Syntax error line 2"
+
+    def test_png_compressed_data_is_not_an_error(self):
+        """Test error-looking bytes inside IDAT do not produce false positives."""
+        check = classify_response(png(idat=b"x\x9c error invalid syntax failed"), "png")
+        assert check.error is None
+
+    def test_png_scan_is_bounded(self):
+        """Test chunk headers beyond the budget are not inspected."""
+        padding = (b"zzZz", b"\0" * 10_000)
+        data = png(padding, (b"tEXt", b"error\0late"))
+        assert classify_response(data, "png").error is None
+        assert classify_response(data, "png", budget=len(data)).error == "late"
+
+    def test_truncated_or_foreign_png(self):
+        """Test bodies without a PNG signature and IHDR are unknown."""
+        assert classify_response(b"\x89PNG\r\n\x1a\n", "png").kind == KIND_UNKNOWN
+        assert classify_response(b"Syntax Error?", "png").kind == KIND_UNKNOWN
+
+    def test_svg_prologues(self):
+        """Test SVG roots are found after declarations, comments and DOCTYPE."""
+        for name in ("graphviz_digraph.svg", "plantuml_sequence_1.svg"):
+            check = classify_response((FIXTURES / name).read_bytes(), "svg")
+            assert check.kind == KIND_SVG
+        doctype = b'\xef\xbb\xbf<!DOCTYPE svg [<!ENTITY a "b">]>\n<!-- c --><svg/>'
+        assert classify_response(doctype, "svg").is_image
+
+    def test_not_svg(self):
+        """Test other documents and plain text are not SVG."""
+        assert not classify_response(b"<?xml version='1.0'?><html/>", "svg").is_image
+        assert not classify_response(b"Error 400: <svg> expected", "svg").is_image
+        assert not classify_response(b"<svgz/>", "svg").is_image
+        assert not classify_response(b"<!-- never closed", "svg").is_image
+
+    def test_error_header(self):
+        """Test PlantUML error headers take precedence."""
+        headers = {
+            "X-PlantUML-Diagram-Error": "Syntax Error?",
+            "X-PlantUML-Diagram-Error-Line": "3",
+        }
+        check = classify_response(png(), "png", headers)
+        assert check.error == "Syntax Error? (line 3)"
+
+    def test_error_excerpt(self):
+        """Test error excerpts are bounded and stripped."""
+        assert error_excerpt(b"  Invalid syntax\n") == "Invalid syntax"
+        assert len(error_excerpt(b"x" * 10_000)) == 200
@@ -1,10 +1,30 @@
 """Tests for Flask routes."""
 
+import gzip
+import logging
 import pytest
 import json
 from unittest.mock import patch, MagicMock
+from src.cluster import Cluster, ClusterForwardError, ForwardedResponse
+from src.hotkeys import HotKeys
 from src.main import create_app
-from src.kroki_client import KrokiError
+from src.kroki_client import (
+    KrokiBusyError,
+    KrokiCancelledError,
+    KrokiError,
+    KrokiTooComplexError,
+)
+from src.memory import MemoryTracker
+from src.permalinks import MemoryPermalinkStore
+from src.profiling import RequestProfiler
+from src.tracing import Tracer
+from src.warmup import WarmUp
+
+PREVIEW_BODY = {
+    "diagram_type": "graphviz",
+    "output_format": "png",
+    "diagram_source": "digraph { a -> b }",
+}
 
 
 @pytest.fixture
@@ -28,6 +48,11 @@ def client(app):
     return app.test_client()
 
 
+def _owned_by(cluster, node):
+    """Make ``node`` the owner of every render on the cluster ring."""
+    return patch.object(cluster.ring, "walk", side_effect=lambda key: iter([node]))
+
+
 class TestRoutes:
     """Test cases for Flask routes."""
 
@@ -111,7 +136,7 @@ class TestRoutes:
         mock_client.generate_diagram.assert_called_once_with(
             diagram_type="plantuml",
             output_format="svg",
-            diagram_source="@startuml\nA -> B\n@enduml",
+            diagram_source=b"@startuml\nA -> B\n@enduml",
         )
 
     def test_generate_diagram_invalid_content_type(self, client):
@@ -300,3 +325,760 @@ class TestRoutes:
 
         assert response.status_code == 200
         assert b"Internal error: Unexpected" in response.data
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_lane(self, mock_kroki_class, client):
+        """Test the UI session selects the lane and the header only lowers it."""
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_diagram.return_value = (b"fake-image-data", "image/png")
+        payload = {
+            "diagram_type": "mermaid",
+            "output_format": "png",
+            "diagram_source": "graph TD\nA --> B",
+            "diagram_theme": "dark",
+        }
+
+        client.post("/api/generate", json=payload, headers={"X-Kroki-Client": "ui"})
+        mock_kroki_class.assert_called_with(theme="dark", lane="api")
+
+        client.get("/")
+        client.post("/api/generate", json=payload)
+        mock_kroki_class.assert_called_with(theme="dark", lane="interactive")
+
+        client.post("/api/generate", json=payload, headers={"X-Kroki-Client": "job"})
+        mock_kroki_class.assert_called_with(theme="dark", lane="batch")
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_busy(self, mock_kroki_class, client):
+        """Test scheduler saturation maps to 503 with Retry-After."""
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_diagram.side_effect = KrokiBusyError("Server busy")
+
+        response = client.post(
+            "/api/generate",
+            json={
+                "diagram_type": "mermaid",
+                "output_format": "png",
+                "diagram_source": "graph TD\nA --> B",
+            },
+            headers={"X-Kroki-Client": "batch"},
+        )
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert json.loads(response.data)["error"] == "Server busy"
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_too_complex(self, mock_kroki_class, client):
+        """Test diagrams above the complexity ceiling map to 422."""
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_diagram.side_effect = KrokiTooComplexError("Too complex")
+
+        response = client.post(
+            "/api/generate",
+            json={
+                "diagram_type": "graphviz",
+                "output_format": "png",
+                "diagram_source": "digraph { a -> b }",
+            },
+        )
+
+        assert response.status_code == 422
+        assert json.loads(response.data)["error"] == "Too complex"
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_svg_compressed(self, mock_kroki_class, client):
+        """Test SVG responses honour Accept-Encoding."""
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_encoded.return_value = (
+            b"gz",
+            "image/svg+xml",
+            "gzip",
+        )
+
+        response = client.post(
+            "/api/generate",
+            json={
+                "diagram_type": "graphviz",
+                "output_format": "svg",
+                "diagram_source": "digraph {}",
+            },
+            headers={"Accept-Encoding": "gzip"},
+        )
+
+        assert response.status_code == 200
+        assert response.data == b"gz"
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Vary"] == "Accept-Encoding"
+        mock_client.generate_encoded.assert_called_once_with(
+            diagram_type="graphviz",
+            output_format="svg",
+            diagram_source="digraph {}",
+            encoding="gzip",
+        )
+        mock_client.generate_diagram.assert_not_called()
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_etag(self, mock_kroki_class, client):
+        """Test responses carry an ETag and honour If-None-Match."""
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_diagram.return_value = (b"<svg/>", "image/svg+xml")
+        payload = {
+            "diagram_type": "graphviz",
+            "output_format": "svg",
+            "diagram_source": "digraph {}",
+        }
+
+        response = client.post("/api/generate", json=payload)
+        etag = response.headers["ETag"]
+        assert response.status_code == 200
+
+        response = client.post(
+            "/api/generate", json=payload, headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.data == b""
+        assert response.headers["ETag"] == etag
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_body_too_large(self, mock_kroki_class, app, client):
+        """Test oversized bodies are refused with 413 before rendering."""
+        app.config["MAX_REQUEST_BYTES"] = 16
+
+        response = client.post(
+            "/api/generate?diagram_type=graphviz&output_format=svg",
+            data="digraph { A -> B -> C -> D }",
+            content_type="text/plain",
+        )
+
+        assert response.status_code == 413
+        assert "too large" in json.loads(response.data)["error"]
+        mock_kroki_class.assert_not_called()
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_text_spooled(self, mock_kroki_class, app, client):
+        """Test text bodies above MAX_BYTES reach the client as a spooled file."""
+        app.config["MAX_BYTES"] = 8
+        received = {}
+
+        def generate(diagram_type, output_format, diagram_source):
+            received["source"] = diagram_source.read()
+            return b"<svg/>", "image/svg+xml"
+
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_diagram.side_effect = generate
+
+        response = client.post(
+            "/api/generate?diagram_type=graphviz&output_format=svg",
+            data="digraph { A -> B }",
+            content_type="text/plain",
+        )
+
+        assert response.status_code == 200
+        assert received["source"] == b"digraph { A -> B }"
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_gzip_body(self, mock_kroki_class, client):
+        """Test gzip-encoded request bodies are decompressed."""
+        mock_client = MagicMock()
+        mock_kroki_class.return_value = mock_client
+        mock_client.generate_diagram.return_value = (b"<svg/>", "image/svg+xml")
+        payload = {
+            "diagram_type": "plantuml",
+            "output_format": "svg",
+            "diagram_source": "@startuml\nA -> B\n@enduml",
+        }
+
+        response = client.post(
+            "/api/generate",
+            data=gzip.compress(json.dumps(payload).encode()),
+            content_type="application/json",
+            headers={"Content-Encoding": "gzip"},
+        )
+
+        assert response.status_code == 200
+        mock_client.generate_diagram.assert_called_once_with(**payload)
+
+    def test_generate_diagram_unsupported_body_encoding(self, client):
+        """Test unknown request content codings get 415."""
+        response = client.post(
+            "/api/generate",
+            data=b"...",
+            content_type="application/json",
+            headers={"Content-Encoding": "compress"},
+        )
+
+        assert response.status_code == 415
+
+    def test_metrics_route(self, client):
+        """Test the Prometheus metrics endpoint."""
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain")
+        assert b'scheduler_in_flight{lane="interactive"} 0' in response.data
+        assert b"render_cache_max_bytes" in response.data
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_request_id(self, mock_kroki_class, client):
+        """Test the request ID is echoed, or generated when missing."""
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"<svg></svg>",
+            "image/svg+xml",
+        )
+        body = {
+            "diagram_type": "graphviz",
+            "output_format": "png",
+            "diagram_source": "digraph { a -> b }",
+        }
+
+        echoed = client.post(
+            "/api/generate", json=body, headers={"X-Request-ID": "req-42"}
+        )
+        generated = client.post("/api/generate", json=body)
+
+        assert echoed.headers["X-Request-ID"] == "req-42"
+        assert len(generated.headers["X-Request-ID"]) == 32
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_failure_logged_once(
+        self, mock_kroki_class, client, caplog
+    ):
+        """Test an unexpected error gives one log line with its traceback."""
+        mock_kroki_class.return_value.generate_diagram.side_effect = ValueError(
+            "Unexpected error"
+        )
+
+        with caplog.at_level(logging.INFO, logger="src"):
+            client.post(
+                "/api/generate",
+                json={
+                    "diagram_type": "mermaid",
+                    "output_format": "png",
+                    "diagram_source": "graph TD\nA --> B",
+                },
+                headers={"X-Request-ID": "req-42"},
+            )
+
+        assert len(caplog.records) == 1
+        record = caplog.records[0]
+        assert record.levelno == logging.ERROR
+        assert record.request_id == "req-42"
+        assert record.status == 500
+        assert record.diagram_type == "mermaid"
+        assert set(record.stages_ms) >= {"read", "parse", "render"}
+        assert record.exc_info[0] is ValueError
+
+    def test_health_route_not_sampled(self, client, caplog, requests_mock):
+        """Test successful health checks are not logged."""
+        requests_mock.get("http://test-kroki:8000/health", text="OK")
+
+        with caplog.at_level(logging.INFO, logger="src.requests"):
+            response = client.get("/health")
+
+        assert response.status_code == 200
+        assert "X-Request-ID" in response.headers
+        assert caplog.records == []
+
+    def test_debug_traces_requires_token(self, app, client):
+        """Test the trace viewer is hidden or refused without the token."""
+        assert client.get("/debug/traces").status_code == 404
+
+        app.config["ADMIN_TOKEN"] = "secret"
+        assert client.get("/debug/traces").status_code == 401
+        response = client.get(
+            "/debug/traces", headers={"Authorization": "Bearer wrong"}
+        )
+        assert response.status_code == 401
+
+    @patch("src.routes.KrokiClient")
+    def test_debug_traces(self, mock_kroki_class, app, client):
+        """Test request traces are kept and served as JSON or Chrome events."""
+        app.config["ADMIN_TOKEN"] = "secret"
+        app.extensions["tracer"] = Tracer(capacity=5)
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+
+        client.post(
+            "/api/generate",
+            json={
+                "diagram_type": "graphviz",
+                "output_format": "png",
+                "diagram_source": "digraph { a -> b }",
+            },
+            headers={"X-Request-ID": "req-42"},
+        )
+        response = client.get("/debug/traces", headers={"X-Admin-Token": "secret"})
+        chrome = client.get(
+            "/debug/traces?format=chrome",
+            headers={"Authorization": "Bearer secret"},
+        )
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["recorded"] == 1
+        trace = data["traces"][0]
+        assert trace["trace_id"] == "req-42"
+        assert trace["name"] == "POST /api/generate"
+        assert trace["attributes"] == {"status": 200}
+        assert [span["name"] for span in trace["spans"]] == [
+            "read",
+            "parse",
+            "render",
+            "respond",
+        ]
+        assert chrome.status_code == 200
+        assert json.loads(chrome.data)["traceEvents"]
+
+    @patch("src.routes.KrokiClient")
+    def test_profile_on_request(self, mock_kroki_class, app, client, tmp_path):
+        """Test an admin can profile a request and download its profile."""
+        app.config["ADMIN_TOKEN"] = "secret"
+        app.extensions["profiler"] = RequestProfiler(str(tmp_path))
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+        body = {
+            "diagram_type": "graphviz",
+            "output_format": "png",
+            "diagram_source": "digraph { a -> b }",
+        }
+
+        unprofiled = client.post("/api/generate", json=body, headers={"X-Profile": "1"})
+        profiled = client.post(
+            "/api/generate",
+            json=body,
+            headers={"X-Profile": "1", "X-Admin-Token": "secret"},
+        )
+        name = profiled.headers["X-Profile-Id"]
+        headers = {"X-Admin-Token": "secret"}
+        listing = client.get("/debug/profiles", headers=headers)
+        summary = client.get(f"/debug/profiles/{name}?format=text", headers=headers)
+        download = client.get(f"/debug/profiles/{name}", headers=headers)
+
+        assert "X-Profile-Id" not in unprofiled.headers
+        profiles = json.loads(listing.data)["profiles"]
+        assert [profile["name"] for profile in profiles] == [name]
+        assert profiles[0]["status"] == 200
+        assert b"generate_diagram" in summary.data
+        assert download.status_code == 200
+        assert download.headers["Content-Type"] == "application/octet-stream"
+        assert client.get("/debug/profiles/nope", headers=headers).status_code == 404
+
+    def test_debug_profiles_disabled(self, app, client):
+        """Test the profile listing is unavailable while profiling is off."""
+        app.config["ADMIN_TOKEN"] = "secret"
+
+        response = client.get("/debug/profiles", headers={"X-Admin-Token": "secret"})
+
+        assert response.status_code == 404
+
+    @patch("src.routes.KrokiClient")
+    def test_memory_tracking(self, mock_kroki_class, app, client, caplog):
+        """Test measured requests export their peak memory per stage."""
+        app.extensions["memory_tracker"] = MemoryTracker()
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+
+        with caplog.at_level(logging.INFO, logger="src.requests"):
+            client.post(
+                "/api/generate",
+                json={
+                    "diagram_type": "graphviz",
+                    "output_format": "png",
+                    "diagram_source": "digraph { a -> b }",
+                },
+            )
+
+        registry = app.extensions["metrics"]
+        summary = registry.summary(
+            "request_memory_peak_bytes", diagram_type="graphviz", size_class="<10KB"
+        )
+        assert summary["count"] == 1
+        assert registry.summary(
+            "request_memory_stage_peak_bytes", diagram_type="graphviz", stage="render"
+        )["count"]
+        record = caplog.records[0]
+        assert record.memory_peak_bytes > 0
+        assert {"read", "parse", "render", "respond"} <= set(record.memory_stages)
+
+    @patch("src.routes.KrokiClient")
+    def test_preview(self, mock_kroki_class, client):
+        """Test a preview renders in the interactive lane with a debounce hint."""
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+        client.get("/")
+
+        response = client.post(
+            "/api/preview",
+            json=PREVIEW_BODY,
+            headers={"X-Preview-Session": "session-1", "X-Preview-Seq": "1"},
+        )
+
+        assert response.status_code == 200
+        assert response.data == b"PNG"
+        assert int(response.headers["X-Debounce-Ms"]) >= 150
+        kwargs = mock_kroki_class.call_args.kwargs
+        assert kwargs["lane"] == "interactive"
+        assert kwargs["cancelled"]() is False
+
+    def test_preview_requires_session(self, client):
+        """Test preview requests must carry a valid session ID."""
+        response = client.post("/api/preview", json=PREVIEW_BODY)
+        assert response.status_code == 400
+
+        response = client.post(
+            "/api/preview", json=PREVIEW_BODY, headers={"X-Preview-Session": "../x"}
+        )
+        assert response.status_code == 400
+
+    @patch("src.routes.KrokiClient")
+    def test_preview_stale_request_superseded(self, mock_kroki_class, app, client):
+        """Test a request older than one already seen is refused unrendered."""
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+        headers = {"X-Preview-Session": "session-1"}
+        client.post(
+            "/api/preview", json=PREVIEW_BODY, headers={**headers, "X-Preview-Seq": "5"}
+        )
+
+        response = client.post(
+            "/api/preview", json=PREVIEW_BODY, headers={**headers, "X-Preview-Seq": "3"}
+        )
+
+        assert response.status_code == 409
+        assert "X-Debounce-Ms" in response.headers
+        assert mock_kroki_class.call_count == 1
+        registry = app.extensions["metrics"]
+        assert registry.get("preview_requests_total", result="superseded") == 1
+        assert registry.get("preview_requests_total", result="rendered") == 1
+
+    @patch("src.routes.KrokiClient")
+    def test_preview_superseded_while_rendering(self, mock_kroki_class, app, client):
+        """Test a render superseded meanwhile is discarded."""
+
+        def newer_request(**kwargs):
+            app.extensions["preview_sessions"].begin("session-1", 2)
+            return b"PNG", "image/png"
+
+        mock_kroki_class.return_value.generate_diagram.side_effect = newer_request
+
+        response = client.post(
+            "/api/preview",
+            json=PREVIEW_BODY,
+            headers={"X-Preview-Session": "session-1", "X-Preview-Seq": "1"},
+        )
+
+        assert response.status_code == 409
+        assert response.data != b"PNG"
+
+    @patch("src.routes.KrokiClient")
+    def test_preview_cancelled_before_upstream(self, mock_kroki_class, client):
+        """Test a render cancelled while queued is reported as superseded."""
+        mock_kroki_class.return_value.generate_diagram.side_effect = (
+            KrokiCancelledError("Render superseded by a newer request")
+        )
+
+        response = client.post(
+            "/api/preview",
+            json=PREVIEW_BODY,
+            headers={"X-Preview-Session": "session-1"},
+        )
+
+        assert response.status_code == 409
+
+    def test_preview_disabled(self, app, client):
+        """Test the preview endpoint is hidden when disabled."""
+        app.extensions["preview_sessions"] = None
+
+        response = client.post(
+            "/api/preview",
+            json=PREVIEW_BODY,
+            headers={"X-Preview-Session": "session-1"},
+        )
+
+        assert response.status_code == 404
+
+    def test_index_cached_with_etag(self, client):
+        """Test the index page is revalidated with its ETag."""
+        response = client.get("/")
+        etag = response.headers["ETag"]
+
+        assert response.headers["Cache-Control"] == "no-cache"
+        assert b"/assets/js/app." in response.data
+
+        response = client.get("/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+
+    def test_index_compressed(self, client):
+        """Test the index page is sent precompressed when accepted."""
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert b"Kroki Generator" in gzip.decompress(response.data)
+        assert response.headers["Vary"] == "Accept-Encoding"
+
+    def test_asset_immutable(self, app, client):
+        """Test fingerprinted assets are cacheable for a year."""
+        url = app.extensions["assets"].url("js/app.js")
+
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert "immutable" in response.headers["Cache-Control"]
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert b"renderHistory" in gzip.decompress(response.data)
+
+        response = client.get(
+            url,
+            headers={
+                "If-None-Match": response.headers["ETag"],
+                "Accept-Encoding": "gzip",
+            },
+        )
+        assert response.status_code == 304
+
+    def test_asset_unknown(self, client):
+        """Test stale or unknown fingerprints are not served."""
+        response = client.get("/assets/js/app.0000000000000000.js")
+        assert response.status_code == 404
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_permalink(self, mock_kroki_class, app, client):
+        """Test a stored render is served by permalink without rendering."""
+        app.extensions["permalinks"] = MemoryPermalinkStore()
+        mock_kroki_class.return_value.generate_encoded.return_value = (
+            gzip.compress(b"<svg/>"),
+            "image/svg+xml",
+            "gzip",
+        )
+
+        response = client.post(
+            "/api/generate",
+            json={
+                "diagram_type": "graphviz",
+                "output_format": "svg",
+                "diagram_source": "digraph { a -> b }",
+                "permalink": True,
+            },
+            headers={"Accept-Encoding": "gzip"},
+        )
+        path = response.headers["X-Permalink"]
+        assert path.startswith("/d/") and path.endswith(".svg")
+
+        mock_kroki_class.reset_mock()
+        response = client.get(path)
+
+        assert response.status_code == 200
+        assert response.data == b"<svg/>"
+        assert response.mimetype == "image/svg+xml"
+        assert "immutable" in response.headers["Cache-Control"]
+        assert "sandbox" in response.headers["Content-Security-Policy"]
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+        mock_kroki_class.assert_not_called()
+
+        response = client.get(path, headers={"If-None-Match": response.headers["ETag"]})
+        assert response.status_code == 304
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_permalink_disabled(self, mock_kroki_class, client):
+        """Test renders are served without permalink when storing is disabled."""
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+
+        response = client.post(
+            "/api/generate?diagram_type=graphviz&output_format=png&permalink=1",
+            data="digraph { a -> b }",
+            content_type="text/plain",
+        )
+
+        assert response.status_code == 200
+        assert "X-Permalink" not in response.headers
+        assert client.get("/d/AAAAAAAAAAAAAAAA.png").status_code == 404
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_forwarded_to_owner(self, mock_kroki_class, app, client):
+        """Test a render owned by another replica is relayed from it."""
+        cluster = Cluster("http://a:5000", ["http://b:5000"])
+        app.extensions["cluster"] = cluster
+        forwarded = ForwardedResponse(
+            200, {"Content-Type": "image/png", "ETag": '"peer"'}, b"PEER-PNG"
+        )
+
+        with _owned_by(cluster, "http://b:5000"):
+            with patch.object(cluster, "forward", return_value=forwarded) as forward:
+                response = client.post(
+                    "/api/generate?diagram_type=graphviz&output_format=png",
+                    data="digraph { a -> b }",
+                    content_type="text/plain",
+                    headers={"X-Kroki-Client": "ui"},
+                )
+
+        assert response.status_code == 200
+        assert response.data == b"PEER-PNG"
+        assert response.headers["ETag"] == '"peer"'
+        node, path, body, headers = forward.call_args[0][:4]
+        assert node == "http://b:5000"
+        assert path == "/api/generate?diagram_type=graphviz&output_format=png"
+        assert body == b"digraph { a -> b }"
+        assert headers["X-Kroki-Client"] == "api"
+        mock_kroki_class.assert_not_called()
+        assert cluster.loads() == {"http://a:5000": 0, "http://b:5000": 0}
+        metrics = app.extensions["metrics"]
+        assert metrics.get("cluster_requests_total", result="forwarded") == 1
+
+    @patch("src.routes.KrokiClient")
+    def test_generate_diagram_local_render_in_cluster(
+        self, mock_kroki_class, app, client
+    ):
+        """Test owned, already forwarded and unforwardable renders stay local."""
+        cluster = Cluster("http://a:5000", ["http://b:5000"])
+        app.extensions["cluster"] = cluster
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+
+        def post(**headers):
+            return client.post(
+                "/api/generate?diagram_type=graphviz&output_format=png",
+                data="digraph { a -> b }",
+                content_type="text/plain",
+                headers=headers,
+            )
+
+        forwarded_by_b = {
+            "X-Kroki-Forwarded-By": "http://b:5000",
+            "X-Kroki-Forwarded-Signature": cluster.sign("", "", sender="http://b:5000"),
+        }
+        with patch.object(cluster, "forward") as forward:
+            forward.side_effect = ClusterForwardError("down")
+            with _owned_by(cluster, "http://a:5000"):
+                assert post().data == b"PNG"
+            with _owned_by(cluster, "http://b:5000"):
+                assert post(**forwarded_by_b).data == b"PNG"
+                forward.assert_not_called()
+                assert post().data == b"PNG"
+            forward.assert_called_once()
+
+        assert mock_kroki_class.return_value.generate_diagram.call_count == 3
+        assert cluster.loads() == {"http://a:5000": 0, "http://b:5000": 0}
+        metrics = app.extensions["metrics"]
+        assert metrics.get("cluster_requests_total", result="local") == 1
+        assert metrics.get("cluster_requests_total", result="forward_failed") == 1
+
+    @patch("src.routes.KrokiClient")
+    def test_peer_lane_is_trusted(self, mock_kroki_class, app, client):
+        """Test the lane of a signed forward is kept, a forged one is not."""
+        cluster = Cluster("http://a:5000", ["http://b:5000"])
+        app.extensions["cluster"] = cluster
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+        signed = cluster.sign("", "interactive", sender="http://b:5000")
+
+        for signature, lane in ((signed, "interactive"), (None, "api"), ("1:x", "api")):
+            headers = {
+                "X-Kroki-Forwarded-By": "http://b:5000",
+                "X-Kroki-Client": "interactive",
+            }
+            if signature:
+                headers["X-Kroki-Forwarded-Signature"] = signature
+            with _owned_by(cluster, "http://a:5000"):
+                client.post(
+                    "/api/generate?diagram_type=graphviz&output_format=png",
+                    data="digraph { a -> b }",
+                    content_type="text/plain",
+                    headers=headers,
+                )
+            assert mock_kroki_class.call_args.kwargs["lane"] == lane
+
+    def test_spoofed_forwarding_header_is_ignored(self, app, client):
+        """Test a forwarding header without a peer's signature does not skip routing."""
+        cluster = Cluster("http://a:5000", ["http://b:5000"])
+        app.extensions["cluster"] = cluster
+        forwarded = ForwardedResponse(200, {"Content-Type": "image/png"}, b"PEER")
+
+        for sender in ("yes", "http://a:5000", "http://evil:5000", "http://b:5000"):
+            with _owned_by(cluster, "http://b:5000"):
+                with patch.object(cluster, "forward", return_value=forwarded):
+                    response = client.post(
+                        "/api/generate?diagram_type=graphviz&output_format=png",
+                        data="digraph { a -> b }",
+                        content_type="text/plain",
+                        headers={"X-Kroki-Forwarded-By": sender},
+                    )
+            assert response.data == b"PEER"
+
+    @patch("src.routes.KrokiClient")
+    def test_admin_hotkeys(self, mock_kroki_class, app, client):
+        """Test rendered requests are counted and the top-K served to admins."""
+        mock_kroki_class.return_value.generate_diagram.return_value = (
+            b"PNG",
+            "image/png",
+        )
+        assert client.get("/admin/hotkeys").status_code == 404
+        app.config["ADMIN_TOKEN"] = "secret"
+        assert client.get("/admin/hotkeys").status_code == 401
+        headers = {"X-Admin-Token": "secret"}
+        assert client.get("/admin/hotkeys", headers=headers).status_code == 404
+
+        app.extensions["hotkeys"] = HotKeys(capacity=4)
+        for source in ("digraph { a }", "digraph { a }", "digraph { b }"):
+            client.post(
+                "/api/generate?diagram_type=graphviz&output_format=png",
+                data=source,
+                content_type="text/plain",
+            )
+        response = client.get("/admin/hotkeys?limit=1", headers=headers)
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["recorded"] == 3
+        assert len(data["hotkeys"]) == 1
+        assert data["hotkeys"][0]["count"] == 2
+        assert data["hotkeys"][0]["diagram_type"] == "graphviz"
+        assert "diagram_source" not in data["hotkeys"][0]
+
+    def test_ready(self, app, client):
+        """Test readiness waits for the startup warm-up."""
+        assert client.get("/ready").status_code == 200
+
+        warmup = WarmUp(app, [])
+        app.extensions["warmup"] = warmup
+        with patch.object(WarmUp, "start"):
+            warmup.state = "warming"
+            response = client.get("/ready")
+        assert response.status_code == 503
+        assert json.loads(response.data)["warmup"]["state"] == "warming"
+
+        warmup.run()
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert json.loads(response.data)["warmup"]["state"] == "ready"
+
+    def test_permalink_unknown(self, app, client):
+        """Test unknown permalinks are not found."""
+        app.extensions["permalinks"] = MemoryPermalinkStore()
+
+        assert client.get("/d/AAAAAAAAAAAAAAAA.png").status_code == 404
+        assert client.get("/d/short.png").status_code == 404
@@ -0,0 +1,156 @@
+"""Tests for the upstream render scheduler."""
+
+import threading
+import time
+
+import pytest
+from src.scheduler import (
+    LANE_API,
+    LANE_BATCH,
+    LANE_INTERACTIVE,
+    PriorityScheduler,
+    SchedulerBusyError,
+    classify_client,
+)
+
+
+def _wait_until(predicate, timeout=2.0):
+    """Poll predicate until it is true or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class TestClassifyClient:
+    """Test cases for request classification."""
+
+    def test_known_hints(self):
+        """Test header values are mapped to lanes."""
+        default = LANE_INTERACTIVE
+        assert classify_client("ui", default) == LANE_INTERACTIVE
+        assert classify_client("UI ", default) == LANE_INTERACTIVE
+        assert classify_client("api", default) == LANE_API
+        assert classify_client("batch", default) == LANE_BATCH
+        assert classify_client("job", default) == LANE_BATCH
+
+    def test_hint_only_lowers_priority(self):
+        """Test a hint cannot raise the lane above the default."""
+        assert classify_client("ui") == LANE_API
+        assert classify_client("interactive", LANE_BATCH) == LANE_BATCH
+        assert classify_client("batch") == LANE_BATCH
+
+    def test_unknown_hint_uses_default(self):
+        """Test missing or unknown hints fall back to the default lane."""
+        assert classify_client(None) == LANE_API
+        assert classify_client("whatever") == LANE_API
+        assert classify_client("", default=LANE_INTERACTIVE) == LANE_INTERACTIVE
+
+
+class TestPriorityScheduler:
+    """Test cases for PriorityScheduler."""
+
+    def test_reserved_slots_only_for_interactive(self):
+        """Test bulk lanes cannot use the reserved interactive capacity."""
+        scheduler = PriorityScheduler(max_concurrency=2, reserved_interactive=1)
+
+        scheduler.acquire(LANE_API)
+        with pytest.raises(SchedulerBusyError, match="Timed out"):
+            scheduler.acquire(LANE_BATCH, timeout=0.01)
+
+        # Interactive still gets the reserved slot immediately
+        scheduler.acquire(LANE_INTERACTIVE, timeout=0.01)
+        stats = scheduler.stats()
+        assert stats["in_flight"][LANE_API] == 1
+        assert stats["in_flight"][LANE_INTERACTIVE] == 1
+        assert stats["rejected"][LANE_BATCH] == 1
+
+    def test_interactive_served_before_queued_bulk(self):
+        """Test a freed slot goes to interactive work ahead of older bulk work."""
+        scheduler = PriorityScheduler(max_concurrency=1, reserved_interactive=0)
+        scheduler.acquire(LANE_API)
+        order = []
+
+        def worker(lane):
+            with scheduler.slot(lane, timeout=2):
+                order.append(lane)
+
+        batch = threading.Thread(target=worker, args=(LANE_BATCH,))
+        batch.start()
+        assert _wait_until(lambda: scheduler.stats()["queued"][LANE_BATCH] == 1)
+
+        ui = threading.Thread(target=worker, args=(LANE_INTERACTIVE,))
+        ui.start()
+        assert _wait_until(lambda: scheduler.stats()["queued"][LANE_INTERACTIVE] == 1)
+
+        scheduler.release(LANE_API)
+        batch.join(2)
+        ui.join(2)
+
+        assert order == [LANE_INTERACTIVE, LANE_BATCH]
+
+    def test_full_queue_rejects_bulk(self):
+        """Test bulk requests are refused when the queue is full."""
+        scheduler = PriorityScheduler(max_concurrency=1, max_queue=0)
+        scheduler.acquire(LANE_INTERACTIVE)
+
+        with pytest.raises(SchedulerBusyError, match="queue is full"):
+            scheduler.acquire(LANE_BATCH)
+
+    def test_interactive_preempts_queued_bulk(self):
+        """Test interactive work evicts queued bulk work when the queue is full."""
+        scheduler = PriorityScheduler(
+            max_concurrency=1, reserved_interactive=0, max_queue=1
+        )
+        scheduler.acquire(LANE_API)
+        errors = []
+
+        def bulk():
+            try:
+                scheduler.acquire(LANE_BATCH, timeout=2)
+            except SchedulerBusyError as e:
+                errors.append(str(e))
+
+        thread = threading.Thread(target=bulk)
+        thread.start()
+        assert _wait_until(lambda: scheduler.stats()["queued"][LANE_BATCH] == 1)
+
+        granted = []
+        ui = threading.Thread(
+            target=lambda: granted.append(scheduler.acquire(LANE_INTERACTIVE, 2))
+        )
+        ui.start()
+        thread.join(2)
+
+        assert errors == ["Preempted by higher priority renders"]
+        scheduler.release(LANE_API)
+        ui.join(2)
+        assert granted == [None]
+
+    def test_slot_releases_on_error(self):
+        """Test the slot context manager releases after an exception."""
+        scheduler = PriorityScheduler(max_concurrency=1)
+
+        with pytest.raises(RuntimeError):
+            with scheduler.slot(LANE_API):
+                raise RuntimeError("boom")
+
+        stats = scheduler.stats()
+        assert stats["in_flight"][LANE_API] == 0
+        assert stats["completed"][LANE_API] == 1
+
+    def test_from_config(self):
+        """Test scheduler construction from a config mapping."""
+        scheduler = PriorityScheduler.from_config(
+            {"SCHEDULER_MAX_CONCURRENCY": 3, "SCHEDULER_RESERVED_INTERACTIVE": 5}
+        )
+        assert scheduler.max_concurrency == 3
+        # Bulk lanes always keep at least one slot
+        assert scheduler.reserved_interactive == 2
+
+    def test_unknown_lane(self):
+        """Test acquiring an unknown lane is a programming error."""
+        with pytest.raises(ValueError):
+            PriorityScheduler().acquire("vip")
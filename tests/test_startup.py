@@ -0,0 +1,100 @@
+"""Tests for the application boot path."""
+
+import gc
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.main import create_app
+from src.render_cache import RenderCache
+from src.startup import (
+    STARTUP_BUDGET,
+    StartupTimer,
+    init_worker,
+    measure_startup,
+    preload,
+)
+from src.warmup import SeedRender, WarmUp
+
+
+@pytest.fixture
+def app():
+    """Create test application."""
+    app = create_app("testing")
+    app.config["KROKI_URL"] = "http://test-kroki:8000"
+    return app
+
+
+class TestStartupTimer:
+    """Test cases for StartupTimer."""
+
+    def test_first_request_once_per_process(self):
+        """Test only the first request of a process is reported first."""
+        timer = StartupTimer()
+
+        assert timer.first_request() is True
+        assert timer.first_request() is False
+
+        timer._pid = -1
+        assert timer.first_request() is True
+
+    def test_create_app_and_first_request_recorded(self, app):
+        """Test the app exports its creation and first request times."""
+        metrics = app.extensions["metrics"]
+        assert metrics.get("startup_create_app_seconds") > 0
+
+        app.test_client().get("/")
+
+        assert metrics.get("startup_first_request_seconds") > 0
+
+
+class TestPreload:
+    """Test cases for preload and init_worker."""
+
+    def test_preload_warms_and_freezes(self, app, requests_mock):
+        """Test the master compiles templates and warms the cache to the end."""
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", text="<svg/>")
+        app.extensions["render_cache"] = RenderCache(max_bytes=100000)
+        warmup = WarmUp(app, [SeedRender("graphviz", "svg", "digraph {}")])
+        app.extensions["warmup"] = warmup
+        app.extensions["png_optimizer"] = MagicMock()
+
+        try:
+            with patch.object(app.jinja_env, "get_template") as mock_get_template:
+                preload(app)
+            assert gc.get_freeze_count() > 0
+        finally:
+            gc.unfreeze()
+
+        mock_get_template.assert_any_call("index.html")
+        assert warmup.status()["state"] == "ready"
+        app.extensions["png_optimizer"].drain.assert_called_once()
+        assert app.extensions["metrics"].get("startup_preload_seconds") > 0
+
+        # A worker forked from this master inherits the finished warm-up
+        warmup._pid = -1
+        with patch("src.warmup.threading.Thread") as mock_thread:
+            init_worker(app)
+        mock_thread.assert_not_called()
+
+    def test_init_worker_starts_threads(self, app):
+        """Test the per-worker threads start when the worker is created."""
+        for name in ("rss_monitor", "hotkey_refresher", "warmup"):
+            app.extensions[name] = MagicMock()
+
+        init_worker(app)
+
+        for name in ("rss_monitor", "hotkey_refresher", "warmup"):
+            app.extensions[name].start.assert_called_once()
+        assert app.extensions["metrics"].get("startup_worker_init_seconds") > 0
+
+
+class TestStartupBudget:
+    """Startup time benchmark."""
+
+    def test_cold_start_within_budget(self):
+        """Test a cold start of the application stays within its budget."""
+        timings = measure_startup()
+
+        for phase, budget in STARTUP_BUDGET.items():
+            assert timings[phase] < budget, f"{phase} took {timings[phase]:.3f}s"
@@ -0,0 +1,128 @@
+"""Tests for deterministic SVG identifier normalisation."""
+
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+from src.svg_normalizer import SvgNormalizer, generated_ids
+
+FIXTURES = Path(__file__).parent / "fixtures" / "svg"
+RENDER_PAIRS = [
+    ("mermaid_flowchart_1.svg", "mermaid_flowchart_2.svg"),
+    ("plantuml_sequence_1.svg", "plantuml_sequence_2.svg"),
+]
+_REFERENCE_RE = re.compile(r'url\(#([^)]+)\)|href="#([^"]+)"')
+
+
+def load(name):
+    """Read an SVG fixture."""
+    return (FIXTURES / name).read_bytes()
+
+
+def assert_same_rendering(original, normalized):
+    """Assert both documents have the same tree, up to identifier renaming."""
+    pairs = list(zip(ET.fromstring(original).iter(), ET.fromstring(normalized).iter()))
+    mapping = {
+        before.attrib["id"]: after.attrib["id"]
+        for before, after in pairs
+        if "id" in before.attrib
+    }
+    assert len(set(mapping.values())) == len(mapping)
+    renames = [(old, new) for old, new in mapping.items() if old != new]
+    renames.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def rename(value):
+        for old, new in renames:
+            value = value.replace(old, new)
+        return value
+
+    for before, after in pairs:
+        assert before.tag == after.tag
+        if before.tag.endswith("style"):
+            assert rename(before.text or "") == (after.text or "")
+        else:
+            assert before.text == after.text
+        assert before.tail == after.tail
+        assert {k: rename(v) for k, v in before.attrib.items()} == after.attrib
+
+    # Every reference still points at the element it pointed at before
+    ids = set(mapping.values())
+    for match in _REFERENCE_RE.finditer(original.decode()):
+        target = match.group(1) or match.group(2)
+        assert mapping[target] in ids
+
+
+class TestSvgNormalizer:
+    """Test cases for SvgNormalizer."""
+
+    @pytest.mark.parametrize("first,second", RENDER_PAIRS)
+    def test_renders_become_identical(self, first, second):
+        """Test two renders of one diagram normalise to the same bytes."""
+        normalizer = SvgNormalizer()
+        assert load(first) != load(second)
+        assert normalizer.normalize(load(first)) == normalizer.normalize(load(second))
+
+    @pytest.mark.parametrize("name", [pair[0] for pair in RENDER_PAIRS])
+    def test_rendering_unchanged(self, name):
+        """Test normalisation only renames identifiers."""
+        original = load(name)
+        normalized = SvgNormalizer().normalize(original)
+        assert normalized != original
+        assert_same_rendering(original, normalized)
+
+    @pytest.mark.parametrize("name", [pair[0] for pair in RENDER_PAIRS])
+    def test_idempotent(self, name):
+        """Test normalising twice is a no-op."""
+        normalizer = SvgNormalizer()
+        once = normalizer.normalize(load(name))
+        assert normalizer.normalize(once) == once
+
+    def test_mermaid_css_selectors_rewritten(self):
+        """Test the Mermaid id is rewritten in styles and marker references."""
+        normalized = SvgNormalizer().normalize(load("mermaid_flowchart_1.svg")).decode()
+        assert "1697040123456" not in normalized
+        root_id = re.search(r'<svg id="([^"]+)"', normalized).group(1)
+        assert f"#{root_id} .node rect" in normalized
+        assert f"url(#{root_id}_flowchart-pointEnd)" in normalized
+
+    def test_deterministic_ids_untouched(self):
+        """Test documents without generated ids are returned as is."""
+        svg = load("graphviz_digraph.svg")
+        assert generated_ids(svg.decode()) == []
+        assert SvgNormalizer().normalize(svg) is svg
+
+    def test_ids_in_labels_untouched(self):
+        """Test a generated id quoted in visible text is not rewritten."""
+        original = load("mermaid_flowchart_1.svg").replace(
+            b">A<", b">mermaid-1697040123456 is my label<"
+        )
+        normalized = SvgNormalizer().normalize(original)
+        assert b">mermaid-1697040123456 is my label<" in normalized
+        assert b'<svg id="mermaid-1697040123456"' not in normalized
+        assert_same_rendering(original, normalized)
+
+    def test_deterministic_def_ids_untouched(self):
+        """Test short gradient ids such as Graphviz ``l_0`` are kept."""
+        svg = (
+            b'<svg xmlns="http://www.w3.org/2000/svg"><defs>'
+            b'<linearGradient id="l_0"><stop offset="0"/></linearGradient></defs>'
+            b'<rect fill="url(#l_0)"/><text>l_0 is my label</text></svg>'
+        )
+        assert generated_ids(svg.decode()) == []
+        assert SvgNormalizer().normalize(svg) is svg
+
+    def test_different_diagrams_get_different_ids(self):
+        """Test the new ids depend on the document content."""
+        normalizer = SvgNormalizer()
+        first = normalizer.normalize(load("mermaid_flowchart_1.svg"))
+        other = load("mermaid_flowchart_1.svg").replace(b">B<", b">C<")
+        second = normalizer.normalize(other)
+        root_id = re.compile(rb'<svg id="([^"]+)"')
+        assert root_id.search(first).group(1) != root_id.search(second).group(1)
+
+    def test_from_config(self):
+        """Test normalisation is enabled unless turned off."""
+        assert isinstance(SvgNormalizer.from_config({}), SvgNormalizer)
+        assert SvgNormalizer.from_config({"SVG_NORMALIZE": False}) is None
@@ -0,0 +1,124 @@
+"""Tests for SVG optimisation passes."""
+
+import xml.etree.ElementTree as ET
+
+import pytest
+from src.svg_optimizer import SvgOptimizer, minify_css
+
+MERMAID_LIKE_SVG = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN"
+ "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
+<!-- Generated by a renderer -->
+<svg xmlns="http://www.w3.org/2000/svg" id="my-svg" class="" viewBox="0 0 120.123456 80.5">
+  <metadata>
+    <rdf>generator info</rdf>
+  </metadata>
+  <style>
+    /* theme */
+    #my-svg .node rect {
+      fill: #ECECFF;
+      stroke: #9370DB;
+    }
+    #my-svg .label { font-family: "trebuchet ms", verdana, arial; }
+  </style>
+  <g   class="node"   transform="translate(10.000000, 20.987654)">
+    <rect x="0.333333" y="1.5" width="50.000001" height="20" style=""/>
+    <text x="2" y="3">  Hello   world  </text>
+  </g>
+  <foreignObject width="10" height="10"><div>  keep   me  </div></foreignObject>
+</svg>
+"""
+
+
+def _structure(document):
+    """Tags and text content of every element, in document order."""
+    root = ET.fromstring(document)
+    return [(el.tag, (el.text or "").strip()) for el in root.iter()]
+
+
+class TestSvgOptimizer:
+    """Test cases for SvgOptimizer."""
+
+    def test_optimize_reduces_size(self):
+        """Test the default passes shrink a typical render."""
+        result = SvgOptimizer().optimize(MERMAID_LIKE_SVG)
+        assert len(result) < len(MERMAID_LIKE_SVG)
+        assert b"<!--" not in result
+        assert b"<!DOCTYPE" not in result
+        assert b"<metadata" not in result
+        assert b'class=""' not in result
+        assert b'style=""' not in result
+
+    def test_optimize_preserves_document_structure(self):
+        """Test elements other than metadata survive with the same text."""
+        result = SvgOptimizer().optimize(MERMAID_LIKE_SVG)
+        before = [
+            item
+            for item in _structure(MERMAID_LIKE_SVG)
+            if "metadata" not in item[0] and not item[0].endswith("rdf")
+        ]
+        after = _structure(result)
+        assert [tag for tag, _ in after] == [tag for tag, _ in before]
+
+    def test_text_and_foreign_object_untouched(self):
+        """Test whitespace-significant content is copied verbatim."""
+        result = SvgOptimizer().optimize(MERMAID_LIKE_SVG)
+        assert b'<text x="2" y="3">  Hello   world  </text>' in result
+        assert b"<div>  keep   me  </div>" in result
+
+    def test_precision_pass(self):
+        """Test geometric floats are rounded to the configured precision."""
+        result = SvgOptimizer(passes=["precision"], precision=2).optimize(
+            MERMAID_LIKE_SVG
+        )
+        assert b'viewBox="0 0 120.12 80.5"' in result
+        assert b'transform="translate(10, 20.99)"' in result
+        assert b'x="0.33"' in result
+        assert b'width="50"' in result
+
+    def test_precision_keeps_adjacent_numbers_apart(self):
+        """Test a number rounded to an integer is not merged with the next one."""
+        optimizer = SvgOptimizer(passes=["precision"], precision=3)
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg"><path d="M0.0001.5 1 1"/></svg>'
+
+        assert b'd="M0 .5 1 1"' in optimizer.optimize(svg)
+
+    def test_style_pass(self):
+        """Test inline stylesheets are minified."""
+        result = SvgOptimizer(passes=["style"]).optimize(MERMAID_LIKE_SVG)
+        assert b"#my-svg .node rect{fill:#ECECFF;stroke:#9370DB}" in result
+        assert b'"trebuchet ms"' in result
+
+    def test_invalid_input_returned_unchanged(self):
+        """Test undecodable or malformed documents are left alone."""
+        optimizer = SvgOptimizer()
+        assert optimizer.optimize(b"\xff\xfe<svg>") == b"\xff\xfe<svg>"
+        broken = b"<svg>\n  <g>\n</svg>"
+        assert optimizer.optimize(broken) == broken
+
+    def test_unknown_pass(self):
+        """Test unknown pass names are rejected."""
+        with pytest.raises(ValueError, match="Unknown SVG optimisation passes"):
+            SvgOptimizer(passes=["nope"])
+
+    def test_from_config(self):
+        """Test optimizer construction from config."""
+        assert SvgOptimizer.from_config({"SVG_OPTIMIZE": False}) is None
+        optimizer = SvgOptimizer.from_config(
+            {
+                "SVG_OPTIMIZE": True,
+                "SVG_OPTIMIZE_PASSES": "comments, whitespace",
+                "SVG_PRECISION": 1,
+            }
+        )
+        assert optimizer.passes == {"comments", "whitespace"}
+        assert optimizer.precision == 1
+
+
+class TestMinifyCss:
+    """Test cases for the CSS minifier."""
+
+    def test_strings_preserved(self):
+        """Test string literals keep their inner whitespace and punctuation."""
+        css = 'a { content: "x ; { y"; }  /* c */ b , c { color : red ; }'
+        assert minify_css(css) == 'a{content:"x ; { y"}b,c{color :red}'
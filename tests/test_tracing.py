@@ -0,0 +1,113 @@
+"""Tests for in-process request tracing."""
+
+import time
+from src.tracing import ORDER_RECENT, Trace, Tracer, chrome_trace
+
+
+def _trace(trace_id, duration):
+    """Build a finished trace with a given duration."""
+    trace = Trace(trace_id, "POST /api/generate")
+    trace.finish(status=200)
+    trace.duration = duration
+    return trace
+
+
+class TestTrace:
+    """Test cases for Trace."""
+
+    def test_spans_nest(self):
+        """Test spans opened inside another span become its children."""
+        trace = Trace("req-1", "POST /api/generate")
+        with trace.span("render") as render:
+            with trace.span("cache", result="miss") as cache:
+                pass
+            now = time.perf_counter()
+            upstream = trace.add_span("upstream.wait", now - 0.01, now)
+        trace.finish(status=200)
+
+        assert render.parent_id == 0
+        assert cache.parent_id == render.span_id
+        assert upstream.parent_id == render.span_id
+        assert cache.attributes == {"result": "miss"}
+        assert abs(upstream.duration - 0.01) < 1e-6
+        assert trace.duration >= render.duration
+
+    def test_to_dict(self):
+        """Test the JSON representation uses milliseconds."""
+        trace = Trace("req-1", "POST /api/generate")
+        with trace.span("parse"):
+            pass
+        trace.finish(status=400)
+
+        document = trace.to_dict()
+
+        assert document["trace_id"] == "req-1"
+        assert document["attributes"] == {"status": 400}
+        assert [span["name"] for span in document["spans"]] == ["parse"]
+        assert "duration_ms" in document["spans"][0]
+
+    def test_chrome_trace(self):
+        """Test traces export as complete events on distinct rows."""
+        first = Trace("req-1", "POST /api/generate")
+        with first.span("render"):
+            pass
+        first.finish(status=200)
+        second = _trace("req-2", 0.5)
+
+        document = chrome_trace([first, second])
+
+        events = document["traceEvents"]
+        complete = [event for event in events if event["ph"] == "X"]
+        assert [event["name"] for event in complete] == [
+            "POST /api/generate",
+            "render",
+            "POST /api/generate",
+        ]
+        assert {event["tid"] for event in complete} == {1, 2}
+        assert complete[2]["dur"] == 500000.0
+
+
+class TestTracer:
+    """Test cases for Tracer."""
+
+    def test_keeps_slowest(self):
+        """Test only the slowest traces are kept, slowest first."""
+        tracer = Tracer(capacity=3)
+        for index, duration in enumerate([0.1, 0.5, 0.2, 0.9, 0.05, 0.3]):
+            tracer.record(_trace(f"req-{index}", duration))
+
+        slowest = tracer.traces()
+
+        assert [trace.duration for trace in slowest] == [0.9, 0.5, 0.3]
+        assert tracer.recorded == 6
+
+    def test_recent_ring_buffer(self):
+        """Test the most recent traces are kept, newest first."""
+        tracer = Tracer(capacity=2)
+        for index in range(4):
+            tracer.record(_trace(f"req-{index}", 0.1))
+
+        recent = tracer.traces(ORDER_RECENT)
+
+        assert [trace.trace_id for trace in recent] == ["req-3", "req-2"]
+
+    def test_min_ms_and_limit(self):
+        """Test fast requests are not kept among the slowest."""
+        tracer = Tracer(capacity=5, min_ms=100)
+        tracer.record(_trace("fast", 0.01))
+        tracer.record(_trace("slow", 0.2))
+        tracer.record(_trace("slower", 0.3))
+
+        assert [trace.trace_id for trace in tracer.traces(limit=1)] == ["slower"]
+        assert len(tracer.traces(ORDER_RECENT)) == 3
+
+    def test_from_config(self):
+        """Test tracing is disabled unless enabled in config."""
+        assert Tracer.from_config({}) is None
+
+        tracer = Tracer.from_config(
+            {"TRACE_ENABLED": True, "TRACE_BUFFER_SIZE": 10, "TRACE_MIN_MS": 5}
+        )
+
+        assert tracer.capacity == 10
+        assert tracer.min_ms == 5
@@ -0,0 +1,156 @@
+"""Tests for local pre-flight syntax checks."""
+
+import re
+import time
+from pathlib import Path
+
+import pytest
+
+from src.validators import (
+    PreflightValidator,
+    SourceSyntaxError,
+    validate_dot,
+    validate_mermaid,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures" / "preflight"
+CHECKERS = {".dot": validate_dot, ".mmd": validate_mermaid}
+VALID = sorted((FIXTURES / "valid").iterdir())
+INVALID = sorted((FIXTURES / "invalid").iterdir())
+# Invalid fixtures state the expected error position on their first line
+_EXPECT_RE = re.compile(r"expect: (\d+):(\d+)")
+
+
+def check(path):
+    """Run the checker matching a fixture's extension."""
+    CHECKERS[path.suffix](path.read_text(encoding="utf-8"))
+
+
+class TestCorpus:
+    """Test the checkers against the fixture corpus."""
+
+    @pytest.mark.parametrize("path", VALID, ids=lambda p: p.name)
+    def test_valid_sources_pass(self, path):
+        """Test no valid source is rejected (no false positives)."""
+        check(path)
+
+    @pytest.mark.parametrize("path", INVALID, ids=lambda p: p.name)
+    def test_invalid_sources_rejected_at_position(self, path):
+        """Test each malformed source is rejected at the expected line and column."""
+        line, column = map(int, _EXPECT_RE.search(path.read_text()).groups())
+
+        with pytest.raises(SourceSyntaxError) as excinfo:
+            check(path)
+
+        assert (excinfo.value.line, excinfo.value.column) == (line, column)
+        assert str(excinfo.value).startswith(f"line {line}, column {column}: ")
+
+    def test_latency(self):
+        """Test a check over the whole corpus takes well under a millisecond each."""
+        paths = VALID + INVALID
+        sources = [(CHECKERS[p.suffix], p.read_text(encoding="utf-8")) for p in paths]
+        rounds = 20
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for checker, source in sources:
+                try:
+                    checker(source)
+                except SourceSyntaxError:
+                    pass
+        mean = (time.perf_counter() - started) / (rounds * len(sources))
+
+        assert mean < 0.005
+
+
+class TestValidateDot:
+    """Test cases for the DOT parser."""
+
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "digraph {}",
+            "graph{a--b}",
+            'digraph { a -> b [label="x"] ; }',
+            "DiGraph G { Node [shape=box] A -> B }",
+            "digraph { a -> subgraph s { b c } -> d }",
+        ],
+    )
+    def test_accepts(self, source):
+        """Test well-formed sources are accepted."""
+        validate_dot(source)
+
+    @pytest.mark.parametrize(
+        "source, message",
+        [
+            ("digraph {", "'{' is never closed"),
+            ("digraph { a -> }", "after edge operator"),
+            ("graph { a -> b }", "'->' not allowed in a graph"),
+            ("digraph { a [color] }", "expected '='"),
+            ('digraph { a [label="x] }', "unterminated string"),
+            ("digraph { a } }", "found '}'"),
+        ],
+    )
+    def test_rejects(self, source, message):
+        """Test malformed sources are rejected with a descriptive message."""
+        with pytest.raises(SourceSyntaxError, match=re.escape(message)):
+            validate_dot(source)
+
+
+class TestValidateMermaid:
+    """Test cases for the Mermaid structure checker."""
+
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "graph TD;A-->B",
+            "graph;A-->B",
+            "flowchart\nA-->B",
+            'pie title Pets\n"Dogs" : 386',
+            "newDiagram-beta\n  anything goes",
+        ],
+    )
+    def test_accepts(self, source):
+        """Test well-formed and undecidable sources are accepted."""
+        validate_mermaid(source)
+
+    def test_unknown_types_are_passed_through(self):
+        """Test diagram keywords are left for Kroki to judge."""
+        validate_mermaid("%% comment\n  kanban\n  todo\n    t1")
+        validate_mermaid("%% comment\n  sequencediagram\n  A->>B: hi")
+
+    def test_rejects_missing_type(self):
+        """Test a source with only comments is reported."""
+        with pytest.raises(SourceSyntaxError) as excinfo:
+            validate_mermaid("%% comment\n\n")
+
+        assert excinfo.value.message == "missing diagram type"
+
+
+class TestPreflightValidator:
+    """Test cases for PreflightValidator."""
+
+    def test_from_config(self):
+        """Test the validator is opt-in."""
+        assert PreflightValidator.from_config({}) is None
+        validator = PreflightValidator.from_config(
+            {"PREFLIGHT_VALIDATE": True, "PREFLIGHT_MAX_CHARS": 10}
+        )
+        assert validator.max_chars == 10
+
+    def test_check_dispatches_by_type(self):
+        """Test unsupported types and oversized sources are passed through."""
+        validator = PreflightValidator(max_chars=20)
+
+        assert validator.check("graphviz", "digraph { a -> b }") is True
+        assert validator.check("plantuml", "@startuml\n???") is False
+        assert validator.check("graphviz", "digraph { " + "a " * 20) is False
+        with pytest.raises(SourceSyntaxError):
+            validator.check("graphviz", "digraph {")
+
+    def test_deep_nesting_is_passed_through(self):
+        """Test sources too deeply nested for the parser are not rejected."""
+        validator = PreflightValidator()
+        source = "digraph { " + "subgraph { " * 5000 + "}" * 5000 + " }"
+
+        assert validator.check("graphviz", source) is False
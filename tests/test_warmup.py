@@ -0,0 +1,174 @@
+"""Tests for the render cache warm-up."""
+
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from src.main import create_app
+from src.metrics import Metrics
+from src.render_cache import RenderCache
+from src.warmup import SeedRender, WarmUp, load_corpus, template_seeds
+
+
+@pytest.fixture
+def app():
+    """Create test application with a render cache."""
+    app = create_app("testing")
+    app.config["KROKI_URL"] = "http://test-kroki:8000"
+    app.extensions["render_cache"] = RenderCache(max_bytes=100000)
+    return app
+
+
+class TestSeeds:
+    """Test cases for the seed corpus."""
+
+    def test_template_seeds(self):
+        """Test every quick-use template is seeded in its supported formats."""
+        seeds = template_seeds("templates/index.html")
+
+        kinds = {(seed.diagram_type, seed.output_format) for seed in seeds}
+        assert ("mermaid", "png") in kinds
+        assert ("mermaid", "svg") in kinds
+        assert ("excalidraw", "svg") in kinds
+        assert ("excalidraw", "png") not in kinds
+        assert {seed.theme for seed in seeds} == {"light"}
+        graphviz = next(seed for seed in seeds if seed.diagram_type == "graphviz")
+        assert "&" not in graphviz.diagram_source
+
+    def test_load_corpus(self, tmp_path):
+        """Test a corpus entry expands to each of its formats."""
+        path = tmp_path / "corpus.json"
+        path.write_text(
+            json.dumps(
+                [
+                    {
+                        "diagram_type": "graphviz",
+                        "output_format": ["svg", "png"],
+                        "diagram_source": "digraph {}",
+                    },
+                    {
+                        "diagram_type": "mermaid",
+                        "output_format": "svg",
+                        "diagram_source": "graph TD; A-->B",
+                        "diagram_theme": "dark",
+                    },
+                ]
+            )
+        )
+
+        assert load_corpus(str(path)) == [
+            SeedRender("graphviz", "svg", "digraph {}"),
+            SeedRender("graphviz", "png", "digraph {}"),
+            SeedRender("mermaid", "svg", "graph TD; A-->B", "dark"),
+        ]
+
+    def test_invalid_corpus(self, tmp_path):
+        """Test a malformed corpus is rejected."""
+        path = tmp_path / "corpus.json"
+        path.write_text(json.dumps([{"diagram_type": "graphviz"}]))
+
+        with pytest.raises(ValueError):
+            load_corpus(str(path))
+
+
+class TestWarmUp:
+    """Test cases for WarmUp."""
+
+    def test_run_fills_cache(self, app, requests_mock):
+        """Test the corpus is rendered once into the cache."""
+        requests_mock.post("http://test-kroki:8000/graphviz/svg", text="<svg/>")
+        requests_mock.post("http://test-kroki:8000/graphviz/png", status_code=400)
+        seeds = [
+            SeedRender("graphviz", "svg", "digraph { a }"),
+            SeedRender("graphviz", "svg", "digraph { a }"),
+            SeedRender("graphviz", "png", "digraph { a }"),
+        ]
+        metrics = Metrics()
+        warmup = WarmUp(app, seeds, metrics=metrics)
+
+        warmup.run()
+
+        assert warmup.ready
+        assert warmup.status()["state"] == "ready"
+        assert (warmup.rendered, warmup.failed) == (1, 1)
+        assert metrics.get("warmup_renders_total", result="rendered") == 1
+        assert metrics.get("warmup_renders_total", result="failed") == 1
+        assert app.extensions["render_cache"].stats()["entries"] == 1
+
+    def test_concurrency_is_bounded(self, app):
+        """Test no more than the configured renders run at the same time."""
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def render(*args):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+            return b"<svg/>", "image/svg+xml"
+
+        seeds = [SeedRender("graphviz", "svg", f"digraph {{ {i} }}") for i in range(12)]
+        with patch("src.warmup.KrokiClient") as mock_kroki_class:
+            mock_kroki_class.return_value.generate_diagram.side_effect = render
+            WarmUp(app, seeds, concurrency=3).run()
+
+        assert len(peak) == 12
+        assert max(peak) <= 3
+
+    def test_timeout(self, app):
+        """Test the worker reports ready when the warm-up times out."""
+        release = threading.Event()
+
+        def render(*args):
+            release.wait(5)
+            return b"<svg/>", "image/svg+xml"
+
+        seeds = [SeedRender("graphviz", "svg", f"digraph {{ {i} }}") for i in range(3)]
+        metrics = Metrics()
+        with patch("src.warmup.KrokiClient") as mock_kroki_class:
+            mock_kroki_class.return_value.generate_diagram.side_effect = render
+            warmup = WarmUp(app, seeds, concurrency=1, timeout=0.05, metrics=metrics)
+            warmup.run()
+            release.set()
+
+        assert warmup.ready
+        assert warmup.status()["state"] == "timed_out"
+        assert metrics.get("warmup_renders_total", result="timed_out") == 3
+
+    def test_starts_once_per_process(self, app):
+        """Test the warm-up thread starts once, and not after it finished."""
+        warmup = WarmUp(app, [])
+
+        with patch("src.warmup.threading.Thread") as mock_thread:
+            warmup.request_started()
+            warmup.request_started()
+        mock_thread.return_value.start.assert_called_once()
+        assert not warmup.ready
+
+        finished = WarmUp(app, [])
+        finished.run()
+        finished._pid = None
+        with patch("src.warmup.threading.Thread") as mock_thread:
+            finished.request_started()
+        mock_thread.assert_not_called()
+
+    def test_from_config(self, app):
+        """Test the warm-up needs to be enabled and a render cache."""
+        assert WarmUp.from_config(app) is None
+
+        app.config["WARMUP_ENABLED"] = True
+        warmup = WarmUp.from_config(app)
+        assert len(warmup.seeds) == len(template_seeds("templates/index.html"))
+
+        app.config["WARMUP_CORPUS"] = "/nonexistent/corpus.json"
+        with pytest.raises(ValueError):
+            WarmUp.from_config(app)
+
+        app.extensions["render_cache"] = None
+        assert WarmUp.from_config(app) is None